@@ -1 +1,7 @@
+import time
+import platform
+
+# before anything else is imported, same clock as ZebVR.utils.get_time_ns (see ZebVR.utils.startup_timeline)
+LAUNCH_NS = time.monotonic_ns() if platform.system() == "Windows" else time.perf_counter_ns()
+
 MAX_PREY = 100
@@ -2,12 +2,18 @@ import time
 from multiprocessing import set_start_method, Process
 import os
 os.environ["OMP_NUM_THREADS"] = "1" # this may not be necessary when setting affinity
-from PyQt5.QtWidgets import QApplication
 import pickle
 import sys
 import pprint
 from pathlib import Path
-from .gui import MainGui
+from .utils.startup_timeline import (
+    startup_timeline, 
+    IMPORTS, 
+    GUI_READY, 
+    SPAWNED, 
+    LAUNCH_MILESTONES, 
+    RUN_MILESTONES
+)
 
 def set_realtime_priority(priority):
     
@@ -34,6 +40,8 @@ def run_vr_file(vr_file, *args) -> None:
         settings = pickle.load(fp)
 
     settings['main']['record'] = True
+    settings['main']['persistent_workers'] = False # single run
+    startup_timeline().new_run()
 
     pprint.pprint(settings)
     prefix = Path(settings['settings']['prefix'])
@@ -56,6 +64,7 @@ def run_vr_file(vr_file, *args) -> None:
     p_worker_logger.start()
     p_queue_logger.start()
     dag.start()
+    startup_timeline().mark(SPAWNED)
 
     try:
         time.sleep(settings['main']['recording_duration'])
@@ -64,6 +73,7 @@ def run_vr_file(vr_file, *args) -> None:
         pass
 
     dag.stop()
+    print(startup_timeline().report(RUN_MILESTONES))
     worker_logger.stop()
     queue_logger.stop()
     p_worker_logger.join()
@@ -71,7 +81,7 @@ def run_vr_file(vr_file, *args) -> None:
 
 def main():
 
-    # set_realtime_priority(99)  # optional
+    # set_realtime_priority(99)  # optional, per worker scheduling is set by CPU placement (Logs tab)
     set_start_method('spawn')
 
     if len(sys.argv) > 1:
@@ -80,10 +90,16 @@ def main():
         run_vr_file(vr_file, *sys.argv[2:])
 
     else:
-        # GUI mode
+        # GUI mode, Qt and the GUI are not needed in CLI mode
+        from PyQt5.QtWidgets import QApplication
+        from .gui import MainGui
+        startup_timeline().mark(IMPORTS)
+
         app = QApplication(sys.argv)
         main_window = MainGui()
         main_window.show()
+        startup_timeline().mark(GUI_READY)
+        print(startup_timeline().report(LAUNCH_MILESTONES))
         app.exec_()
 
 if __name__ == "__main__":
@@ -6,6 +6,7 @@ import re
 from re import Pattern
 from video_tools import OpenCV_VideoReader
 import pickle
+from numpy.typing import NDArray
 
 class BehaviorData(NamedTuple):
     metadata: Dict
@@ -70,6 +71,7 @@ stimuli_filename_regexp = filename_regexp('stim_','json')
 tracking_filename_regexp = filename_regexp('tracking_','csv')
 temperature_filename_regexp = filename_regexp('temperature_','csv')
 video_filename_regexp = filename_regexp('','mp4')
+mkv_video_filename_regexp = filename_regexp('','mkv')
 video_timestamps_filename_regexp = filename_regexp('','csv')
 
 def parse_filename(path: Path, regexp: Pattern) -> FileNameInfo:
@@ -110,6 +112,28 @@ def load_video(video_file: Path) -> OpenCV_VideoReader:
     reader.open_file(str(video_file))
     return reader 
 
+def load_roi_manifest(manifest_file: Path) -> Dict:
+    '''ROI geometry of a ROI recording (<video>_rois.json)'''
+    with open(manifest_file) as f:
+        return json.load(f)
+
+def load_roi_video(manifest_file: Path, identity: int) -> OpenCV_VideoReader:
+    '''
+    Video of one fish recorded in 'per ROI' mode. For 'mosaic' recordings, 
+    open the shared video and crop frames with roi_from_mosaic.
+    Frame timestamps are in the manifest's timings file, shared by all ROIs.
+    '''
+    manifest = load_roi_manifest(manifest_file)
+    return load_video(Path(manifest['rois'][identity]['filename']))
+
+def roi_from_mosaic(frame: NDArray, manifest: Dict, identity: int) -> NDArray:
+    roi = manifest['rois'][identity]
+    if 'mosaic_origin' not in roi:
+        return frame
+    x, y = roi['mosaic_origin']
+    h, w = roi['shape']
+    return frame[y:y+h, x:x+w]
+
 def load_video_timestamps(video_timestamp_file: Path) -> pd.DataFrame:
     return pd.read_csv(video_timestamp_file)
 
@@ -130,7 +154,11 @@ def load_data(files: BehaviorFiles) -> BehaviorData:
 
 def find_file(file_info: FileNameInfo, dir: Path, regexp: Pattern, prefix: str, extension: str, required: bool = True) -> Optional[Path]:
     for file in dir.glob(f'{prefix}*.{extension}'):
-        info = parse_filename(file, regexp)
+        try:
+            info = parse_filename(file, regexp)
+        except ValueError:
+            # e.g. segments or per ROI videos of a recording
+            continue
         if (
             info.fish_id == file_info.fish_id and
             info.age == file_info.age and
@@ -153,7 +181,10 @@ def find_files(dir: Directories) -> List[BehaviorFiles]:
             metadata = metadata_file,
             stimuli = find_file(file_info, dir.stimuli, stimuli_filename_regexp, 'stim_', 'json'), # type: ignore
             tracking = find_file(file_info, dir.tracking, tracking_filename_regexp, 'tracking_', 'csv'), # type: ignore
-            video = find_file(file_info, dir.video, video_filename_regexp, '', 'mp4'), # type: ignore
+            video = (
+                find_file(file_info, dir.video, video_filename_regexp, '', 'mp4', required=False) 
+                or find_file(file_info, dir.video, mkv_video_filename_regexp, '', 'mkv')
+            ), # type: ignore
             video_timestamps = find_file(file_info, dir.video_timestamps, video_timestamps_filename_regexp, '', 'csv'), # type: ignore
             temperature = find_file(file_info, dir.temperature, temperature_filename_regexp, 'temperature_', 'csv', required=False)
         )
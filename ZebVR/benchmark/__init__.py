@@ -0,0 +1,3 @@
+from .synthetic_camera import SyntheticCamera, grid_ROIs
+from .run import run_benchmark, benchmark_settings, compare_cpu_placement, compare_conversion, compare_run_turnaround, BENCHMARK_DAGS
+from .report import print_report, print_cpu_placement_comparison, print_conversion_comparison, print_run_turnaround, percentiles
@@ -0,0 +1,114 @@
+'''
+End-to-end benchmark of a DAG on a synthetic camera, without camera, projector or other hardware.
+
+Usage: python -m ZebVR.benchmark SETTINGS.vr [--dag tracking] [--width 1024] [--height 1024]
+       [--fps 100] [--animals 1] [--duration 30] [--warmup 5] [--record-video] [--keep FOLDER] [--json FILE]
+       [--replay RECORDING [--speed 1]] [--separate-conversion]
+       [--pin | --compare-pinning | --compare-conversion | --turnaround RUNS]
+
+Settings (tracker, stimulus, codec, calibration) come from a .vr file saved from the GUI.
+With --replay, a recording is streamed through the DAG instead of the synthetic camera,
+with the ROIs and background of the settings.
+With --compare-pinning, the benchmark runs twice, without and with CPU placement, 
+and latency and jitter are compared.
+With --separate-conversion, an RGB camera is recorded to a video file with pixel 
+format conversion in a separate worker. With --compare-conversion, the same recording 
+runs with conversion in the video saver, then in a separate worker, and camera to 
+video writer latency and per-worker CPU are compared.
+With --turnaround, RUNS consecutive runs of --duration seconds are timed, with new 
+workers for each run and with persistent workers.
+'''
+
+import os
+os.environ["OMP_NUM_THREADS"] = "1"
+import argparse
+import json
+import pickle
+from multiprocessing import set_start_method
+from .run import run_benchmark, compare_cpu_placement, compare_conversion, compare_run_turnaround, BENCHMARK_DAGS
+from .report import print_report, print_cpu_placement_comparison, print_conversion_comparison, print_run_turnaround
+
+def main():
+
+    parser = argparse.ArgumentParser(description='benchmark a DAG on a synthetic camera')
+    parser.add_argument('settings', help='.vr settings file')
+    parser.add_argument('--dag', choices=BENCHMARK_DAGS, default='tracking')
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--fps', type=float, default=100)
+    parser.add_argument('--animals', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds excluded from the report')
+    parser.add_argument('--record-video', action='store_true', help='include the video recording branch')
+    parser.add_argument('--keep', default=None, help='write outputs to this folder instead of a temporary one')
+    parser.add_argument('--json', default=None, help='save the report, to track results across releases')
+    parser.add_argument('--replay', default=None, help='recording to replay (video, segmented video manifest or image store)')
+    parser.add_argument('--speed', type=float, default=1.0, help='replay speed, 0: as fast as possible')
+    parser.add_argument('--separate-conversion', action='store_true', help='record an RGB camera, converted by a separate worker')
+    pinning = parser.add_mutually_exclusive_group()
+    pinning.add_argument('--pin', action='store_true', help='enable CPU placement, whatever the settings')
+    pinning.add_argument('--compare-pinning', action='store_true', help='compare runs without and with CPU placement')
+    pinning.add_argument('--compare-conversion', action='store_true', help='compare conversion in the video saver and in a separate worker')
+    pinning.add_argument('--turnaround', type=int, default=0, help='time consecutive runs with new and persistent workers')
+    args = parser.parse_args()
+
+    set_start_method('spawn')
+
+    with open(args.settings, 'rb') as fp:
+        settings = pickle.load(fp)
+
+    kwargs = dict(
+        dag_name = args.dag,
+        width = args.width,
+        height = args.height,
+        fps = args.fps,
+        n_animals = args.animals,
+        duration_sec = args.duration,
+        warmup_sec = args.warmup,
+        record_video = args.record_video,
+        replay = args.replay,
+        speed = args.speed
+    )
+
+    if args.turnaround:
+        report = compare_run_turnaround(
+            settings,
+            dag_name = args.dag,
+            width = args.width,
+            height = args.height,
+            fps = args.fps,
+            n_animals = args.animals,
+            num_runs = args.turnaround,
+            run_sec = args.duration,
+            record_video = args.record_video,
+            folder = args.keep
+        )
+        print_run_turnaround(report)
+    elif args.compare_conversion:
+        report = compare_conversion(settings, folder=args.keep, cpu_placement=True if args.pin else None, **kwargs)
+        for label, r in report.items():
+            print(f'\nconversion in the {label}:', end='')
+            print_report(r)
+        print_conversion_comparison(report)
+    elif args.compare_pinning:
+        report = compare_cpu_placement(settings, folder=args.keep, **kwargs)
+        for label, r in report.items():
+            print(f'\n{label}:', end='')
+            print_report(r)
+        print_cpu_placement_comparison(report)
+    else:
+        report = run_benchmark(
+            settings, 
+            folder = args.keep, 
+            cpu_placement = True if args.pin else None, 
+            separate_conversion = True if args.separate_conversion else None,
+            **kwargs
+        )
+        print_report(report)
+
+    if args.json is not None:
+        with open(args.json, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+if __name__ == "__main__":
+    main()
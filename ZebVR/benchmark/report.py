@@ -0,0 +1,341 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from numpy.typing import ArrayLike
+import pandas as pd
+from ..utils import load_binary_records, ReplayCamera, load_traces, stage_latencies, write_chrome_trace
+from ..utils.latency_trace import SINK_DONE
+from .synthetic_camera import SyntheticCamera
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+def percentiles(values: ArrayLike) -> Dict[str, float]:
+    values = np.asarray(values, dtype=np.float64)
+    if values.size == 0:
+        return {}
+    res = {f'p{p:g}': float(np.percentile(values, p)) for p in PERCENTILES}
+    res['max'] = float(values.max())
+    return res
+
+def process_tree(pid: int) -> List[int]:
+    '''pid and all its descendants, from /proc (Linux)'''
+
+    children = {}
+    for entry in Path('/proc').iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / 'stat').read_text()
+        except OSError:
+            continue
+        # the command name can contain spaces, the fields after it can't
+        ppid = int(stat.rsplit(')', 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    pids = [pid]
+    for p in pids:
+        pids.extend(children.get(p, []))
+    return pids
+
+def process_memory(pid: int) -> Optional[int]:
+    '''
+    proportional set size in bytes: shared memory (ring buffers) is split between
+    the processes mapping it instead of being counted in each. RSS on older kernels.
+    '''
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as fd:
+            for line in fd:
+                if line.startswith('Pss:'):
+                    return 1024 * int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        with open(f'/proc/{pid}/statm') as fd:
+            return int(fd.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+class MemorySampler(threading.Thread):
+    '''sample the memory of the whole process tree (DAG workers included) in the background'''
+
+    def __init__(self, interval_sec: float = 0.5, pid: Optional[int] = None) -> None:
+        super().__init__(daemon=True)
+        self.interval_sec = interval_sec
+        self.pid = os.getpid() if pid is None else pid
+        self.samples = []
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval_sec):
+            memory = [process_memory(p) for p in process_tree(self.pid)]
+            memory = [m for m in memory if m is not None]
+            self.samples.append((sum(memory), len(memory)))
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.join()
+
+    def summary(self) -> Dict:
+        if not self.samples:
+            return {}
+        memory = np.array([m for m, _ in self.samples]) / 1024**2
+        return {
+            'memory_mb_mean': float(memory.mean()),
+            'memory_mb_peak': float(memory.max()),
+            'memory_mb_final': float(memory[-1]),
+            'num_processes': max(n for _, n in self.samples)
+        }
+
+def camera_summary(counters, replay: bool, run_sec: float) -> Dict:
+    '''counters of SyntheticCamera or ReplayCamera'''
+
+    if replay:
+        # ReplayCamera counters are updated when acquisition stops
+        decode_sec = counters[ReplayCamera.DECODE_SEC]
+        return {
+            'num_frames': int(counters[ReplayCamera.NUM_FRAMES]),
+            'num_late': int(counters[ReplayCamera.NUM_LATE]),
+            'fps': counters[ReplayCamera.NUM_FRAMES] / run_sec,
+            'decode_fps': counters[ReplayCamera.NUM_DECODED] / decode_sec if decode_sec > 0 else 0.0,
+        }
+
+    return {
+        'num_frames': int(counters[SyntheticCamera.NUM_FRAMES]),
+        'num_skipped': int(counters[SyntheticCamera.NUM_SKIPPED]),
+        'fps': counters[SyntheticCamera.NUM_FRAMES] / run_sec,
+    }
+
+def cpu_summary(start: Optional[Tuple[Dict[str, float], float]], stop: Tuple[Dict[str, float], float]) -> Dict[str, float]:
+    '''
+    CPU usage of each worker between start and stop (% of a core), from 
+    (SamplingProfiler.cpu_seconds(), time.monotonic()) pairs. Workers which 
+    did not publish their CPU time are left out.
+    '''
+
+    if start is None:
+        return {}
+    (cpu_start, time_start), (cpu_stop, time_stop) = start, stop
+    if time_stop <= time_start:
+        return {}
+    return {
+        name: 100 * (cpu_stop[name] - cpu_start[name]) / (time_stop - time_start)
+        for name in cpu_stop if cpu_stop[name] > 0
+    }
+
+def find_files(folder: Path, pattern: str) -> List[Path]:
+    return sorted(f for f in folder.glob(pattern) if not f.name.endswith(('.checkpoint', '.tmp')))
+
+def tracking_summary(folder: Path, start_ns: int) -> Dict:
+    '''sustained tracking rate, missing frames and camera to saver latency, after start_ns'''
+
+    frames = []
+    for filename in find_files(folder, 'tracking*.csv'):
+        frames.append(pd.read_csv(filename, usecols=['index', 'timestamp', 'identity', 'latency_ms']))
+    if not frames:
+        return {}
+
+    tracking = pd.concat(frames)
+    tracking = tracking[tracking['timestamp'] >= start_ns]
+    if tracking.empty:
+        return {}
+
+    fps = []
+    num_missing = 0
+    jitter = []
+    for _, animal in tracking.groupby('identity'):
+        duration_sec = 1e-9 * (animal['timestamp'].max() - animal['timestamp'].min())
+        fps.append((len(animal) - 1) / duration_sec if duration_sec > 0 else 0.0)
+        num_missing += int(animal['index'].max() - animal['index'].min() + 1 - animal['index'].nunique())
+        # deviation of frame intervals from the median, at the camera worker
+        intervals = 1e-6 * np.diff(np.sort(animal['timestamp'].to_numpy()))
+        if intervals.size > 0:
+            jitter.append(np.abs(intervals - np.median(intervals)))
+
+    return {
+        'fps_min': float(min(fps)),
+        'fps_per_animal': [float(f) for f in fps],
+        'num_missing': num_missing,
+        'latency_ms': percentiles(tracking['latency_ms'].to_numpy()),
+        'interval_jitter_ms': percentiles(np.concatenate(jitter)) if jitter else {},
+    }
+
+def video_summary(folder: Path, start_ns: int) -> Dict:
+    '''camera to video writer latency, from the .timing sidecars'''
+
+    latencies = []
+    for filename in find_files(folder, '*.timing'):
+        try:
+            _, records = load_binary_records(filename)
+        except ValueError:
+            continue
+        records = records[records['timestamp'] >= start_ns]
+        latencies.append(1e-6 * (records['written_timestamp'] - records['timestamp']))
+    if not latencies:
+        return {}
+    return {'latency_ms': percentiles(np.concatenate(latencies))}
+
+def queue_summary(folder: Path, start_ns: int) -> Dict:
+    '''per queue depth and blocking time, from the queue monitor summaries'''
+
+    res = {}
+    for filename in find_files(folder, 'queue_metrics*.bin'):
+        header, records = load_binary_records(filename)
+        records = records[records['timestamp'] >= start_ns]
+        policies = header.get('policies', ['lossless'] * len(header['queues']))
+        for index, name in enumerate(header['queues']):
+            queue = records[records['queue'] == index]
+            if queue.size == 0:
+                continue
+            res[name] = {
+                'policy': policies[index],
+                'num_dropped': int(queue['num_dropped'].sum()) if 'num_dropped' in queue.dtype.names else 0,
+                'health_max': int(queue['health'].max()) if 'health' in queue.dtype.names else 0,
+                'depth_max': int(queue['depth_max'].max()),
+                'capacity': int(queue['capacity'].max()),
+                'get_rate_hz': float(queue['get_rate_hz'].mean()),
+                'put_blocking_us': percentiles(queue['put_blocking_us']),
+                'get_blocking_us': percentiles(queue['get_blocking_us']),
+            }
+    return res
+
+def latency_trace_summary(folder: Path, start_ns: int, chrome_file: Optional[Path] = None) -> Dict:
+    '''per sink, time spent in each stage and queue, from the latency traces'''
+
+    filenames = find_files(folder, 'latency_trace*.bin')
+    if not filenames:
+        return {}
+
+    traces = load_traces(filenames)
+    res = {}
+    for sink, records in traces.items():
+        records = records[records['trace'][:, SINK_DONE] >= start_ns]
+        if records.size == 0:
+            continue
+        res[sink] = {name: percentiles(values) for name, values in stage_latencies(records, sink).items()}
+
+    if chrome_file is not None:
+        write_chrome_trace(traces, chrome_file)
+    return res
+
+def print_report(report: Dict) -> None:
+
+    def fmt(stats: Dict) -> str:
+        return ', '.join(f'{k} {v:.2f}' for k, v in stats.items())
+
+    config = report['config']
+    print(
+        f"\n{config['dag']}: {config['width']}x{config['height']} @ {config['fps']} fps, "
+        f"{config['n_animals']} animals, {config['duration_sec']} s "
+        f"({config['warmup_sec']} s warmup excluded)"
+    )
+
+    camera = report['camera']
+    if config['replay'] is not None:
+        print(
+            f"replay of {config['replay']} at speed {config['speed']}: {camera['num_frames']} frames, "
+            f"{camera['num_late']} late, {camera['fps']:.1f} fps, decoding {camera['decode_fps']:.1f} fps"
+        )
+    else:
+        print(f"camera: {camera['num_frames']} frames, {camera['num_skipped']} skipped, {camera['fps']:.1f} fps")
+
+    tracking = report['tracking']
+    if tracking:
+        print(f"tracking: {tracking['fps_min']:.1f} fps (slowest animal), {tracking['num_missing']} frames missing")
+        print(f"  camera -> tracking saver latency (ms): {fmt(tracking['latency_ms'])}")
+        print(f"  frame interval jitter (ms): {fmt(tracking['interval_jitter_ms'])}")
+
+    if report['video']:
+        print(f"  camera -> video writer latency (ms): {fmt(report['video']['latency_ms'])}")
+
+    cpu = report['cpu_percent']
+    if cpu:
+        print(f"CPU (% of a core), total {sum(cpu.values()):.0f}: " + ', '.join(f'{k} {v:.0f}' for k, v in cpu.items()))
+
+    for sink, stages in report['latency_trace'].items():
+        print(f"latency trace, {sink} (ms):")
+        for name, stats in stages.items():
+            print(f"  {name}: {fmt(stats)}")
+
+    startup = report['startup_ms']
+    if startup:
+        print('startup (ms after run start): ' + ', '.join(f'{k} {v:.0f}' for k, v in startup.items()))
+
+    for name, counters in report['frame_timing'].items():
+        print(f"frame timing {name}: {int(counters['num_dropped'])} dropped, {int(counters['num_gaps'])} gaps")
+
+    for name, queue in report['queues'].items():
+        print(
+            f"queue {name} ({queue['policy']}): depth max {queue['depth_max']}/{queue['capacity']}, "
+            f"get {queue['get_rate_hz']:.1f} Hz, {queue['num_dropped']} dropped, "
+            f"get blocking (us) {fmt(queue['get_blocking_us'])}"
+        )
+
+    memory = report['memory']
+    if memory:
+        print(
+            f"memory: peak {memory['memory_mb_peak']:.0f} MB, mean {memory['memory_mb_mean']:.0f} MB "
+            f"over {memory['num_processes']} processes"
+        )
+
+def print_cpu_placement_comparison(reports: Dict[str, Dict]) -> None:
+    '''latency and jitter without and with CPU placement, see compare_cpu_placement'''
+
+    rows = {
+        'tracking fps (slowest animal)': lambda r: r['tracking'].get('fps_min'),
+        'camera skipped frames': lambda r: r['camera'].get('num_skipped', r['camera'].get('num_late')),
+        'latency p50 (ms)': lambda r: r['tracking'].get('latency_ms', {}).get('p50'),
+        'latency p99 (ms)': lambda r: r['tracking'].get('latency_ms', {}).get('p99'),
+        'latency p99.9 (ms)': lambda r: r['tracking'].get('latency_ms', {}).get('p99.9'),
+        'latency max (ms)': lambda r: r['tracking'].get('latency_ms', {}).get('max'),
+        'interval jitter p99 (ms)': lambda r: r['tracking'].get('interval_jitter_ms', {}).get('p99'),
+        'interval jitter max (ms)': lambda r: r['tracking'].get('interval_jitter_ms', {}).get('max'),
+    }
+
+    labels = list(reports)
+    print('\n' + f"{'':<32}" + ''.join(f'{label:>12}' for label in labels))
+    for name, value in rows.items():
+        values = [value(reports[label]) for label in labels]
+        print(f'{name:<32}' + ''.join(f'{v:>12.2f}' if v is not None else f"{'-':>12}" for v in values))
+
+def print_conversion_comparison(reports: Dict[str, Dict]) -> None:
+    '''video latency and per-worker CPU with conversion in the saver and in a separate worker, see compare_conversion'''
+
+    rows = {
+        'video latency p50 (ms)': lambda r: r['video'].get('latency_ms', {}).get('p50'),
+        'video latency p99 (ms)': lambda r: r['video'].get('latency_ms', {}).get('p99'),
+        'video latency max (ms)': lambda r: r['video'].get('latency_ms', {}).get('max'),
+        'camera skipped frames': lambda r: r['camera'].get('num_skipped', r['camera'].get('num_late')),
+        'CPU total (% of a core)': lambda r: sum(r['cpu_percent'].values()) if r['cpu_percent'] else None,
+    }
+    workers = []
+    for report in reports.values():
+        workers.extend(w for w in report['cpu_percent'] if w not in workers)
+    for worker in workers:
+        rows[f'CPU {worker} (%)'] = lambda r, worker=worker: r['cpu_percent'].get(worker)
+
+    labels = list(reports)
+    print('\n' + f"{'':<32}" + ''.join(f'{label:>12}' for label in labels))
+    for name, value in rows.items():
+        values = [value(reports[label]) for label in labels]
+        print(f'{name:<32}' + ''.join(f'{v:>12.2f}' if v is not None else f"{'-':>12}" for v in values))
+
+def print_run_turnaround(report: Dict) -> None:
+    '''startup and run to run turnaround with new and persistent workers, see compare_run_turnaround'''
+
+    config = report['config']
+    print(
+        f"\n{config['dag']}: {config['width']}x{config['height']} @ {config['fps']} fps, "
+        f"{config['n_animals']} animals, {config['num_runs']} runs of {config['run_sec']} s"
+    )
+    for label in ('new workers', 'persistent workers'):
+        startup = report[label]['startup_ms'] or {}
+        turnaround = report[label]['turnaround_ms']
+        line = f"{label}: startup {startup.get('recording', float('nan')):.0f} ms"
+        if turnaround:
+            line += (
+                f", turnaround mean {np.mean(turnaround):.0f} ms, "
+                f"max {np.max(turnaround):.0f} ms over {len(turnaround)} runs"
+            )
+        print(line)
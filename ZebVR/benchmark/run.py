@@ -0,0 +1,397 @@
+import copy
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+from multiprocessing import Process
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+import numpy as np
+from ..utils import get_time_ns, registered_frame_timing_counters, clear_frame_timing_counters, ReplayCamera, current_profiling_session, startup_timeline
+from ..utils.startup_timeline import SPAWNED, RECORDING, RUN_MILESTONES
+from .synthetic_camera import SyntheticCamera, grid_ROIs, ROI
+from .report import MemorySampler, tracking_summary, video_summary, queue_summary, camera_summary, latency_trace_summary, cpu_summary
+
+BENCHMARK_DAGS = ('closed_loop', 'open_loop', 'tracking')
+
+def benchmark_settings(
+        settings: Dict,
+        folder: Path,
+        camera_constructor,
+        width: int,
+        height: int,
+        fps: float,
+        ROIs: Optional[List[ROI]] = None,
+        background_file: Optional[Path] = None,
+        record_video: bool = False,
+        cpu_placement: Optional[bool] = None,
+        separate_conversion: Optional[bool] = None
+    ) -> Dict:
+    '''
+    Copy of the settings where the camera is replaced, every output goes
+    to folder, and hardware (DAQ, audio, temperature and other sensors, projector
+    fullscreen) is disabled. Tracker settings, stimulus and video codec
+    settings are kept, as well as ROIs and background if not given.
+    CPU placement is enabled or disabled if cpu_placement is not None.
+    If separate_conversion is not None, the camera is RGB and full frames are 
+    recorded to a video file, converted by a separate worker or by the saver.
+    '''
+
+    settings = copy.deepcopy(settings)
+
+    settings['camera'].update({
+        'camera_constructor': camera_constructor,
+        'width_value': width,
+        'height_value': height,
+        'framerate_value': fps,
+        'offsetX_value': 0,
+        'offsetY_value': 0,
+        'num_channels': 1 if separate_conversion is None else 3,
+    })
+    if ROIs is not None:
+        settings['identity']['n_animals'] = len(ROIs)
+        settings['identity']['ROIs'] = ROIs
+    if background_file is not None:
+        settings['background']['background_file'] = str(background_file)
+
+    settings['settings']['prefix'] = str(folder / 'benchmark')
+    settings['settings']['tracking']['csv_filename'] = str(folder / 'tracking.csv')
+    settings['settings']['tracking']['qc_recording'] = False
+    settings['settings']['stim_output']['filename'] = str(folder / 'stim.json')
+    settings['settings']['videorecording']['video_recording'] = record_video
+    settings['settings']['videorecording']['video_filename'] = str(folder / 'video.mp4')
+    settings['settings']['videorecording']['video_recording_dir'] = str(folder / 'images')
+    settings['settings']['videorecording']['clip_recording'] = False
+    if separate_conversion is not None:
+        settings['settings']['videorecording'].update({
+            'video_recording': True,
+            'video_method': 'video file',
+            'video_roi_mode': 'full frame',
+            'video_conversion_worker': separate_conversion,
+        })
+
+    settings['logs']['log']['worker_logfile'] = str(folder / 'workers.log')
+    settings['logs']['log']['queue_logfile'] = str(folder / 'queues.log')
+    settings['logs']['log']['queue_metrics_file'] = str(folder / 'queue_metrics.bin')
+    settings['logs']['log']['prometheus_port'] = 0
+    settings['logs']['log']['latency_trace_file'] = str(folder / 'latency_trace.bin')
+
+    settings['daq'] = {}
+    settings['audio']['enabled'] = False
+    settings['temperature']['serial_port'] = ''
+    settings['temperature']['csv_filename'] = str(folder / 'temperature.csv')
+    settings['sensors']['enabled'] = False
+    settings['projector']['fullscreen'] = False
+    settings['main']['record'] = True
+    settings['main']['persistent_workers'] = False
+
+    if cpu_placement is not None:
+        settings['logs']['cpu']['enabled'] = cpu_placement
+
+    return settings
+
+def synthetic_camera(
+        settings: Dict, 
+        folder: Path, 
+        width: int, 
+        height: int, 
+        fps: float, 
+        n_animals: int, 
+        num_channels: int = 1
+    ) -> Tuple:
+    '''camera constructor, ROIs, background file and counters of a synthetic camera with n_animals'''
+
+    ROIs = grid_ROIs(width, height, n_animals)
+    camera_counters = SyntheticCamera.new_counters()
+    camera_constructor = partial(
+        SyntheticCamera,
+        ROIs = ROIs,
+        pix_per_mm = settings['calibration']['pix_per_mm'],
+        height = height,
+        width = width,
+        framerate = fps,
+        num_channels = num_channels,
+        counters = camera_counters
+    )
+    background_file = folder / 'background.npy'
+    np.save(background_file, camera_constructor().background())
+    return camera_constructor, ROIs, background_file, camera_counters
+
+def run_benchmark(
+        settings: Dict,
+        dag_name: str = 'tracking',
+        width: int = 1024,
+        height: int = 1024,
+        fps: float = 100,
+        n_animals: int = 1,
+        duration_sec: float = 30,
+        warmup_sec: float = 5,
+        record_video: bool = False,
+        folder: Optional[Union[str, Path]] = None,
+        replay: Optional[Union[str, Path]] = None,
+        speed: float = 1.0,
+        cpu_placement: Optional[bool] = None,
+        separate_conversion: Optional[bool] = None
+    ) -> Dict:
+    '''
+    Run a DAG for duration_sec on a synthetic camera and report sustained
+    tracking rate, latency percentiles, dropped frames, queue blocking
+    and memory. The first warmup_sec are excluded from rates and latencies.
+    With replay, a recording is replayed at speed (0: as fast as possible,
+    see ZebVR.utils.ReplayCamera) instead, with the ROIs and background of 
+    the settings, and width, height, fps and n_animals are ignored.
+    CPU placement follows the settings unless cpu_placement is given.
+    With separate_conversion (True: in a separate worker, False: in the video 
+    saver), an RGB camera is recorded to a video file, see benchmark_settings.
+    CPU usage of each worker (% of a core) is reported after warmup.
+    Outputs are written to folder (a temporary folder, deleted afterwards,
+    if None), including per-message latency traces and their Chrome trace 
+    export (see ZebVR.utils.latency_trace), time to first frame, tracking
+    and stimulus (see ZebVR.utils.startup_timeline), and the merged sampling profile
+    if enabled (see ZebVR.utils.sampling_profiler). Windows are rendered offscreen.
+    '''
+
+    from ..dags import open_loop, closed_loop, tracking
+
+    dags = {'closed_loop': closed_loop, 'open_loop': open_loop, 'tracking': tracking}
+    if dag_name not in dags:
+        raise ValueError(f'dag must be one of {BENCHMARK_DAGS}')
+
+    # inherited by the worker processes
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    keep_files = folder is not None
+    folder = Path(tempfile.mkdtemp(prefix='zebvr_benchmark_')) if folder is None else Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    if replay is None:
+        camera_constructor, ROIs, background_file, camera_counters = synthetic_camera(
+            settings, folder, width, height, fps, n_animals, 1 if separate_conversion is None else 3
+        )
+    else:
+        ROIs = None
+        background_file = None
+        camera_counters = ReplayCamera.new_counters()
+        camera_constructor = partial(ReplayCamera, filename=str(replay), speed=speed, counters=camera_counters)
+        camera = camera_constructor()
+        width, height, fps = camera.get_width(), camera.get_height(), camera.get_framerate()
+        n_animals = settings['identity']['n_animals']
+
+    if separate_conversion is not None:
+        record_video = True
+    settings = benchmark_settings(
+        settings, folder, camera_constructor, width, height, fps, ROIs, background_file, 
+        record_video, cpu_placement, separate_conversion
+    )
+
+    clear_frame_timing_counters()
+    startup_timeline().new_run()
+    dag, worker_logger, queue_logger = dags[dag_name](settings)
+
+    p_worker_logger = Process(target=worker_logger.run)
+    p_queue_logger = Process(target=queue_logger.run)
+    p_worker_logger.start()
+    p_queue_logger.start()
+
+    memory_sampler = MemorySampler()
+    memory_sampler.start()
+
+    # per worker CPU time, published by the profiler threads of the workers
+    profiler = current_profiling_session()
+    cpu_start = None
+
+    start_ns = get_time_ns()
+    start = time.monotonic()
+    dag.start()
+    startup_timeline().mark(SPAWNED)
+    try:
+        time.sleep(min(warmup_sec, duration_sec))
+        cpu_start = profiler.cpu_seconds(), time.monotonic()
+        time.sleep(max(0, duration_sec - warmup_sec))
+    except KeyboardInterrupt:
+        print('stopping')
+    cpu_stop = profiler.cpu_seconds(), time.monotonic()
+    run_sec = time.monotonic() - start
+    dag.stop()
+
+    memory_sampler.stop()
+    worker_logger.stop()
+    queue_logger.stop()
+    p_worker_logger.join()
+    p_queue_logger.join()
+
+    # sampling profile, if enabled in settings['logs']['profiler']
+    profile_file = profiler.merge()
+
+    analysis_start_ns = start_ns + int(1e9 * warmup_sec)
+    report = {
+        'config': {
+            'dag': dag_name,
+            'width': width,
+            'height': height,
+            'fps': fps,
+            'n_animals': n_animals,
+            'duration_sec': duration_sec,
+            'warmup_sec': warmup_sec,
+            'record_video': record_video,
+            'replay': None if replay is None else str(replay),
+            'speed': speed,
+            'cpu_placement': settings['logs']['cpu']['enabled'],
+            'separate_conversion': separate_conversion,
+        },
+        'camera': camera_summary(camera_counters, replay is not None, run_sec),
+        'tracking': tracking_summary(folder, analysis_start_ns),
+        'video': video_summary(folder, analysis_start_ns),
+        'cpu_percent': cpu_summary(cpu_start, cpu_stop),
+        'queues': queue_summary(folder, analysis_start_ns),
+        'latency_trace': latency_trace_summary(
+            folder, 
+            analysis_start_ns, 
+            folder / 'latency_trace.json' if keep_files else None
+        ),
+        'frame_timing': {c.name: c.snapshot() for c in registered_frame_timing_counters()},
+        'memory': memory_sampler.summary(),
+        'startup_ms': startup_timeline().summary(RUN_MILESTONES),
+        'profile': str(profile_file) if keep_files and profile_file is not None else None,
+    }
+
+    if keep_files:
+        print(f'benchmark files kept in {folder}')
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return report
+
+def compare_cpu_placement(settings: Dict, folder: Optional[Union[str, Path]] = None, **kwargs) -> Dict[str, Dict]:
+    '''
+    Run the same benchmark without and with CPU placement (see ZebVR.utils.cpu_placement),
+    kwargs as in run_benchmark. Outputs go to folder/unpinned and folder/pinned if folder is given.
+    '''
+
+    reports = {}
+    for label, cpu_placement in (('unpinned', False), ('pinned', True)):
+        print(f'benchmark {label}')
+        reports[label] = run_benchmark(
+            settings,
+            folder = None if folder is None else Path(folder) / label,
+            cpu_placement = cpu_placement,
+            **kwargs
+        )
+    return reports
+
+def compare_conversion(settings: Dict, folder: Optional[Union[str, Path]] = None, **kwargs) -> Dict[str, Dict]:
+    '''
+    Record an RGB camera with pixel format conversion in the video saver, then in a
+    separate worker, kwargs as in run_benchmark. Outputs go to folder/saver and 
+    folder/worker if folder is given.
+    '''
+
+    reports = {}
+    for label, separate_conversion in (('saver', False), ('worker', True)):
+        print(f'benchmark, conversion in the {label}')
+        reports[label] = run_benchmark(
+            settings,
+            folder = None if folder is None else Path(folder) / label,
+            separate_conversion = separate_conversion,
+            **kwargs
+        )
+    return reports
+
+def wait_for_milestone(milestone: str, timeout_sec: float) -> bool:
+    deadline = time.monotonic() + timeout_sec
+    while not startup_timeline().reached(milestone):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def compare_run_turnaround(
+        settings: Dict,
+        dag_name: str = 'tracking',
+        width: int = 1024,
+        height: int = 1024,
+        fps: float = 100,
+        n_animals: int = 1,
+        num_runs: int = 4,
+        run_sec: float = 5,
+        record_video: bool = False,
+        folder: Optional[Union[str, Path]] = None,
+        timeout_sec: float = 120
+    ) -> Dict:
+    '''
+    Consecutive short runs on a synthetic camera, with new workers for each
+    run and with persistent workers (see ZebVR.dags.WorkerPool). Turnaround
+    is the time from the end of a run to the outputs of the next one being
+    opened (the 'recording' milestone of ZebVR.utils.startup_timeline).
+    The first run, which starts the workers in both cases, is reported
+    as startup.
+    '''
+
+    from ..dags import open_loop, closed_loop, tracking, WorkerPool
+
+    dags = {'closed_loop': closed_loop, 'open_loop': open_loop, 'tracking': tracking}
+    if dag_name not in dags:
+        raise ValueError(f'dag must be one of {BENCHMARK_DAGS}')
+
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    keep_files = folder is not None
+    folder = Path(tempfile.mkdtemp(prefix='zebvr_turnaround_')) if folder is None else Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    camera_constructor, ROIs, background_file, _ = synthetic_camera(settings, folder, width, height, fps, n_animals)
+
+    report = {
+        'config': {
+            'dag': dag_name,
+            'width': width,
+            'height': height,
+            'fps': fps,
+            'n_animals': n_animals,
+            'num_runs': num_runs,
+            'run_sec': run_sec,
+            'record_video': record_video,
+        }
+    }
+
+    pool = WorkerPool()
+    for label, persistent in (('new workers', False), ('persistent workers', True)):
+
+        print(f'turnaround, {label}')
+        run_folder = folder / label.replace(' ', '_')
+        run_folder.mkdir(exist_ok=True)
+        run_settings = benchmark_settings(
+            settings, run_folder, camera_constructor, width, height, fps, ROIs, background_file, record_video
+        )
+        run_settings['main']['persistent_workers'] = persistent
+
+        startup_ms = None
+        turnaround_ms = []
+        stop_ns = None
+        for run in range(num_runs):
+            pool.start_run(dags[dag_name], run_settings, persistent)
+            if not wait_for_milestone(RECORDING, timeout_sec):
+                print(f'run {run}: outputs not opened after {timeout_sec} s')
+                break
+            timeline = startup_timeline()
+            if stop_ns is None:
+                startup_ms = timeline.summary(RUN_MILESTONES)
+            else:
+                turnaround_ms.append(1e-6 * (timeline.timestamp(RECORDING) - stop_ns))
+            time.sleep(run_sec)
+            stop_ns = get_time_ns()
+            pool.stop_run(persistent)
+        pool.shutdown()
+
+        report[label] = {
+            'startup_ms': startup_ms,
+            'turnaround_ms': turnaround_ms,
+        }
+
+    if keep_files:
+        print(f'benchmark files kept in {folder}')
+    else:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return report
@@ -0,0 +1,303 @@
+import math
+import time
+from multiprocessing import RawArray
+from typing import Dict, List, Optional, Sequence, Tuple
+import cv2
+import numpy as np
+from numpy.typing import NDArray
+
+ROI = Tuple[int, int, int, int] # x, y, w, h as in settings['identity']['ROIs']
+
+FISH_LENGTH_MM = 4.0
+NUM_NOISE_FRAMES = 8
+
+def grid_ROIs(width: int, height: int, n_animals: int) -> List[ROI]:
+    '''split the image in a grid of n_animals equal cells'''
+    num_cols = math.ceil(math.sqrt(n_animals))
+    num_rows = math.ceil(n_animals / num_cols)
+    w = width // num_cols
+    h = height // num_rows
+    return [((n % num_cols) * w, (n // num_cols) * h, w, h) for n in range(n_animals)]
+
+class SyntheticCamera:
+    '''
+    Camera generating one fish-like blob (body, eyes and a beating tail) per
+    ROI, swimming in bouts on a static noisy background. Same interface as
+    camera_tools cameras, for use as a camera_constructor. With num_channels=3,
+    frames are RGB (gray replicated), e.g. to benchmark pixel format conversion.
+    Frames are paced at the framerate and, like a real camera, frames the
+    consumer is too late for are skipped: indices follow the clock. Frames
+    and skipped frames are counted in counters, if provided (see new_counters).
+    '''
+
+    NUM_FRAMES = 0
+    NUM_SKIPPED = 1
+    NUM_COUNTERS = 2
+
+    def __init__(
+            self,
+            ROIs: Sequence[ROI],
+            pix_per_mm: float = 40,
+            height: int = 1024,
+            width: int = 1024,
+            framerate: float = 100,
+            background_intensity: int = 40,
+            fish_intensity: int = 200,
+            noise_std: float = 3.0,
+            seed: int = 0,
+            num_channels: int = 1,
+            counters: Optional[RawArray] = None
+        ) -> None:
+
+        self.ROIs = list(ROIs)
+        self.fish_length = FISH_LENGTH_MM * pix_per_mm
+        self.height = height
+        self.width = width
+        self.framerate = framerate
+        self.offsetX = 0
+        self.offsetY = 0
+        self.exposure = 1000
+        self.gain = 0
+        self.background_intensity = background_intensity
+        self.fish_intensity = fish_intensity
+        self.noise_std = noise_std
+        self.seed = seed
+        self.num_channels = num_channels
+        self.counters = counters
+        self.acquiring = False
+
+    @staticmethod
+    def new_counters() -> RawArray:
+        return RawArray('Q', SyntheticCamera.NUM_COUNTERS)
+
+    def background(self) -> NDArray:
+        '''noise-free background, for background subtraction'''
+        rng = np.random.default_rng(self.seed)
+        # smooth illumination gradient and fixed pattern, as seen through a diffuser
+        y, x = np.mgrid[0:self.height, 0:self.width]
+        vignetting = 1 - 0.2 * (((x - self.width/2) / self.width)**2 + ((y - self.height/2) / self.height)**2)
+        pattern = cv2.GaussianBlur(rng.normal(0, 4, (self.height, self.width)).astype(np.float32), (0, 0), 3)
+        return np.clip(self.background_intensity * vignetting + pattern, 0, 255).astype(np.uint8)
+
+    def start_acquisition(self) -> None:
+
+        rng = np.random.default_rng(self.seed)
+        background = self.background().astype(np.float32)
+
+        # noise is precomputed, generating it for each frame would be the bottleneck
+        self.backgrounds = np.empty((NUM_NOISE_FRAMES, self.height, self.width), dtype=np.uint8)
+        for i in range(NUM_NOISE_FRAMES):
+            noise = rng.normal(0, self.noise_std, (self.height, self.width)).astype(np.float32)
+            self.backgrounds[i] = np.clip(background + noise, 0, 255)
+        self.image = np.empty((self.height, self.width), dtype=np.uint8)
+        self.image_rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+        self.fish = []
+        for x, y, w, h in self.ROIs:
+            self.fish.append({
+                'x': x + w/2 + rng.uniform(-0.25, 0.25) * w,
+                'y': y + h/2 + rng.uniform(-0.25, 0.25) * h,
+                'heading': rng.uniform(0, 2*np.pi),
+                'speed': 0.0,
+                'tail_phase': 0.0,
+                'next_bout': rng.uniform(0, 1),
+            })
+        self.rng = rng
+
+        self.start_time = time.perf_counter()
+        self.index = -1
+        self.acquiring = True
+
+    def stop_acquisition(self) -> None:
+        self.acquiring = False
+
+    def swim(self, fish: Dict, roi: ROI, t: float, dt: float) -> None:
+        '''bouts of ~2 body lengths every ~0.5 s, with a turn, then glide'''
+
+        x, y, w, h = roi
+        if t >= fish['next_bout']:
+            fish['heading'] += self.rng.normal(0, 0.6)
+            fish['speed'] = 20 * self.fish_length * self.rng.uniform(0.5, 1.5) # px/s
+            fish['next_bout'] = t + self.rng.exponential(0.5)
+
+        fish['speed'] *= math.exp(-dt / 0.05)
+        fish['tail_phase'] += 2 * np.pi * 30 * dt * min(1.0, fish['speed'] / (10 * self.fish_length))
+        fish['x'] += fish['speed'] * math.cos(fish['heading']) * dt
+        fish['y'] += fish['speed'] * math.sin(fish['heading']) * dt
+
+        # turn back at the walls
+        margin = 0.6 * self.fish_length
+        if not x + margin <= fish['x'] <= x + w - margin:
+            fish['heading'] = np.pi - fish['heading']
+            fish['x'] = min(max(fish['x'], x + margin), x + w - margin)
+        if not y + margin <= fish['y'] <= y + h - margin:
+            fish['heading'] = -fish['heading']
+            fish['y'] = min(max(fish['y'], y + margin), y + h - margin)
+
+    def draw(self, fish: Dict) -> None:
+
+        L = self.fish_length
+        c, s = math.cos(fish['heading']), math.sin(fish['heading'])
+
+        def point(u: float, v: float) -> Tuple[int, int]:
+            # u along the body (head forward), v lateral, in body lengths
+            return (int(fish['x'] + L*(u*c - v*s)), int(fish['y'] + L*(u*s + v*c)))
+
+        angle = math.degrees(fish['heading'])
+        cv2.ellipse(
+            self.image, point(0, 0), (max(1, int(0.22*L)), max(1, int(0.07*L))),
+            angle, 0, 360, self.fish_intensity, -1
+        )
+        for side in (-1, 1):
+            cv2.circle(self.image, point(0.17, side*0.05), max(1, int(0.04*L)), min(255, self.fish_intensity + 40), -1)
+
+        amplitude = 0.1 * min(1.0, fish['speed'] / (10 * L))
+        tail = np.array([
+            point(-0.2 - 0.55*u, amplitude * u * math.sin(fish['tail_phase'] - 4*u))
+            for u in np.linspace(0, 1, 10)
+        ], dtype=np.int32)
+        cv2.polylines(self.image, [tail], False, self.fish_intensity, max(1, int(0.03*L)))
+
+    def get_frame(self) -> Optional[Dict]:
+
+        if not self.acquiring:
+            return None
+
+        # wait for the next frame
+        next_time = self.start_time + (self.index + 1) / self.framerate
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        now = time.perf_counter()
+        index = int((now - self.start_time) * self.framerate)
+        index = max(index, self.index + 1)
+        num_skipped = index - self.index - 1
+        dt = (index - self.index) / self.framerate
+        self.index = index
+
+        np.copyto(self.image, self.backgrounds[index % NUM_NOISE_FRAMES])
+        t = index / self.framerate
+        for fish, roi in zip(self.fish, self.ROIs):
+            self.swim(fish, roi, t, dt)
+            self.draw(fish)
+
+        if self.counters is not None:
+            self.counters[self.NUM_FRAMES] += 1
+            self.counters[self.NUM_SKIPPED] += num_skipped
+
+        image = self.image
+        if self.num_channels == 3:
+            image = cv2.cvtColor(self.image, cv2.COLOR_GRAY2RGB, dst=self.image_rgb)
+
+        return {'index': index, 'timestamp': now, 'image': image}
+
+    # camera_tools interface ---------------------------------------------------
+
+    def set_exposure(self, exp_time: float) -> None:
+        self.exposure = exp_time
+
+    def get_exposure(self) -> float:
+        return self.exposure
+
+    def get_exposure_range(self) -> Tuple[float, float]:
+        return (1, 100_000)
+
+    def get_exposure_increment(self) -> float:
+        return 1
+
+    def exposure_available(self) -> bool:
+        return True
+
+    def set_framerate(self, fps: float) -> None:
+        self.framerate = fps
+
+    def get_framerate(self) -> float:
+        return self.framerate
+
+    def get_framerate_range(self) -> Tuple[float, float]:
+        return (1, 10_000)
+
+    def get_framerate_increment(self) -> float:
+        return 1
+
+    def framerate_available(self) -> bool:
+        return True
+
+    def set_gain(self, gain: float) -> None:
+        self.gain = gain
+
+    def get_gain(self) -> float:
+        return self.gain
+
+    def get_gain_range(self) -> Tuple[float, float]:
+        return (0, 0)
+
+    def get_gain_increment(self) -> float:
+        return 0
+
+    def gain_available(self) -> bool:
+        return False
+
+    def set_width(self, width: int) -> None:
+        self.width = width
+
+    def get_width(self) -> int:
+        return self.width
+
+    def get_width_range(self) -> Tuple[int, int]:
+        return (16, 8192)
+
+    def get_width_increment(self) -> int:
+        return 1
+
+    def width_available(self) -> bool:
+        return True
+
+    def set_height(self, height: int) -> None:
+        self.height = height
+
+    def get_height(self) -> int:
+        return self.height
+
+    def get_height_range(self) -> Tuple[int, int]:
+        return (16, 8192)
+
+    def get_height_increment(self) -> int:
+        return 1
+
+    def height_available(self) -> bool:
+        return True
+
+    def set_offsetX(self, offsetX: int) -> None:
+        self.offsetX = offsetX
+
+    def get_offsetX(self) -> int:
+        return self.offsetX
+
+    def get_offsetX_range(self) -> Tuple[int, int]:
+        return (0, 0)
+
+    def get_offsetX_increment(self) -> int:
+        return 1
+
+    def offsetX_available(self) -> bool:
+        return False
+
+    def set_offsetY(self, offsetY: int) -> None:
+        self.offsetY = offsetY
+
+    def get_offsetY(self) -> int:
+        return self.offsetY
+
+    def get_offsetY_range(self) -> Tuple[int, int]:
+        return (0, 0)
+
+    def get_offsetY_increment(self) -> int:
+        return 1
+
+    def offsetY_available(self) -> bool:
+        return False
+
+    def get_num_channels(self) -> int:
+        return self.num_channels
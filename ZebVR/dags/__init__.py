@@ -4,3 +4,5 @@ from .open_loop import open_loop
 from .video_recording import video_recording
 from .tracking import tracking
 
+from .pipeline import Pipeline, Edge
+from .worker_pool import WorkerPool
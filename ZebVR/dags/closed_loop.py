@@ -1,139 +1,58 @@
 from typing import Dict, Optional, Tuple
+from pathlib import Path
 import numpy as np
 
 from multiprocessing_logger import Logger
-from ipc_tools import MonitoredQueue, ModifiableRingBuffer, QueueMP
 from dagline import ProcessingDAG, receive_strategy, send_strategy
 from geometry import AffineTransform2D
 from tracker import SingleFishOverlay_opencv
 from ..workers import (
+    RunControlWorker,
     CropWorker, 
-    AudioStimWorker,
     CameraWorker, 
     TrackerWorker, 
     ImageSaverWorker, 
     VideoSaverWorker,
+    ClipRecorderWorker,
     TrackerGui, 
     StimGUI,
     TrackingDisplay,
     Display,
     Protocol,
     QueueMonitor,
+    DiskMonitorWorker,
     ImageFilterWorker, 
     TrackingSaver,
+    TrackingQCRecorder,
     TemperatureLoggerWorker,
+    SensorLoggerWorker,
+    SensorDisplay,
     DAQ_Worker,
     LatencyDisplay,
     StimSaver,
-    rgb_to_yuv420p,
-    rgb_to_gray
+    RGB_TO_YUV420P,
+    RGB_TO_GRAY
 )
 from ..stimulus import VisualStimWorker, GeneralStim
-from ..utils import tracker_from_json
+from ..utils import tracker_from_json, estimate_data_rates, place_workers, profile_workers, time_startup, new_run_control
+from .pipeline import Pipeline
+from .topology import connect_tracking, connect_video_recording, connect_stimulus_control, connect_clip_recording, sensor_channels, connect_sensors, connect_run_control, recorded_streams
 
-DEFAULT_QUEUE_SIZE_MB = 500
 PROFILE = False
 
 def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[ProcessingDAG, Logger, Logger]:
     
-    # create DAG
-    if dag is None:
-        dag = ProcessingDAG()
-    
     # create loggers
     worker_logger = Logger(settings['logs']['log']['worker_logfile'], Logger.INFO)
     queue_logger = Logger(settings['logs']['log']['queue_logfile'], Logger.INFO)
+    trace_file = settings['logs']['log']['latency_trace_file'] or None # per-message latency tracing
 
-    # create queues -----------------------------------------------------------------------            
-    queue_camera_to_converter = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_converter',
-                    )
-    )
-
-    queue_converter_to_saver = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'converter_to_saver',
-                    )
-    )
-
-    queue_save_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_image_saver',
-                    )
-    )
-
-    queue_display_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'image_saver_to_display',
-                    )
+    pipeline = Pipeline(
+        queue_logger, 
+        memory_budget_mb = settings['logs']['queues']['memory_budget_mb'], 
+        prefix = settings['settings']['prefix']
     )
 
-    queue_cam_to_cropper = MonitoredQueue(ModifiableRingBuffer(
-        num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-        #copy=False, # you probably don't need to copy if processing is fast enough
-        logger = queue_logger,
-        name = 'camera_to_crop',
-    ))
-
-    queue_crop_to_tracker = []
-    queue_tracking_to_stim = []
-    queue_tracking_to_overlay = []
-    queue_tracking_to_saver = []
-
-    for i in range(settings['identity']['n_animals']):
-
-        queue_crop_to_tracker.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                #copy=False, # you probably don't need to copy if processing is fast enough
-                logger = queue_logger,
-                name = 'crop_to_trackers',
-                            ))
-        )
-
-        queue_tracking_to_stim.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_stim',
-                            ))
-        )
-
-        queue_tracking_to_overlay.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
-
-        queue_tracking_to_saver.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
-
-    queue_trigger_metadata = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 200*1024**2,
-            logger = queue_logger,
-            name = 'tracker_to_protocol',
-                    )
-    )
-
-    queue_stim_saver = QueueMP()
-
     # create workers -----------------------------------------------------------------------
     camera_worker = CameraWorker(
         camera_constructor = settings['camera']['camera_constructor'], 
@@ -161,6 +80,7 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         decimation = settings['settings']['videorecording']['video_decimation'],
         compress = settings['settings']['videorecording']['video_recording_compression'],
         resize = settings['settings']['videorecording']['video_recording_resize'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
         name = 'cam_output2',  
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -180,6 +100,13 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         video_profile = 'main' if not settings['settings']['videorecording']['video_grayscale'] else 'high',
         video_preset = settings['settings']['videorecording']['video_preset'],
         video_quality = settings['settings']['videorecording']['video_quality'],
+        segment_duration_sec = settings['settings']['videorecording']['video_segment_duration_sec'],
+        num_encoders = settings['settings']['videorecording']['video_num_encoders'],
+        crash_safe_container = settings['settings']['videorecording']['video_crash_safe'],
+        roi_mode = settings['settings']['videorecording']['video_roi_mode'],
+        ROIs = settings['identity']['ROIs'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'video_recorder',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -187,8 +114,33 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         receive_data_timeout = 1.0,
     )
 
+    clip_trigger_stims = [
+        int(stim) for stim in settings['settings']['videorecording']['clip_trigger_stims'].split(',') 
+        if stim.strip()
+    ]
+    clip_recorder_worker = ClipRecorderWorker(
+        filename = settings['settings']['videorecording']['video_filename'],
+        fps = settings['camera']['framerate_value'],
+        pre_trigger_sec = settings['settings']['videorecording']['clip_pre_trigger_sec'],
+        post_trigger_sec = settings['settings']['videorecording']['clip_post_trigger_sec'],
+        trigger_stims = clip_trigger_stims or None,
+        max_buffer_mb = settings['settings']['videorecording']['clip_max_buffer_mb'],
+        video_codec = settings['settings']['videorecording']['video_codec'],
+        gpu = settings['settings']['videorecording']['video_gpu'],
+        grayscale = settings['settings']['videorecording']['video_grayscale'],
+        video_profile = 'main' if not settings['settings']['videorecording']['video_grayscale'] else 'high',
+        video_preset = settings['settings']['videorecording']['video_preset'],
+        video_quality = settings['settings']['videorecording']['video_quality'],
+        name = 'clip_recorder',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+        receive_metadata_strategy = receive_strategy.POLL
+    )
+
     yuv420p_converter = ImageFilterWorker(
-        image_function=rgb_to_yuv420p,
+        image_function=RGB_TO_YUV420P,
         name = 'yuv420p_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -197,7 +149,7 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
     )
 
     rgb_to_gray_converter = ImageFilterWorker(
-        image_function=rgb_to_gray,
+        image_function=RGB_TO_GRAY,
         name = 'rgb_to_gray_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -205,28 +157,24 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         receive_data_timeout = 1.0,
     )
 
-    queues = {
-        queue_cam_to_cropper: 'camera to crop',
-        queue_display_image: 'display',
-        queue_save_image: 'direct video recording',
-        queue_camera_to_converter: 'pixel format conversion',
-        queue_converter_to_saver: 'converted video recording',
-        queue_trigger_metadata: 'tracker to protocol',
-    }
-    queues.update({q: f'tracking to stim {n}' for n,q in enumerate(queue_tracking_to_stim)})
-    queues.update({q: f'crop to tracker {n}' for n,q in enumerate(queue_crop_to_tracker)})
-    queues.update({q: f'tracking to overlay {n}' for n,q in enumerate(queue_tracking_to_overlay)})
-    queues.update({q: f'tracking to saver {n}' for n,q in enumerate(queue_tracking_to_saver)})
-    
-    queue_monitor_worker = QueueMonitor(
-        queues = queues,
-        name = 'queue_monitor',
+    record_video, record_tracking = recorded_streams(settings, 'closed_loop')
+    disk_monitor_worker = DiskMonitorWorker(
+        data_rates = estimate_data_rates(settings, record_video, record_tracking),
+        name = 'disk_monitor',
         logger = worker_logger, 
         logger_queues = queue_logger,
-        log_level = Logger.ERROR,
+        log_level = Logger.INFO,
         receive_data_timeout = 1.0,
     )
 
+    run_control_worker = RunControlWorker(
+        run_control = new_run_control(),
+        name = 'run_control',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+    )
+
     temperature_logger = TemperatureLoggerWorker(
         filename = settings['temperature']['csv_filename'],
         serial_port = settings['temperature']['serial_port'],
@@ -234,6 +182,28 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         logger = worker_logger, 
         logger_queues = queue_logger,
         log_level = Logger.ERROR,
+        send_data_strategy = send_strategy.BROADCAST,
+    )
+
+    sensors = sensor_channels(settings, temperature_logger.sample_period_sec)
+
+    sensor_logger = SensorLoggerWorker(
+        channels = sensors,
+        filename = settings['sensors']['filename'],
+        name = 'sensor_logger',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1,
+    )
+
+    sensor_display = SensorDisplay(
+        channels = [f'{channel.name} ({channel.unit})' for channel in sensors],
+        name = 'sensor_display',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1, # readings are slow, keep the window responsive
     )
 
     daq_worker = DAQ_Worker(
@@ -273,6 +243,8 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
                 cam_width = settings['camera']['width_value'],
                 cam_height = settings['camera']['height_value'],
                 n_tracker_workers = settings['identity']['n_animals'],
+                qc_decimation = settings['settings']['tracking']['qc_decimation'] if settings['settings']['tracking']['qc_recording'] else 0,
+                warmup_ROI = settings['identity']['ROIs'][i],
                 name = f'tracker{i}', 
                 logger = worker_logger, 
                 logger_queues = queue_logger,
@@ -297,9 +269,20 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         profile = False
     )
 
+    tracking_qc_worker = TrackingQCRecorder(
+        folder = Path(settings['settings']['tracking']['csv_filename']).parent,
+        name = 'tracking_qc',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
+
     tracking_saver_worker = TrackingSaver(
         filename = settings['settings']['tracking']['csv_filename'],
         num_tail_points_interp = settings['settings']['tracking']['n_tail_pts_interp'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'tracking_saver',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -341,6 +324,7 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
 
     # protocol -------------------------------------------------
     protocol_worker = Protocol(
+        keep_alive = settings['main']['persistent_workers'],
         name = "protocol", 
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -367,6 +351,7 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
 
     stim_worker = VisualStimWorker(
         stim = stim, 
+        trace_file = trace_file,
         name = 'visual_stim', 
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -376,20 +361,23 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         send_metadata_strategy = send_strategy.DISPATCH
     )
 
-    audio_stim_worker = AudioStimWorker(
-        units_per_dB = settings['audio']['units_per_dB'],
-        device_index = settings['audio']['device_index'],
-        samplerate = settings['audio']['samplerate'], 
-        blocksize = settings['audio']['blocksize'], 
-        channels = settings['audio']['channels'],
-        rollover_time_sec = settings['audio']['rollover_time_sec'],
-        name = 'audio_stim', 
-        logger = worker_logger, 
-        logger_queues = queue_logger,
-        log_level = Logger.ERROR,
-        receive_data_timeout = 1.0,
-        send_metadata_strategy = send_strategy.DISPATCH
-    )
+    if settings['audio']['enabled']:
+        # sounddevice, PyAV and numba are only imported when needed
+        from ..workers import AudioStimWorker
+        audio_stim_worker = AudioStimWorker(
+            units_per_dB = settings['audio']['units_per_dB'],
+            device_index = settings['audio']['device_index'],
+            samplerate = settings['audio']['samplerate'], 
+            blocksize = settings['audio']['blocksize'], 
+            channels = settings['audio']['channels'],
+            rollover_time_sec = settings['audio']['rollover_time_sec'],
+            name = 'audio_stim', 
+            logger = worker_logger, 
+            logger_queues = queue_logger,
+            log_level = Logger.ERROR,
+            receive_data_timeout = 1.0,
+            send_metadata_strategy = send_strategy.DISPATCH
+        )
 
     stim_control_worker = StimGUI(
         daq_boards = settings['daq'],
@@ -404,6 +392,7 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
 
     stim_saver = StimSaver(
         filename = settings['settings']['stim_output']['filename'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
         name = 'stim_saver', 
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -412,193 +401,86 @@ def closed_loop(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Pr
         receive_metadata_strategy = receive_strategy.POLL
     )
 
+    # stages -----------------------------------------------------------------------------
+    pipeline.add_stage('camera', camera_worker)
+    pipeline.add_stage('image_saver', image_saver_worker)
+    pipeline.add_stage('video_recorder', video_recorder_worker)
+    pipeline.add_stage('yuv420p', yuv420p_converter)
+    pipeline.add_stage('rgb_to_gray', rgb_to_gray_converter)
+    pipeline.add_stage('display', display_worker)
+    pipeline.add_stage('clip_recorder', clip_recorder_worker)
+    pipeline.add_stage('crop', cropper)
+    for i, tracker_worker in enumerate(tracker_worker_list):
+        pipeline.add_stage(f'tracker{i}', tracker_worker)
+    pipeline.add_stage('tracker_gui', tracker_control_worker)
+    pipeline.add_stage('tracking_display', tracking_display_worker)
+    pipeline.add_stage('tracking_saver', tracking_saver_worker)
+    pipeline.add_stage('tracking_qc', tracking_qc_worker)
+    pipeline.add_stage('tracking_latency_display', tracking_latency_display)
+    pipeline.add_stage('protocol', protocol_worker)
+    pipeline.add_stage('visual_stim', stim_worker)
+    if settings['audio']['enabled']:
+        pipeline.add_stage('audio_stim', audio_stim_worker)
+    pipeline.add_stage('stim_gui', stim_control_worker)
+    pipeline.add_stage('daq', daq_worker)
+    pipeline.add_stage('stim_saver', stim_saver)
+    if settings['main']['record']:
+        pipeline.add_stage('disk_monitor', disk_monitor_worker, isolated=True)
+    pipeline.add_stage('run_control', run_control_worker)
+    pipeline.add_stage('temperature_logger', temperature_logger)
+    pipeline.add_stage('sensor_logger', sensor_logger)
+    pipeline.add_stage('sensor_display', sensor_display)
+
     # connect DAG -----------------------------------------------------------------------
-    # data
-    dag.connect_data(
-        sender = camera_worker, 
-        receiver = cropper, 
-        queue = queue_cam_to_cropper, 
-        name = 'cam_output1'
+    pipeline.connect_data(
+        'camera', 'crop', 'cam_output1', 
+        label = 'camera to crop',
+        dtype = camera_worker.res.dtype,
+        rate_hz = settings['camera']['framerate_value'],
+        buffer_sec = settings['logs']['queues']['buffer_sec']
     )
+    connect_tracking(pipeline, settings, camera_worker.res.dtype)
+    pipeline.connect_data('tracking_saver', 'tracking_latency_display', 'tracking_latency')
 
     if settings['settings']['videorecording']['video_recording']:
+        connect_video_recording(pipeline, settings, camera_worker.res.dtype)
 
-        if settings['settings']['videorecording']['video_method'] == 'image sequence':
-            dag.connect_data(
-                sender = camera_worker, 
-                receiver = image_saver_worker, 
-                queue = queue_save_image, 
-                name = 'cam_output2'
-            )
-        
-        else:
-            if settings['camera']['num_channels'] == 3:
-
-                if settings['settings']['videorecording']['video_grayscale']:
-                    dag.connect_data(
-                        sender = camera_worker, 
-                        receiver = rgb_to_gray_converter, 
-                        queue = queue_camera_to_converter, 
-                        name = 'cam_output2'
-                    )
-
-                    dag.connect_data(
-                        sender = rgb_to_gray_converter, 
-                        receiver = video_recorder_worker, 
-                        queue = queue_converter_to_saver, 
-                        name = 'gray_compression'
-                    )
-
-                else:
-                    dag.connect_data(
-                        sender = camera_worker, 
-                        receiver = yuv420p_converter, 
-                        queue = queue_camera_to_converter, 
-                        name = 'cam_output2'
-                    )
-
-                    dag.connect_data(
-                        sender = yuv420p_converter, 
-                        receiver = video_recorder_worker, 
-                        queue = queue_converter_to_saver, 
-                        name = 'yuv420p_compression'
-                    )
-
-            else:
-
-                dag.connect_data(
-                    sender = camera_worker, 
-                    receiver = video_recorder_worker, 
-                    queue = queue_save_image, 
-                    name = 'cam_output2'
-                )
-
-        dag.connect_data(
-            sender = video_recorder_worker, 
-            receiver = display_worker, 
-            queue = queue_display_image, 
-            name = 'display_recording'
-        )
+    if settings['main']['record']:
+        protocol_worker.set_protocol(settings['sequencer']['protocol'])
+    connect_stimulus_control(pipeline, settings)
 
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_data(
-            sender = cropper, 
-            receiver = tracker_worker_list[i], 
-            queue = queue_crop_to_tracker[i], 
-            name = f'cropper_output_{i}'
-        )
+    if settings['settings']['videorecording']['clip_recording']:
+        connect_clip_recording(pipeline, settings, camera_worker.res.dtype)
 
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = stim_worker, 
-            queue = queue_tracking_to_stim[i], 
-            name = f'tracker_output_stim'
-        )
+    connect_sensors(pipeline, settings, sensors)
+    connect_run_control(pipeline)
 
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_display_worker, 
-            queue = queue_tracking_to_overlay[i], 
-            name = 'tracker_output_overlay'
-        )
-
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_saver_worker, 
-            queue = queue_tracking_to_saver[i], 
-            name = 'tracker_output_saver'
-        )
+    dag = pipeline.compile(dag)
 
-    dag.connect_data(
-        sender = tracking_saver_worker, 
-        receiver = tracking_latency_display, 
-        queue = QueueMP(), 
-        name = 'tracking_latency'
+    queue_monitor_worker = QueueMonitor(
+        queues = pipeline.monitored_queues(),
+        sampling_rate_hz = settings['logs']['log']['queue_metrics_rate_hz'],
+        metrics_file = settings['logs']['log']['queue_metrics_file'],
+        prometheus_port = settings['logs']['log']['prometheus_port'],
+        name = 'queue_monitor',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
     )
+    dag.add_node(queue_monitor_worker)
 
-    # metadata
-    if settings['main']['record']:
-        protocol = settings['sequencer']['protocol']
-        protocol_worker.set_protocol(protocol)
-        dag.connect_metadata(
-            sender = protocol_worker, 
-            receiver = stim_worker, 
-            queue = QueueMP(), 
-            name = 'stim_control'
-        )
-        if settings['audio']['enabled']:
-            dag.connect_metadata(
-                sender = protocol_worker, 
-                receiver = audio_stim_worker, 
-                queue = QueueMP(), 
-                name = 'audio_stim_control'
-            )
-        dag.connect_metadata(
-            sender = protocol_worker, 
-            receiver = daq_worker, 
-            queue = QueueMP(), 
-            name = 'daq_stim_control'
-        )
-        for i in range(settings['identity']['n_animals']):
-            dag.connect_metadata(
-                sender = tracker_worker_list[i], 
-                receiver = protocol_worker, 
-                queue = queue_trigger_metadata, 
-                name = 'tracker_metadata'
-            )
-    else:
-        dag.connect_metadata(
-            sender = stim_control_worker, 
-            receiver= stim_worker, 
-            queue = QueueMP(), 
-            name = 'stim_control'
-        )
-        if settings['audio']['enabled']:
-            dag.connect_metadata(
-                sender = stim_control_worker, 
-                receiver = audio_stim_worker, 
-                queue = QueueMP(), 
-                name = 'audio_stim_control'
-            )
-        dag.connect_metadata(
-            sender = stim_control_worker, 
-            receiver = daq_worker, 
-            queue = QueueMP(), 
-            name = 'daq_stim_control'
-        )
-        
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_metadata(
-            sender = tracker_control_worker, 
-            receiver = tracker_worker_list[i], 
-            queue = QueueMP(), # multiple queues
-            name = f'tracker_control_{i}'
-        )
+    # CPU placement -----------------------------------------------------------------------
+    place_workers(pipeline.workers(), settings['logs']['cpu'], settings['settings']['prefix'])
 
-    dag.connect_metadata(
-        sender = stim_worker,
-        receiver = stim_saver,
-        queue = queue_stim_saver, 
-        name = 'visual_stim_logger'
-    )
-    dag.connect_metadata(
-        sender = daq_worker,
-        receiver = stim_saver,
-        queue = queue_stim_saver, 
-        name = 'daq_stim_logger'
+    # sampling profiler -------------------------------------------------------------------
+    profile_workers(
+        pipeline.workers() + [queue_monitor_worker], 
+        settings['logs']['profiler'], 
+        settings['settings']['prefix']
     )
-    if settings['audio']['enabled']:
-        dag.connect_metadata(
-            sender = audio_stim_worker,
-            receiver = stim_saver,
-            queue = queue_stim_saver, 
-            name = 'audio_stim_logger'
-        )
-
-    # isolated nodes
-    dag.add_node(queue_monitor_worker)
 
-    if settings['temperature']['serial_port'] != '':
-        dag.add_node(temperature_logger)
+    # startup timeline --------------------------------------------------------------------
+    time_startup(pipeline.workers())
 
     return (dag, worker_logger, queue_logger)
\ No newline at end of file
@@ -1,8 +1,8 @@
 from typing import Dict, Optional, Tuple
+from pathlib import Path
 import numpy as np
 
 from multiprocessing_logger import Logger
-from ipc_tools import MonitoredQueue, ModifiableRingBuffer, QueueMP
 from dagline import ProcessingDAG, receive_strategy, send_strategy
 from geometry import AffineTransform2D
 
@@ -11,6 +11,7 @@ from tracker import (
     SingleFishOverlay_opencv, 
 )
 from ..workers import (
+    RunControlWorker,
     CropWorker, 
     CameraWorker, 
     TrackerWorker, 
@@ -22,120 +23,33 @@ from ..workers import (
     Display,
     Protocol,
     QueueMonitor,
+    DiskMonitorWorker,
     ImageFilterWorker, 
     TrackingSaver,
+    TrackingQCRecorder,
     TemperatureLoggerWorker,
+    SensorLoggerWorker,
+    SensorDisplay,
     DAQ_Worker,
-    rgb_to_yuv420p,
-    rgb_to_gray
+    RGB_TO_YUV420P,
+    RGB_TO_GRAY
 )
 from ..stimulus import VisualStimWorker, Stim3D
-
-DEFAULT_QUEUE_SIZE_MB = 500
+from ..utils import estimate_data_rates, place_workers, profile_workers, time_startup, new_run_control
+from .pipeline import Pipeline
+from .topology import connect_tracking, connect_video_recording, tracking_sizing, sensor_channels, connect_sensors, connect_run_control, recorded_streams
 
 def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[ProcessingDAG, Logger, Logger]:
     
-    # create DAG
-    if dag is None:
-        dag = ProcessingDAG()
-    
     # create loggers
     worker_logger = Logger(settings['logs']['log']['worker_logfile'], Logger.INFO)
     queue_logger = Logger(settings['logs']['log']['queue_logfile'], Logger.INFO)
+    trace_file = settings['logs']['log']['latency_trace_file'] or None # per-message latency tracing
 
-    # create queues -----------------------------------------------------------------------            
-    queue_camera_to_converter = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_converter',
-                    )
-    )
-
-    queue_converter_to_saver = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'converter_to_saver',
-                    )
-    )
-
-    queue_save_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_image_saver',
-                    )
-    )
-
-    queue_display_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-            logger = queue_logger,
-            name = 'image_saver_to_display',
-                    )
-    )
-
-    queue_cam_to_background = MonitoredQueue(ModifiableRingBuffer(
-        num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-        #copy=False, # you probably don't need to copy if processing is fast enough
-        logger = queue_logger,
-        name = 'background_to_crop',
-            ))
-
-    queue_background_to_cropper = MonitoredQueue(ModifiableRingBuffer(
-        num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-        #copy=False, # you probably don't need to copy if processing is fast enough
-        logger = queue_logger,
-        name = 'background_to_crop',
-            ))
-
-    queue_crop_to_tracker = []
-    queue_tracking_to_stim = []
-    queue_tracking_to_overlay = []
-    queue_tracking_to_saver = []
-
-    for i in range(settings['identity']['n_animals']):
-
-        queue_crop_to_tracker.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                #copy=False, # you probably don't need to copy if processing is fast enough
-                logger = queue_logger,
-                name = 'background_to_trackers',
-                            ))
-        )
-
-        queue_tracking_to_stim.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_stim',
-                            ))
-        )
-
-        queue_tracking_to_overlay.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
-
-        queue_tracking_to_saver.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = 200*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
-
-    queue_trigger_metadata = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 200*1024**2,
-            logger = queue_logger,
-            name = 'tracker_to_protocol',
-                    )
+    pipeline = Pipeline(
+        queue_logger, 
+        memory_budget_mb = settings['logs']['queues']['memory_budget_mb'], 
+        prefix = settings['settings']['prefix']
     )
 
     # create workers -----------------------------------------------------------------------
@@ -164,6 +78,7 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         decimation = settings['settings']['videorecording']['video_decimation'],
         compress = settings['settings']['videorecording']['video_recording_compression'],
         resize = settings['settings']['videorecording']['video_recording_resize'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
         name = 'cam_output2',  
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -183,6 +98,13 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         video_profile = 'main' if not settings['settings']['videorecording']['video_grayscale'] else 'high',
         video_preset = settings['settings']['videorecording']['video_preset'],
         video_quality = settings['settings']['videorecording']['video_quality'],
+        segment_duration_sec = settings['settings']['videorecording']['video_segment_duration_sec'],
+        num_encoders = settings['settings']['videorecording']['video_num_encoders'],
+        crash_safe_container = settings['settings']['videorecording']['video_crash_safe'],
+        roi_mode = settings['settings']['videorecording']['video_roi_mode'],
+        ROIs = settings['identity']['ROIs'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'video_recorder',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -191,7 +113,7 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
     )
 
     yuv420p_converter = ImageFilterWorker(
-        image_function=rgb_to_yuv420p,
+        image_function=RGB_TO_YUV420P,
         name = 'yuv420p_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -200,7 +122,7 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
     )
 
     rgb_to_gray_converter = ImageFilterWorker(
-        image_function=rgb_to_gray,
+        image_function=RGB_TO_GRAY,
         name = 'rgb_to_gray_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -208,29 +130,24 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         receive_data_timeout = 1.0,
     )
 
-    queues = {
-        queue_cam_to_background: 'camera to background',
-        queue_background_to_cropper: 'backgroud_to_cropper',
-        queue_display_image: 'display',
-        queue_save_image: 'direct video recording',
-        queue_camera_to_converter: 'pixel format conversion',
-        queue_converter_to_saver: 'converted video recording',
-        queue_trigger_metadata: 'tracker to protocol',
-    }
-    queues.update({q: f'tracking to stim {n}' for n,q in enumerate(queue_tracking_to_stim)})
-    queues.update({q: f'crop to tracker {n}' for n,q in enumerate(queue_crop_to_tracker)})
-    queues.update({q: f'tracking to overlay {n}' for n,q in enumerate(queue_tracking_to_overlay)})
-    queues.update({q: f'tracking to saver {n}' for n,q in enumerate(queue_tracking_to_saver)})
-    
-    queue_monitor_worker = QueueMonitor(
-        queues = queues,
-        name = 'queue_monitor',
+    record_video, record_tracking = recorded_streams(settings, 'closed_loop_3D')
+    disk_monitor_worker = DiskMonitorWorker(
+        data_rates = estimate_data_rates(settings, record_video, record_tracking),
+        name = 'disk_monitor',
         logger = worker_logger, 
         logger_queues = queue_logger,
-        log_level = Logger.ERROR,
+        log_level = Logger.INFO,
         receive_data_timeout = 1.0,
     )
 
+    run_control_worker = RunControlWorker(
+        run_control = new_run_control(),
+        name = 'run_control',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+    )
+
     temperature_logger = TemperatureLoggerWorker(
         filename = settings['temperature']['csv_filename'],
         serial_port = settings['temperature']['serial_port'],
@@ -238,6 +155,28 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         logger = worker_logger, 
         logger_queues = queue_logger,
         log_level = Logger.ERROR,
+        send_data_strategy = send_strategy.BROADCAST,
+    )
+
+    sensors = sensor_channels(settings, temperature_logger.sample_period_sec)
+
+    sensor_logger = SensorLoggerWorker(
+        channels = sensors,
+        filename = settings['sensors']['filename'],
+        name = 'sensor_logger',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1,
+    )
+
+    sensor_display = SensorDisplay(
+        channels = [f'{channel.name} ({channel.unit})' for channel in sensors],
+        name = 'sensor_display',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1, # readings are slow, keep the window responsive
     )
 
     daq_worker = DAQ_Worker(
@@ -264,10 +203,13 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         tracker_worker_list.append(
             TrackerWorker(
                 SingleFishTracker_CPU(), 
+                background_image_file = settings['background']['background_file'],
                 cam_fps = settings['camera']['framerate_value'],
                 cam_width = settings['camera']['width_value'],
                 cam_height = settings['camera']['height_value'],
                 n_tracker_workers = settings['identity']['n_animals'],
+                qc_decimation = settings['settings']['tracking']['qc_decimation'] if settings['settings']['tracking']['qc_recording'] else 0,
+                warmup_ROI = settings['identity']['ROIs'][i],
                 name = f'tracker{i}', 
                 logger = worker_logger, 
                 logger_queues = queue_logger,
@@ -291,9 +233,20 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         profile = False
     )
 
+    tracking_qc_worker = TrackingQCRecorder(
+        folder = Path(settings['settings']['tracking']['csv_filename']).parent,
+        name = 'tracking_qc',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
+
     tracking_saver_worker = TrackingSaver(
         filename = settings['settings']['tracking']['csv_filename'],
         num_tail_points_interp = settings['settings']['tracking']['n_tail_pts_interp'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'tracking_saver',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -328,6 +281,7 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
 
     # protocol -------------------------------------------------
     protocol_worker = Protocol(
+        keep_alive = settings['main']['persistent_workers'],
         name = "protocol", 
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -353,6 +307,7 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
 
     stim_worker = VisualStimWorker(
         stim = stim, 
+        trace_file = trace_file,
         name = 'visual_stim', 
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -372,148 +327,87 @@ def closed_loop_3D(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple
         profile = False
     ) 
 
-    # connect DAG -----------------------------------------------------------------------
-    # data
-    dag.connect_data(
-        sender = camera_worker, 
-        receiver = background_worker, 
-        queue = queue_cam_to_background, 
-        name = 'cam_output1'
-    )
+    # stages -----------------------------------------------------------------------------
+    pipeline.add_stage('camera', camera_worker)
+    pipeline.add_stage('image_saver', image_saver_worker)
+    pipeline.add_stage('video_recorder', video_recorder_worker)
+    pipeline.add_stage('yuv420p', yuv420p_converter)
+    pipeline.add_stage('rgb_to_gray', rgb_to_gray_converter)
+    pipeline.add_stage('display', display_worker)
+    pipeline.add_stage('crop', cropper)
+    for i, tracker_worker in enumerate(tracker_worker_list):
+        pipeline.add_stage(f'tracker{i}', tracker_worker)
+    pipeline.add_stage('tracker_gui', tracker_control_worker)
+    pipeline.add_stage('tracking_display', tracking_display_worker)
+    pipeline.add_stage('tracking_saver', tracking_saver_worker)
+    pipeline.add_stage('tracking_qc', tracking_qc_worker)
+    pipeline.add_stage('protocol', protocol_worker)
+    pipeline.add_stage('visual_stim', stim_worker)
+    pipeline.add_stage('stim_gui', stim_control_worker)
+    if settings['main']['record']:
+        pipeline.add_stage('disk_monitor', disk_monitor_worker, isolated=True)
+    pipeline.add_stage('run_control', run_control_worker)
+    pipeline.add_stage('temperature_logger', temperature_logger)
+    pipeline.add_stage('sensor_logger', sensor_logger)
+    pipeline.add_stage('sensor_display', sensor_display)
 
-    dag.connect_data(
-        sender = background_worker, 
-        receiver = cropper, 
-        queue = queue_background_to_cropper, 
-        name = 'background_to_crop'
+    # connect DAG -----------------------------------------------------------------------
+    # background is subtracted by the trackers, as in closed_loop
+    pipeline.connect_data(
+        'camera', 'crop', 'cam_output1', 
+        label = 'camera to crop',
+        dtype = camera_worker.res.dtype,
+        rate_hz = settings['camera']['framerate_value'],
+        buffer_sec = settings['logs']['queues']['buffer_sec']
     )
+    connect_tracking(pipeline, settings, camera_worker.res.dtype)
 
-    # NOTE: the order in which you declare connections matter: background_subtraction will
-    # be served before image_saver
     if settings['settings']['videorecording']['video_recording']:
-
-        if settings['settings']['videorecording']['video_method'] == 'image sequence':
-            dag.connect_data(
-                sender = camera_worker, 
-                receiver = image_saver_worker, 
-                queue = queue_save_image, 
-                name = 'cam_output2'
-            )
-        
-        else:
-            if settings['camera']['num_channels'] == 3:
-
-                if settings['settings']['videorecording']['video_grayscale']:
-                    dag.connect_data(
-                        sender = camera_worker, 
-                        receiver = rgb_to_gray_converter, 
-                        queue = queue_camera_to_converter, 
-                        name = 'cam_output2'
-                    )
-
-                    dag.connect_data(
-                        sender = rgb_to_gray_converter, 
-                        receiver = video_recorder_worker, 
-                        queue = queue_converter_to_saver, 
-                        name = 'gray_compression'
-                    )
-
-                else:
-                    dag.connect_data(
-                        sender = camera_worker, 
-                        receiver = yuv420p_converter, 
-                        queue = queue_camera_to_converter, 
-                        name = 'cam_output2'
-                    )
-
-                    dag.connect_data(
-                        sender = yuv420p_converter, 
-                        receiver = video_recorder_worker, 
-                        queue = queue_converter_to_saver, 
-                        name = 'yuv420p_compression'
-                    )
-
-            else:
-
-                dag.connect_data(
-                    sender = camera_worker, 
-                    receiver = video_recorder_worker, 
-                    queue = queue_save_image, 
-                    name = 'cam_output2'
-                )
-
-        dag.connect_data(
-            sender = video_recorder_worker, 
-            receiver = display_worker, 
-            queue = queue_display_image, 
-            name = 'display_recording'
-        )
-
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_data(
-            sender = cropper, 
-            receiver = tracker_worker_list[i], 
-            queue = queue_crop_to_tracker[i], 
-            name = f'cropper_output_{i}'
-        )
-
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = stim_worker, 
-            queue = queue_tracking_to_stim[i], 
-            name = f'tracker_output_stim'
-        )
-
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_display_worker, 
-            queue = queue_tracking_to_overlay[i], 
-            name = 'tracker_output_overlay'
-        )
-
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_saver_worker, 
-            queue = queue_tracking_to_saver[i], 
-            name = 'tracker_output_saver'
-        )
+        connect_video_recording(pipeline, settings, camera_worker.res.dtype)
 
     # metadata
     if settings['main']['record']:
-        protocol = settings['sequencer']['protocol']
-        protocol_worker.set_protocol(protocol)
-        dag.connect_metadata(
-            sender = protocol_worker, 
-            receiver = stim_worker, 
-            queue = QueueMP(), 
-            name = 'stim_control'
-        )
+        protocol_worker.set_protocol(settings['sequencer']['protocol'])
+        pipeline.connect_metadata('protocol', 'visual_stim', 'stim_control')
         for i in range(settings['identity']['n_animals']):
-            dag.connect_metadata(
-                sender = tracker_worker_list[i], 
-                receiver = protocol_worker, 
-                queue = queue_trigger_metadata, 
-                name = 'tracker_metadata'
+            pipeline.connect_metadata(
+                f'tracker{i}', 'protocol', 'tracker_metadata',
+                label = 'tracker to protocol',
+                shared = 'trigger_metadata',
+                **tracking_sizing(pipeline, settings, i)
             )
     else:
-        dag.connect_metadata(
-            sender = stim_control_worker, 
-            receiver= stim_worker, 
-            queue = QueueMP(), 
-            name = 'stim_control'
-        )
-        
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_metadata(
-            sender = tracker_control_worker, 
-            receiver = tracker_worker_list[i], 
-            queue = QueueMP(), # multiple queues
-            name = f'tracker_control_{i}'
-        )
+        pipeline.connect_metadata('stim_gui', 'visual_stim', 'stim_control')
+
+    connect_sensors(pipeline, settings, sensors)
+    connect_run_control(pipeline)
 
-    # isolated nodes
+    dag = pipeline.compile(dag)
+
+    queue_monitor_worker = QueueMonitor(
+        queues = pipeline.monitored_queues(),
+        sampling_rate_hz = settings['logs']['log']['queue_metrics_rate_hz'],
+        metrics_file = settings['logs']['log']['queue_metrics_file'],
+        prometheus_port = settings['logs']['log']['prometheus_port'],
+        name = 'queue_monitor',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
     dag.add_node(queue_monitor_worker)
-    if settings['temperature']['serial_port'] != '':
-        dag.add_node(temperature_logger)
+
+    # CPU placement -----------------------------------------------------------------------
+    place_workers(pipeline.workers(), settings['logs']['cpu'], settings['settings']['prefix'])
+
+    # sampling profiler -------------------------------------------------------------------
+    profile_workers(
+        pipeline.workers() + [queue_monitor_worker], 
+        settings['logs']['profiler'], 
+        settings['settings']['prefix']
+    )
+
+    # startup timeline --------------------------------------------------------------------
+    time_startup(pipeline.workers())
 
     return (dag, worker_logger, queue_logger)
\ No newline at end of file
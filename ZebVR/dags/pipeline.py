@@ -0,0 +1,365 @@
+'''
+Declarative description of a DAG: stages (workers) and the edges between
+them, compiled into a ProcessingDAG.
+
+Edges carry their queue policy (see InstrumentedQueue) and their size:
+ring buffers hold buffer_sec of messages at rate_hz, messages of the
+declared dtype (or of message_nbytes), unless num_bytes is given. Edges
+without size use a QueueMP. Edges with the same shared key share a single
+queue, sized from the first one. Stages are only part of the DAG when they
+are connected (or isolated, e.g. monitors), so optional branches are left
+out by not declaring their edges.
+
+When compiling, the graph is validated and buffering times are reduced
+if needed to fit the memory budget: the configured one, and in any case
+the shared memory (/dev/shm) and RAM available. Each edge keeps at least
+MIN_BUFFERED_MESSAGES. The queue memory report is printed and saved to
+<prefix>_queue_memory_<timestamp>.json.
+'''
+
+import json
+import os
+from dataclasses import dataclass
+from math import ceil
+from typing import Any, Dict, List, Optional
+import numpy as np
+from numpy.typing import DTypeLike
+from ipc_tools import MonitoredQueue, ModifiableRingBuffer, QueueMP
+from dagline import ProcessingDAG, WorkerNode
+from multiprocessing_logger import Logger
+from ..workers import InstrumentedQueue
+from ..utils import append_timestamp_to_filename
+
+DEFAULT_BUFFER_SEC = 2.0
+MIN_BUFFERED_MESSAGES = 8
+SYSTEM_MEMORY_FRACTION = 0.8 # of the free shared memory and RAM, leaves room for the workers
+
+@dataclass
+class Edge:
+    sender: str
+    receiver: str
+    name: str
+    metadata: bool = False
+    label: Optional[str] = None # queue monitor label, not monitored if None
+    policy: str = InstrumentedQueue.LOSSLESS
+    message_nbytes: int = 0
+    rate_hz: float = 0.0
+    buffer_sec: float = DEFAULT_BUFFER_SEC
+    num_bytes: Optional[int] = None # fixed ring buffer size
+    shared: Optional[str] = None # edges with the same key share one queue
+    dtype: Optional[DTypeLike] = None # message dtype, sets message_nbytes
+    requested_buffer_sec: Optional[float] = None # before fitting the memory budget
+
+    def __post_init__(self) -> None:
+        if self.dtype is not None:
+            self.dtype = np.dtype(self.dtype)
+            self.message_nbytes = self.dtype.itemsize
+        self.requested_buffer_sec = self.buffer_sec
+
+    def is_sized(self) -> bool:
+        '''sized from the message size and buffering time, as opposed to a fixed size'''
+        return self.num_bytes is None and self.message_nbytes > 0
+
+    def is_ring_buffer(self) -> bool:
+        return self.num_bytes is not None or self.message_nbytes > 0
+
+    def num_messages(self) -> int:
+        return max(MIN_BUFFERED_MESSAGES, ceil(self.rate_hz * self.buffer_sec))
+
+    def ring_buffer_bytes(self) -> int:
+        if self.num_bytes is not None:
+            return self.num_bytes
+        return self.message_nbytes * self.num_messages()
+
+    def __str__(self) -> str:
+        kind = 'metadata' if self.metadata else 'data'
+        return f'{self.sender} -> {self.receiver} ({kind} {self.name})'
+
+def system_memory_available() -> Dict[str, Optional[int]]:
+    '''free shared memory (where ring buffers live) and available RAM in bytes, None if unknown'''
+
+    res = {'shm': None, 'ram': None}
+    try:
+        stat = os.statvfs('/dev/shm')
+        res['shm'] = stat.f_bavail * stat.f_frsize
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open('/proc/meminfo') as fd:
+            for line in fd:
+                if line.startswith('MemAvailable:'):
+                    res['ram'] = 1024 * int(line.split()[1])
+    except OSError:
+        pass
+    return res
+
+class Pipeline:
+
+    def __init__(
+            self, 
+            queue_logger: Logger, 
+            memory_budget_mb: float = 0, 
+            prefix: Optional[str] = None
+        ) -> None:
+        '''memory_budget_mb: maximum queue memory, 0 for the system limit only'''
+        self.queue_logger = queue_logger
+        self.memory_budget_mb = memory_budget_mb
+        self.prefix = prefix
+        self.memory_budget: Optional[int] = None # bytes, once compiled
+        self.stages: Dict[str, WorkerNode] = {}
+        self.isolated: List[str] = []
+        self.edges: List[Edge] = []
+        self.queues: Dict[int, Any] = {} # by edge index, once compiled
+        self.shared_queues: Dict[str, Any] = {}
+
+    def add_stage(self, name: str, worker: WorkerNode, isolated: bool = False) -> WorkerNode:
+        '''isolated stages are added to the DAG without edges'''
+        if name in self.stages:
+            raise ValueError(f'stage {name} already declared')
+        self.stages[name] = worker
+        if isolated:
+            self.isolated.append(name)
+        return worker
+
+    def connect_data(self, sender: str, receiver: str, name: str, **kwargs) -> Edge:
+        '''kwargs as in Edge'''
+        edge = Edge(sender, receiver, name, metadata=False, **kwargs)
+        self.edges.append(edge)
+        return edge
+
+    def connect_metadata(self, sender: str, receiver: str, name: str, **kwargs) -> Edge:
+        '''kwargs as in Edge'''
+        edge = Edge(sender, receiver, name, metadata=True, **kwargs)
+        self.edges.append(edge)
+        return edge
+
+    def used_stages(self) -> List[str]:
+        '''connected or isolated stages, in declaration order'''
+        used = set(self.isolated)
+        for edge in self.edges:
+            used.update((edge.sender, edge.receiver))
+        return [name for name in self.stages if name in used]
+
+    def workers(self) -> List[WorkerNode]:
+        return [self.stages[name] for name in self.used_stages()]
+
+    def validate(self) -> None:
+        '''raise ValueError listing every problem found'''
+
+        errors = []
+        seen = set()
+        outputs = {}
+        for edge in self.edges:
+            for stage in (edge.sender, edge.receiver):
+                if stage not in self.stages:
+                    errors.append(f'{edge}: unknown stage {stage}')
+            if edge.sender == edge.receiver:
+                errors.append(f'{edge}: stage connected to itself')
+            key = (edge.sender, edge.receiver, edge.name, edge.metadata)
+            if key in seen:
+                errors.append(f'{edge}: declared twice')
+            seen.add(key)
+            # a sender addresses its outputs by name, one receiver per name
+            output = (edge.sender, edge.name, edge.metadata)
+            if outputs.get(output, edge.receiver) != edge.receiver:
+                errors.append(f'{edge}: {edge.sender} already sends {edge.name} to {outputs[output]}')
+            outputs.setdefault(output, edge.receiver)
+            if edge.policy not in InstrumentedQueue.POLICIES:
+                errors.append(f'{edge}: unknown policy {edge.policy}')
+            if edge.is_ring_buffer() and edge.ring_buffer_bytes() < 2 * edge.message_nbytes:
+                errors.append(f'{edge}: {edge.ring_buffer_bytes()} bytes can not buffer messages of {edge.message_nbytes} bytes')
+
+        # data flows one way, metadata (control, logs) can go back
+        children = {}
+        for edge in self.edges:
+            if not edge.metadata:
+                children.setdefault(edge.sender, set()).add(edge.receiver)
+        state = {}
+        def visit(stage: str, path: List[str]) -> None:
+            state[stage] = 'visiting'
+            for child in children.get(stage, ()):
+                if state.get(child) == 'visiting':
+                    errors.append(f"data cycle: {' -> '.join(path + [child])}")
+                elif child not in state:
+                    visit(child, path + [child])
+            state[stage] = 'done'
+        for stage in list(children):
+            if stage not in state:
+                visit(stage, [stage])
+
+        if errors:
+            raise ValueError('invalid pipeline:\n    ' + '\n    '.join(errors))
+
+    def allocated_edges(self) -> List[Edge]:
+        '''edges which allocate a ring buffer, shared queues once'''
+        edges = []
+        shared = set()
+        for edge in self.edges:
+            if edge.shared is not None:
+                if edge.shared in shared:
+                    continue
+                shared.add(edge.shared)
+            if edge.is_ring_buffer():
+                edges.append(edge)
+        return edges
+
+    def memory_footprint(self) -> int:
+        '''bytes of shared memory allocated for ring buffers'''
+        return sum(edge.ring_buffer_bytes() for edge in self.allocated_edges())
+
+    def effective_memory_budget(self) -> Optional[int]:
+        '''configured budget, capped by the system, in bytes. None if unlimited'''
+
+        limits = [
+            int(SYSTEM_MEMORY_FRACTION * available) 
+            for available in system_memory_available().values() 
+            if available is not None
+        ]
+        system_limit = min(limits) if limits else None
+
+        if self.memory_budget_mb <= 0:
+            return system_limit
+
+        budget = int(self.memory_budget_mb * 1024**2)
+        if system_limit is not None and budget > system_limit:
+            print(
+                f'queue memory budget of {self.memory_budget_mb:g} MB exceeds the free '
+                f'shared memory or RAM, using {system_limit/1024**2:.0f} MB'
+            )
+            return system_limit
+        return budget
+
+    def fit_memory_budget(self, budget: int) -> None:
+        '''
+        Shorten the buffering time of sized edges by a common factor, edges
+        that reach MIN_BUFFERED_MESSAGES stay there. Fixed size edges are kept.
+        Raise ValueError if the budget can't be met.
+        '''
+
+        edges = self.allocated_edges()
+        if sum(edge.ring_buffer_bytes() for edge in edges) <= budget:
+            return
+
+        fixed = sum(edge.ring_buffer_bytes() for edge in edges if not edge.is_sized())
+        for _ in range(len(edges)):
+            # edges at their minimum are as good as fixed
+            shrinkable = [e for e in edges if e.is_sized() and e.num_messages() > MIN_BUFFERED_MESSAGES]
+            at_minimum = [e for e in edges if e.is_sized() and e not in shrinkable]
+            minimum = fixed + sum(e.ring_buffer_bytes() for e in at_minimum)
+            current = sum(e.ring_buffer_bytes() for e in shrinkable)
+            if not shrinkable or minimum + current <= budget:
+                break
+            factor = max(0.0, budget - minimum) / current
+            for edge in shrinkable:
+                edge.buffer_sec = edge.buffer_sec * factor
+
+        footprint = self.memory_footprint()
+        if footprint > budget:
+            raise ValueError(
+                f'queues need at least {footprint/1024**2:.1f} MB, '
+                f'more than the memory budget of {budget/1024**2:.1f} MB:\n'
+                + self.footprint_report()
+            )
+        print(
+            f'queue buffering times reduced to fit the memory budget of {budget/1024**2:.0f} MB, '
+            'consider fewer or smaller ROIs, a lower frame rate or a larger budget'
+        )
+
+    def footprint_report(self) -> str:
+        lines = ['queue memory:']
+        for edge in self.allocated_edges():
+            if not edge.is_sized():
+                sizing = 'fixed size'
+            else:
+                sizing = (
+                    f'{edge.num_messages()} x {edge.message_nbytes/1024:.1f} kB '
+                    f'({edge.buffer_sec:.2g} s at {edge.rate_hz:g} Hz)'
+                )
+                if edge.buffer_sec < edge.requested_buffer_sec:
+                    sizing += f', reduced from {edge.requested_buffer_sec:g} s'
+            lines.append(f'    {str(edge):<64} {edge.ring_buffer_bytes()/1024**2:9.1f} MB  {sizing}')
+        total = f'    total {self.memory_footprint()/1024**2:.1f} MB'
+        if self.memory_budget is not None:
+            total += f' (budget {self.memory_budget/1024**2:.0f} MB)'
+        lines.append(total)
+        return '\n'.join(lines)
+
+    def save_footprint_report(self, filename: str) -> None:
+        edges = []
+        for edge in self.allocated_edges():
+            edges.append({
+                'edge': str(edge),
+                'label': edge.label,
+                'policy': edge.policy,
+                'sized': edge.is_sized(),
+                'message_nbytes': edge.message_nbytes,
+                'rate_hz': edge.rate_hz,
+                'requested_buffer_sec': edge.requested_buffer_sec,
+                'buffer_sec': edge.buffer_sec,
+                'num_messages': edge.num_messages() if edge.is_sized() else None,
+                'num_bytes': edge.ring_buffer_bytes(),
+            })
+        report = {
+            'memory_budget': self.memory_budget,
+            'total_bytes': self.memory_footprint(),
+            'edges': edges
+        }
+        with open(filename, 'w') as fd:
+            json.dump(report, fd, indent=2)
+
+    def create_queue(self, edge: Edge) -> Any:
+        if edge.shared is not None:
+            if edge.shared not in self.shared_queues:
+                self.shared_queues[edge.shared] = self.new_queue(edge)
+            return self.shared_queues[edge.shared]
+        return self.new_queue(edge)
+
+    def new_queue(self, edge: Edge) -> Any:
+        if not edge.is_ring_buffer():
+            return QueueMP()
+        return InstrumentedQueue(
+            MonitoredQueue(ModifiableRingBuffer(
+                num_bytes = edge.ring_buffer_bytes(),
+                logger = self.queue_logger,
+                name = f'{edge.sender}_to_{edge.receiver}',
+            )),
+            policy = edge.policy
+        )
+
+    def compile(self, dag: Optional[ProcessingDAG] = None) -> ProcessingDAG:
+        '''validate, fit the memory budget, report the memory footprint, create queues and connect the DAG'''
+
+        self.validate()
+        self.memory_budget = self.effective_memory_budget()
+        if self.memory_budget is not None:
+            self.fit_memory_budget(self.memory_budget)
+        print(self.footprint_report())
+        if self.prefix:
+            self.save_footprint_report(append_timestamp_to_filename(f'{self.prefix}_queue_memory.json'))
+
+        if dag is None:
+            dag = ProcessingDAG()
+
+        for index, edge in enumerate(self.edges):
+            queue = self.create_queue(edge)
+            self.queues[index] = queue
+            connect = dag.connect_metadata if edge.metadata else dag.connect_data
+            connect(
+                sender = self.stages[edge.sender],
+                receiver = self.stages[edge.receiver],
+                queue = queue,
+                name = edge.name
+            )
+
+        for name in self.isolated:
+            dag.add_node(self.stages[name])
+
+        return dag
+
+    def monitored_queues(self) -> Dict[Any, str]:
+        '''queue -> label for the queue monitor, once compiled'''
+        return {
+            self.queues[index]: edge.label
+            for index, edge in enumerate(self.edges)
+            if edge.label is not None and index in self.queues
+        }
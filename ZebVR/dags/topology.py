@@ -0,0 +1,295 @@
+'''
+Edges shared by the DAGs, declared on a Pipeline with the stage names below.
+Stages which are not declared in a DAG must not be reached by its settings.
+
+    camera, crop, tracker{i}, tracker_gui, tracking_display, tracking_saver,
+    tracking_qc, visual_stim, audio_stim, daq, protocol, stim_gui, stim_saver,
+    image_saver, video_recorder, rgb_to_gray, yuv420p, display, clip_recorder,
+    temperature_logger, sensor_logger, sensor_display, run_control
+
+Queues are sized from the message dtypes and the buffering times in 
+settings['logs']['queues'] (see Pipeline for the memory budget).
+
+Edges leaving the critical path (camera, crop, trackers, stimulus) to savers
+and recorders never block their producer: they are DROP_WHEN_FULL, drops are
+counted by the queue monitor (QueueMetrics, alerts) and show up as missing
+indices in the savers' frame timing. Edges which may still block are:
+    camera to crop and crop to trackers (critical path, LOSSLESS)
+    converters to the video recorder (only the converter waits, its input
+        from the camera drops)
+    trackers to the protocol, temperature logger to the sensor logger
+    metadata edges without a dtype, which are not bounded (stimulus logs to
+        the stim saver, GUI controls)
+'''
+
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from ..workers import InstrumentedQueue, crop_message_dtype
+from ..utils.run_control import run_control_input
+from .pipeline import Pipeline
+
+TRACKING_QUEUE_BYTES = 200*1024**2 # if the tracking dtype can't be determined
+
+# stages with per-run state, restarted by run control on persistent workers
+RUN_CONTROLLED_STAGES = (
+    'tracking_saver', 
+    'stim_saver', 
+    'temperature_logger', 
+    'sensor_logger', 
+    'video_recorder', 
+    'clip_recorder',
+    'tracking_qc',
+    'protocol'
+)
+
+def recorded_streams(settings: Dict, dag_name: str) -> Tuple[bool, bool]:
+    '''(video, tracking) written to disk by a DAG when recording, see estimate_data_rates'''
+
+    video = settings['settings']['videorecording']['video_recording']
+    return {
+        'closed_loop': (video, True),
+        'closed_loop_3D': (video, True),
+        'open_loop': (video, False),
+        'video_recording': (True, False),
+        'tracking': (False, True),
+    }[dag_name]
+
+def crop_dtype(settings: Dict, frame_dtype: np.dtype, identity: int) -> np.dtype:
+    _, _, w, h = settings['identity']['ROIs'][identity]
+    image = frame_dtype['image']
+    return crop_message_dtype((h, w) + image.shape[2:], image.base)
+
+def tracking_sizing(pipeline: Pipeline, settings: Dict, identity: int) -> Dict:
+    '''
+    Edge kwargs for tracker outputs: sized from the tracker's message dtype if known 
+    (computed once per tracker, see TrackerWorker.output_dtype)
+    '''
+    dtype = pipeline.stages[f'tracker{identity}'].output_dtype(settings['identity']['ROIs'][identity])
+    if dtype is None:
+        return dict(num_bytes = TRACKING_QUEUE_BYTES)
+    return dict(
+        dtype = dtype, 
+        rate_hz = settings['camera']['framerate_value'], 
+        buffer_sec = settings['logs']['queues']['buffer_sec']
+    )
+
+def separate_conversion(settings: Dict) -> bool:
+    '''color conversion happens in the video saver unless a separate worker is requested'''
+    return (
+        settings['camera']['num_channels'] == 3
+        and settings['settings']['videorecording']['video_conversion_worker']
+        # ROIs are cropped from camera frames, before conversion
+        and settings['settings']['videorecording']['video_roi_mode'] == 'full frame'
+    )
+
+def connect_video_recording(pipeline: Pipeline, settings: Dict, frame_dtype: np.dtype) -> None:
+    '''camera to image or video saver (through a pixel format converter if requested), and recording preview'''
+
+    fps = settings['camera']['framerate_value']
+    # encoders are bursty (keyframes, segment switches)
+    buffer_sec = settings['logs']['queues']['recording_buffer_sec']
+    # a slow encoder or disk must not stall the camera
+    recording = dict(policy = InstrumentedQueue.DROP_WHEN_FULL, dtype = frame_dtype, rate_hz = fps, buffer_sec = buffer_sec)
+
+    if settings['settings']['videorecording']['video_method'] == 'image sequence':
+        pipeline.connect_data('camera', 'image_saver', 'cam_output2', label='direct video recording', **recording)
+        return
+
+    if separate_conversion(settings):
+        if settings['settings']['videorecording']['video_grayscale']:
+            converter, output = 'rgb_to_gray', 'gray_compression'
+        else:
+            converter, output = 'yuv420p', 'yuv420p_compression'
+        image = frame_dtype['image']
+        pipeline.connect_data('camera', converter, 'cam_output2', label='pixel format conversion', **recording)
+        pipeline.connect_data(
+            converter, 'video_recorder', output, 
+            label = 'converted video recording', 
+            dtype = pipeline.stages[converter].output_dtype(image.shape, image.base),
+            rate_hz = fps,
+            buffer_sec = buffer_sec
+        )
+    else:
+        pipeline.connect_data('camera', 'video_recorder', 'cam_output2', label='direct video recording', **recording)
+
+    pipeline.connect_data(
+        'video_recorder', 'display', 'display_recording',
+        label = 'display',
+        policy = InstrumentedQueue.DECIMATE, # preview of the recording
+        dtype = frame_dtype,
+        rate_hz = fps / settings['settings']['videorecording']['video_decimation'],
+        buffer_sec = settings['logs']['queues']['preview_buffer_sec']
+    )
+
+def connect_tracking(
+        pipeline: Pipeline, 
+        settings: Dict, 
+        frame_dtype: np.dtype, 
+        source: str = 'crop', 
+        stimulus: Optional[str] = 'visual_stim'
+    ) -> None:
+    '''source (cropper of frame_dtype images) to one tracker per animal, and trackers to stimulus, display and savers'''
+
+    fps = settings['camera']['framerate_value']
+    buffer_sec = settings['logs']['queues']['buffer_sec']
+
+    for i in range(settings['identity']['n_animals']):
+        tracker = f'tracker{i}'
+        tracking = tracking_sizing(pipeline, settings, i)
+
+        pipeline.connect_data(
+            source, tracker, f'cropper_output_{i}',
+            label = f'crop to tracker {i}',
+            dtype = crop_dtype(settings, frame_dtype, i),
+            rate_hz = fps,
+            buffer_sec = buffer_sec
+        )
+        if stimulus is not None:
+            pipeline.connect_data(
+                tracker, stimulus, 'tracker_output_stim',
+                label = f'tracking to stim {i}',
+                policy = InstrumentedQueue.LATEST_ONLY, # stimulus only needs the latest tracking
+                **tracking
+            )
+        pipeline.connect_data(
+            tracker, 'tracking_display', 'tracker_output_overlay',
+            label = f'tracking to overlay {i}',
+            policy = InstrumentedQueue.LATEST_ONLY, # display
+            **tracking
+        )
+        pipeline.connect_data(
+            tracker, 'tracking_saver', 'tracker_output_saver', 
+            label = f'tracking to saver {i}', 
+            policy = InstrumentedQueue.DROP_WHEN_FULL, # savers must not stall the tracker
+            **tracking
+        )
+        if settings['settings']['tracking']['qc_recording']:
+            pipeline.connect_data(
+                tracker, 'tracking_qc', 'tracker_output_qc', 
+                label = f'tracking to QC {i}', 
+                policy = InstrumentedQueue.DROP_WHEN_FULL,
+                **tracking
+            )
+
+        pipeline.connect_metadata('tracker_gui', tracker, f'tracker_control_{i}')
+
+def connect_stimulus_control(pipeline: Pipeline, settings: Dict, tracking: bool = True) -> None:
+    '''
+    Protocol (when recording) or stimulus GUI to stimulus workers, and stimulus
+    logs to the stim saver. Trackers trigger the protocol if tracking.
+    '''
+
+    controller = 'protocol' if settings['main']['record'] else 'stim_gui'
+    pipeline.connect_metadata(controller, 'visual_stim', 'stim_control')
+    if settings['audio']['enabled']:
+        pipeline.connect_metadata(controller, 'audio_stim', 'audio_stim_control')
+    pipeline.connect_metadata(controller, 'daq', 'daq_stim_control')
+
+    if settings['main']['record'] and tracking:
+        for i in range(settings['identity']['n_animals']):
+            pipeline.connect_metadata(
+                f'tracker{i}', 'protocol', 'tracker_metadata',
+                label = 'tracker to protocol',
+                shared = 'trigger_metadata',
+                **tracking_sizing(pipeline, settings, i)
+            )
+
+    # one queue for all logs
+    pipeline.connect_metadata('visual_stim', 'stim_saver', 'visual_stim_logger', shared='stim_saver')
+    pipeline.connect_metadata('daq', 'stim_saver', 'daq_stim_logger', shared='stim_saver')
+    if settings['audio']['enabled']:
+        pipeline.connect_metadata('audio_stim', 'stim_saver', 'audio_stim_logger', shared='stim_saver')
+
+def connect_clip_recording(pipeline: Pipeline, settings: Dict, frame_dtype: np.dtype) -> None:
+    '''full frame rate clips around logged stimulus events'''
+    pipeline.connect_data(
+        'camera', 'clip_recorder', 'cam_output3',
+        label = 'clip recording',
+        policy = InstrumentedQueue.DROP_WHEN_FULL,
+        dtype = frame_dtype,
+        rate_hz = settings['camera']['framerate_value'],
+        buffer_sec = settings['logs']['queues']['buffer_sec']
+    )
+    pipeline.connect_metadata('stim_saver', 'clip_recorder', 'stim_log')
+
+def sensor_channels(settings: Dict, temperature_period_sec: float) -> List['SensorChannel']:
+    '''
+    Channels shown by the sensor display and, when enabled, logged by the sensor
+    logger: the temperature sensor first if one is selected (read by the 
+    temperature logger), then the DAQ analog inputs of settings['sensors'].
+    '''
+
+    from ..workers import SensorChannel, DAQAnalogSensor
+
+    channels = []
+    if settings['temperature']['serial_port'] != '':
+        channels.append(SensorChannel('temperature', None, temperature_period_sec, '\N{DEGREE SIGN}C'))
+
+    if not settings['sensors']['enabled']:
+        return channels
+
+    for channel in settings['sensors']['channels']:
+        stim_boards = [board.id for board in settings['daq'].get(channel['board_type'], [])]
+        if channel['board_id'] in stim_boards:
+            print(f"sensor {channel['name']}: {channel['board_type'].name} board {channel['board_id']} is also used for stimulation")
+        channels.append(SensorChannel(
+            name = channel['name'],
+            sensor_constructor = partial(DAQAnalogSensor, channel['board_type'], channel['board_id'], channel['channel']),
+            sample_period_sec = channel['sample_period_sec'],
+            unit = channel['unit']
+        ))
+    return channels
+
+def connect_sensors(pipeline: Pipeline, settings: Dict, channels: List['SensorChannel']) -> None:
+    '''
+    Sensor logger (for channels from sensor_channels) to the sensor display. The 
+    temperature logger feeds the sensor logger when sensors are logged, and the
+    display directly otherwise.
+    '''
+
+    from ..workers import sensor_message_dtype
+
+    temperature = settings['temperature']['serial_port'] != ''
+    sensors = settings['sensors']['enabled'] and len(channels) > 0
+    buffer_sec = settings['logs']['queues']['preview_buffer_sec']
+
+    if temperature:
+        temperature_edge = dict(
+            dtype = sensor_message_dtype(1),
+            rate_hz = 1/pipeline.stages['temperature_logger'].sample_period_sec,
+        )
+        if sensors:
+            pipeline.connect_data(
+                'temperature_logger', 'sensor_logger', 'temperature_log',
+                label = 'temperature to sensor log',
+                buffer_sec = settings['logs']['queues']['buffer_sec'],
+                **temperature_edge
+            )
+        else:
+            pipeline.connect_data(
+                'temperature_logger', 'sensor_display', 'temperature_display',
+                label = 'temperature display',
+                policy = InstrumentedQueue.LATEST_ONLY, # display, only the latest reading matters
+                buffer_sec = buffer_sec,
+                **temperature_edge
+            )
+
+    if not sensors:
+        return
+
+    pipeline.connect_data(
+        'sensor_logger', 'sensor_display', 'sensor_readings',
+        label = 'sensor display',
+        policy = InstrumentedQueue.LATEST_ONLY,
+        dtype = sensor_message_dtype(len(channels)),
+        rate_hz = max(1/channel.sample_period_sec for channel in channels),
+        buffer_sec = buffer_sec
+    )
+
+def connect_run_control(pipeline: Pipeline) -> None:
+    '''run control to the run controlled stages of the DAG, call once the other edges are declared'''
+    stages = [stage for stage in pipeline.used_stages() if stage in RUN_CONTROLLED_STAGES]
+    for stage in stages:
+        pipeline.connect_metadata('run_control', stage, run_control_input(stage))
+    pipeline.stages['run_control'].set_receivers(stages)
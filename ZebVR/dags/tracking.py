@@ -1,82 +1,43 @@
 from typing import Dict, Optional, Tuple
+from pathlib import Path
 
 from multiprocessing_logger import Logger
-from ipc_tools import MonitoredQueue, ModifiableRingBuffer, QueueMP
 from dagline import ProcessingDAG, receive_strategy, send_strategy
 from tracker import (
     SingleFishTracker_CPU,
     SingleFishOverlay_opencv
 )
 from ..workers import (
+    RunControlWorker,
     CameraWorker, 
     TrackerWorker, 
     CropWorker,
     TrackerGui, 
     TrackingDisplay,
     QueueMonitor,
+    DiskMonitorWorker,
     TrackingSaver,
+    TrackingQCRecorder,
+    TemperatureLoggerWorker,
+    SensorLoggerWorker,
+    SensorDisplay,
 )
-from ..utils import tracker_from_json
-
-DEFAULT_QUEUE_SIZE_MB = 500
+from ..utils import tracker_from_json, estimate_data_rates, place_workers, profile_workers, time_startup, new_run_control
+from .pipeline import Pipeline
+from .topology import connect_tracking, sensor_channels, connect_sensors, connect_run_control, recorded_streams
 
 def tracking(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[ProcessingDAG, Logger, Logger]:
     
-    # create DAG
-    if dag is None:
-        dag = ProcessingDAG()
-    
     # create loggers
     worker_logger = Logger(settings['logs']['log']['worker_logfile'], Logger.INFO)
     queue_logger = Logger(settings['logs']['log']['queue_logfile'], Logger.INFO)
+    trace_file = settings['logs']['log']['latency_trace_file'] or None # per-message latency tracing
 
-    # create queues -----------------------------------------------------------------------            
-    queue_cam_to_crop = MonitoredQueue(ModifiableRingBuffer(
-        num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-        #copy=False, # you probably don't need to copy if processing is fast enough
-        logger = queue_logger,
-        name = 'cam_to_crop',
-    ))
-
-    queue_crop_to_tracker = []
-    queue_tracking_to_stim = []
-    queue_tracking_to_overlay = []
-    queue_tracking_to_saver = []
-
-    for i in range(settings['identity']['n_animals']):
-
-        queue_crop_to_tracker.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                #copy=False, # you probably don't need to copy if processing is fast enough
-                logger = queue_logger,
-                name = 'crop_to_trackers',
-            ))
-        )
-        
-        queue_tracking_to_stim.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_stim',
-                            ))
-        )
-
-        queue_tracking_to_overlay.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
-
-        queue_tracking_to_saver.append(
-            MonitoredQueue(ModifiableRingBuffer(
-                num_bytes = DEFAULT_QUEUE_SIZE_MB*1024**2,
-                logger = queue_logger,
-                name = 'tracker_to_overlay',
-                            ))
-        )
+    pipeline = Pipeline(
+        queue_logger, 
+        memory_budget_mb = settings['logs']['queues']['memory_budget_mb'], 
+        prefix = settings['settings']['prefix']
+    )
 
     # create workers -----------------------------------------------------------------------
     camera_worker = CameraWorker(
@@ -98,21 +59,22 @@ def tracking(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Proce
         receive_data_timeout = 1.0,
     )
 
-    queues = {
-        queue_cam_to_crop: 'camera to cropper',
-    }
-    queues.update({q: f'crop to tracker {n}' for n,q in enumerate(queue_crop_to_tracker)})
-    queues.update({q: f'tracking to stim {n}' for n,q in enumerate(queue_tracking_to_stim)})
-    queues.update({q: f'tracking to overlay {n}' for n,q in enumerate(queue_tracking_to_overlay)})
-    queues.update({q: f'tracking to saver {n}' for n,q in enumerate(queue_tracking_to_saver)})
+    record_video, record_tracking = recorded_streams(settings, 'tracking')
+    disk_monitor_worker = DiskMonitorWorker(
+        data_rates = estimate_data_rates(settings, record_video, record_tracking),
+        name = 'disk_monitor',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.INFO,
+        receive_data_timeout = 1.0,
+    )
 
-    queue_monitor_worker = QueueMonitor(
-        queues = queues,
-        name = 'queue_monitor',
+    run_control_worker = RunControlWorker(
+        run_control = new_run_control(),
+        name = 'run_control',
         logger = worker_logger, 
         logger_queues = queue_logger,
         log_level = Logger.ERROR,
-        receive_data_timeout = 1.0,
     )
 
     cropper = CropWorker(
@@ -142,6 +104,8 @@ def tracking(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Proce
                 cam_width = settings['camera']['width_value'],
                 cam_height = settings['camera']['height_value'],
                 n_tracker_workers = settings['identity']['n_animals'],
+                qc_decimation = settings['settings']['tracking']['qc_decimation'] if settings['settings']['tracking']['qc_recording'] else 0,
+                warmup_ROI = settings['identity']['ROIs'][i],
                 name = f'tracker{i}', 
                 logger = worker_logger, 
                 logger_queues = queue_logger,
@@ -179,9 +143,20 @@ def tracking(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Proce
         profile = False
     )
 
+    tracking_qc_worker = TrackingQCRecorder(
+        folder = Path(settings['settings']['tracking']['csv_filename']).parent,
+        name = 'tracking_qc',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
+
     tracking_saver_worker = TrackingSaver(
         filename = settings['settings']['tracking']['csv_filename'],
         num_tail_points_interp = settings['settings']['tracking']['n_tail_pts_interp'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'tracking_saver',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -189,47 +164,93 @@ def tracking(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[Proce
         receive_data_timeout = 1.0,
     )
 
-    # connect DAG -----------------------------------------------------------------------
-    # data
-    dag.connect_data(
-        sender = camera_worker, 
-        receiver = cropper, 
-        queue = queue_cam_to_crop, 
-        name = 'cam_output1'
+    # sensors ------------------------------------------------
+    temperature_logger = TemperatureLoggerWorker(
+        filename = settings['temperature']['csv_filename'],
+        serial_port = settings['temperature']['serial_port'],
+        name = 'temperature_logger',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        send_data_strategy = send_strategy.BROADCAST,
     )
 
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_data(
-            sender = cropper, 
-            receiver = tracker_worker_list[i], 
-            queue = queue_crop_to_tracker[i], 
-            name = f'cropper_output_{i}'
-        )
+    sensors = sensor_channels(settings, temperature_logger.sample_period_sec)
 
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_display_worker, 
-            queue = queue_tracking_to_overlay[i], 
-            name = 'tracker_output_overlay'
-        )
+    sensor_logger = SensorLoggerWorker(
+        channels = sensors,
+        filename = settings['sensors']['filename'],
+        name = 'sensor_logger',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1,
+    )
 
-        dag.connect_data(
-            sender = tracker_worker_list[i], 
-            receiver = tracking_saver_worker, 
-            queue = queue_tracking_to_saver[i], 
-            name = 'tracker_output_saver'
-        )
+    sensor_display = SensorDisplay(
+        channels = [f'{channel.name} ({channel.unit})' for channel in sensors],
+        name = 'sensor_display',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1, # readings are slow, keep the window responsive
+    )
 
-    # metadata
-    for i in range(settings['identity']['n_animals']):
-        dag.connect_metadata(
-            sender = tracker_control_worker, 
-            receiver = tracker_worker_list[i], 
-            queue = QueueMP(), 
-            name = f'tracker_control_{i}'
-        )
+    # stages -----------------------------------------------------------------------------
+    pipeline.add_stage('camera', camera_worker)
+    pipeline.add_stage('crop', cropper)
+    for i, tracker_worker in enumerate(tracker_worker_list):
+        pipeline.add_stage(f'tracker{i}', tracker_worker)
+    pipeline.add_stage('tracker_gui', tracker_control_worker)
+    pipeline.add_stage('tracking_display', tracking_display_worker)
+    pipeline.add_stage('tracking_saver', tracking_saver_worker)
+    pipeline.add_stage('tracking_qc', tracking_qc_worker)
+    if settings['main']['record']:
+        pipeline.add_stage('disk_monitor', disk_monitor_worker, isolated=True)
+    pipeline.add_stage('run_control', run_control_worker)
+    pipeline.add_stage('temperature_logger', temperature_logger)
+    pipeline.add_stage('sensor_logger', sensor_logger)
+    pipeline.add_stage('sensor_display', sensor_display)
+
+    # connect DAG -----------------------------------------------------------------------
+    pipeline.connect_data(
+        'camera', 'crop', 'cam_output1', 
+        label = 'camera to cropper',
+        dtype = camera_worker.res.dtype,
+        rate_hz = settings['camera']['framerate_value'],
+        buffer_sec = settings['logs']['queues']['buffer_sec']
+    )
+    connect_tracking(pipeline, settings, camera_worker.res.dtype, stimulus=None)
+    connect_sensors(pipeline, settings, sensors)
+    connect_run_control(pipeline)
+
+    dag = pipeline.compile(dag)
+
+    queue_monitor_worker = QueueMonitor(
+        queues = pipeline.monitored_queues(),
+        sampling_rate_hz = settings['logs']['log']['queue_metrics_rate_hz'],
+        metrics_file = settings['logs']['log']['queue_metrics_file'],
+        prometheus_port = settings['logs']['log']['prometheus_port'],
+        name = 'queue_monitor',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
 
-    # isolated nodes
     dag.add_node(queue_monitor_worker)
 
+    # CPU placement -----------------------------------------------------------------------
+    place_workers(pipeline.workers(), settings['logs']['cpu'], settings['settings']['prefix'])
+
+    # sampling profiler -------------------------------------------------------------------
+    profile_workers(
+        pipeline.workers() + [queue_monitor_worker], 
+        settings['logs']['profiler'], 
+        settings['settings']['prefix']
+    )
+
+    # startup timeline --------------------------------------------------------------------
+    time_startup(pipeline.workers())
+
     return (dag, worker_logger, queue_logger)
\ No newline at end of file
@@ -1,68 +1,36 @@
 from dagline import ProcessingDAG, receive_strategy, send_strategy
 from typing import Dict, Tuple, Optional
 from ..workers import (
+    RunControlWorker,
     CameraWorker, 
     ImageSaverWorker, 
     VideoSaverWorker,
     Display,
     QueueMonitor,
+    DiskMonitorWorker,
     ImageFilterWorker, 
     TemperatureLoggerWorker,
-    rgb_to_yuv420p,
-    rgb_to_gray
+    SensorLoggerWorker,
+    SensorDisplay,
+    RGB_TO_YUV420P,
+    RGB_TO_GRAY
 )
 from multiprocessing_logger import Logger
-from ipc_tools import MonitoredQueue, ModifiableRingBuffer
+from ..utils import estimate_data_rates, place_workers, profile_workers, time_startup, new_run_control
+from .pipeline import Pipeline
+from .topology import connect_video_recording, sensor_channels, connect_sensors, connect_run_control, recorded_streams
 
 def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tuple[ProcessingDAG, Logger, Logger]:
     
-    # create DAG
-    if dag is None:
-        dag = ProcessingDAG()
-    
     # create loggers
     worker_logger = Logger(settings['logs']['log']['worker_logfile'], Logger.INFO)
     queue_logger = Logger(settings['logs']['log']['queue_logfile'], Logger.INFO)
+    trace_file = settings['logs']['log']['latency_trace_file'] or None # per-message latency tracing
     
-    # create queues -----------------------------------------------------------------------
-    queue_cam = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 500*1024**2, 
-            logger = queue_logger,
-            name = 'camera_to_background',
-                    )
-    )
-
-    queue_display_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 500*1024**2,
-            logger = queue_logger,
-            name = 'image_saver_to_display',
-                    )
-    )
-
-    queue_camera_to_converter = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 500*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_converter',
-                    )
-    )
-
-    queue_converter_to_saver = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 500*1024**2,
-            logger = queue_logger,
-            name = 'converter_to_saver',
-                    )
-    )
-
-    queue_save_image = MonitoredQueue(
-        ModifiableRingBuffer(
-            num_bytes = 500*1024**2,
-            logger = queue_logger,
-            name = 'camera_to_image_saver',
-                    )
+    pipeline = Pipeline(
+        queue_logger, 
+        memory_budget_mb = settings['logs']['queues']['memory_budget_mb'], 
+        prefix = settings['settings']['prefix']
     )
 
     # create workers -----------------------------------------------------------------------
@@ -90,6 +58,7 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
         decimation = settings['settings']['videorecording']['video_decimation'],
         compress = settings['settings']['videorecording']['video_recording_compression'],
         resize = settings['settings']['videorecording']['video_recording_resize'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
         name = 'cam_output2',  
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -109,6 +78,13 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
         video_profile = 'main' if not settings['settings']['videorecording']['video_grayscale'] else 'high',
         video_preset = settings['settings']['videorecording']['video_preset'],
         video_quality = settings['settings']['videorecording']['video_quality'],
+        segment_duration_sec = settings['settings']['videorecording']['video_segment_duration_sec'],
+        num_encoders = settings['settings']['videorecording']['video_num_encoders'],
+        crash_safe_container = settings['settings']['videorecording']['video_crash_safe'],
+        roi_mode = settings['settings']['videorecording']['video_roi_mode'],
+        ROIs = settings['identity']['ROIs'],
+        checkpoint_interval_sec = settings['logs']['log']['checkpoint_interval_sec'],
+        trace_file = trace_file,
         name = 'video_recorder',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -117,7 +93,7 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
     )
 
     yuv420p_converter = ImageFilterWorker(
-        image_function=rgb_to_yuv420p,
+        image_function=RGB_TO_YUV420P,
         name = 'yuv420p_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -126,7 +102,7 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
     )
 
     rgb_to_gray_converter = ImageFilterWorker(
-        image_function=rgb_to_gray,
+        image_function=RGB_TO_GRAY,
         name = 'rgb_to_gray_converter',
         logger = worker_logger, 
         logger_queues = queue_logger,
@@ -143,21 +119,24 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
         receive_data_timeout = 1.0,
     )
 
-    queue_monitor_worker = QueueMonitor(
-        queues = {
-            queue_cam: 'camera to background',
-            queue_display_image: 'display',
-            queue_save_image: 'direct video recording',
-            queue_camera_to_converter: 'pixel format conversion',
-            queue_converter_to_saver: 'converted video recording',
-        },
-        name = 'queue_monitor',
+    record_video, record_tracking = recorded_streams(settings, 'video_recording')
+    disk_monitor_worker = DiskMonitorWorker(
+        data_rates = estimate_data_rates(settings, record_video, record_tracking),
+        name = 'disk_monitor',
         logger = worker_logger, 
         logger_queues = queue_logger,
-        log_level = Logger.ERROR,
+        log_level = Logger.INFO,
         receive_data_timeout = 1.0,
     )
 
+    run_control_worker = RunControlWorker(
+        run_control = new_run_control(),
+        name = 'run_control',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+    )
+
     temperature_logger = TemperatureLoggerWorker(
         filename = settings['temperature']['csv_filename'],
         serial_port = settings['temperature']['serial_port'],
@@ -165,68 +144,72 @@ def video_recording(settings: Dict, dag: Optional[ProcessingDAG] = None) -> Tupl
         logger = worker_logger, 
         logger_queues = queue_logger,
         log_level = Logger.ERROR,
+        send_data_strategy = send_strategy.BROADCAST,
     )
 
-    # connect DAG -----------------------------------------------------------------------
-    if settings['settings']['videorecording']['video_method'] == 'image sequence':
-        dag.connect_data(
-            sender = camera_worker, 
-            receiver = image_saver_worker, 
-            queue = queue_save_image, 
-            name = 'cam_output2'
-        )
-
-    else:
-        if settings['camera']['num_channels'] == 3:
-
-            if settings['settings']['videorecording']['video_grayscale']:
-                dag.connect_data(
-                    sender = camera_worker, 
-                    receiver = rgb_to_gray_converter, 
-                    queue = queue_camera_to_converter, 
-                    name = 'cam_output2'
-                )
-
-                dag.connect_data(
-                    sender = rgb_to_gray_converter, 
-                    receiver = video_recorder_worker, 
-                    queue = queue_converter_to_saver, 
-                    name = 'gray_compression'
-                )
-
-            else:
-                dag.connect_data(
-                    sender = camera_worker, 
-                    receiver = yuv420p_converter, 
-                    queue = queue_camera_to_converter, 
-                    name = 'cam_output2'
-                )
-
-                dag.connect_data(
-                    sender = yuv420p_converter, 
-                    receiver = video_recorder_worker, 
-                    queue = queue_converter_to_saver, 
-                    name = 'yuv420p_compression'
-                )
-
-        else:
-
-            dag.connect_data(
-                sender = camera_worker, 
-                receiver = video_recorder_worker, 
-                queue = queue_save_image, 
-                name = 'cam_output2'
-            )
-
-    dag.connect_data(
-        sender = video_recorder_worker, 
-        receiver = display_worker, 
-        queue = queue_display_image, 
-        name = 'display_recording'
+    sensors = sensor_channels(settings, temperature_logger.sample_period_sec)
+
+    sensor_logger = SensorLoggerWorker(
+        channels = sensors,
+        filename = settings['sensors']['filename'],
+        name = 'sensor_logger',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1,
+    )
+
+    sensor_display = SensorDisplay(
+        channels = [f'{channel.name} ({channel.unit})' for channel in sensors],
+        name = 'sensor_display',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 0.1, # readings are slow, keep the window responsive
     )
 
+    # stages -----------------------------------------------------------------------------
+    pipeline.add_stage('camera', camera_worker)
+    pipeline.add_stage('image_saver', image_saver_worker)
+    pipeline.add_stage('video_recorder', video_recorder_worker)
+    pipeline.add_stage('yuv420p', yuv420p_converter)
+    pipeline.add_stage('rgb_to_gray', rgb_to_gray_converter)
+    pipeline.add_stage('display', display_worker)
+    if settings['main']['record']:
+        pipeline.add_stage('disk_monitor', disk_monitor_worker, isolated=True)
+    pipeline.add_stage('run_control', run_control_worker)
+    pipeline.add_stage('temperature_logger', temperature_logger)
+    pipeline.add_stage('sensor_logger', sensor_logger)
+    pipeline.add_stage('sensor_display', sensor_display)
+
+    # connect DAG -----------------------------------------------------------------------
+    connect_video_recording(pipeline, settings, camera_worker.res.dtype)
+    connect_sensors(pipeline, settings, sensors)
+    connect_run_control(pipeline)
+
+    dag = pipeline.compile(dag)
+
+    queue_monitor_worker = QueueMonitor(
+        queues = pipeline.monitored_queues(),
+        name = 'queue_monitor',
+        logger = worker_logger, 
+        logger_queues = queue_logger,
+        log_level = Logger.ERROR,
+        receive_data_timeout = 1.0,
+    )
     dag.add_node(queue_monitor_worker)
-    if settings['temperature']['serial_port'] != '':
-        dag.add_node(temperature_logger)
+
+    # CPU placement -----------------------------------------------------------------------
+    place_workers(pipeline.workers(), settings['logs']['cpu'], settings['settings']['prefix'])
+
+    # sampling profiler -------------------------------------------------------------------
+    profile_workers(
+        pipeline.workers() + [queue_monitor_worker], 
+        settings['logs']['profiler'], 
+        settings['settings']['prefix']
+    )
+
+    # startup timeline --------------------------------------------------------------------
+    time_startup(pipeline.workers())
 
     return (dag, worker_logger, queue_logger)
\ No newline at end of file
@@ -0,0 +1,106 @@
+'''
+Workers and queues kept across consecutive runs.
+
+Building a DAG spawns every worker process, which imports its modules,
+and allocates the shared memory of the queues. With persistent workers,
+a run whose settings differ from the previous one only in RUN_SETTINGS
+(output filenames, protocol, duration, see ZebVR.utils.run_control)
+reuses the running DAG, the run is started and stopped with run control
+messages instead. Any other change builds a new DAG.
+'''
+
+from multiprocessing import Process
+from typing import Callable, Dict, Optional, Tuple
+from dagline import ProcessingDAG
+from multiprocessing_logger import Logger
+from ..utils import (
+    RunControl,
+    pool_key,
+    clear_run_control,
+    current_run_control,
+    clear_frame_timing_counters,
+    registered_frame_timing_counters,
+    startup_timeline
+)
+from ..utils.startup_timeline import SPAWNED
+
+DAGBuilder = Callable[[Dict], Tuple[ProcessingDAG, Logger, Logger]]
+
+class WorkerPool:
+
+    def __init__(self) -> None:
+        self.dag: Optional[ProcessingDAG] = None
+        self.worker_logger: Optional[Logger] = None
+        self.queue_logger: Optional[Logger] = None
+        self.p_worker_logger: Optional[Process] = None
+        self.p_queue_logger: Optional[Process] = None
+        self.run_control: Optional[RunControl] = None
+        self.key: Optional[str] = None
+
+    def is_running(self) -> bool:
+        return self.dag is not None
+
+    def start_run(self, build: DAGBuilder, settings: Dict, persistent: bool = False) -> bool:
+        '''
+        Start a run of the DAG built by build (e.g. closed_loop) from settings,
+        on the running workers if persistent and possible. Returns True if
+        workers were reused.
+        '''
+
+        startup_timeline().new_run()
+        key = f'{build.__name__}\n{pool_key(settings)}'
+
+        if self.dag is not None:
+            if persistent and key == self.key and self.run_control is not None:
+                for counters in registered_frame_timing_counters():
+                    counters.reset()
+                run = self.run_control.start_run(settings)
+                print(f'persistent workers: run {run}')
+                return True
+            self.shutdown()
+
+        clear_frame_timing_counters()
+        clear_run_control()
+        self.dag, self.worker_logger, self.queue_logger = build(settings)
+        self.run_control = current_run_control()
+        self.key = key
+
+        self.p_worker_logger = Process(target=self.worker_logger.run)
+        self.p_queue_logger = Process(target=self.queue_logger.run)
+        self.p_worker_logger.start()
+        self.p_queue_logger.start()
+        self.dag.start()
+        startup_timeline().mark(SPAWNED)
+
+        if persistent and self.run_control is not None:
+            self.run_control.open_log(settings)
+        return False
+
+    def stop_run(self, persistent: bool = False) -> None:
+        '''stop the current run, workers keep running if persistent'''
+
+        if self.dag is None:
+            return
+        
+        if persistent and self.run_control is not None:
+            self.run_control.stop_run()
+        else:
+            self.shutdown()
+
+    def shutdown(self) -> None:
+        '''stop the workers'''
+
+        if self.dag is None:
+            return
+        
+        if self.run_control is not None:
+            self.run_control.log_stop()
+        self.dag.stop()
+        self.worker_logger.stop()
+        self.queue_logger.stop()
+        self.p_worker_logger.join()
+        self.p_queue_logger.join()
+
+        self.dag = None
+        self.run_control = None
+        self.key = None
@@ -19,7 +19,9 @@ from PyQt5.QtWidgets import (
     QAction,
     QButtonGroup,
     QFileDialog,
-    QSizePolicy
+    QSizePolicy,
+    QLabel,
+    QCheckBox
 )
 from PyQt5.QtGui import QIcon
 from PyQt5.QtCore import QTimer, Qt
@@ -33,6 +35,7 @@ from .calibration import (
     power_calibration
 )
 from .background import inpaint_background, static_background
+from .protocol import daq_trigger_conflicts
 from .widgets import (
     CameraWidget, 
     CameraController,
@@ -45,12 +48,23 @@ from .widgets import (
     SequencerWidget,
     SettingsWidget,
     TemperatureWidget,
+    SensorWidget,
     LogsWidget,
     AudioWidget,
     DaqWidget
 )
-from .utils import append_timestamp_to_filename, serialize
-from .dags import closed_loop, open_loop, video_recording, tracking
+from .utils import (
+    append_timestamp_to_filename, 
+    serialize,
+    registered_frame_timing_counters,
+    check_disks,
+    DiskStatus,
+    current_profiling_session,
+    startup_timeline
+)
+from .utils.startup_timeline import FIRST_FRAME, RUN_MILESTONES
+
+STARTUP_REPORT_DELAY_SEC = 5 # after the first frame, for tracking and stimulus to start
 
 from enum import Enum
 
@@ -71,9 +85,10 @@ class MainGui(QMainWindow):
         self.settings['main'] = {}
         self.state = State.IDLE
 
-        self.dag = None
-        self.worker_logger = None
-        self.queue_logger = None
+        self.worker_pool = None # created with the first DAG
+        self.metadata_filename = None
+        self.disks_ok = False # result of the last disk check
+        self.startup_reported = True
 
         self.create_components()
         self.layout_components()
@@ -82,6 +97,14 @@ class MainGui(QMainWindow):
         self.setWindowTitle('ZebVR')
         self.setWindowIcon(QIcon('ZebVR/resources/zebvr.png'))
 
+        # DAGs import every worker backend, in the background so the window shows first
+        self.warmup_thread = WorkerThread(self.warm_up)
+        self.warmup_thread.finished.connect(self.warmup_thread.deleteLater)
+        self.warmup_thread.start()
+
+    def warm_up(self):
+        from . import dags
+
     def create_components(self):
 
         self.busy_overlay = BusyOverlay(self)
@@ -123,9 +146,13 @@ class MainGui(QMainWindow):
         
         self.temperature_widget = TemperatureWidget()
         self.temperature_widget.state_changed.connect(self.update_temperature)
+
+        self.sensor_widget = SensorWidget()
+        self.sensor_widget.state_changed.connect(self.update_sensors)
         
         self.settings_widget = SettingsWidget()
         self.settings_widget.prefix_changed.connect(self.temperature_widget.set_prefix)
+        self.settings_widget.prefix_changed.connect(self.sensor_widget.set_prefix)
         self.settings_widget.state_changed.connect(self.update_settings)
         self.settings_widget.experiment_data_widget.experiment_data() # update prefix
 
@@ -162,6 +189,7 @@ class MainGui(QMainWindow):
         self.tabs.addTab(self.settings_widget, "Settings")
         self.tabs.addTab(self.logs_widget, "Logs") 
         self.tabs.addTab(self.temperature_widget, "T (\N{DEGREE SIGN}C)") 
+        self.tabs.addTab(self.sensor_widget, "Sensors") 
         self.tabs.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding) 
 
         self.start_button = QPushButton()
@@ -182,6 +210,11 @@ class MainGui(QMainWindow):
         self.recording_duration.setValue(0)
         self.recording_duration.valueChanged.connect(self.update_main_settings)
 
+        # consecutive runs with the same settings (except outputs and protocol) reuse the workers
+        self.persistent_workers = QCheckBox('keep workers between runs')
+        self.persistent_workers.setChecked(False)
+        self.persistent_workers.stateChanged.connect(self.update_main_settings)
+
         self.main_widget = QWidget()
         self.setCentralWidget(self.main_widget)
 
@@ -208,6 +241,10 @@ class MainGui(QMainWindow):
         self.stop_recording_timer.setSingleShot(True)
         self.stop_recording_timer.timeout.connect(self.stop)
 
+        self.frame_timing_label = QLabel()
+        self.frame_timing_timer = QTimer(self)
+        self.frame_timing_timer.timeout.connect(self.update_frame_timing)
+
     def layout_components(self) -> None:
 
         top_buttons = QHBoxLayout()
@@ -222,6 +259,7 @@ class MainGui(QMainWindow):
        
         record = QHBoxLayout()
         record.addWidget(self.recording_duration)
+        record.addWidget(self.persistent_workers)
         record.addWidget(self.record_button)
 
         layout = QVBoxLayout(self.main_widget)
@@ -229,6 +267,7 @@ class MainGui(QMainWindow):
         layout.addWidget(self.tabs)
         layout.addLayout(controls)
         layout.addLayout(record)
+        layout.addWidget(self.frame_timing_label)
 
     def set_tab_visibililty(self, widgets_to_show, widgets_to_hide):
 
@@ -365,6 +404,7 @@ class MainGui(QMainWindow):
         self.close_loop_button.setChecked(state['close_loop'])
         self.video_recording_button.setChecked(state['video_recording'])
         self.tracking_button.setChecked(state['tracking'])
+        self.persistent_workers.setChecked(state.get('persistent_workers', False))
 
     def set_state(self, state: Dict) -> None:
 
@@ -381,6 +421,7 @@ class MainGui(QMainWindow):
             'logs': self.logs_widget.set_state,
             'sequencer': self.sequencer_widget.set_state,
             'temperature': self.temperature_widget.set_state,
+            'sensors': self.sensor_widget.set_state,
             'main': self.set_main_state
         }
 
@@ -430,6 +471,10 @@ class MainGui(QMainWindow):
 
     def update_logs(self):
         self.settings['logs'] = self.logs_widget.get_state()
+        # the sampling profiler can be toggled while running
+        profiler = current_profiling_session()
+        if profiler is not None:
+            profiler.set_enabled(self.settings['logs']['profiler']['enabled'])
 
     def update_sequencer_settings(self):
         self.settings['sequencer'] = self.sequencer_widget.get_state()
@@ -437,12 +482,16 @@ class MainGui(QMainWindow):
     def update_temperature(self):
         self.settings['temperature'] = self.temperature_widget.get_state()
 
+    def update_sensors(self):
+        self.settings['sensors'] = self.sensor_widget.get_state()
+
     def update_main_settings(self):
         self.settings['main']['recording_duration'] = self.recording_duration.value()
         self.settings['main']['open_loop'] = self.open_loop_button.isChecked()
         self.settings['main']['close_loop'] = self.close_loop_button.isChecked()
         self.settings['main']['video_recording'] = self.video_recording_button.isChecked()
         self.settings['main']['tracking'] = self.tracking_button.isChecked()
+        self.settings['main']['persistent_workers'] = self.persistent_workers.isChecked()
 
     def refresh_settings(self):
         self.update_camera_settings()
@@ -457,6 +506,7 @@ class MainGui(QMainWindow):
         self.update_logs()
         self.update_sequencer_settings()
         self.update_temperature()
+        self.update_sensors()
         self.update_main_settings()
 
     def register_done_callback(self, callback):
@@ -776,6 +826,7 @@ class MainGui(QMainWindow):
     def _on_start_finished(self):
 
         self.busy_overlay.hide_overlay()
+        self.frame_timing_timer.start(1000)
 
         if self.settings['main']['record']:
             self.state = State.RECORDING
@@ -786,48 +837,81 @@ class MainGui(QMainWindow):
         else:
             self.state = State.PREVIEW
 
+    def update_frame_timing(self):
+        
+        # dropped frames must be noticed during the session
+        text = []
+        has_drops = False
+        for counters in registered_frame_timing_counters():
+            snapshot = counters.snapshot()
+            has_drops = has_drops or snapshot['num_dropped'] > 0
+            text.append(
+                f"{counters.name}: {int(snapshot['num_frames'])} frames, "
+                f"{int(snapshot['num_dropped'])} dropped ({int(snapshot['num_gaps'])} gaps), "
+                f"{int(snapshot['num_jitter'])} jitter"
+            )
+        self.frame_timing_label.setText(' | '.join(text))
+        self.frame_timing_label.setStyleSheet('color: red' if has_drops else '')
+
+        timeline = startup_timeline()
+        if not self.startup_reported and timeline.reached(FIRST_FRAME):
+            if timeline.since(FIRST_FRAME) > STARTUP_REPORT_DELAY_SEC:
+                print(timeline.report(RUN_MILESTONES))
+                self.startup_reported = True
+
+    def save_frame_timing_metadata(self):
+
+        if self.metadata_filename is None:
+            return
+        
+        with open(self.metadata_filename, 'r') as f:
+            metadata = json.load(f)
+        metadata['frame_timing'] = {
+            counters.name: counters.snapshot() for counters in registered_frame_timing_counters()
+        }
+        with open(self.metadata_filename, 'w') as f:
+            json.dump(metadata, f)
+
     def start_dag(self):
 
+        from .dags import closed_loop, open_loop, video_recording, tracking, WorkerPool
+
+        self.startup_reported = False
         pprint.pprint(self.settings)
 
         prefix = Path(self.settings['settings']['prefix'])
         filename = prefix.with_suffix('.metadata')
         filename = append_timestamp_to_filename(filename)       
         self.serialize_to_json(filename)
+        self.metadata_filename = filename
 
-        if self.open_loop_button.isChecked():
-            self.dag, self.worker_logger, self.queue_logger = open_loop(self.settings)
-
-        elif self.video_recording_button.isChecked():
-            self.dag, self.worker_logger, self.queue_logger = video_recording(self.settings)
-
-        elif self.tracking_button.isChecked():
-            self.dag, self.worker_logger, self.queue_logger = tracking(self.settings)
-
-        elif self.close_loop_button.isChecked():
-            self.dag, self.worker_logger, self.queue_logger = closed_loop(self.settings)
-        
-        else:
-            raise RuntimeError()
-
-        self.p_worker_logger = Process(target=self.worker_logger.run)
-        self.p_queue_logger = Process(target=self.queue_logger.run)
+        builders = {
+            'open_loop': open_loop,
+            'video_recording': video_recording,
+            'tracking': tracking,
+            'closed_loop': closed_loop,
+        }
+        build = builders[self.selected_dag()]
 
-        self.p_worker_logger.start()
-        self.p_queue_logger.start()
-        self.dag.start() 
+        if self.worker_pool is None:
+            self.worker_pool = WorkerPool()
+        self.worker_pool.start_run(build, self.settings, self.settings['main']['persistent_workers'])
 
     def stop_dag(self):
 
-        if self.dag is None:
+        if self.worker_pool is None or not self.worker_pool.is_running():
             return
         
-        self.dag.stop() 
-        self.worker_logger.stop() 
-        self.queue_logger.stop()
-        self.p_worker_logger.join()
-        self.p_queue_logger.join()
+        self.worker_pool.stop_run(self.settings['main']['persistent_workers'])
+        self.save_frame_timing_metadata()
+
+        profiler = current_profiling_session()
+        if profiler is not None:
+            profiler.merge()
 
+        if not self.startup_reported:
+            print(startup_timeline().report(RUN_MILESTONES))
+            self.startup_reported = True
 
     def stop(self):
 
@@ -842,6 +926,8 @@ class MainGui(QMainWindow):
         if self.stop_recording_timer.isActive():
             self.stop_recording_timer.stop()
 
+        self.frame_timing_timer.stop()
+
         self.stop_thread = WorkerThread(self.stop_dag)
         self.stop_thread.finished.connect(self._on_stop_finished, Qt.UniqueConnection)
         self.stop_thread.finished.connect(self.stop_thread.deleteLater)
@@ -850,6 +936,7 @@ class MainGui(QMainWindow):
     def _on_stop_finished(self):
 
         self.busy_overlay.hide_overlay()
+        self.update_frame_timing()
         self.state = State.IDLE
 
     def preview(self):
@@ -863,17 +950,88 @@ class MainGui(QMainWindow):
         self.start()
 
 
+    def selected_dag(self) -> str:
+
+        if self.open_loop_button.isChecked():
+            return 'open_loop'
+
+        elif self.video_recording_button.isChecked():
+            return 'video_recording'
+
+        elif self.tracking_button.isChecked():
+            return 'tracking'
+
+        elif self.close_loop_button.isChecked():
+            return 'closed_loop'
+        
+        else:
+            raise RuntimeError()
+
+    def check_disk_throughput(self):
+        '''in a worker thread, the write benchmark takes seconds on a new disk'''
+
+        from .dags.topology import recorded_streams
+
+        record_video, record_tracking = recorded_streams(self.settings, self.selected_dag())
+
+        print('Checking disk throughput...')
+        try:
+            checks = check_disks(
+                self.settings, 
+                duration_sec = self.settings['main']['recording_duration'],
+                record_video = record_video,
+                record_tracking = record_tracking
+            )
+        except OSError as e:
+            # e.g. missing or read-only output folder
+            print(f'Disk check failed: {e}')
+            self.disks_ok = False
+            return
+        for check in checks:
+            print(check)
+
+        self.disks_ok = all(check.status != DiskStatus.REFUSE for check in checks)
+
     def record(self):
 
         if self.state != State.IDLE:
             print(f"ZebVR is in {self.state} state, cannot be started")
             return
 
+        if self.selected_dag() in ('open_loop', 'closed_loop'):
+            conflicts = daq_trigger_conflicts(self.settings['sequencer']['protocol'], self.settings['daq'])
+            for conflict in conflicts:
+                print(conflict)
+            if conflicts:
+                print('Recording refused: use a DAQ board which is not used for stimulation to trigger the protocol')
+                return
+
         self.state = State.STARTING
+        self.disks_ok = False
+        self.busy_overlay.show_overlay()
+
+        self.disk_check_thread = WorkerThread(self.check_disk_throughput)
+        self.disk_check_thread.finished.connect(self._on_disk_check_finished, Qt.UniqueConnection)
+        self.disk_check_thread.finished.connect(self.disk_check_thread.deleteLater)
+        self.disk_check_thread.start()
+
+    def _on_disk_check_finished(self):
+
+        self.busy_overlay.hide_overlay()
+
+        if not self.disks_ok:
+            print('Recording refused, see the disk check above')
+            self.state = State.IDLE
+            return
+
         self.settings['main']['record'] = True
         self.start()
 
     def closeEvent(self, event):
+        # workers kept after the last run
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+
         # close all widgets. Ensures that cleanup logic defined in closeEvent 
         # is executed
         self.camera_widget.close()
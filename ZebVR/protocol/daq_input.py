@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Optional, Union
+from daq_tools import BoardType, DAQ_CONSTRUCTORS
+from .debouncer import Debouncer
+from ..utils import get_time_ns
+
+class SimulatedDAQInput:
+    '''
+    Stand-in for a DAQ board generating a TTL square wave on every digital input.
+    The true time of each edge is recorded to benchmark trigger latency.
+    '''
+
+    def __init__(
+            self,
+            board_id: Union[int, str] = 0,
+            period_sec: float = 1.0,
+            duty_cycle: float = 0.5
+        ) -> None:
+
+        self.board_id = board_id
+        self.period_sec = period_sec
+        self.duty_cycle = duty_cycle
+        self.time_start = get_time_ns()
+        self.period_ns = int(1e9*period_sec)
+        self.high_ns = int(duty_cycle*self.period_ns)
+
+    def edge_timestamp(self, timestamp: int) -> int:
+        '''timestamp of the most recent edge before timestamp'''
+        elapsed = timestamp - self.time_start
+        period_start = self.time_start + (elapsed // self.period_ns) * self.period_ns
+        if elapsed % self.period_ns < self.high_ns:
+            return period_start
+        return period_start + self.high_ns
+
+    def digital_read(self, channel: int) -> bool:
+        elapsed = get_time_ns() - self.time_start
+        return (elapsed % self.period_ns) < self.high_ns
+
+    def close(self) -> None:
+        pass
+
+class DAQInputReader:
+    '''
+    Poll a digital input in a dedicated thread, debounce it and timestamp
+    transitions with get_time_ns.
+    '''
+
+    def __init__(
+            self,
+            board_type: BoardType,
+            board_id: Union[int, str],
+            channel: int,
+            polling_rate_hz: float = 1000,
+            debounce_samples: int = 1,
+            input_constructor: Optional[Callable[..., Any]] = None,
+            max_events: int = 1024
+        ) -> None:
+
+        self.board_type = board_type
+        self.board_id = board_id
+        self.channel = channel
+        self.polling_rate_hz = polling_rate_hz
+        self.debounce_samples = debounce_samples
+        self.input_constructor = input_constructor
+        self.max_events = max_events
+
+        self.board = None
+        self.thread = None
+        self.keepgoing = threading.Event()
+        self.lock = threading.Lock()
+        self.events: Deque = deque(maxlen=max_events)  # (timestamp, Debouncer.Transition)
+        self.state = Debouncer.State.IDLE
+        self.num_samples = 0
+
+    def start(self) -> None:
+
+        if self.thread is not None:
+            return
+
+        if self.input_constructor is not None:
+            self.board = self.input_constructor(board_id = self.board_id)
+        else:
+            self.board = DAQ_CONSTRUCTORS[self.board_type](board_id = self.board_id)
+
+        self.keepgoing.set()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+
+        if self.thread is None:
+            return
+
+        self.keepgoing.clear()
+        self.thread.join()
+        self.thread = None
+        self.board.close()
+        self.board = None
+
+    def run(self) -> None:
+
+        debouncer = Debouncer(self.debounce_samples)
+        period_ns = int(1e9/self.polling_rate_hz)
+        next_poll = get_time_ns()
+
+        while self.keepgoing.is_set():
+
+            level = int(bool(self.board.digital_read(self.channel)))
+            timestamp = get_time_ns()
+            transition = debouncer.update(level)
+
+            with self.lock:
+                self.num_samples += 1
+                self.state = debouncer.get_state()
+                if transition != Debouncer.Transition.NONE:
+                    self.events.append((timestamp, transition))
+
+            # sleep until next poll, do not accumulate drift
+            next_poll += period_ns
+            delay = next_poll - get_time_ns()
+            if delay > 0:
+                time.sleep(1e-9*delay)
+            else:
+                next_poll = get_time_ns()
+
+    def get_state(self) -> Debouncer.State:
+        with self.lock:
+            return self.state
+
+    def events_since(self, timestamp: int) -> list:
+        with self.lock:
+            return [event for event in self.events if event[0] >= timestamp]
+
+# protocol items are all initialized at once: share one reader per input 
+# so that a board is only opened once per process
+_readers = {}
+_reader_count = {}
+
+def acquire_reader(
+        board_type: BoardType,
+        board_id: Union[int, str],
+        channel: int,
+        polling_rate_hz: float = 1000,
+        debounce_samples: int = 1,
+        **kwargs
+    ) -> DAQInputReader:
+    '''
+    Shared reader of the input. Raises ValueError if the input is already read
+    with a different polling rate or debouncing.
+    '''
+
+    key = (board_type, board_id, channel)
+    if key not in _readers:
+        _readers[key] = DAQInputReader(
+            board_type, 
+            board_id, 
+            channel, 
+            polling_rate_hz = polling_rate_hz, 
+            debounce_samples = debounce_samples, 
+            **kwargs
+        )
+        _readers[key].start()
+        _reader_count[key] = 0
+
+    reader = _readers[key]
+    if (reader.polling_rate_hz, reader.debounce_samples) != (polling_rate_hz, debounce_samples):
+        raise ValueError(
+            f'{board_type} {board_id} channel {channel} is already read at {reader.polling_rate_hz} Hz '
+            f'with {reader.debounce_samples} debounce samples, '
+            f'requested {polling_rate_hz} Hz with {debounce_samples} debounce samples'
+        )
+    _reader_count[key] += 1
+    return reader
+
+def release_reader(reader: DAQInputReader) -> None:
+
+    key = (reader.board_type, reader.board_id, reader.channel)
+    if key not in _readers:
+        return
+    _reader_count[key] -= 1
+    if _reader_count[key] == 0:
+        _readers.pop(key).stop()
+        _reader_count.pop(key)
+
+if __name__ == '__main__':
+
+    # benchmark trigger latency against simulated input
+    import numpy as np
+
+    for polling_rate_hz in [100, 1000, 10000]:
+
+        reader = DAQInputReader(
+            board_type = None,
+            board_id = 0,
+            channel = 0,
+            polling_rate_hz = polling_rate_hz,
+            input_constructor = lambda board_id: SimulatedDAQInput(board_id, period_sec = 0.05)
+        )
+        reader.start()
+        time.sleep(5)
+        events = reader.events_since(0)
+        latency_ms = [1e-6*(t - reader.board.edge_timestamp(t)) for t, _ in events]
+        num_samples = reader.num_samples
+        reader.stop()
+
+        print(
+            f'{polling_rate_hz} Hz: {len(events)} edges, {num_samples/5:.0f} samples/s, '
+            f'latency median {np.median(latency_ms):.3f} ms, max {np.max(latency_ms):.3f} ms'
+        )
@@ -26,11 +26,11 @@ class ProtocolItem(ABC):
 
     def initialize(self):
         '''Run init steps in target worker process'''
-        pass
+        self.stop_condition.initialize()
 
     def cleanup(self):
         '''Run cleanup steps in target worker process'''
-        pass
+        self.stop_condition.cleanup()
 
     def set_stop_condition(self, stop_condition: StopCondition):
         self.stop_condition = stop_condition
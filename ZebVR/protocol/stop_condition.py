@@ -1,11 +1,22 @@
-from typing import Optional, Any, TypedDict,  Dict, Optional
+from typing import Optional, Any, TypedDict,  Dict, Optional, Union, Callable, Iterable, List
 from abc import ABC, abstractmethod
 from enum import IntEnum
 import time
 import numpy as np
 from numpy.typing import NDArray
 from .debouncer import Debouncer
-from qt_widgets import LabeledDoubleSpinBox, FileOpenLabeledEditButton, NDarray_to_QPixmap, CodeEditor
+from .daq_input import acquire_reader, release_reader
+from ..utils import get_time_ns
+from daq_tools import BoardType
+from qt_widgets import (
+    LabeledDoubleSpinBox, 
+    LabeledSpinBox, 
+    LabeledComboBox, 
+    LabeledEditLine, 
+    FileOpenLabeledEditButton, 
+    NDarray_to_QPixmap, 
+    CodeEditor
+)
 from image_tools import DrawPolyMaskDialog, im2uint8, ImageViewerCoord
 import cv2
 from pathlib import Path
@@ -42,10 +53,27 @@ class TriggerType(IntEnum):
 class TriggerPolarity(IntEnum):
     RISING_EDGE = 0
     FALLING_EDGE = 1
+    HIGH_LEVEL = 2
+    LOW_LEVEL = 3
 
     def __str__(self):
         return self.name
 
+def is_triggered(
+        debouncer: Debouncer, 
+        transition: Debouncer.Transition, 
+        polarity: TriggerPolarity
+    ) -> bool:
+    '''debouncer: anything with get_state, e.g. a DAQInputReader'''
+    
+    if polarity == TriggerPolarity.HIGH_LEVEL:
+        return debouncer.get_state() == Debouncer.State.ON
+    
+    if polarity == TriggerPolarity.LOW_LEVEL:
+        return debouncer.get_state() == Debouncer.State.OFF
+    
+    return transition.name == polarity.name
+
 class TriggerDict(TypedDict):
     trigger: int 
 
@@ -59,6 +87,14 @@ class StopCondition(ABC):
     def done(self, metadata: Optional[Any]) -> bool:
         pass
 
+    def initialize(self) -> None:
+        '''Run init steps in target worker process'''
+        pass
+
+    def cleanup(self) -> None:
+        '''Run cleanup steps in target worker process'''
+        pass
+
 class Pause(StopCondition):
 
     def __init__(self, pause_sec: float = 0) -> None:
@@ -73,7 +109,91 @@ class Pause(StopCondition):
         return (time.perf_counter() - self.time_start) >= self.pause_sec
 
 class DAQTrigger(StopCondition):
-    pass
+
+    def __init__(
+            self,
+            board_type: BoardType,
+            board_id: Union[int, str],
+            channel: int,
+            polarity: TriggerPolarity = TriggerPolarity.RISING_EDGE,
+            debounce_samples: int = 1,
+            polling_rate_hz: float = 1000,
+            input_constructor: Optional[Callable[..., Any]] = None
+        ) -> None:
+
+        super().__init__()
+        self.board_type = board_type
+        self.board_id = board_id
+        self.channel = channel
+        self.polarity = polarity
+        self.debounce_samples = debounce_samples
+        self.polling_rate_hz = polling_rate_hz
+        self.input_constructor = input_constructor
+        self.reader = None
+        self.time_start = 0
+
+    def initialize(self) -> None:
+        # the board is opened in the protocol worker process, it must not be
+        # one of the stimulation boards opened by the DAQ worker (see daq_trigger_conflicts)
+        self.reader = acquire_reader(
+            board_type = self.board_type,
+            board_id = self.board_id,
+            channel = self.channel,
+            polling_rate_hz = self.polling_rate_hz,
+            debounce_samples = self.debounce_samples,
+            input_constructor = self.input_constructor
+        )
+
+    def cleanup(self) -> None:
+        if self.reader is not None:
+            release_reader(self.reader)
+            self.reader = None
+
+    def __getstate__(self) -> Dict:
+        # reader holds a thread and an open board, never pickle it
+        state = self.__dict__.copy()
+        state['reader'] = None
+        return state
+
+    def start(self) -> None:
+        self.time_start = get_time_ns()
+
+    def done(self, metadata: Optional[Any]) -> bool:
+
+        if self.reader is None:
+            return False
+        
+        # levels depend on the current state of the reader, edges on its transitions
+        if is_triggered(self.reader, Debouncer.Transition.NONE, self.polarity):
+            return True
+
+        for _, transition in self.reader.events_since(self.time_start):
+            if is_triggered(self.reader, transition, self.polarity):
+                return True
+            
+        return False
+
+def daq_trigger_conflicts(protocol: Iterable, daq_boards: Dict) -> List[str]:
+    '''
+    DAQ triggers of the protocol reading a board which is also opened by the 
+    DAQ worker (daq_boards, as in settings['daq']). A board can only be opened
+    by one process.
+    '''
+
+    conflicts = []
+    for protocol_item in protocol:
+        trigger = protocol_item.stop_condition
+        if not isinstance(trigger, DAQTrigger):
+            continue
+        stim_boards = [board.id for board in daq_boards.get(trigger.board_type, [])]
+        conflict = (
+            f'DAQ trigger: {BoardType(trigger.board_type).name} board {trigger.board_id} '
+            'is also used for stimulation'
+        )
+        # loops repeat protocol items
+        if trigger.board_id in stim_boards and conflict not in conflicts:
+            conflicts.append(conflict)
+    return conflicts
 
 class SoftwareTrigger(StopCondition):
 
@@ -106,7 +226,7 @@ class SoftwareTrigger(StopCondition):
             return output
         
         transition = self.debouncer.update(value)
-        if transition.name == self.polarity.name: 
+        if is_triggered(self.debouncer, transition, self.polarity): 
             output = True
         return output
 
@@ -152,7 +272,7 @@ class TrackingTriggerMask(StopCondition):
             return output
             
         transition = self.debouncer.update(triggered)
-        if transition.name == self.polarity.name: 
+        if is_triggered(self.debouncer, transition, self.polarity): 
             output = True
 
         return output
@@ -196,7 +316,7 @@ class TrackingTriggerCode(StopCondition):
             return output
             
         transition = self.debouncer.update(triggered)
-        if transition.name == self.polarity.name: 
+        if is_triggered(self.debouncer, transition, self.polarity): 
             output = True
 
         return output
@@ -287,6 +407,34 @@ class StopWidget(QWidget):
 
         self.mask_image = QLabel() 
 
+        self.daq_board_type = LabeledComboBox()
+        self.daq_board_type.setText('DAQ Board Type')
+        for board_type in BoardType:
+            self.daq_board_type.addItem(board_type.name)
+        self.daq_board_type.currentIndexChanged.connect(self.state_changed)
+
+        self.daq_board_id = LabeledEditLine()
+        self.daq_board_id.setLabel('DAQ Board ID:')
+        self.daq_board_id.textChanged.connect(self.state_changed)
+
+        self.daq_channel = LabeledSpinBox()
+        self.daq_channel.setText('input channel:')
+        self.daq_channel.setRange(0, 63)
+        self.daq_channel.setValue(0)
+        self.daq_channel.valueChanged.connect(self.state_changed)
+
+        self.daq_polling_rate = LabeledDoubleSpinBox()
+        self.daq_polling_rate.setText('polling rate (Hz):')
+        self.daq_polling_rate.setRange(1, 100_000)
+        self.daq_polling_rate.setValue(1000)
+        self.daq_polling_rate.valueChanged.connect(self.state_changed)
+
+        self.daq_debounce = LabeledSpinBox()
+        self.daq_debounce.setText('debounce (samples):')
+        self.daq_debounce.setRange(1, 1000)
+        self.daq_debounce.setValue(1)
+        self.daq_debounce.valueChanged.connect(self.state_changed)
+
     def layout_components(self) -> None:
 
         software_trigger_layout = QVBoxLayout()
@@ -295,6 +443,11 @@ class StopWidget(QWidget):
         self.software_trigger_group.setLayout(software_trigger_layout)
 
         daq_trigger_layout = QVBoxLayout()
+        daq_trigger_layout.addWidget(self.daq_board_type)
+        daq_trigger_layout.addWidget(self.daq_board_id)
+        daq_trigger_layout.addWidget(self.daq_channel)
+        daq_trigger_layout.addWidget(self.daq_polling_rate)
+        daq_trigger_layout.addWidget(self.daq_debounce)
         daq_trigger_layout.addStretch()
         self.daq_trigger_group = QGroupBox('DAQ Trigger parameters')
         self.daq_trigger_group.setLayout(daq_trigger_layout)
@@ -403,6 +556,16 @@ class StopWidget(QWidget):
             self.cmb_trigger_select.setCurrentIndex(TriggerType.SOFTWARE)
             self.cmb_trigger_polarity.setCurrentIndex(TriggerPolarity(stop_condition.polarity))
 
+        elif isinstance(stop_condition, DAQTrigger):
+            self.cmb_policy_select.setCurrentIndex(StopPolicy.TRIGGER)
+            self.cmb_trigger_select.setCurrentIndex(TriggerType.DAQ)
+            self.cmb_trigger_polarity.setCurrentIndex(TriggerPolarity(stop_condition.polarity))
+            self.daq_board_type.setCurrentText(BoardType(stop_condition.board_type).name)
+            self.daq_board_id.setText(str(stop_condition.board_id))
+            self.daq_channel.setValue(stop_condition.channel)
+            self.daq_polling_rate.setValue(stop_condition.polling_rate_hz)
+            self.daq_debounce.setValue(stop_condition.debounce_samples)
+
         elif isinstance(stop_condition, TrackingTriggerMask):
             self.cmb_policy_select.setCurrentIndex(StopPolicy.TRIGGER)
             self.cmb_trigger_select.setCurrentIndex(TriggerType.TRACKING_MASK)
@@ -434,7 +597,15 @@ class StopWidget(QWidget):
                 )
 
             if state['trigger_select'] == TriggerType.DAQ:
-                pass
+                board_id = state['daq_board_id']
+                stop_condition = DAQTrigger(
+                    board_type = BoardType[state['daq_board_type']],
+                    board_id = int(board_id) if board_id.isdigit() else board_id,
+                    channel = state['daq_channel'],
+                    polarity = TriggerPolarity(state['trigger_polarity']),
+                    debounce_samples = state['daq_debounce_samples'],
+                    polling_rate_hz = state['daq_polling_rate_hz']
+                )
 
             if state['trigger_select'] == TriggerType.TRACKING_MASK:
                 stop_condition = TrackingTriggerMask(
@@ -460,6 +631,11 @@ class StopWidget(QWidget):
         state['mask_file'] = self.trigger_mask.text()
         state['code'] = self.code_editor.toPlainText()
         state['pause_sec'] = self.pause_sec.value()
+        state['daq_board_type'] = self.daq_board_type.currentText()
+        state['daq_board_id'] = self.daq_board_id.text()
+        state['daq_channel'] = self.daq_channel.value()
+        state['daq_polling_rate_hz'] = self.daq_polling_rate.value()
+        state['daq_debounce_samples'] = self.daq_debounce.value()
         return state
     
     def set_state(self, state: Dict) -> None:
@@ -470,7 +646,12 @@ class StopWidget(QWidget):
             'trigger_polarity': self.cmb_trigger_polarity.setCurrentIndex,
             'mask_file': self.trigger_mask.setText,
             'code': self.code_editor.setPlainText,
-            'pause_sec': self.pause_sec.setValue
+            'pause_sec': self.pause_sec.setValue,
+            'daq_board_type': self.daq_board_type.setCurrentText,
+            'daq_board_id': self.daq_board_id.setText,
+            'daq_channel': self.daq_channel.setValue,
+            'daq_polling_rate_hz': self.daq_polling_rate.setValue,
+            'daq_debounce_samples': self.daq_debounce.setValue
         }
 
         for key, setter in setters.items():
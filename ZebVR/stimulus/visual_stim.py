@@ -1,5 +1,5 @@
 from vispy import app, gloo
-from typing import Tuple, Any
+from typing import Tuple, Any, Optional
 from dagline import WorkerNode
 from multiprocessing import Process
 from numpy.typing import NDArray
@@ -7,6 +7,9 @@ import numpy as np
 from multiprocessing import Event
 from geometry import AffineTransform2D
 from multiprocessing import Queue
+from ZebVR.utils import get_time_ns, apply_cpu_placement, start_sampling_profiler, mark_startup
+from ZebVR.utils.startup_timeline import STIM_READY, FIRST_STIM
+from ZebVR.utils.latency_trace import TraceRecorder
 
 class VisualStim(app.Canvas):
 
@@ -91,12 +94,15 @@ class VisualStimWorker(WorkerNode):
     def __init__(
             self, 
             stim: VisualStim, 
+            trace_file: Optional[str] = None,
             *args, 
             **kwargs
         ):
 
         super().__init__(*args, **kwargs)
         self.stim = stim
+        self.trace_file = trace_file
+        self.trace_recorder = None
         self.display_process = None
         self.log_queue = Queue()
         self.stim.set_log_queue(self.log_queue)
@@ -114,17 +120,32 @@ class VisualStimWorker(WorkerNode):
 
     def initialize(self) -> None:
         super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
         # launch main window loop in a separate process 
         self.display_process = Process(target=self.run)
         self.display_process.start()
         self.stim.initialized.wait()
+        mark_startup(self, STIM_READY)
+        if self.trace_file is not None:
+            self.trace_recorder = TraceRecorder(self.trace_file, 'stim')
 
     def cleanup(self) -> None:
         super().cleanup()
         self.display_process.join()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+            self.trace_recorder = None
 
     def process_data(self, data: Any) -> None:
-        return self.stim.process_data(data)
+        if data is not None:
+            mark_startup(self, FIRST_STIM)
+        if self.trace_recorder is None or data is None:
+            return self.stim.process_data(data)
+        received = get_time_ns()
+        res = self.stim.process_data(data)
+        self.trace_recorder.write(data, received)
+        return res
     
     def process_metadata(self, metadata) -> Any:
         return self.stim.process_metadata(metadata)
\ No newline at end of file
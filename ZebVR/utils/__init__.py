@@ -1,7 +1,71 @@
+import importlib
+
 from .set_from_dict import set_from_dict
 from .shared_string import SharedString
 from .timing import get_time_ns
 from .append_timestamp_to_filename import append_timestamp_to_filename
-from .tracker_from_json import tracker_from_json
 from .serialize import serialize
-from .find_circular_arenas import FindCircularArenasDialog
\ No newline at end of file
+from .binary_records import BinaryRecordWriter, load_binary_records
+from .chunked_image_store import ChunkedImageStoreWriter, ChunkedImageStore
+from .frame_timing import (
+    FRAME_TIMING_DTYPE,
+    FrameTimingCounters,
+    FrameContinuityMonitor,
+    FrameTimingSidecar,
+    register_frame_timing_counters,
+    registered_frame_timing_counters,
+    clear_frame_timing_counters
+)
+from .checkpoint import Checkpointer, checkpoint_filename, load_checkpoint
+from .recovery import recover_recording
+from .replay_camera import ReplayCamera, load_recording
+from .latency_trace import (
+    TRACE_FIELD,
+    TraceRecorder,
+    stamp,
+    copy_trace,
+    load_traces,
+    stage_latencies,
+    latency_summary,
+    write_chrome_trace
+)
+from .cpu_placement import (
+    CPUPlacement,
+    CPULayout,
+    plan_cpu_placement,
+    place_workers,
+    apply_cpu_placement
+)
+from .sampling_profiler import (
+    SamplingProfiler,
+    profile_workers,
+    current_profiling_session,
+    start_sampling_profiler
+)
+from .startup_timeline import (
+    StartupTimeline,
+    startup_timeline,
+    time_startup,
+    mark_startup
+)
+from .run_control import (
+    RunControl,
+    new_run_control,
+    current_run_control,
+    clear_run_control,
+    run_control_message,
+    run_settings,
+    pool_key
+)
+from .disk_guard import estimate_data_rates, check_disks, DiskStatus
+
+# imported on first use, worker processes import this package (see ZebVR.workers)
+LAZY_IMPORTS = {
+    'tracker_from_json': '.tracker_from_json',
+    'FindCircularArenasDialog': '.find_circular_arenas',
+}
+
+def __getattr__(name: str):
+    if name in LAZY_IMPORTS:
+        return getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
\ No newline at end of file
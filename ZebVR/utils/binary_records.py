@@ -0,0 +1,92 @@
+import gzip
+import json
+import zlib
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+from numpy.typing import NDArray, DTypeLike
+
+BINARY_RECORDS_MAGIC = b'ZEBVRREC'
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+class BinaryRecordWriter:
+    '''
+    Append-only file of fixed-size numpy records: magic, header length (uint32),
+    JSON header (with the record dtype), then raw records.
+    Optionally gzip-compressed.
+    '''
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            dtype: DTypeLike,
+            header: Optional[Dict] = None,
+            compress: bool = False,
+            compresslevel: int = 1
+        ) -> None:
+
+        self.filename = Path(filename)
+        self.dtype = np.dtype(dtype)
+
+        if compress:
+            self.fd = gzip.open(self.filename, 'wb', compresslevel=compresslevel)
+        else:
+            self.fd = open(self.filename, 'wb')
+
+        full_header = {} if header is None else dict(header)
+        full_header['dtype'] = np.lib.format.dtype_to_descr(self.dtype)
+        encoded = json.dumps(full_header).encode()
+        self.fd.write(BINARY_RECORDS_MAGIC)
+        self.fd.write(np.uint32(len(encoded)).tobytes())
+        self.fd.write(encoded)
+
+    def write(self, records: NDArray) -> None:
+        self.fd.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+
+    def flush(self) -> None:
+        # for gzip this is a sync flush: everything written so far is readable after a crash
+        self.fd.flush()
+
+    def fileno(self) -> int:
+        return self.fd.fileno()
+
+    def close(self) -> None:
+        self.fd.close()
+
+def _descr_from_json(descr):
+    # JSON turns tuples into lists
+    if isinstance(descr, str):
+        return descr
+    fields = []
+    for field in descr:
+        if len(field) == 3:
+            fields.append((field[0], _descr_from_json(field[1]), tuple(field[2])))
+        else:
+            fields.append((field[0], _descr_from_json(field[1])))
+    return fields
+
+def load_binary_records(filename: Union[str, Path]) -> Tuple[Dict, NDArray]:
+
+    with open(filename, 'rb') as fd:
+        raw = fd.read()
+
+    if raw[:2] == GZIP_MAGIC:
+        # decompress what's there: the stream may be truncated after a crash,
+        # everything up to the last flush is still readable
+        raw = zlib.decompressobj(wbits=GZIP_WBITS).decompress(raw)
+
+    if raw[:len(BINARY_RECORDS_MAGIC)] != BINARY_RECORDS_MAGIC:
+        raise ValueError(f'{filename} is not a binary record file')
+    offset = len(BINARY_RECORDS_MAGIC)
+    header_length = int(np.frombuffer(raw[offset:offset+4], dtype=np.uint32)[0])
+    offset += 4
+    header = json.loads(raw[offset:offset+header_length])
+    offset += header_length
+
+    dtype = np.lib.format.descr_to_dtype(_descr_from_json(header['dtype']))
+
+    # drop incomplete trailing record
+    num_records = (len(raw) - offset) // dtype.itemsize
+    records = np.frombuffer(raw, dtype=dtype, count=num_records, offset=offset)
+    return header, records
@@ -0,0 +1,91 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+from .timing import get_time_ns
+
+class Checkpointer:
+    '''
+    Periodically push recorded files to disk (flush + fsync), so that a crash
+    or power loss loses at most interval_sec of data. Files written by another
+    process (e.g. an ffmpeg encoder) are synced by path. Optionally records
+    the state at each checkpoint (e.g. last index and timestamp written) in a
+    small JSON file, used by ZebVR.utils.recovery.
+    '''
+
+    def __init__(
+            self,
+            interval_sec: float = 10,
+            filename: Optional[Union[str, Path]] = None
+        ) -> None:
+
+        self.interval_sec = interval_sec
+        self.filename = None if filename is None else Path(filename)
+        self.files = []
+        self.paths: List[Path] = []
+        self.last_checkpoint = time.monotonic()
+        self.num_checkpoints = 0
+
+    def add_file(self, fd) -> None:
+        '''anything with flush() and fileno()'''
+        self.files.append(fd)
+
+    def add_path(self, path: Union[str, Path]) -> None:
+        self.paths.append(Path(path))
+
+    def due(self) -> bool:
+        return self.interval_sec > 0 and time.monotonic() - self.last_checkpoint >= self.interval_sec
+
+    def checkpoint(self, state: Optional[Dict] = None) -> None:
+
+        for fd in self.files:
+            fd.flush()
+            os.fsync(fd.fileno())
+
+        for path in self.paths:
+            if not path.exists():
+                continue
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        self.last_checkpoint = time.monotonic()
+        self.num_checkpoints += 1
+
+        if self.filename is not None:
+            checkpoint = {
+                'timestamp': get_time_ns(),
+                'num_checkpoints': self.num_checkpoints,
+                'interval_sec': self.interval_sec,
+                'state': {} if state is None else state
+            }
+            write_checkpoint(self.filename, checkpoint)
+
+    def maybe_checkpoint(self, state: Optional[Dict] = None) -> bool:
+        if not self.due():
+            return False
+        self.checkpoint(state)
+        return True
+
+def checkpoint_filename(filename: Union[str, Path]) -> Path:
+    filename = Path(filename)
+    return filename.with_name(f'{filename.name}.checkpoint')
+
+def write_checkpoint(filename: Path, checkpoint: Dict) -> None:
+    # write, sync, then rename: the checkpoint on disk is always valid JSON
+    tmp_filename = filename.with_name(f'{filename.name}.tmp')
+    with open(tmp_filename, 'w') as fd:
+        json.dump(checkpoint, fd)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(tmp_filename, filename)
+
+def load_checkpoint(filename: Union[str, Path]) -> Optional[Dict]:
+    try:
+        with open(filename, 'r') as fd:
+            return json.load(fd)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
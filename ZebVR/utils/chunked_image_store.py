@@ -0,0 +1,214 @@
+import json
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+import numpy as np
+from numpy.typing import NDArray, DTypeLike
+from .binary_records import BinaryRecordWriter, load_binary_records
+
+# Directory layout, one store per recording:
+#   store.json         frame shape, dtype, chunking, compression
+#   chunks/00000000    frames [0, chunk_frames), raw or zlib-compressed
+#   chunks/00000001    frames [chunk_frames, 2*chunk_frames)
+#   ...
+#   records.bin        per-frame index/timestamps, parallel to the frames
+
+STORE_METADATA_FILE = 'store.json'
+STORE_RECORDS_FILE = 'records.bin'
+STORE_CHUNKS_FOLDER = 'chunks'
+CHUNK_ZERO_PADDING = 8
+
+class ChunkedImageStoreWriter:
+    '''
+    Append frames to a chunked image store. Frames are copied into
+    preallocated chunk buffers, full chunks are compressed and written
+    by a thread pool (zlib releases the GIL). Chunk buffers in flight are 
+    bounded in number and in bytes (chunks are shortened if two of them don't
+    fit in max_pending_bytes): append blocks if writers fall behind, or with 
+    block=False drops the frame and returns False.
+    '''
+
+    def __init__(
+            self,
+            folder: Union[str, Path],
+            frame_shape: Tuple[int, ...],
+            dtype: DTypeLike,
+            record_dtype: DTypeLike,
+            chunk_frames: int = 100,
+            compress: bool = True,
+            compresslevel: int = 1,
+            num_threads: int = 4,
+            max_pending_chunks: int = 8,
+            max_pending_bytes: int = 512*1024**2
+        ) -> None:
+
+        self.folder = Path(folder)
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+
+        frame_bytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        chunk_frames = max(1, min(chunk_frames, max_pending_bytes // (2*frame_bytes)))
+        num_buffers = max(2, min(max_pending_chunks + 1, max_pending_bytes // (chunk_frames*frame_bytes)))
+
+        self.chunk_frames = chunk_frames
+        self.compress = compress
+        self.compresslevel = compresslevel
+
+        (self.folder / STORE_CHUNKS_FOLDER).mkdir(parents=True, exist_ok=True)
+        metadata = {
+            'frame_shape': self.frame_shape,
+            'dtype': self.dtype.str,
+            'chunk_frames': chunk_frames,
+            'compressor': 'zlib' if compress else None,
+        }
+        with open(self.folder / STORE_METADATA_FILE, 'w') as fd:
+            json.dump(metadata, fd)
+
+        self.records = BinaryRecordWriter(self.folder / STORE_RECORDS_FILE, record_dtype)
+
+        # recycle chunk buffers to bound memory
+        self.free_buffers = queue.Queue()
+        for _ in range(num_buffers):
+            self.free_buffers.put(np.empty((chunk_frames,) + self.frame_shape, dtype=self.dtype))
+
+        self.pool = ThreadPoolExecutor(max_workers=num_threads)
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        self.buffer = self.free_buffers.get()
+        self.num_frames = 0
+        self.num_dropped = 0
+        self.num_chunks = 0
+        self.bytes_written = 0
+
+    def append(self, image: NDArray, record: NDArray, block: bool = True) -> bool:
+
+        if self.buffer is None:
+            try:
+                self.buffer = self.free_buffers.get(block=block)
+            except queue.Empty:
+                self.num_dropped += 1
+                return False
+
+        position = self.num_frames % self.chunk_frames
+        self.buffer[position] = image
+        self.records.write(record)
+        self.num_frames += 1
+
+        if position == self.chunk_frames - 1:
+            self._submit(self.chunk_frames)
+            self.buffer = None
+        return True
+
+    def _submit(self, num_frames: int) -> None:
+        self.pool.submit(self._write_chunk, self.num_chunks, self.buffer, num_frames)
+        self.num_chunks += 1
+
+    def _write_chunk(self, chunk_index: int, buffer: NDArray, num_frames: int) -> None:
+
+        try:
+            data = buffer[:num_frames].tobytes()
+            if self.compress:
+                data = zlib.compress(data, self.compresslevel)
+
+            # write then rename, so that a chunk on disk is always complete
+            filename = self.folder / STORE_CHUNKS_FOLDER / f'{chunk_index:0{CHUNK_ZERO_PADDING}}'
+            tmp_filename = filename.with_suffix('.tmp')
+            with open(tmp_filename, 'wb') as fd:
+                fd.write(data)
+            os.replace(tmp_filename, filename)
+
+            with self.errors_lock:
+                self.bytes_written += len(data)
+
+        except Exception as e:
+            print(f'chunk {chunk_index}: {e}')
+            with self.errors_lock:
+                self.errors.append(e)
+
+        finally:
+            self.free_buffers.put(buffer)
+
+    def close(self) -> None:
+
+        # last partial chunk
+        remaining = self.num_frames % self.chunk_frames
+        if remaining:
+            self._submit(remaining)
+
+        self.pool.shutdown(wait=True)
+        self.records.close()
+
+class ChunkedImageStore:
+    '''Random access to frames of a chunked image store, decompressed chunks are cached'''
+
+    def __init__(self, folder: Union[str, Path], cache_size: int = 4) -> None:
+
+        self.folder = Path(folder)
+        with open(self.folder / STORE_METADATA_FILE, 'r') as fd:
+            metadata = json.load(fd)
+
+        self.frame_shape = tuple(metadata['frame_shape'])
+        self.dtype = np.dtype(metadata['dtype'])
+        self.chunk_frames = metadata['chunk_frames']
+        self.compressor = metadata['compressor']
+        self.cache_size = cache_size
+        self.cache: Dict[int, NDArray] = {}
+
+        _, self.records = load_binary_records(self.folder / STORE_RECORDS_FILE)
+
+        # after a crash or a failed write, records may refer to frames whose
+        # chunk was never written: stop at the first missing chunk
+        num_chunks = 0
+        while self._chunk_file(num_chunks).exists():
+            num_chunks += 1
+        last_chunk = num_chunks - 1
+        if num_chunks > 0:
+            last_chunk_frames = self._read_chunk(last_chunk).shape[0]
+            self.num_frames = min(len(self.records), last_chunk*self.chunk_frames + last_chunk_frames)
+        else:
+            self.num_frames = 0
+        self.records = self.records[:self.num_frames]
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def _chunk_file(self, chunk_index: int) -> Path:
+        return self.folder / STORE_CHUNKS_FOLDER / f'{chunk_index:0{CHUNK_ZERO_PADDING}}'
+
+    def _read_chunk(self, chunk_index: int) -> NDArray:
+
+        if chunk_index in self.cache:
+            return self.cache[chunk_index]
+
+        with open(self._chunk_file(chunk_index), 'rb') as fd:
+            data = fd.read()
+        if self.compressor == 'zlib':
+            data = zlib.decompress(data)
+        chunk = np.frombuffer(data, dtype=self.dtype).reshape((-1,) + self.frame_shape)
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.pop(next(iter(self.cache)))
+        self.cache[chunk_index] = chunk
+        return chunk
+
+    def __getitem__(self, index: int) -> NDArray:
+        if not -self.num_frames <= index < self.num_frames:
+            raise IndexError(index)
+        index = index % self.num_frames
+        return self._read_chunk(index // self.chunk_frames)[index % self.chunk_frames]
+
+    def __iter__(self):
+        for index in range(self.num_frames):
+            yield self[index]
+
+    @property
+    def index(self) -> NDArray:
+        return self.records['index']
+
+    @property
+    def timestamp(self) -> NDArray:
+        return self.records['timestamp']
@@ -0,0 +1,316 @@
+'''
+CPU placement of DAG workers (Linux).
+
+Workers are given a role from their class: latency critical workers (camera,
+stimulus, cropper and trackers) get dedicated cores, one physical core each
+when there are enough, on a single NUMA node. Encoders and everything else
+(GUIs, displays, savers, monitors) run on the remaining housekeeping cores,
+encoders preferably on another NUMA node. Dedicated cores are the ones given
+in settings, or the cores isolated by the kernel (isolcpus), or all but
+num_housekeeping_cpus cores.
+
+The plan is made in the main process, which then moves itself to the
+housekeeping cores: every process it starts afterwards inherits them.
+Dedicated workers and encoders keep their placement and apply it when
+they start (apply_cpu_placement in initialize). Dedicated workers get
+real-time scheduling (SCHED_RR) if enabled, or a negative niceness, 
+encoders (and the ffmpeg processes they start) a positive niceness. 
+Scheduling changes are applied where permitted (root or CAP_SYS_NICE), 
+and skipped with a message otherwise.
+'''
+
+import json
+import os
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+from .append_timestamp_to_filename import append_timestamp_to_filename
+
+CAMERA = 'camera'
+STIMULUS = 'stimulus'
+TRACKING = 'tracking'
+ENCODER = 'encoder'
+BACKGROUND = 'background'
+
+# by class name, workers are not imported here
+WORKER_ROLES = {
+    'CameraWorker': CAMERA,
+    'VisualStimWorker': STIMULUS,
+    'AudioStimWorker': STIMULUS,
+    'DAQ_Worker': STIMULUS,
+    'CropWorker': TRACKING,
+    'CropWorker2': TRACKING,
+    'TrackerWorker': TRACKING,
+    'VideoSaverWorker': ENCODER,
+    'ImageSaverWorker': ENCODER,
+    'ClipRecorderWorker': ENCODER,
+    'ImageFilterWorker': ENCODER,
+    'TrackingQCRecorder': ENCODER,
+}
+DEDICATED_ROLES = (CAMERA, STIMULUS, TRACKING) # in order of priority
+
+# restored when placement is disabled, the main process may have been moved before
+INITIAL_AFFINITY = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None
+
+@dataclass
+class CPUPlacement:
+    worker: str
+    role: str
+    cpus: List[int]
+    realtime_priority: int = 0 # SCHED_RR priority, 0: default scheduling
+    nice: int = 0
+    dedicated: bool = False
+
+    def __str__(self) -> str:
+        scheduling = f'SCHED_RR {self.realtime_priority}' if self.realtime_priority > 0 else f'nice {self.nice}'
+        return f'{self.worker:<24} {self.role:<11} cpus {format_cpu_list(self.cpus):<12} {scheduling}'
+
+@dataclass
+class CPULayout:
+    dedicated_cpus: List[int]
+    housekeeping_cpus: List[int]
+    numa_node: int
+    placements: List[CPUPlacement] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        return (
+            f'CPU layout: dedicated {format_cpu_list(self.dedicated_cpus)} (NUMA node {self.numa_node}), '
+            f'housekeeping {format_cpu_list(self.housekeeping_cpus)}\n'
+            + '\n'.join(f'    {placement}' for placement in self.placements)
+        )
+
+    def save(self, filename: Union[str, Path]) -> None:
+        with open(filename, 'w') as fd:
+            json.dump(asdict(self), fd, indent=2)
+
+def parse_cpu_list(text: str) -> List[int]:
+    '''kernel cpu list format, e.g. "2-5,8"'''
+    cpus = []
+    for part in text.strip().split(','):
+        if part == '':
+            continue
+        if '-' in part:
+            start, stop = part.split('-')
+            cpus.extend(range(int(start), int(stop) + 1))
+        else:
+            cpus.append(int(part))
+    return sorted(set(cpus))
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    parts = []
+    cpus = sorted(cpus)
+    start = None
+    for i, cpu in enumerate(cpus):
+        if start is None:
+            start = cpu
+        if i + 1 == len(cpus) or cpus[i+1] != cpu + 1:
+            parts.append(f'{start}' if start == cpu else f'{start}-{cpu}')
+            start = None
+    return ','.join(parts)
+
+def read_cpu_list(filename: Union[str, Path]) -> List[int]:
+    try:
+        return parse_cpu_list(Path(filename).read_text())
+    except (OSError, ValueError):
+        return []
+
+def isolated_cpus() -> List[int]:
+    return read_cpu_list('/sys/devices/system/cpu/isolated')
+
+def numa_nodes() -> Dict[int, List[int]]:
+    nodes = {}
+    for folder in sorted(Path('/sys/devices/system/node').glob('node[0-9]*')):
+        nodes[int(folder.name[4:])] = read_cpu_list(folder / 'cpulist')
+    return nodes
+
+def physical_cores(cpus: Sequence[int]) -> List[int]:
+    '''one logical CPU per physical core (hyperthread siblings share a core)'''
+    cores = []
+    seen = set()
+    for cpu in sorted(cpus):
+        siblings = read_cpu_list(f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list') or [cpu]
+        if seen.isdisjoint(siblings):
+            cores.append(cpu)
+        seen.update(siblings)
+    return cores
+
+def worker_role(worker) -> str:
+    for cls in type(worker).__mro__:
+        if cls.__name__ in WORKER_ROLES:
+            return WORKER_ROLES[cls.__name__]
+    return BACKGROUND
+
+def worker_name(worker) -> str:
+    return getattr(worker, 'name', type(worker).__name__)
+
+def plan_cpu_placement(
+        workers: Sequence,
+        settings: Dict,
+        available_cpus: Optional[Sequence[int]] = None,
+        nodes: Optional[Dict[int, List[int]]] = None,
+        kernel_isolated_cpus: Optional[Sequence[int]] = None,
+    ) -> CPULayout:
+    '''
+    Assign cores to workers, settings as in settings['logs']['cpu'].
+    Topology is read from the system unless given.
+    '''
+
+    available = sorted(os.sched_getaffinity(0)) if available_cpus is None else sorted(available_cpus)
+    nodes = numa_nodes() if nodes is None else nodes
+    kernel_isolated = isolated_cpus() if kernel_isolated_cpus is None else list(kernel_isolated_cpus)
+    if not nodes:
+        nodes = {0: available}
+
+    # candidates for dedicated cores
+    if settings['isolated_cpus'].strip() != '':
+        candidates = [cpu for cpu in parse_cpu_list(settings['isolated_cpus']) if cpu in available]
+    elif kernel_isolated:
+        # isolated cores are not in the default affinity, but can be requested
+        candidates = list(kernel_isolated)
+    else:
+        candidates = available[settings['num_housekeeping_cpus']:]
+
+    # frames go through shared memory between dedicated workers: keep them on one NUMA node
+    numa_node = max(nodes, key=lambda n: len(set(nodes[n]) & set(candidates)))
+    candidates = [cpu for cpu in candidates if cpu in nodes[numa_node]]
+    dedicated = physical_cores(candidates)
+
+    # hyperthread siblings of dedicated cores stay idle, candidates on other nodes are not wasted
+    housekeeping = [cpu for cpu in available if cpu not in candidates] or available
+
+    # encoders on another node if possible, to keep memory bandwidth away from tracking
+    other_nodes = [cpu for n, cpus in nodes.items() if n != numa_node for cpu in cpus if cpu in housekeeping]
+    encoder_cpus = other_nodes or housekeeping
+
+    layout = CPULayout(dedicated, housekeeping, numa_node)
+    realtime = settings['realtime']
+    priority = settings['realtime_priority']
+    nice = 0 if realtime else settings['dedicated_nice']
+
+    by_role = {role: [w for w in workers if worker_role(w) == role] for role in DEDICATED_ROLES}
+    num_dedicated_workers = sum(len(w) for w in by_role.values())
+
+    if len(dedicated) >= num_dedicated_workers:
+        # one core each
+        free = iter(dedicated)
+        pools = {role: None for role in DEDICATED_ROLES}
+    elif len(dedicated) >= 3:
+        # camera and stimulus workers keep their own core, the tracking pool shares the rest
+        free = iter(dedicated[:2])
+        pools = {CAMERA: None, STIMULUS: None, TRACKING: dedicated[2:]}
+        if len(by_role[CAMERA]) + len(by_role[STIMULUS]) > 2:
+            pools[STIMULUS] = dedicated[1:2]
+    else:
+        # not enough cores to separate roles
+        free = iter(())
+        pools = {role: dedicated or housekeeping for role in DEDICATED_ROLES}
+        if not dedicated:
+            # real-time workers would compete with everything else
+            print('CPU placement: no dedicated cores available, latency critical workers share the housekeeping cores')
+            realtime = False
+            nice = settings['dedicated_nice']
+
+    for role in DEDICATED_ROLES:
+        # trackers just below camera and stimulus, so they can't delay them on a shared core
+        role_priority = priority if role != TRACKING else max(1, priority - 1)
+        for worker in by_role[role]:
+            cpus = pools[role] if pools[role] is not None else [next(free)]
+            layout.placements.append(CPUPlacement(
+                worker = worker_name(worker),
+                role = role,
+                cpus = list(cpus),
+                realtime_priority = role_priority if realtime else 0,
+                nice = nice,
+                dedicated = pools[role] is None
+            ))
+
+    for worker in workers:
+        role = worker_role(worker)
+        if role == ENCODER:
+            layout.placements.append(CPUPlacement(worker_name(worker), role, list(encoder_cpus), nice=settings['encoder_nice']))
+        elif role == BACKGROUND:
+            # inherited from the main process
+            layout.placements.append(CPUPlacement(worker_name(worker), role, list(housekeeping)))
+
+    placements = {placement.worker: placement for placement in layout.placements}
+    for worker in workers:
+        worker.cpu_placement = placements[worker_name(worker)]
+
+    return layout
+
+def place_workers(workers: Sequence, settings: Dict, prefix: Optional[str] = None) -> Optional[CPULayout]:
+    '''
+    Plan and log the CPU placement of workers, settings as in settings['logs']['cpu'].
+    The layout is saved to <prefix>_cpu_layout_<timestamp>.json, and the calling 
+    process moves to the housekeeping cores.
+    '''
+
+    if INITIAL_AFFINITY is None:
+        if settings['enabled']:
+            print('CPU placement is only supported on Linux')
+        return None
+
+    if not settings['enabled']:
+        set_process_affinity(INITIAL_AFFINITY)
+        return None
+
+    layout = plan_cpu_placement(workers, settings)
+    print(layout)
+    if prefix:
+        layout.save(append_timestamp_to_filename(f'{prefix}_cpu_layout.json'))
+    set_process_affinity(layout.housekeeping_cpus)
+    return layout
+
+def process_threads() -> List[int]:
+    try:
+        return [int(task.name) for task in Path('/proc/self/task').iterdir()]
+    except OSError:
+        return [0]
+
+def set_process_affinity(cpus: Sequence[int]) -> None:
+    '''affinity is per thread on Linux, set it for every thread of the process'''
+    for tid in process_threads():
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except (OSError, ValueError):
+            pass
+
+def apply_cpu_placement(worker) -> None:
+    '''called by workers when they start, in their own process'''
+
+    placement = getattr(worker, 'cpu_placement', None)
+    if placement is None:
+        return
+
+    applied = []
+    # set_process_affinity ignores errors (threads may exit meanwhile): check the result
+    set_process_affinity(placement.cpus)
+    affinity = sorted(os.sched_getaffinity(0))
+    if set(affinity) != set(placement.cpus):
+        print(
+            f'{placement.worker}: failed to set CPU affinity to {format_cpu_list(sorted(placement.cpus))}, '
+            f'running on {format_cpu_list(affinity)}'
+        )
+    applied.append(f'cpus {format_cpu_list(affinity)}')
+
+    if placement.realtime_priority > 0:
+        try:
+            for tid in process_threads():
+                os.sched_setscheduler(tid, os.SCHED_RR, os.sched_param(placement.realtime_priority))
+            applied.append(f'SCHED_RR {placement.realtime_priority}')
+        except PermissionError:
+            print(f'{placement.worker}: real-time scheduling not permitted, run as root or grant CAP_SYS_NICE')
+        except OSError as e:
+            print(f'{placement.worker}: failed to set real-time scheduling: {e}')
+
+    if placement.nice != 0:
+        try:
+            for tid in process_threads():
+                os.setpriority(os.PRIO_PROCESS, tid, placement.nice)
+            applied.append(f'nice {placement.nice}')
+        except PermissionError:
+            print(f'{placement.worker}: niceness {placement.nice} not permitted, run as root or grant CAP_SYS_NICE')
+        except OSError as e:
+            print(f'{placement.worker}: failed to set niceness: {e}')
+
+    print(f"{placement.worker} (pid {os.getpid()}): {', '.join(applied)}")
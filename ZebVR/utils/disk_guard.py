@@ -0,0 +1,237 @@
+import os
+import shutil
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from pathlib import Path
+from typing import Dict, List, Union
+import numpy as np
+
+# rough compressed size / raw size, used to estimate data rates before recording
+COMPRESSION_RATIO = {
+    'h264': 0.05,
+    'hevc': 0.03,
+    'h264_nvenc': 0.05,
+    'hevc_nvenc': 0.03,
+    'mjpeg': 0.15,
+    'ffv1': 0.5,
+}
+IMAGE_SEQUENCE_COMPRESSION_RATIO = 0.5
+TRACKING_BYTES_PER_VALUE = 20 # CSV text
+FRAME_TIMING_BYTES = 32
+
+WARN_HEADROOM = 2.0 # measured throughput / required throughput
+REFUSE_HEADROOM = 1.0
+
+class DiskStatus(Enum):
+    OK = 0
+    WARN = 1
+    REFUSE = 2
+
+@dataclass
+class DiskCheck:
+    folder: Path
+    streams: Dict[str, float] # bytes per second
+    measured_bytes_per_sec: float = 0
+    write_latency_ms_p99: float = 0
+    free_bytes: int = 0
+    duration_sec: float = 0
+    status: DiskStatus = DiskStatus.OK
+    messages: List[str] = field(default_factory=list)
+
+    @property
+    def required_bytes_per_sec(self) -> float:
+        return sum(self.streams.values())
+
+    @property
+    def headroom(self) -> float:
+        if self.required_bytes_per_sec == 0:
+            return float('inf')
+        return self.measured_bytes_per_sec / self.required_bytes_per_sec
+
+    def __str__(self) -> str:
+        streams = ', '.join(f'{name} {1e-6*rate:.1f} MB/s' for name, rate in self.streams.items())
+        return (
+            f'{self.folder}: {self.status.name}, requires {1e-6*self.required_bytes_per_sec:.1f} MB/s ({streams}), '
+            f'measured {1e-6*self.measured_bytes_per_sec:.1f} MB/s (headroom x{self.headroom:.1f}), '
+            f'write latency p99 {self.write_latency_ms_p99:.1f} ms, free {1e-9*self.free_bytes:.1f} GB'
+            + ''.join(f'\n    {message}' for message in self.messages)
+        )
+
+def estimate_data_rates(
+        settings: Dict,
+        record_video: bool = True,
+        record_tracking: bool = True
+    ) -> Dict[Path, Dict[str, float]]:
+    '''bytes per second for each stream, grouped by destination folder'''
+
+    camera = settings['camera']
+    videorecording = settings['settings']['videorecording']
+    fps = camera['framerate_value']
+    pixels = camera['height_value'] * camera['width_value']
+    rates: Dict[Path, Dict[str, float]] = {}
+
+    def add(folder: Union[str, Path], name: str, bytes_per_sec: float) -> None:
+        rates.setdefault(Path(folder).resolve(), {})[name] = bytes_per_sec
+
+    if record_video:
+        frame_rate = fps / videorecording['video_decimation']
+
+        if videorecording['video_method'] == 'image sequence':
+            resize = videorecording['video_recording_resize']
+            raw = pixels * resize**2 * camera['num_channels'] * frame_rate
+            ratio = IMAGE_SEQUENCE_COMPRESSION_RATIO if videorecording['video_recording_compression'] else 1.0
+            add(videorecording['video_recording_dir'], 'image sequence', raw * ratio)
+
+        else:
+            bytes_per_pixel = 1.0 if videorecording['video_grayscale'] else 1.5 # yuv420p
+            if videorecording['video_roi_mode'] != 'full frame':
+                # only ROIs are encoded (a mosaic also has some black padding, negligible once compressed)
+                pixels = sum(w * h for _, _, w, h in settings['identity']['ROIs'])
+            raw = pixels * bytes_per_pixel * frame_rate
+            ratio = COMPRESSION_RATIO.get(videorecording['video_codec'], 1.0)
+            add(Path(videorecording['video_filename']).parent, 'video', raw * ratio)
+            add(Path(videorecording['video_filename']).parent, 'video timing', 2 * FRAME_TIMING_BYTES * frame_rate)
+
+    if record_tracking:
+        values_per_row = 16 + 2*settings['settings']['tracking']['n_tail_pts_interp']
+        bytes_per_sec = settings['identity']['n_animals'] * fps * values_per_row * TRACKING_BYTES_PER_VALUE
+        add(Path(settings['settings']['tracking']['csv_filename']).parent, 'tracking', bytes_per_sec)
+
+    return rates
+
+def benchmark_write(
+        folder: Union[str, Path],
+        num_bytes: int = 256*1024**2,
+        block_size: int = 8*1024**2
+    ) -> Dict[str, float]:
+    '''sustained write throughput and per-block latency, data is flushed to disk'''
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    filename = folder / f'.zebvr_write_benchmark_{os.getpid()}'
+    block = np.random.randint(0, 256, block_size, dtype=np.uint8).tobytes() # incompressible
+    latency_ms = []
+
+    try:
+        start = time.perf_counter()
+        with open(filename, 'wb', buffering=0) as fd:
+            for _ in range(max(1, num_bytes // block_size)):
+                block_start = time.perf_counter()
+                fd.write(block)
+                os.fsync(fd.fileno())
+                latency_ms.append(1000*(time.perf_counter() - block_start))
+        elapsed = time.perf_counter() - start
+    finally:
+        filename.unlink(missing_ok=True)
+
+    return {
+        'bytes_per_sec': len(latency_ms) * block_size / elapsed,
+        'latency_ms_p50': float(np.percentile(latency_ms, 50)),
+        'latency_ms_p99': float(np.percentile(latency_ms, 99))
+    }
+
+# write benchmarks by device (st_dev), run once per session
+_write_benchmarks: Dict[int, Dict[str, float]] = {}
+
+def benchmark_device(folder: Union[str, Path], num_bytes: int = 256*1024**2) -> Dict[str, float]:
+    '''benchmark_write on the device of folder, cached for the session'''
+
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    device = os.stat(folder).st_dev
+    if device not in _write_benchmarks:
+        _write_benchmarks[device] = benchmark_write(folder, num_bytes)
+    return _write_benchmarks[device]
+
+def check_disks(
+        settings: Dict,
+        duration_sec: float = 0,
+        record_video: bool = True,
+        record_tracking: bool = True,
+        benchmark_bytes: int = 256*1024**2
+    ) -> List[DiskCheck]:
+    '''
+    Pre-flight check: compare estimated data rates with a short write
+    benchmark on each destination device (once per session, see 
+    benchmark_device), and the data volume of the recording (duration_sec, 
+    0 if unknown) with free space. This takes seconds on a new device: 
+    don't call it from the GUI thread.
+    '''
+
+    checks = []
+    for folder, streams in estimate_data_rates(settings, record_video, record_tracking).items():
+
+        check = DiskCheck(folder, streams, duration_sec=duration_sec)
+        result = benchmark_device(folder, benchmark_bytes)
+        check.measured_bytes_per_sec = result['bytes_per_sec']
+        check.write_latency_ms_p99 = result['latency_ms_p99']
+        check.free_bytes = shutil.disk_usage(folder).free
+
+        if check.headroom < REFUSE_HEADROOM:
+            check.status = DiskStatus.REFUSE
+            check.messages.append('disk is slower than the data rate')
+        elif check.headroom < WARN_HEADROOM:
+            check.status = DiskStatus.WARN
+            check.messages.append('little write headroom, frames may be dropped')
+
+        required_bytes = check.required_bytes_per_sec * duration_sec
+        if required_bytes > check.free_bytes:
+            check.status = DiskStatus.REFUSE
+            check.messages.append(f'recording needs {1e-9*required_bytes:.1f} GB')
+        elif check.required_bytes_per_sec > 0:
+            check.messages.append(
+                f'disk full after {check.free_bytes / check.required_bytes_per_sec / 3600:.1f} h'
+            )
+
+        checks.append(check)
+
+    return checks
+
+class DiskUsageMonitor:
+    '''Free space and write latency probe for one folder, to call periodically during a run'''
+
+    PROBE_BYTES = 1024**2
+
+    def __init__(
+            self,
+            folder: Union[str, Path],
+            required_bytes_per_sec: float = 0,
+            min_free_sec: float = 600,
+            max_latency_ms: float = 100
+        ) -> None:
+
+        self.folder = Path(folder)
+        self.required_bytes_per_sec = required_bytes_per_sec
+        self.min_free_sec = min_free_sec
+        self.max_latency_ms = max_latency_ms
+        self.probe = np.random.randint(0, 256, self.PROBE_BYTES, dtype=np.uint8).tobytes()
+        self.probe_filename = self.folder / f'.zebvr_write_probe_{os.getpid()}'
+
+    def check(self) -> Dict[str, float]:
+
+        free_bytes = shutil.disk_usage(self.folder).free
+
+        start = time.perf_counter()
+        with open(self.probe_filename, 'wb', buffering=0) as fd:
+            fd.write(self.probe)
+            os.fsync(fd.fileno())
+        latency_ms = 1000*(time.perf_counter() - start)
+        self.probe_filename.unlink(missing_ok=True)
+
+        res = {'free_bytes': free_bytes, 'write_latency_ms': latency_ms}
+        if self.required_bytes_per_sec > 0:
+            res['free_sec'] = free_bytes / self.required_bytes_per_sec
+        return res
+
+    def warnings(self, res: Dict[str, float]) -> List[str]:
+
+        warnings = []
+        if res.get('free_sec', float('inf')) < self.min_free_sec:
+            warnings.append(f"{self.folder}: disk full in {res['free_sec']/60:.1f} min")
+        if res['write_latency_ms'] > self.max_latency_ms:
+            warnings.append(f"{self.folder}: write latency {res['write_latency_ms']:.0f} ms")
+        return warnings
+
+    def close(self) -> None:
+        self.probe_filename.unlink(missing_ok=True)
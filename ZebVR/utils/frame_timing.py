@@ -0,0 +1,153 @@
+from multiprocessing import RawArray
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import numpy as np
+from numpy.typing import NDArray
+from .binary_records import BinaryRecordWriter
+from .timing import get_time_ns
+
+FRAME_TIMING_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('camera_timestamp', np.float64), # camera clock
+    ('timestamp', np.int64), # get_time_ns when the frame was received from the camera
+    ('written_timestamp', np.int64), # get_time_ns when the frame was handed to the writer
+])
+
+class FrameTimingCounters:
+    '''
+    Frame continuity counters in shared memory, updated by a saver and read
+    by the GUI while the DAG is running.
+    '''
+
+    FIELDS = (
+        'num_frames',
+        'num_dropped',  # missing indices
+        'num_gaps',     # discontinuities, one gap can drop several frames
+        'max_gap',
+        'num_out_of_order',
+        'num_jitter',   # intervals deviating from the expected interval
+        'max_jitter_ms'
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.values = RawArray('d', len(self.FIELDS))
+
+    def __getitem__(self, field: str) -> float:
+        return self.values[self.FIELDS.index(field)]
+
+    def __setitem__(self, field: str, value: float) -> None:
+        self.values[self.FIELDS.index(field)] = value
+
+    def snapshot(self) -> Dict:
+        return {field: self.values[i] for i, field in enumerate(self.FIELDS)}
+
+    def reset(self) -> None:
+        for i in range(len(self.FIELDS)):
+            self.values[i] = 0
+
+class FrameContinuityMonitor:
+    '''
+    Detect skipped indices and timestamp jitter online. Indices are expected
+    to increase by index_step (e.g. the decimation factor). The expected frame
+    interval is a running average of received timestamps.
+    '''
+
+    def __init__(
+            self,
+            counters: FrameTimingCounters,
+            index_step: int = 1,
+            jitter_tolerance: float = 0.5,
+            smoothing: float = 0.01
+        ) -> None:
+
+        self.counters = counters
+        self.index_step = index_step
+        self.jitter_tolerance = jitter_tolerance
+        self.smoothing = smoothing
+        self.last_index = None
+        self.last_timestamp = None
+        self.expected_interval_ns = None
+
+    def update(self, index: int, timestamp: int) -> int:
+        '''returns the number of frames dropped before this one'''
+
+        counters = self.counters
+        counters['num_frames'] += 1
+        num_dropped = 0
+
+        if self.last_index is None:
+            self.last_index = index
+            self.last_timestamp = timestamp
+            return num_dropped
+
+        step = index - self.last_index
+        if step <= 0:
+            counters['num_out_of_order'] += 1
+            return num_dropped
+
+        num_steps = step // self.index_step
+        if num_steps > 1:
+            num_dropped = num_steps - 1
+            counters['num_dropped'] += num_dropped
+            counters['num_gaps'] += 1
+            counters['max_gap'] = max(counters['max_gap'], num_dropped)
+
+        interval_ns = (timestamp - self.last_timestamp) / num_steps
+        if self.expected_interval_ns is None:
+            self.expected_interval_ns = interval_ns
+        else:
+            deviation_ns = abs(interval_ns - self.expected_interval_ns)
+            if deviation_ns > self.jitter_tolerance * self.expected_interval_ns:
+                counters['num_jitter'] += 1
+                counters['max_jitter_ms'] = max(counters['max_jitter_ms'], 1e-6*deviation_ns)
+            self.expected_interval_ns += self.smoothing * (interval_ns - self.expected_interval_ns)
+
+        self.last_index = index
+        self.last_timestamp = timestamp
+        return num_dropped
+
+class FrameTimingSidecar:
+    '''Binary per-frame timing file next to a recording, with continuity monitoring'''
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            counters: FrameTimingCounters,
+            index_step: int = 1,
+            header: Optional[Dict] = None
+        ) -> None:
+
+        self.monitor = FrameContinuityMonitor(counters, index_step)
+        full_header = {'timebase': 'get_time_ns', 'stream': counters.name, 'index_step': index_step}
+        if header is not None:
+            full_header.update(header)
+        self.writer = BinaryRecordWriter(filename, FRAME_TIMING_DTYPE, full_header)
+        self.record = np.zeros((), dtype=FRAME_TIMING_DTYPE)
+
+    def frame_received(self, index: int, timestamp: int) -> int:
+        return self.monitor.update(index, timestamp)
+
+    def frame_written(self, index: int, camera_timestamp: float, timestamp: int) -> None:
+        self.record['index'] = index
+        self.record['camera_timestamp'] = camera_timestamp
+        self.record['timestamp'] = timestamp
+        self.record['written_timestamp'] = get_time_ns()
+        self.writer.write(self.record)
+
+    def close(self) -> None:
+        self.writer.close()
+
+# savers are constructed in the GUI process, which reads their counters
+_registered_counters: List[FrameTimingCounters] = []
+
+def register_frame_timing_counters(name: str) -> FrameTimingCounters:
+    counters = FrameTimingCounters(name)
+    _registered_counters.append(counters)
+    return counters
+
+def registered_frame_timing_counters() -> List[FrameTimingCounters]:
+    return list(_registered_counters)
+
+def clear_frame_timing_counters() -> None:
+    _registered_counters.clear()
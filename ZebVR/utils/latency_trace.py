@@ -0,0 +1,208 @@
+'''
+Per-message latency tracing.
+
+Messages carry a 'trace' field (TRACE_FIELD): one get_time_ns stamp per trace
+point, 0 when a stage was not traversed. Each stage stamps when it receives
+a message and when it is done with it, sinks (stimulus, savers) record the
+trace of every message with a TraceRecorder. Input messages may live in
+shared memory and are never modified: reception times are taken with
+get_time_ns and stamped in the output message. Stamping costs one clock 
+read and one array write, well under a microsecond.
+
+Traces are analysed offline: time spent in each stage and in the queues
+between stages, as percentiles and histograms, and as a Chrome trace
+(chrome://tracing or https://ui.perfetto.dev).
+
+Usage: python -m ZebVR.utils.latency_trace TRACE_FILE ... [--chrome trace.json] [--max-messages 10000]
+'''
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+import numpy as np
+from numpy.typing import NDArray
+from .append_timestamp_to_filename import append_timestamp_to_filename
+from .binary_records import BinaryRecordWriter, load_binary_records
+from .timing import get_time_ns
+
+TRACE_POINTS = (
+    'camera_received',
+    'camera_sent',
+    'crop_received',
+    'crop_sent',
+    'tracker_received',
+    'tracker_sent',
+    'sink_received',
+    'sink_done',
+)
+CAMERA_RECEIVED, CAMERA_SENT, CROP_RECEIVED, CROP_SENT, \
+TRACKER_RECEIVED, TRACKER_SENT, SINK_RECEIVED, SINK_DONE = range(len(TRACE_POINTS))
+NUM_TRACE_POINTS = len(TRACE_POINTS)
+
+TRACE_FIELD = ('trace', np.int64, (NUM_TRACE_POINTS,))
+
+TRACE_RECORD_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('identity', np.int32),
+    TRACE_FIELD,
+])
+
+LATENCY_BINS_MS = np.concatenate(([0], np.logspace(-3, 4, 57))) # 1 us to 10 s
+
+def stamp(message: NDArray, point: int, timestamp: Optional[int] = None) -> None:
+    '''stamp a trace point (now by default), messages without trace are left untouched'''
+    try:
+        message['trace'][point] = get_time_ns() if timestamp is None else timestamp
+    except (ValueError, KeyError, IndexError):
+        pass
+
+def copy_trace(source: NDArray, destination: NDArray) -> None:
+    '''carry the trace of an input message over to an output message'''
+    try:
+        destination['trace'] = source['trace']
+    except (ValueError, KeyError):
+        destination['trace'] = 0
+
+def trace_filename(filename: Union[str, Path], sink: str) -> Path:
+    filename = Path(filename)
+    return filename.with_name(f'{filename.stem}_{sink}{filename.suffix}')
+
+class TraceRecorder:
+    '''Stamp sink_received and sink_done, and record the traces reaching a sink in a binary record file'''
+
+    def __init__(self, filename: Union[str, Path], sink: str) -> None:
+        self.sink = sink
+        self.filename = append_timestamp_to_filename(trace_filename(filename, sink))
+        self.writer = BinaryRecordWriter(
+            self.filename,
+            TRACE_RECORD_DTYPE,
+            header = {'timebase': 'get_time_ns', 'sink': sink, 'points': list(TRACE_POINTS)}
+        )
+        self.record = np.zeros((), dtype=TRACE_RECORD_DTYPE)
+
+    def write(self, message: NDArray, received: int, identity: Optional[int] = None) -> None:
+        '''received: get_time_ns when the sink got the message, identity read from the message if None'''
+        try:
+            self.record['trace'] = message['trace']
+            if identity is None:
+                identity = message['identity'] if 'identity' in message.dtype.names else -1
+        except (ValueError, KeyError, IndexError, AttributeError):
+            return
+        self.record['trace'][SINK_RECEIVED] = received
+        self.record['trace'][SINK_DONE] = get_time_ns()
+        self.record['index'] = message['index']
+        self.record['identity'] = identity
+        self.writer.write(self.record)
+
+    def close(self) -> None:
+        self.writer.close()
+
+def load_traces(filenames: Sequence[Union[str, Path]]) -> Dict[str, NDArray]:
+    '''trace records by sink'''
+    traces = {}
+    for filename in filenames:
+        header, records = load_binary_records(filename)
+        sink = header.get('sink', Path(filename).stem)
+        traces[sink] = np.concatenate((traces[sink], records)) if sink in traces else records
+    return traces
+
+def segment_name(start: int, stop: int, sink: str) -> str:
+    start_stage = TRACE_POINTS[start].rsplit('_', 1)[0].replace('sink', sink)
+    stop_stage = TRACE_POINTS[stop].rsplit('_', 1)[0].replace('sink', sink)
+    if start_stage == stop_stage:
+        return start_stage
+    return f'{start_stage} -> {stop_stage}'
+
+def stage_latencies(records: NDArray, sink: str) -> Dict[str, NDArray]:
+    '''
+    time (ms) between consecutive stamped points: within a stage (e.g. 'tracker')
+    or waiting in the queue between two stages (e.g. 'crop -> tracker'), plus 'total'
+    '''
+
+    trace = records['trace']
+    stamped = trace > 0
+    latencies = {}
+
+    # messages can take different paths (e.g. camera -> video saver skips crop and tracker)
+    for path in np.unique(stamped, axis=0):
+        selected = trace[np.all(stamped == path, axis=1)]
+        points = np.flatnonzero(path)
+        for start, stop in zip(points[:-1], points[1:]):
+            name = segment_name(start, stop, sink)
+            values = 1e-6 * (selected[:, stop] - selected[:, start])
+            latencies[name] = np.concatenate((latencies[name], values)) if name in latencies else values
+        if len(points) > 1:
+            values = 1e-6 * (selected[:, points[-1]] - selected[:, points[0]])
+            latencies['total'] = np.concatenate((latencies['total'], values)) if 'total' in latencies else values
+
+    return latencies
+
+def latency_summary(latencies: Dict[str, NDArray]) -> Dict[str, Dict[str, float]]:
+    summary = {}
+    for name, values in latencies.items():
+        if values.size == 0:
+            continue
+        summary[name] = {
+            'count': int(values.size),
+            'p50': float(np.percentile(values, 50)),
+            'p90': float(np.percentile(values, 90)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(values.max()),
+        }
+    return summary
+
+def latency_histograms(latencies: Dict[str, NDArray], bins: NDArray = LATENCY_BINS_MS) -> Dict[str, NDArray]:
+    return {name: np.histogram(values, bins)[0] for name, values in latencies.items()}
+
+def chrome_trace(traces: Dict[str, NDArray], max_messages: Optional[int] = 10_000) -> Dict:
+    '''
+    Chrome trace events, one track per sink and identity, one slice per stage
+    and queue traversed by each message. Only the last max_messages of each sink.
+    '''
+
+    events = []
+    origin = min(int(r['trace'][r['trace'] > 0].min()) for r in traces.values() if np.any(r['trace'] > 0))
+
+    for pid, (sink, records) in enumerate(traces.items()):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': sink}})
+        if max_messages is not None:
+            records = records[-max_messages:]
+        for record in records:
+            points = np.flatnonzero(record['trace'])
+            for start, stop in zip(points[:-1], points[1:]):
+                name = segment_name(start, stop, sink)
+                events.append({
+                    'name': name,
+                    'cat': 'queue' if '->' in name else 'stage',
+                    'ph': 'X',
+                    'ts': 1e-3 * (int(record['trace'][start]) - origin),
+                    'dur': 1e-3 * (int(record['trace'][stop]) - int(record['trace'][start])),
+                    'pid': pid,
+                    'tid': int(record['identity']),
+                    'args': {'index': int(record['index'])}
+                })
+
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+def write_chrome_trace(traces: Dict[str, NDArray], filename: Union[str, Path], max_messages: Optional[int] = 10_000) -> None:
+    with open(filename, 'w') as fd:
+        json.dump(chrome_trace(traces, max_messages), fd)
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='per-stage latency from trace files')
+    parser.add_argument('files', nargs='+', help='trace files written by TraceRecorder')
+    parser.add_argument('--chrome', default=None, help='export a Chrome trace JSON file')
+    parser.add_argument('--max-messages', type=int, default=10_000, help='messages per sink in the Chrome trace')
+    args = parser.parse_args()
+
+    traces = load_traces(args.files)
+    for sink, records in traces.items():
+        print(f'{sink}: {len(records)} messages')
+        for name, stats in latency_summary(stage_latencies(records, sink)).items():
+            print(f"  {name:<28} p50 {stats['p50']:8.3f} ms  p90 {stats['p90']:8.3f} ms  p99 {stats['p99']:8.3f} ms  max {stats['max']:8.3f} ms")
+
+    if args.chrome is not None:
+        write_chrome_trace(traces, args.chrome, args.max_messages)
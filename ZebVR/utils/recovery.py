@@ -0,0 +1,232 @@
+'''
+Recover the files of an interrupted recording (crash, killed DAG, power loss).
+
+- text files (tracking / timing CSV, stimulus JSON lines): the incomplete last line is removed
+- binary record files (.timing sidecars, sensor and queue logs): the incomplete last record is removed
+- videos: the number of decodable frames is probed with ffprobe. Matroska files
+  are readable up to the last written cluster and can be remuxed to rebuild their
+  index. MP4 files without a moov atom cannot be recovered this way.
+- the timing files of a video are trimmed to the frames present in the video,
+  so that row i still describes frame i
+
+Usage: python -m ZebVR.utils.recovery [--dry-run] [--remux] FILE_OR_FOLDER ...
+'''
+
+import json
+import os
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+import numpy as np
+from .binary_records import BINARY_RECORDS_MAGIC, GZIP_MAGIC, _descr_from_json
+from .checkpoint import checkpoint_filename, load_checkpoint
+
+TEXT_SUFFIXES = ('.csv', '.json', '.jsonl')
+BINARY_SUFFIXES = ('.timing', '.bin')
+VIDEO_SUFFIXES = ('.mp4', '.mkv', '.avi')
+
+def trim_text_file(filename: Path, dry_run: bool = False) -> Dict:
+    '''remove the incomplete last line, returns number of complete lines'''
+
+    size = filename.stat().st_size
+    with open(filename, 'rb') as fd:
+        data = fd.read()
+
+    if filename.suffix == '.json':
+        # manifests and metadata are a single JSON document, stimulus logs one per line 
+        try:
+            json.loads(data)
+            return {'num_lines': data.count(b'\n'), 'bytes_removed': 0}
+        except ValueError:
+            pass
+
+    valid_size = data.rfind(b'\n') + 1
+    num_lines = data.count(b'\n')
+
+    if valid_size < size and not dry_run:
+        os.truncate(filename, valid_size)
+
+    return {'num_lines': num_lines, 'bytes_removed': size - valid_size}
+
+def trim_text_lines(filename: Path, num_lines: int, dry_run: bool = False) -> int:
+    '''keep the first num_lines lines, returns number of lines removed'''
+
+    with open(filename, 'rb') as fd:
+        lines = fd.readlines()
+    num_removed = max(0, len(lines) - num_lines)
+    if num_removed > 0 and not dry_run:
+        os.truncate(filename, sum(len(line) for line in lines[:num_lines]))
+    return num_removed
+
+def trim_binary_records(filename: Path, num_records: Optional[int] = None, dry_run: bool = False) -> Dict:
+    '''
+    remove the incomplete last record (or keep num_records records).
+    Compressed files are left as they are, the loader tolerates truncated streams.
+    '''
+
+    size = filename.stat().st_size
+    with open(filename, 'rb') as fd:
+        start = fd.read(len(BINARY_RECORDS_MAGIC))
+        if start[:2] == GZIP_MAGIC:
+            return {'compressed': True, 'bytes_removed': 0}
+        if start != BINARY_RECORDS_MAGIC:
+            raise ValueError(f'{filename} is not a binary record file')
+        header_length = int(np.frombuffer(fd.read(4), dtype=np.uint32)[0])
+        header = json.loads(fd.read(header_length))
+
+    dtype = np.lib.format.descr_to_dtype(_descr_from_json(header['dtype']))
+    offset = len(BINARY_RECORDS_MAGIC) + 4 + header_length
+    complete_records = (size - offset) // dtype.itemsize
+    if num_records is None:
+        num_records = complete_records
+    num_records = min(num_records, complete_records)
+    valid_size = offset + num_records * dtype.itemsize
+
+    if valid_size < size and not dry_run:
+        os.truncate(filename, valid_size)
+
+    return {'num_records': num_records, 'bytes_removed': size - valid_size}
+
+def probe_video(filename: Path) -> Optional[int]:
+    '''number of decodable video packets, None if the file can't be read'''
+
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-count_packets',
+        '-show_entries', 'stream=nb_read_packets',
+        '-of', 'csv=p=0',
+        str(filename)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        return int(result.stdout.strip().rstrip(','))
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        return None
+
+def remux_video(filename: Path) -> Optional[Path]:
+    '''copy the streams of a truncated video into a new file with a complete index'''
+
+    output = filename.with_name(f'{filename.stem}_recovered.mkv')
+    cmd = [
+        'ffmpeg', '-y', '-v', 'error',
+        '-err_detect', 'ignore_err',
+        '-i', str(filename),
+        '-c', 'copy',
+        str(output)
+    ]
+    result = subprocess.run(cmd)
+    if result.returncode != 0:
+        print(f'remux of {filename} failed')
+        return None
+    return output
+
+def last_timestamp(filename: Path, column: int = 1) -> Optional[int]:
+    '''timestamp (get_time_ns) of the last complete row of a CSV file'''
+
+    with open(filename, 'rb') as fd:
+        fd.seek(max(0, filename.stat().st_size - 65536))
+        lines = fd.read().split(b'\n')
+    for line in reversed(lines[:-1]):
+        try:
+            return int(line.split(b',')[column])
+        except (IndexError, ValueError):
+            continue
+    return None
+
+def recover_video(filename: Path, dry_run: bool = False, remux: bool = False) -> Dict:
+
+    report = {'num_frames': probe_video(filename)}
+    if report['num_frames'] is None:
+        print(f'{filename}: unreadable video')
+        return report
+
+    timings = filename.with_suffix('.csv')
+    if timings.exists():
+        trim_text_file(timings, dry_run)
+        report['timing_rows_removed'] = trim_text_lines(timings, report['num_frames'] + 1, dry_run) # header line
+        report['last_timestamp'] = last_timestamp(timings)
+
+    sidecar = filename.with_suffix('.timing')
+    if sidecar.exists():
+        report['sidecar'] = trim_binary_records(sidecar, report['num_frames'], dry_run)
+
+    if remux and not dry_run:
+        output = remux_video(filename)
+        report['remuxed'] = None if output is None else str(output)
+
+    return report
+
+def collect_files(paths: List[Union[str, Path]]) -> List[Path]:
+
+    files = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            files.extend(sorted(p for p in path.rglob('*') if p.is_file()))
+        else:
+            files.append(path)
+    return files
+
+def recover_recording(
+        paths: List[Union[str, Path]],
+        dry_run: bool = False,
+        remux: bool = False
+    ) -> Dict[str, Dict]:
+    '''
+    Trim each file to its last complete record and align video timings with
+    the frames present in the video. The time at which each stream stops
+    (last timestamp) is reported, to compare streams with each other and with
+    the last checkpoint.
+    '''
+
+    files = collect_files(paths)
+    videos = [f for f in files if f.suffix in VIDEO_SUFFIXES and not f.stem.endswith('_recovered')]
+    video_companions = {v.with_suffix(s) for v in videos for s in ('.csv', '.timing')}
+    reports = {}
+
+    for filename in files:
+
+        if filename.name.endswith(('.checkpoint', '.tmp')) or filename in video_companions:
+            continue
+
+        try:
+            if filename in videos:
+                report = recover_video(filename, dry_run, remux)
+            elif filename.suffix in TEXT_SUFFIXES:
+                report = trim_text_file(filename, dry_run)
+                if filename.suffix == '.csv':
+                    report['last_timestamp'] = last_timestamp(filename)
+            elif filename.suffix in BINARY_SUFFIXES:
+                report = trim_binary_records(filename, dry_run=dry_run)
+            else:
+                continue
+        except (OSError, ValueError) as e:
+            print(f'{filename}: {e}')
+            continue
+
+        checkpoint = load_checkpoint(checkpoint_filename(filename))
+        if checkpoint is not None:
+            report['checkpoint'] = checkpoint
+        reports[str(filename)] = report
+
+    timestamps = [r['last_timestamp'] for r in reports.values() if r.get('last_timestamp') is not None]
+    if timestamps:
+        end = min(timestamps)
+        for report in reports.values():
+            if report.get('last_timestamp') is not None:
+                report['sec_after_common_end'] = 1e-9 * (report['last_timestamp'] - end)
+
+    return reports
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='recover the files of an interrupted recording')
+    parser.add_argument('paths', nargs='+', help='files or folders')
+    parser.add_argument('--dry-run', action='store_true', help='report without modifying files')
+    parser.add_argument('--remux', action='store_true', help='rebuild the index of truncated videos')
+    args = parser.parse_args()
+
+    reports = recover_recording(args.paths, args.dry_run, args.remux)
+    print(json.dumps(reports, indent=2))
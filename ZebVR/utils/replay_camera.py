@@ -0,0 +1,392 @@
+import json
+import queue
+import threading
+import time
+from pathlib import Path
+from multiprocessing import RawArray
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import cv2
+import numpy as np
+from numpy.typing import NDArray
+from .binary_records import load_binary_records
+from .chunked_image_store import ChunkedImageStore, STORE_METADATA_FILE
+
+REPLAY_TIMING_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('camera_timestamp', np.float64), # camera clock
+    ('timestamp', np.int64), # get_time_ns when the frame was received during the recording
+])
+
+def find_store_folder(path: Path) -> Optional[Path]:
+    '''chunked image store containing path (its folder or any of its files)'''
+    for folder in (path, path.parent, path.parent.parent):
+        if (folder / STORE_METADATA_FILE).exists():
+            return folder
+    return None
+
+def load_recording(path: Union[str, Path]) -> Tuple[List[Path], Optional[ChunkedImageStore], NDArray]:
+    '''
+    Frames sources and per-frame timing of a recording: a chunked image store
+    (ImageSaverWorker), a segmented video manifest, or a video file with its
+    .timing sidecar or timings .csv (VideoSaverWorker).
+    Returns (videos, store, timing), one of videos and store is empty.
+    '''
+
+    path = Path(path)
+
+    store_folder = find_store_folder(path)
+    if store_folder is not None:
+        store = ChunkedImageStore(store_folder)
+        timing = np.zeros(len(store), dtype=REPLAY_TIMING_DTYPE)
+        for field in REPLAY_TIMING_DTYPE.names:
+            timing[field] = store.records[field]
+        return [], store, timing
+
+    if path.name.endswith('_manifest.json'):
+        with open(path, 'r') as fd:
+            manifest = json.load(fd)
+        segments = sorted(manifest['segments'], key=lambda s: s['segment'])
+        videos = [Path(s['filename']) for s in segments if s['num_written'] > 0]
+        video = Path(manifest['timings'])
+    else:
+        videos = [path]
+        video = path
+
+    timing = None
+    sidecar = video.with_suffix('.timing')
+    timings_csv = video.with_suffix('.csv')
+    if sidecar.exists():
+        _, records = load_binary_records(sidecar)
+        timing = np.zeros(len(records), dtype=REPLAY_TIMING_DTYPE)
+        for field in REPLAY_TIMING_DTYPE.names:
+            timing[field] = records[field]
+    elif timings_csv.exists():
+        rows = np.loadtxt(timings_csv, delimiter=',', skiprows=1, ndmin=2)
+        timing = np.zeros(len(rows), dtype=REPLAY_TIMING_DTYPE)
+        timing['index'] = rows[:, 0]
+        timing['timestamp'] = rows[:, 1]
+        timing['camera_timestamp'] = rows[:, 2]
+    else:
+        # no timing recorded, assume a constant frame rate
+        num_frames = 0
+        fps = 0
+        for filename in videos:
+            cap = cv2.VideoCapture(str(filename))
+            num_frames += int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = cap.get(cv2.CAP_PROP_FPS) or 30
+            cap.release()
+        print(f'{video}: no timing file, replaying at {fps:.1f} fps')
+        timing = np.zeros(num_frames, dtype=REPLAY_TIMING_DTYPE)
+        timing['index'] = np.arange(num_frames)
+        timing['camera_timestamp'] = np.arange(num_frames) / fps
+        timing['timestamp'] = (1e9 * timing['camera_timestamp']).astype(np.int64)
+
+    return videos, None, timing
+
+class ReplayCamera:
+    '''
+    Replay a recording through the DAG, with the camera_tools interface.
+    Frames keep their recorded index and camera timestamp, and are emitted
+    at the recorded timing divided by speed (speed 0: as fast as possible).
+    Frames are decoded ahead in a thread into a buffer of buffer_frames.
+    Every frame is emitted, frames are late rather than skipped when the
+    DAG is slower than the recording. Replay and decode statistics are
+    printed when acquisition stops, and kept in counters if provided
+    (see new_counters), to be read from another process.
+    '''
+
+    NUM_FRAMES = 0
+    NUM_LATE = 1
+    NUM_DECODED = 2
+    DECODE_SEC = 3
+    NUM_COUNTERS = 4
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            speed: float = 1.0,
+            buffer_frames: int = 64,
+            grayscale: bool = True,
+            loop: bool = False,
+            counters: Optional[RawArray] = None
+        ) -> None:
+
+        self.filename = Path(filename)
+        self.speed = speed
+        self.buffer_frames = buffer_frames
+        self.grayscale = grayscale
+        self.loop = loop
+        self.counters = counters
+
+        self.videos, self.store, self.timing = load_recording(self.filename)
+        if len(self.timing) == 0:
+            raise ValueError(f'{self.filename}: empty recording')
+
+        intervals = np.diff(self.timing['timestamp'])
+        self.recorded_fps = 1e9 / np.median(intervals) if len(intervals) > 0 else 30
+
+        frames = self.frames()
+        first = next(frames)
+        frames.close()
+        self.height, self.width = first.shape[:2]
+        self.num_channels = 1 if first.ndim == 2 else first.shape[2]
+
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.buffer = None
+
+    @staticmethod
+    def new_counters() -> RawArray:
+        return RawArray('d', ReplayCamera.NUM_COUNTERS)
+
+    def frames(self) -> Iterator[NDArray]:
+
+        if self.store is not None:
+            # image stores keep camera frames (RGB), videos decode to BGR
+            for image in self.store:
+                if self.grayscale and image.ndim == 3:
+                    image = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+                yield image
+            return
+
+        for filename in self.videos:
+            cap = cv2.VideoCapture(str(filename))
+            try:
+                while True:
+                    ret, image = cap.read()
+                    if not ret:
+                        break
+                    if self.grayscale and image.ndim == 3:
+                        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+                    yield image
+            finally:
+                cap.release()
+
+    def put(self, item) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                self.buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def decode(self) -> None:
+        '''
+        fill the buffer, frames beyond the timing (or timing beyond the frames) are ignored.
+        The end of the recording is marked by None, also if decoding fails.
+        '''
+
+        try:
+            while True:
+                frames = self.frames()
+                for timing in self.timing:
+                    start = time.perf_counter()
+                    image = next(frames, None)
+                    self.decode_time += time.perf_counter() - start
+                    if image is None:
+                        break
+                    if not self.put((timing, image)):
+                        frames.close()
+                        return
+                    self.num_decoded += 1
+                frames.close()
+                if not self.loop:
+                    break
+        except Exception as e:
+            print(f'{self.filename}: decoding failed after {self.num_decoded} frames: {e}')
+        finally:
+            self.put(None)
+
+    def start_acquisition(self) -> None:
+
+        self.buffer = queue.Queue(maxsize=self.buffer_frames)
+        self.stop_event.clear()
+        self.num_decoded = 0
+        self.num_frames = 0
+        self.num_late = 0
+        self.num_underruns = 0
+        self.decode_time = 0.0
+        self.finished = False
+        self.start_time = None
+        self.first_timestamp = None
+
+        self.thread = threading.Thread(target=self.decode, daemon=True)
+        self.thread.start()
+
+    def stop_acquisition(self) -> None:
+
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+        if self.counters is not None:
+            self.counters[self.NUM_FRAMES] += self.num_frames
+            self.counters[self.NUM_LATE] += self.num_late
+            self.counters[self.NUM_DECODED] += self.num_decoded
+            self.counters[self.DECODE_SEC] += self.decode_time
+
+        if self.num_frames > 0:
+            print(self.stats())
+
+    def stats(self) -> Dict:
+        elapsed = time.perf_counter() - self.start_time if self.start_time is not None else 0
+        return {
+            'replay_frames': self.num_frames,
+            'replay_fps': self.num_frames / elapsed if elapsed > 0 else 0.0,
+            'decoded_frames': self.num_decoded,
+            'decode_fps': self.num_decoded / self.decode_time if self.decode_time > 0 else 0.0,
+            'late_frames': self.num_late,
+            'buffer_underruns': self.num_underruns,
+        }
+
+    def get_frame(self) -> Optional[Dict]:
+
+        if self.thread is None or self.finished:
+            return None
+
+        if self.buffer.empty():
+            self.num_underruns += 1
+        item = None
+        while True:
+            try:
+                item = self.buffer.get(timeout=0.1)
+                break
+            except queue.Empty:
+                # the decode thread always ends with None, unless it died 
+                if not self.thread.is_alive() and self.buffer.empty():
+                    break
+        if item is None:
+            self.finished = True
+            print(f'{self.filename}: end of recording')
+            return None
+        timing, image = item
+
+        now = time.perf_counter()
+        if self.start_time is None or timing['timestamp'] < self.first_timestamp:
+            # first frame, or recording looped
+            self.start_time = now
+            self.first_timestamp = timing['timestamp']
+
+        if self.speed > 0:
+            due = self.start_time + 1e-9 * (timing['timestamp'] - self.first_timestamp) / self.speed
+            if due > now:
+                time.sleep(due - now)
+            elif now - due > 1 / self.recorded_fps:
+                self.num_late += 1
+
+        self.num_frames += 1
+        return {'index': int(timing['index']), 'timestamp': float(timing['camera_timestamp']), 'image': image}
+
+    # camera_tools interface, the recording can't be changed -------------------
+
+    def set_exposure(self, exp_time: float) -> None:
+        pass
+
+    def get_exposure(self) -> float:
+        return 0
+
+    def get_exposure_range(self) -> Tuple[float, float]:
+        return (0, 0)
+
+    def get_exposure_increment(self) -> float:
+        return 0
+
+    def exposure_available(self) -> bool:
+        return False
+
+    def set_framerate(self, fps: float) -> None:
+        pass
+
+    def get_framerate(self) -> float:
+        return self.recorded_fps
+
+    def get_framerate_range(self) -> Tuple[float, float]:
+        return (self.recorded_fps, self.recorded_fps)
+
+    def get_framerate_increment(self) -> float:
+        return 0
+
+    def framerate_available(self) -> bool:
+        return True
+
+    def set_gain(self, gain: float) -> None:
+        pass
+
+    def get_gain(self) -> float:
+        return 0
+
+    def get_gain_range(self) -> Tuple[float, float]:
+        return (0, 0)
+
+    def get_gain_increment(self) -> float:
+        return 0
+
+    def gain_available(self) -> bool:
+        return False
+
+    def set_width(self, width: int) -> None:
+        pass
+
+    def get_width(self) -> int:
+        return self.width
+
+    def get_width_range(self) -> Tuple[int, int]:
+        return (self.width, self.width)
+
+    def get_width_increment(self) -> int:
+        return 0
+
+    def width_available(self) -> bool:
+        return True
+
+    def set_height(self, height: int) -> None:
+        pass
+
+    def get_height(self) -> int:
+        return self.height
+
+    def get_height_range(self) -> Tuple[int, int]:
+        return (self.height, self.height)
+
+    def get_height_increment(self) -> int:
+        return 0
+
+    def height_available(self) -> bool:
+        return True
+
+    def set_offsetX(self, offsetX: int) -> None:
+        pass
+
+    def get_offsetX(self) -> int:
+        return 0
+
+    def get_offsetX_range(self) -> Tuple[int, int]:
+        return (0, 0)
+
+    def get_offsetX_increment(self) -> int:
+        return 0
+
+    def offsetX_available(self) -> bool:
+        return False
+
+    def set_offsetY(self, offsetY: int) -> None:
+        pass
+
+    def get_offsetY(self) -> int:
+        return 0
+
+    def get_offsetY_range(self) -> Tuple[int, int]:
+        return (0, 0)
+
+    def get_offsetY_increment(self) -> int:
+        return 0
+
+    def offsetY_available(self) -> bool:
+        return False
+
+    def get_num_channels(self) -> int:
+        return self.num_channels
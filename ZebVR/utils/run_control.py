@@ -0,0 +1,161 @@
+'''
+Consecutive runs on a persistent DAG.
+
+When workers are kept between runs (see ZebVR.dags.WorkerPool), the main
+process starts and stops runs by sending run control messages to the run
+control worker, which forwards them on the metadata channel of the workers
+that keep per-run state: savers close their files at the end of a run and
+open new ones, with the new run settings, at the start of the next. Only
+RUN_SETTINGS may change between runs, any other change requires new
+workers.
+
+Run boundaries (run index, get_time_ns timestamps of start and stop, run
+settings) are saved to <prefix>_runs_<timestamp>.json, so that outputs
+which are not split per run can be cut at run boundaries.
+'''
+
+import copy
+import json
+import pprint
+from multiprocessing import Queue
+from typing import Any, Dict, List, Optional, Tuple
+from .append_timestamp_to_filename import append_timestamp_to_filename
+from .timing import get_time_ns
+
+RUN_CONTROL = 'run_control'
+START_RUN = 'start run'
+STOP_RUN = 'stop run'
+
+# settings sent to the workers with each run, as paths in the settings.
+# Not the prefix: files named after it when the DAG is built (queue metrics,
+# latency traces, CPU layout, profiles) are kept between runs, a new prefix
+# needs new workers.
+RUN_SETTINGS: Tuple[Tuple[str, ...], ...] = (
+    ('main', 'recording_duration'),
+    ('sequencer',),
+    ('settings', 'experiment_data'),
+    ('settings', 'tracking', 'csv_filename'),
+    ('settings', 'stim_output', 'filename'),
+    ('settings', 'videorecording', 'video_filename'),
+    ('temperature', 'csv_filename'),
+    ('sensors', 'filename'),
+    ('logs', 'profiler', 'enabled'), # toggled on running workers
+)
+
+def run_settings(settings: Dict) -> Dict:
+    '''the RUN_SETTINGS part of settings, nested as in settings'''
+
+    res = {}
+    for path in RUN_SETTINGS:
+        source, target = settings, res
+        for key in path[:-1]:
+            if key not in source:
+                break
+            source = source[key]
+            target = target.setdefault(key, {})
+        else:
+            if path[-1] in source:
+                target[path[-1]] = source[path[-1]]
+    return res
+
+def pool_key(settings: Dict) -> str:
+    '''settings which shape the workers and queues: equal keys can share workers'''
+
+    settings = copy.copy(settings)
+    for path in RUN_SETTINGS:
+        parent = settings
+        for key in path[:-1]:
+            if key not in parent:
+                break
+            parent[key] = copy.copy(parent[key])
+            parent = parent[key]
+        else:
+            parent.pop(path[-1], None)
+    return pprint.pformat(settings)
+
+def run_control_input(stage: str) -> str:
+    '''name of the run control metadata input of stage'''
+    return f'{RUN_CONTROL}_{stage}'
+
+def run_control_message(metadata: Any) -> Optional[Dict]:
+    '''
+    Run control message received by a worker, None if there is none.
+    metadata is either the dict of metadata inputs or, when polling,
+    a single message.
+    '''
+
+    if not isinstance(metadata, dict):
+        return None
+    if RUN_CONTROL in metadata:
+        return metadata
+    for name, message in metadata.items():
+        if name.startswith(RUN_CONTROL) and message is not None:
+            return message
+    return None
+
+class RunControl:
+    '''created with the DAG, commands from the main process to the run control worker'''
+
+    def __init__(self) -> None:
+        self.commands = Queue()
+        self.run = 0
+        self.log_filename = None
+        self.runs: List[Dict] = []
+
+    def open_log(self, settings: Dict) -> None:
+        '''start logging run boundaries, the first run starts with the DAG'''
+        self.log_filename = append_timestamp_to_filename(f"{settings['settings']['prefix']}_runs.json")
+        self.log_run(settings)
+
+    def log_run(self, settings: Dict) -> None:
+        self.runs.append({
+            'run': self.run,
+            'start_ns': get_time_ns(),
+            'stop_ns': None,
+            'settings': run_settings(settings)
+        })
+        self.save_log()
+
+    def save_log(self) -> None:
+        if self.log_filename is None:
+            return
+        with open(self.log_filename, 'w') as fd:
+            json.dump({'runs': self.runs}, fd, indent=2, default=str)
+
+    def start_run(self, settings: Dict) -> int:
+        '''new run with the run settings of settings, returns the run index'''
+        self.run += 1
+        self.commands.put({
+            RUN_CONTROL: START_RUN,
+            'run': self.run,
+            'timestamp': get_time_ns(),
+            'settings': run_settings(settings)
+        })
+        self.log_run(settings)
+        return self.run
+
+    def stop_run(self) -> None:
+        timestamp = get_time_ns()
+        self.commands.put({RUN_CONTROL: STOP_RUN, 'run': self.run, 'timestamp': timestamp})
+        self.log_stop(timestamp)
+
+    def log_stop(self, timestamp: Optional[int] = None) -> None:
+        '''end of the current run, when it is stopped or the DAG stops'''
+        if self.runs and self.runs[-1]['stop_ns'] is None:
+            self.runs[-1]['stop_ns'] = get_time_ns() if timestamp is None else timestamp
+            self.save_log()
+
+# created when building the DAG, in the main process
+_run_control: Optional[RunControl] = None
+
+def new_run_control() -> RunControl:
+    global _run_control
+    _run_control = RunControl()
+    return _run_control
+
+def current_run_control() -> Optional[RunControl]:
+    return _run_control
+
+def clear_run_control() -> None:
+    global _run_control
+    _run_control = None
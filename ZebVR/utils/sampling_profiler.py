@@ -0,0 +1,224 @@
+'''
+Sampling profiler for running DAGs.
+
+A session is created in the main process with the DAG: workers receive it
+before they start and run a sampler thread (start_sampling_profiler in
+initialize). While sampling is enabled (it can be toggled at any time from
+the GUI, through shared memory), the sampler records the stack of every
+thread of its process rate_hz times per second, from sys._current_frames.
+Each sample costs a few microseconds, there is no tracing of calls.
+
+Stacks are counted in the folded format (root;...;leaf count) and written
+to <prefix>_profile_<timestamp>_<worker>_<pid>.folded every few seconds and
+when the worker stops. merge() combines the files of a session into one
+flame graph file, with the worker name as root frame, readable by
+flamegraph.pl, speedscope or inferno. Blocked threads are sampled too:
+waits on queues show up as such.
+
+Whether sampling is enabled or not, the sampler thread also publishes the
+CPU time of its process, read with cpu_seconds() (e.g. per-worker CPU
+usage in benchmarks).
+'''
+
+import ctypes
+import os
+import sys
+import threading
+import time
+from multiprocessing import RawArray, RawValue
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+from .append_timestamp_to_filename import append_timestamp_to_filename
+
+FLUSH_INTERVAL_SEC = 5.0
+
+class SamplingProfiler:
+    '''session shared by the main process and the workers'''
+
+    def __init__(
+            self, 
+            prefix: str, 
+            rate_hz: float = 99, 
+            enabled: bool = False, 
+            worker_names: Sequence[str] = ()
+        ) -> None:
+        # 99 Hz rather than 100 Hz, not to sample in lockstep with periodic work
+        self.prefix = prefix
+        self.rate_hz = rate_hz
+        self.enabled = RawValue(ctypes.c_bool, enabled)
+        # CPU time of each worker process, in seconds
+        self.worker_names = list(worker_names)
+        self.cpu_sec = RawArray('d', max(1, len(self.worker_names)))
+
+    def set_enabled(self, enabled: bool) -> None:
+        self.enabled.value = enabled
+
+    def is_enabled(self) -> bool:
+        return self.enabled.value
+
+    def cpu_seconds(self) -> Dict[str, float]:
+        '''CPU time of each worker process so far, as last published by its sampler'''
+        return {name: self.cpu_sec[i] for i, name in enumerate(self.worker_names)}
+
+    def worker_filename(self, worker_name: str) -> Path:
+        return Path(f'{self.prefix}_{worker_name}_{os.getpid()}.folded')
+
+    def worker_files(self) -> List[Path]:
+        prefix = Path(self.prefix)
+        return sorted(prefix.parent.glob(f'{prefix.name}_*.folded'))
+
+    def merge(self, filename: Optional[str] = None) -> Optional[Path]:
+        '''one flame graph file for the session, <prefix>.folded unless given. None if nothing was sampled'''
+
+        stacks = {}
+        for worker_file in self.worker_files():
+            # <prefix>_<worker>_<pid>.folded
+            worker_name = worker_file.stem[len(Path(self.prefix).name)+1:].rsplit('_', 1)[0]
+            for stack, count in read_folded(worker_file).items():
+                stacks[f'{worker_name};{stack}'] = stacks.get(f'{worker_name};{stack}', 0) + count
+
+        if not stacks:
+            return None
+
+        filename = Path(f'{self.prefix}.folded' if filename is None else filename)
+        write_folded(filename, stacks)
+        print(profile_summary(stacks))
+        print(f'flame graph data saved to {filename}')
+        return filename
+
+class StackSampler(threading.Thread):
+    '''samples the stacks of the other threads of the process'''
+
+    def __init__(self, profiler: SamplingProfiler, worker_name: str) -> None:
+        super().__init__(name='sampling_profiler', daemon=True)
+        self.profiler = profiler
+        self.filename = profiler.worker_filename(worker_name)
+        names = profiler.worker_names
+        self.cpu_index = names.index(worker_name) if worker_name in names else None
+        self.counts: Dict[str, int] = {}
+        self.labels: Dict[object, str] = {} # by code object
+        self.num_flushed = 0
+        self.stop_event = threading.Event()
+
+    def run(self) -> None:
+        interval = 1 / self.profiler.rate_hz
+        next_flush = time.monotonic() + FLUSH_INTERVAL_SEC
+        while not self.stop_event.wait(interval):
+            self.publish_cpu_time()
+            if self.profiler.enabled.value:
+                self.sample()
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush += FLUSH_INTERVAL_SEC
+
+    def publish_cpu_time(self) -> None:
+        if self.cpu_index is not None:
+            self.profiler.cpu_sec[self.cpu_index] = time.process_time()
+
+    def label(self, code) -> str:
+        try:
+            return self.labels[code]
+        except KeyError:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = f'{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+            # ';' separates frames in the folded format
+            self.labels[code] = label.replace(';', ':')
+            return self.labels[code]
+
+    def sample(self) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread {ident}'))
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def flush(self) -> None:
+        num_samples = sum(self.counts.values())
+        if num_samples == self.num_flushed:
+            return
+        write_folded(self.filename, self.counts)
+        self.num_flushed = num_samples
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.publish_cpu_time()
+        self.flush()
+
+def start_sampling_profiler(worker) -> Optional[StackSampler]:
+    '''called by workers when they start, in their own process'''
+
+    profiler = getattr(worker, 'sampling_profiler', None)
+    if profiler is None:
+        return None
+
+    sampler = StackSampler(profiler, getattr(worker, 'name', type(worker).__name__))
+    sampler.start()
+    # worker processes exit through multiprocessing, which runs finalizers
+    Finalize(None, sampler.stop, exitpriority=10)
+    return sampler
+
+def read_folded(filename: Path) -> Dict[str, int]:
+    stacks = {}
+    with open(filename) as fd:
+        for line in fd:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+def write_folded(filename: Path, stacks: Dict[str, int]) -> None:
+    '''atomically, the file may be merged while a worker writes it'''
+    tmp = Path(f'{filename}.tmp')
+    with open(tmp, 'w') as fd:
+        for stack, count in stacks.items():
+            fd.write(f'{stack} {count}\n')
+    os.replace(tmp, filename)
+
+def profile_summary(stacks: Dict[str, int], num_functions: int = 5) -> str:
+    '''samples per worker and the functions they were in most (leaf frames)'''
+
+    workers = {}
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        leaves = workers.setdefault(frames[0], {})
+        leaves[frames[-1]] = leaves.get(frames[-1], 0) + count
+
+    lines = ['sampling profile:']
+    for worker, leaves in workers.items():
+        total = sum(leaves.values())
+        lines.append(f'    {worker}: {total} samples')
+        for leaf, count in sorted(leaves.items(), key=lambda x: -x[1])[:num_functions]:
+            lines.append(f'        {100*count/total:5.1f}%  {leaf}')
+    return '\n'.join(lines)
+
+_session: Optional[SamplingProfiler] = None
+
+def profile_workers(workers: Sequence, settings: Dict, prefix: str) -> SamplingProfiler:
+    '''
+    New profiling session for workers, settings as in settings['logs']['profiler'].
+    Workers sample when they start if enabled, and can be toggled afterwards
+    with current_profiling_session().set_enabled.
+    '''
+
+    global _session
+    _session = SamplingProfiler(
+        prefix = str(append_timestamp_to_filename(f'{prefix}_profile')),
+        rate_hz = settings['rate_hz'],
+        enabled = settings['enabled'],
+        worker_names = [getattr(worker, 'name', type(worker).__name__) for worker in workers]
+    )
+    for worker in workers:
+        worker.sampling_profiler = _session
+    return _session
+
+def current_profiling_session() -> Optional[SamplingProfiler]:
+    return _session
@@ -0,0 +1,96 @@
+'''
+Time to first frame, tracking and stimulus, in shared memory so that
+workers can mark their milestones. Launch milestones are marked once by
+the main process, run milestones again for each DAG run (new_run).
+'''
+
+from multiprocessing import RawArray
+from typing import Dict, Optional, Sequence
+from .timing import get_time_ns
+
+LAUNCH = 'launch' # process start, see ZebVR.LAUNCH_NS
+IMPORTS = 'imports'
+GUI_READY = 'gui ready'
+RUN_START = 'run start'
+DAG_BUILT = 'dag built'
+SPAWNED = 'workers spawned'
+FIRST_FRAME = 'first frame'
+FIRST_TRACKING = 'first tracking'
+STIM_READY = 'stim ready'
+FIRST_STIM = 'first stim'
+RECORDING = 'recording' # outputs opened, also for runs on persistent workers
+
+LAUNCH_MILESTONES = (LAUNCH, IMPORTS, GUI_READY)
+RUN_MILESTONES = (RUN_START, DAG_BUILT, SPAWNED, FIRST_FRAME, FIRST_TRACKING, STIM_READY, FIRST_STIM, RECORDING)
+MILESTONES = LAUNCH_MILESTONES + RUN_MILESTONES
+
+class StartupTimeline:
+
+    def __init__(self) -> None:
+        self.timestamps = RawArray('q', len(MILESTONES)) # 0: not reached
+
+    def mark(self, milestone: str, timestamp: Optional[int] = None) -> None:
+        self.timestamps[MILESTONES.index(milestone)] = get_time_ns() if timestamp is None else timestamp
+
+    def mark_once(self, milestone: str) -> None:
+        index = MILESTONES.index(milestone)
+        if self.timestamps[index] == 0:
+            self.timestamps[index] = get_time_ns()
+
+    def new_run(self) -> None:
+        for milestone in RUN_MILESTONES:
+            self.timestamps[MILESTONES.index(milestone)] = 0
+        self.mark(RUN_START)
+
+    def reached(self, milestone: str) -> bool:
+        return self.timestamps[MILESTONES.index(milestone)] != 0
+
+    def timestamp(self, milestone: str) -> int:
+        '''get_time_ns when the milestone was reached, 0 if not reached'''
+        return self.timestamps[MILESTONES.index(milestone)]
+
+    def since(self, milestone: str) -> float:
+        '''seconds since milestone'''
+        return 1e-9 * (get_time_ns() - self.timestamps[MILESTONES.index(milestone)])
+
+    def summary(self, milestones: Sequence[str] = MILESTONES) -> Dict[str, float]:
+        '''ms since the first milestone of the sequence, reached milestones only'''
+        timestamps = {m: self.timestamps[MILESTONES.index(m)] for m in milestones if self.reached(m)}
+        if not timestamps:
+            return {}
+        origin = timestamps[milestones[0]] if milestones[0] in timestamps else min(timestamps.values())
+        return {m: 1e-6 * (t - origin) for m, t in timestamps.items()}
+
+    def report(self, milestones: Sequence[str] = MILESTONES) -> str:
+        summary = self.summary(milestones)
+        steps = []
+        previous = 0.0
+        for milestone, ms in sorted(summary.items(), key=lambda x: x[1]):
+            steps.append(f'{milestone} {ms:.0f} ms (+{ms - previous:.0f})')
+            previous = ms
+        return 'startup timeline: ' + ', '.join(steps)
+
+_timeline: Optional[StartupTimeline] = None
+
+def startup_timeline() -> StartupTimeline:
+    '''the timeline of the main process, created on first use'''
+    global _timeline
+    if _timeline is None:
+        from .. import LAUNCH_NS
+        _timeline = StartupTimeline()
+        _timeline.mark(LAUNCH, LAUNCH_NS)
+    return _timeline
+
+def time_startup(workers: Sequence) -> StartupTimeline:
+    '''give workers the timeline, so they can mark their first frame, tracking or stimulus'''
+    timeline = startup_timeline()
+    timeline.mark(DAG_BUILT)
+    for worker in workers:
+        worker.startup_timeline = timeline
+    return timeline
+
+def mark_startup(worker, milestone: str) -> None:
+    '''called by workers, the first time only'''
+    timeline = getattr(worker, 'startup_timeline', None)
+    if timeline is not None and not timeline.reached(milestone):
+        timeline.mark_once(milestone)
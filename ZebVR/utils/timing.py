@@ -1,6 +1,9 @@
 import time
 import platform
 
+# checked once, get_time_ns is called several times per message
+IS_WINDOWS = platform.system() == "Windows"
+
 def get_time_ns() -> int:
     """
     Return a high-resolution, system-wide, monotonic timestamp in nanoseconds.
@@ -8,9 +11,7 @@ def get_time_ns() -> int:
     Elsewhere (or Python ≥ 3.10), use perf_counter_ns() for best resolution.
     """
 
-    is_windows = platform.system() == "Windows"
-
-    if is_windows:
+    if IS_WINDOWS:
         return time.monotonic_ns()
     
     return time.perf_counter_ns()
@@ -8,12 +8,16 @@ from .background_widget import *
 from .logs_widget import *
 from .identity_widget import *
 from .temperature_widget import *
+from .sensor_widget import *
 
 from .experiment_data_widget import *
 from .stim_output_widget import *
 from .tracking_widget import *
 from .video_recording_widget import *
 from .log_output_widget import *
+from .cpu_placement_widget import *
+from .queue_sizing_widget import *
+from .profiler_widget import *
 from .settings_widget import *
 from .daq_widget import *
 from .protocol_widget import *
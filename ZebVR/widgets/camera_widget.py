@@ -45,6 +45,7 @@ from camera_tools import (
     MovieFileCamGray,
     ZeroCam
 )
+from ..utils import ReplayCamera
 try:
     from camera_tools import XimeaCamera_Transport
     XIMEA_ENABLED = True
@@ -66,9 +67,11 @@ class CameraModel(IntEnum):
     SPINNAKER = 6
     MOVIE = 7
     MOVIE_GRAY = 8
+    REPLAY = 9
 
 WEBCAMS = [CameraModel.WEBCAM, CameraModel.WEBCAM_GRAY, CameraModel.WEBCAM_REGISTRATION]
 MOVIES = [CameraModel.MOVIE, CameraModel.MOVIE_GRAY]
+FILE_SOURCES = MOVIES + [CameraModel.REPLAY]
 
 class CameraWidget(QWidget):
 
@@ -127,6 +130,15 @@ class CameraWidget(QWidget):
     
         self.filename = QLabel('')
 
+        # recordings are replayed with their timing, speed 0: as fast as possible
+        self.replay_speed = LabeledDoubleSpinBox()
+        self.replay_speed.setText('Replay speed:')
+        self.replay_speed.setRange(0, 100)
+        self.replay_speed.setSingleStep(0.5)
+        self.replay_speed.setValue(1.0)
+        self.replay_speed.setVisible(False)
+        self.replay_speed.valueChanged.connect(self.on_source_change)
+
         # controls 
         for control in self.controls:
             if control in ['framerate','gain', 'exposure']:
@@ -321,6 +333,7 @@ class CameraWidget(QWidget):
         layout_cam = QVBoxLayout()
         layout_cam.addWidget(self.camera_id)
         layout_cam.addLayout(layout_moviecam)
+        layout_cam.addWidget(self.replay_speed)
 
         layout_channels = QHBoxLayout()
         layout_channels.addWidget(self.num_channels_label)
@@ -355,7 +368,9 @@ class CameraWidget(QWidget):
         id = self.camera_id.value() 
         filename = self.filename.text()
 
-        if model in MOVIES:
+        self.replay_speed.setVisible(model == CameraModel.REPLAY)
+
+        if model in FILE_SOURCES:
             self.camera_id.setEnabled(False)
             self.movie_load.setEnabled(True)
         else:
@@ -389,6 +404,7 @@ class CameraWidget(QWidget):
         state['camera_model'] = self.camera_model.currentIndex()
         state['camera_index'] = self.camera_id.value()
         state['movie_file'] = self.filename.text()
+        state['replay_speed'] = self.replay_speed.value()
         for control in self.controls:
             spinbox = getattr(self, control + '_spinbox')
             state[control + '_enabled'] = spinbox.isEnabled()
@@ -406,6 +422,7 @@ class CameraWidget(QWidget):
         setters = {
             'camera_index': self.camera_id.setValue,
             'movie_file': lambda x: self.filename.setText(str(x)),
+            'replay_speed': self.replay_speed.setValue,
             'camera_model': self.camera_model.setCurrentIndex,
             'num_channels': lambda x: self.num_channels.setText(str(x)),
         }
@@ -631,7 +648,7 @@ class CameraHandler(QObject):
 
         try:                
             frame = self.camera.get_frame()
-            if frame['image'] is not None:
+            if frame is not None and frame['image'] is not None:
                 self.view.set_image(frame['image'])
         except Exception as e:
             print(f'Caught exception: {e}')               
@@ -712,6 +729,13 @@ class CameraController(QObject):
             
             self.camera_constructor = partial(MovieFileCamGray, filename=str(filename))
 
+        elif camera_model==CameraModel.REPLAY:
+            if not filename.exists():
+                return
+            
+            # a video, segmented recording manifest, or a file of a chunked image store
+            self.camera_constructor = partial(ReplayCamera, filename=str(filename), speed=self.view.replay_speed.value())
+
         elif camera_model==CameraModel.XIMEA and XIMEA_ENABLED:
             self.camera_constructor = partial(XimeaCamera_Transport, dev_id=camera_index)
 
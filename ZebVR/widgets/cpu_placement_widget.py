@@ -0,0 +1,125 @@
+from PyQt5.QtWidgets import (
+    QWidget, 
+    QVBoxLayout,
+    QGroupBox,
+    QCheckBox,
+)
+from PyQt5.QtCore import pyqtSignal
+from typing import Dict
+
+from qt_widgets import LabeledEditLine, LabeledSpinBox
+
+class CPUPlacementWidget(QWidget):
+
+    state_changed = pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        
+        self.declare_components()
+        self.layout_components()
+
+    def declare_components(self) -> None:
+        
+        self.cpu_group = QGroupBox('CPU placement')
+
+        self.enabled = QCheckBox('Pin workers to cores')
+        self.enabled.setChecked(False)
+        self.enabled.stateChanged.connect(self.state_changed)
+
+        self.isolated_cpus = LabeledEditLine()
+        self.isolated_cpus.setLabel('dedicated cores, e.g. 2-7 (empty: isolcpus or automatic):')
+        self.isolated_cpus.setText('')
+        self.isolated_cpus.textChanged.connect(self.state_changed)
+
+        self.num_housekeeping_cpus = LabeledSpinBox()
+        self.num_housekeeping_cpus.setText('housekeeping cores (automatic):')
+        self.num_housekeeping_cpus.setRange(1, 256)
+        self.num_housekeeping_cpus.setValue(2)
+        self.num_housekeeping_cpus.valueChanged.connect(self.state_changed)
+
+        self.realtime = QCheckBox('Real-time scheduling (root or CAP_SYS_NICE)')
+        self.realtime.setChecked(False)
+        self.realtime.stateChanged.connect(self.state_changed)
+
+        self.realtime_priority = LabeledSpinBox()
+        self.realtime_priority.setText('real-time priority:')
+        self.realtime_priority.setRange(1, 99)
+        self.realtime_priority.setValue(50)
+        self.realtime_priority.valueChanged.connect(self.state_changed)
+
+        self.dedicated_nice = LabeledSpinBox()
+        self.dedicated_nice.setText('camera, stimulus, tracking niceness (without real-time):')
+        self.dedicated_nice.setRange(-20, 0)
+        self.dedicated_nice.setValue(-10)
+        self.dedicated_nice.valueChanged.connect(self.state_changed)
+
+        self.encoder_nice = LabeledSpinBox()
+        self.encoder_nice.setText('encoders niceness:')
+        self.encoder_nice.setRange(0, 19)
+        self.encoder_nice.setValue(5)
+        self.encoder_nice.valueChanged.connect(self.state_changed)
+
+    def layout_components(self) -> None:
+
+        cpu_layout = QVBoxLayout()
+        cpu_layout.addWidget(self.enabled)
+        cpu_layout.addWidget(self.isolated_cpus)
+        cpu_layout.addWidget(self.num_housekeeping_cpus)
+        cpu_layout.addWidget(self.realtime)
+        cpu_layout.addWidget(self.realtime_priority)
+        cpu_layout.addWidget(self.dedicated_nice)
+        cpu_layout.addWidget(self.encoder_nice)
+        self.cpu_group.setLayout(cpu_layout)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.addWidget(self.cpu_group)
+
+    def get_state(self) -> Dict:
+        state = {}
+        state['enabled'] = self.enabled.isChecked()
+        state['isolated_cpus'] = self.isolated_cpus.text()
+        state['num_housekeeping_cpus'] = self.num_housekeeping_cpus.value()
+        state['realtime'] = self.realtime.isChecked()
+        state['realtime_priority'] = self.realtime_priority.value()
+        state['dedicated_nice'] = self.dedicated_nice.value()
+        state['encoder_nice'] = self.encoder_nice.value()
+        return state
+    
+    def set_state(self, state: Dict) -> None:
+
+        setters = {
+            'enabled': self.enabled.setChecked,
+            'isolated_cpus': self.isolated_cpus.setText,
+            'num_housekeeping_cpus': self.num_housekeeping_cpus.setValue,
+            'realtime': self.realtime.setChecked,
+            'realtime_priority': self.realtime_priority.setValue,
+            'dedicated_nice': self.dedicated_nice.setValue,
+            'encoder_nice': self.encoder_nice.setValue,
+        }
+
+        for key, setter in setters.items():
+            if key in state:
+                setter(state[key])
+
+if __name__ == "__main__":
+
+    from PyQt5.QtWidgets import QApplication, QMainWindow
+
+    class Window(QMainWindow):
+
+        def __init__(self,*args,**kwargs):
+
+            super().__init__(*args, **kwargs)
+            self.cpu_widget = CPUPlacementWidget()
+            self.setCentralWidget(self.cpu_widget)
+            self.cpu_widget.state_changed.connect(self.state_changed)
+
+        def state_changed(self):
+            print(self.cpu_widget.get_state())
+    
+    app = QApplication([])
+    window = Window()
+    window.show()
+    app.exec()
@@ -6,7 +6,7 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import pyqtSignal
 from typing import Dict
 
-from qt_widgets import LabeledEditLine
+from qt_widgets import LabeledEditLine, LabeledSpinBox, LabeledDoubleSpinBox
 
 class LogOutputWidget(QWidget):
 
@@ -34,11 +34,45 @@ class LogOutputWidget(QWidget):
         self.queue_logfile.setText('queues.log')
         self.queue_logfile.textChanged.connect(self.state_changed)
 
+        self.queue_metrics_file = LabeledEditLine()
+        self.queue_metrics_file.setLabel('queue metrics file:')
+        self.queue_metrics_file.setText('queue_metrics.bin')
+        self.queue_metrics_file.textChanged.connect(self.state_changed)
+
+        self.queue_metrics_rate_hz = LabeledSpinBox()
+        self.queue_metrics_rate_hz.setText('queue sampling rate (Hz):')
+        self.queue_metrics_rate_hz.setRange(1, 2000)
+        self.queue_metrics_rate_hz.setValue(200)
+        self.queue_metrics_rate_hz.valueChanged.connect(self.state_changed)
+
+        self.prometheus_port = LabeledSpinBox()
+        self.prometheus_port.setText('prometheus port (0: off):')
+        self.prometheus_port.setRange(0, 65535)
+        self.prometheus_port.setValue(0)
+        self.prometheus_port.valueChanged.connect(self.state_changed)
+
+        self.checkpoint_interval_sec = LabeledDoubleSpinBox()
+        self.checkpoint_interval_sec.setText('sync recordings to disk every (s, 0: off):')
+        self.checkpoint_interval_sec.setRange(0, 3600)
+        self.checkpoint_interval_sec.setSingleStep(1)
+        self.checkpoint_interval_sec.setValue(10)
+        self.checkpoint_interval_sec.valueChanged.connect(self.state_changed)
+
+        self.latency_trace_file = LabeledEditLine()
+        self.latency_trace_file.setLabel('latency trace file (empty: off):')
+        self.latency_trace_file.setText('')
+        self.latency_trace_file.textChanged.connect(self.state_changed)
+
     def layout_components(self) -> None:
 
         log_layout = QVBoxLayout()
         log_layout.addWidget(self.worker_logfile)
         log_layout.addWidget(self.queue_logfile)
+        log_layout.addWidget(self.queue_metrics_file)
+        log_layout.addWidget(self.queue_metrics_rate_hz)
+        log_layout.addWidget(self.prometheus_port)
+        log_layout.addWidget(self.checkpoint_interval_sec)
+        log_layout.addWidget(self.latency_trace_file)
         self.log_group.setLayout(log_layout)
 
         main_layout = QVBoxLayout(self)
@@ -48,13 +82,23 @@ class LogOutputWidget(QWidget):
         state = {}
         state['worker_logfile'] = self.worker_logfile.text()
         state['queue_logfile'] = self.queue_logfile.text()
+        state['queue_metrics_file'] = self.queue_metrics_file.text()
+        state['queue_metrics_rate_hz'] = self.queue_metrics_rate_hz.value()
+        state['prometheus_port'] = self.prometheus_port.value()
+        state['checkpoint_interval_sec'] = self.checkpoint_interval_sec.value()
+        state['latency_trace_file'] = self.latency_trace_file.text()
         return state
     
     def set_state(self, state: Dict) -> None:
 
         setters = {
             'worker_logfile': self.worker_logfile.setText,
-            'queue_logfile': self.queue_logfile.setText
+            'queue_logfile': self.queue_logfile.setText,
+            'queue_metrics_file': self.queue_metrics_file.setText,
+            'queue_metrics_rate_hz': self.queue_metrics_rate_hz.setValue,
+            'prometheus_port': self.prometheus_port.setValue,
+            'checkpoint_interval_sec': self.checkpoint_interval_sec.setValue,
+            'latency_trace_file': self.latency_trace_file.setText,
         }
 
         for key, setter in setters.items():
@@ -5,6 +5,9 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import pyqtSignal
 from typing import Dict
 from .log_output_widget import LogOutputWidget
+from .cpu_placement_widget import CPUPlacementWidget
+from .queue_sizing_widget import QueueSizingWidget
+from .profiler_widget import ProfilerWidget
 
 # TODO add loglevel to choose for each log
 # TODO right now this is a useless extra level compared to LogOutputWidget alone
@@ -23,23 +26,41 @@ class LogsWidget(QWidget):
 
         self.log_widget = LogOutputWidget()
         self.log_widget.state_changed.connect(self.state_changed)
+
+        self.cpu_widget = CPUPlacementWidget()
+        self.cpu_widget.state_changed.connect(self.state_changed)
+
+        self.queue_widget = QueueSizingWidget()
+        self.queue_widget.state_changed.connect(self.state_changed)
+
+        self.profiler_widget = ProfilerWidget()
+        self.profiler_widget.state_changed.connect(self.state_changed)
         
     def layout_components(self) -> None:
         
         layout = QVBoxLayout(self)
         layout.addWidget(self.log_widget)
+        layout.addWidget(self.cpu_widget)
+        layout.addWidget(self.queue_widget)
+        layout.addWidget(self.profiler_widget)
         layout.addStretch()
 
     def get_state(self) -> Dict:
 
         state = {}
         state['log'] = self.log_widget.get_state()
+        state['cpu'] = self.cpu_widget.get_state()
+        state['queues'] = self.queue_widget.get_state()
+        state['profiler'] = self.profiler_widget.get_state()
         return state
     
     def set_state(self, state: Dict) -> None:
 
         setters = {
             'log': self.log_widget.set_state,
+            'cpu': self.cpu_widget.set_state,
+            'queues': self.queue_widget.set_state,
+            'profiler': self.profiler_widget.set_state,
         }
 
         for key, setter in setters.items():
@@ -0,0 +1,84 @@
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QGroupBox,
+    QCheckBox,
+)
+from PyQt5.QtCore import pyqtSignal
+from typing import Dict
+
+from qt_widgets import LabeledSpinBox
+
+class ProfilerWidget(QWidget):
+
+    state_changed = pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.declare_components()
+        self.layout_components()
+
+    def declare_components(self) -> None:
+
+        self.profiler_group = QGroupBox('Sampling profiler')
+
+        # can be toggled while the DAG is running
+        self.enabled = QCheckBox('Sample worker stacks')
+        self.enabled.setChecked(False)
+        self.enabled.stateChanged.connect(self.state_changed)
+
+        self.rate_hz = LabeledSpinBox()
+        self.rate_hz.setText('sampling rate (Hz, on start):')
+        self.rate_hz.setRange(1, 1000)
+        self.rate_hz.setValue(99)
+        self.rate_hz.valueChanged.connect(self.state_changed)
+
+    def layout_components(self) -> None:
+
+        profiler_layout = QVBoxLayout()
+        profiler_layout.addWidget(self.enabled)
+        profiler_layout.addWidget(self.rate_hz)
+        self.profiler_group.setLayout(profiler_layout)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.addWidget(self.profiler_group)
+
+    def get_state(self) -> Dict:
+        state = {}
+        state['enabled'] = self.enabled.isChecked()
+        state['rate_hz'] = self.rate_hz.value()
+        return state
+
+    def set_state(self, state: Dict) -> None:
+
+        setters = {
+            'enabled': self.enabled.setChecked,
+            'rate_hz': self.rate_hz.setValue,
+        }
+
+        for key, setter in setters.items():
+            if key in state:
+                setter(state[key])
+
+if __name__ == "__main__":
+
+    from PyQt5.QtWidgets import QApplication, QMainWindow
+
+    class Window(QMainWindow):
+
+        def __init__(self,*args,**kwargs):
+
+            super().__init__(*args, **kwargs)
+            self.profiler_widget = ProfilerWidget()
+            self.setCentralWidget(self.profiler_widget)
+            self.profiler_widget.state_changed.connect(self.state_changed)
+
+        def state_changed(self):
+            print(self.profiler_widget.get_state())
+
+    app = QApplication([])
+    window = Window()
+    window.show()
+    app.exec()
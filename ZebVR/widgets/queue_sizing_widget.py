@@ -0,0 +1,106 @@
+from PyQt5.QtWidgets import (
+    QWidget,
+    QVBoxLayout,
+    QGroupBox,
+)
+from PyQt5.QtCore import pyqtSignal
+from typing import Dict
+
+from qt_widgets import LabeledDoubleSpinBox, LabeledSpinBox
+
+class QueueSizingWidget(QWidget):
+
+    state_changed = pyqtSignal()
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+
+        self.declare_components()
+        self.layout_components()
+
+    def declare_components(self) -> None:
+
+        self.queue_group = QGroupBox('Queue sizing')
+
+        self.buffer_sec = LabeledDoubleSpinBox()
+        self.buffer_sec.setText('buffering (s):')
+        self.buffer_sec.setRange(0.1, 60)
+        self.buffer_sec.setSingleStep(0.5)
+        self.buffer_sec.setValue(2.0)
+        self.buffer_sec.valueChanged.connect(self.state_changed)
+
+        self.recording_buffer_sec = LabeledDoubleSpinBox()
+        self.recording_buffer_sec.setText('video recording buffering (s):')
+        self.recording_buffer_sec.setRange(0.1, 60)
+        self.recording_buffer_sec.setSingleStep(0.5)
+        self.recording_buffer_sec.setValue(5.0)
+        self.recording_buffer_sec.valueChanged.connect(self.state_changed)
+
+        self.preview_buffer_sec = LabeledDoubleSpinBox()
+        self.preview_buffer_sec.setText('preview buffering (s):')
+        self.preview_buffer_sec.setRange(0.1, 60)
+        self.preview_buffer_sec.setSingleStep(0.5)
+        self.preview_buffer_sec.setValue(1.0)
+        self.preview_buffer_sec.valueChanged.connect(self.state_changed)
+
+        self.memory_budget_mb = LabeledSpinBox()
+        self.memory_budget_mb.setText('memory budget (MB, 0: free shared memory):')
+        self.memory_budget_mb.setRange(0, 1024**2)
+        self.memory_budget_mb.setSingleStep(256)
+        self.memory_budget_mb.setValue(0)
+        self.memory_budget_mb.valueChanged.connect(self.state_changed)
+
+    def layout_components(self) -> None:
+
+        queue_layout = QVBoxLayout()
+        queue_layout.addWidget(self.buffer_sec)
+        queue_layout.addWidget(self.recording_buffer_sec)
+        queue_layout.addWidget(self.preview_buffer_sec)
+        queue_layout.addWidget(self.memory_budget_mb)
+        self.queue_group.setLayout(queue_layout)
+
+        main_layout = QVBoxLayout(self)
+        main_layout.addWidget(self.queue_group)
+
+    def get_state(self) -> Dict:
+        state = {}
+        state['buffer_sec'] = self.buffer_sec.value()
+        state['recording_buffer_sec'] = self.recording_buffer_sec.value()
+        state['preview_buffer_sec'] = self.preview_buffer_sec.value()
+        state['memory_budget_mb'] = self.memory_budget_mb.value()
+        return state
+
+    def set_state(self, state: Dict) -> None:
+
+        setters = {
+            'buffer_sec': self.buffer_sec.setValue,
+            'recording_buffer_sec': self.recording_buffer_sec.setValue,
+            'preview_buffer_sec': self.preview_buffer_sec.setValue,
+            'memory_budget_mb': self.memory_budget_mb.setValue,
+        }
+
+        for key, setter in setters.items():
+            if key in state:
+                setter(state[key])
+
+if __name__ == "__main__":
+
+    from PyQt5.QtWidgets import QApplication, QMainWindow
+
+    class Window(QMainWindow):
+
+        def __init__(self,*args,**kwargs):
+
+            super().__init__(*args, **kwargs)
+            self.queue_widget = QueueSizingWidget()
+            self.setCentralWidget(self.queue_widget)
+            self.queue_widget.state_changed.connect(self.state_changed)
+
+        def state_changed(self):
+            print(self.queue_widget.get_state())
+
+    app = QApplication([])
+    window = Window()
+    window.show()
+    app.exec()
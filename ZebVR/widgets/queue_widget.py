@@ -10,10 +10,13 @@ from PyQt5.QtWidgets import (
 from PyQt5.QtCore import Qt
 from typing import Optional
 
-#TODO add dropped frames and fps
+#TODO add fps
 
 class QueueWidget(QWidget):
 
+    # by health: healthy, consumer behind, saturated
+    HEALTH_COLORS = ('', '#e6a700', '#d32f2f')
+
     def __init__(
             self,
             name: str,
@@ -24,23 +27,38 @@ class QueueWidget(QWidget):
         super().__init__(*args, **kwargs)
 
         self.name = name
+        self.health = 0
         self.declare_components()
         self.layout_components()
 
     def declare_components(self) -> None:
         self.name_label = QLabel(self.name)
         self.progress_bar = QProgressBar()
+        self.dropped_label = QLabel('dropped: 0')
 
     def layout_components(self) -> None:
         layout = QHBoxLayout(self)
         layout.addWidget(self.name_label)
         layout.addWidget(self.progress_bar)
-
-    def set_state(self, count: Optional[int], max: Optional[int]) -> None:
+        layout.addWidget(self.dropped_label)
+
+    def set_state(
+            self, 
+            count: Optional[int], 
+            max: Optional[int], 
+            num_dropped: Optional[int] = None,
+            health: Optional[int] = None
+        ) -> None:
         if count is not None:
             self.progress_bar.setValue(count)
         if max is not None:
             self.progress_bar.setMaximum(max)
+        if num_dropped is not None:
+            self.dropped_label.setText(f'dropped: {num_dropped}')
+        if health is not None and health != self.health:
+            self.health = health
+            color = self.HEALTH_COLORS[health]
+            self.progress_bar.setStyleSheet(f'QProgressBar::chunk {{ background-color: {color}; }}' if color else '')
         self.update()
 
 class QueueMonitorWidget(QWidget):
@@ -0,0 +1,182 @@
+from PyQt5.QtWidgets import (
+    QApplication,
+    QWidget,
+    QVBoxLayout,
+    QHBoxLayout,
+    QGroupBox,
+    QCheckBox,
+    QComboBox,
+    QListWidget,
+    QPushButton
+)
+from PyQt5.QtCore import pyqtSignal
+from pathlib import Path
+from typing import Dict, List
+from daq_tools import BoardType
+
+from qt_widgets import LabeledEditLine, LabeledSpinBox, LabeledDoubleSpinBox
+
+class SensorWidget(QWidget):
+    '''
+    Low rate channels logged to a single file on the tracking timebase: the
+    temperature sensor, if one is selected, and DAQ analog inputs (e.g. 
+    heater, oxygen probe). Boards used for sensors should not be selected
+    for stimulation.
+    '''
+
+    state_changed = pyqtSignal()
+
+    LOG_FOLDER: Path = Path('output/data')
+
+    def __init__(self, *args, **kwargs):
+
+        super().__init__(*args, **kwargs)
+        self.channels: List[Dict] = []
+
+        self.declare_components()
+        self.layout_components()
+
+    def declare_components(self) -> None:
+
+        self.sensor_group = QGroupBox('Sensor log')
+
+        self.enabled = QCheckBox('Log sensors')
+        self.enabled.setChecked(False)
+        self.enabled.stateChanged.connect(self.state_changed)
+
+        self.edt_filename = LabeledEditLine()
+        self.edt_filename.setLabel('sensor file:')
+        self.edt_filename.setText('sensors.gz')
+        self.edt_filename.textChanged.connect(self.state_changed)
+
+        self.channel_list = QListWidget()
+
+        self.channel_group = QGroupBox('DAQ analog input')
+
+        self.channel_name = LabeledEditLine()
+        self.channel_name.setLabel('name:')
+        self.channel_name.setText('oxygen')
+
+        self.channel_unit = LabeledEditLine()
+        self.channel_unit.setLabel('unit:')
+        self.channel_unit.setText('V')
+
+        self.board_type = QComboBox()
+        for board_type in BoardType:
+            self.board_type.addItem(board_type.name)
+
+        self.board_id = LabeledEditLine()
+        self.board_id.setLabel('board id:')
+        self.board_id.setText('0')
+
+        self.channel = LabeledSpinBox()
+        self.channel.setText('channel:')
+        self.channel.setRange(0, 255)
+        self.channel.setValue(0)
+
+        self.sample_period_sec = LabeledDoubleSpinBox()
+        self.sample_period_sec.setText('sample period (s):')
+        self.sample_period_sec.setRange(0.01, 3600)
+        self.sample_period_sec.setSingleStep(0.1)
+        self.sample_period_sec.setValue(1.0)
+
+        self.add_button = QPushButton('Add channel')
+        self.add_button.clicked.connect(self.add_channel)
+
+        self.remove_button = QPushButton('Remove selected channel')
+        self.remove_button.clicked.connect(self.remove_channel)
+
+    def layout_components(self) -> None:
+
+        channel_layout = QVBoxLayout()
+        channel_layout.addWidget(self.channel_name)
+        channel_layout.addWidget(self.channel_unit)
+        channel_layout.addWidget(self.board_type)
+        channel_layout.addWidget(self.board_id)
+        channel_layout.addWidget(self.channel)
+        channel_layout.addWidget(self.sample_period_sec)
+        channel_layout.addWidget(self.add_button)
+        self.channel_group.setLayout(channel_layout)
+
+        sensor_layout = QVBoxLayout()
+        sensor_layout.addWidget(self.enabled)
+        sensor_layout.addWidget(self.edt_filename)
+        sensor_layout.addWidget(self.channel_list)
+        sensor_layout.addWidget(self.remove_button)
+        self.sensor_group.setLayout(sensor_layout)
+
+        layout = QHBoxLayout(self)
+        layout.addWidget(self.sensor_group)
+        layout.addWidget(self.channel_group)
+
+    def add_channel(self) -> None:
+        board_id = self.board_id.text()
+        channel = {
+            'name': self.channel_name.text(),
+            'unit': self.channel_unit.text(),
+            'board_type': BoardType[self.board_type.currentText()],
+            'board_id': int(board_id) if board_id.isdigit() else board_id, # serial ports for Arduinos
+            'channel': self.channel.value(),
+            'sample_period_sec': self.sample_period_sec.value()
+        }
+        self.set_channels(self.channels + [channel])
+
+    def remove_channel(self) -> None:
+        row = self.channel_list.currentRow()
+        if row < 0:
+            return
+        self.set_channels(self.channels[:row] + self.channels[row+1:])
+
+    def set_channels(self, channels: List[Dict]) -> None:
+        self.channels = list(channels)
+        self.channel_list.clear()
+        for c in self.channels:
+            self.channel_list.addItem(
+                f"{c['name']} ({c['unit']}): {c['board_type'].name} {c['board_id']} "
+                f"channel {c['channel']}, every {c['sample_period_sec']:g} s"
+            )
+        self.state_changed.emit()
+
+    def set_prefix(self, prefix: str) -> None:
+        self.edt_filename.setText(str(self.LOG_FOLDER / f'sensors_{prefix}.gz'))
+        self.state_changed.emit()
+
+    def get_state(self) -> Dict:
+        state = {}
+        state['enabled'] = self.enabled.isChecked()
+        state['filename'] = self.edt_filename.text()
+        state['channels'] = list(self.channels)
+        return state
+
+    def set_state(self, state: Dict) -> None:
+
+        setters = {
+            'enabled': self.enabled.setChecked,
+            'filename': self.edt_filename.setText,
+            'channels': self.set_channels,
+        }
+
+        for key, setter in setters.items():
+            if key in state:
+                setter(state[key])
+
+if __name__ == "__main__":
+
+    from PyQt5.QtWidgets import QMainWindow
+
+    class Window(QMainWindow):
+
+        def __init__(self,*args,**kwargs):
+
+            super().__init__(*args, **kwargs)
+            self.sensor_widget = SensorWidget()
+            self.setCentralWidget(self.sensor_widget)
+            self.sensor_widget.state_changed.connect(self.state_changed)
+
+        def state_changed(self):
+            print(self.sensor_widget.get_state())
+
+    app = QApplication([])
+    window = Window()
+    window.show()
+    app.exec()
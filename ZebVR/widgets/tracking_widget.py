@@ -48,6 +48,17 @@ class TrackingWidget(QWidget):
         self.edt_filename.setText('tracking.csv')
         self.edt_filename.textChanged.connect(self.state_changed)
 
+        self.qc_group = QGroupBox('Save processed images and masks (QC)')
+        self.qc_group.setCheckable(True)
+        self.qc_group.setChecked(False)
+        self.qc_group.toggled.connect(self.state_changed)
+
+        self.qc_decimation = LabeledSpinBox()
+        self.qc_decimation.setText('every N frames:')
+        self.qc_decimation.setRange(1, 10000)
+        self.qc_decimation.setValue(100)
+        self.qc_decimation.valueChanged.connect(self.state_changed)
+
     def update_prefix(self, prefix: str):
 
         self.filename = self.CSV_FOLDER / f'tracking_{prefix}.csv'
@@ -63,8 +74,13 @@ class TrackingWidget(QWidget):
         closedloop_layout.addWidget(self.edt_filename)
         self.closedloop_group.setLayout(closedloop_layout)
 
+        qc_layout = QVBoxLayout()
+        qc_layout.addWidget(self.qc_decimation)
+        self.qc_group.setLayout(qc_layout)
+
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self.closedloop_group)
+        main_layout.addWidget(self.qc_group)
 
     def get_state(self) -> Dict:
 
@@ -73,6 +89,8 @@ class TrackingWidget(QWidget):
         state['n_tail_pts_interp'] = self.n_tail_pts_interp.value()
         state['display_fps'] = self.display_fps.value()
         state['csv_filename'] = self.edt_filename.text()
+        state['qc_recording'] = self.qc_group.isChecked()
+        state['qc_decimation'] = self.qc_decimation.value()
         return state
     
     def set_state(self, state: Dict) -> None:
@@ -81,7 +99,9 @@ class TrackingWidget(QWidget):
             'tracker_settings_file': self.tracking_settings.setText,
             'n_tail_pts_interp': self.n_tail_pts_interp.setValue,
             'display_fps': self.display_fps.setValue,
-            'csv_filename': self.edt_filename.setText
+            'csv_filename': self.edt_filename.setText,
+            'qc_recording': self.qc_group.setChecked,
+            'qc_decimation': self.qc_decimation.setValue,
         }
         
         for key, setter in setters.items():
@@ -90,11 +90,27 @@ class VideoOutputWidget(QWidget):
         self.grayscale.setChecked(False)
         self.grayscale.stateChanged.connect(self.grayscale_toggled)
 
+        self.conversion_worker = QCheckBox('Separate color conversion worker')
+        self.conversion_worker.setChecked(False)
+        self.conversion_worker.stateChanged.connect(self.state_changed)
+
+        self.crash_safe = QCheckBox('Crash-safe container (.mkv)')
+        self.crash_safe.setChecked(True)
+        self.crash_safe.stateChanged.connect(self.state_changed)
+
+        self.roi_mode = LabeledComboBox()
+        self.roi_mode.setText('record:')
+        self.roi_mode.addItem('full frame')
+        self.roi_mode.addItem('per ROI')
+        self.roi_mode.addItem('mosaic')
+        self.roi_mode.currentIndexChanged.connect(self.state_changed)
+
         self.codec_combobox = LabeledComboBox()
         self.codec_combobox.setText('video codec:')
         self.codec_combobox.addItem('h264')
         self.codec_combobox.addItem('mjpeg')
         self.codec_combobox.addItem('hevc')
+        self.codec_combobox.addItem('ffv1')
         self.codec_combobox.currentIndexChanged.connect(self.codec_changed)        
 
         self.video_preset = LabeledComboBox()
@@ -116,6 +132,47 @@ class VideoOutputWidget(QWidget):
         self.video_quality.setValue(18)
         self.video_quality.valueChanged.connect(self.state_changed)
 
+        self.segment_duration = LabeledDoubleSpinBox()
+        self.segment_duration.setText('Segment duration (s, 0: single file):')
+        self.segment_duration.setRange(0, 3600)
+        self.segment_duration.setSingleStep(10)
+        self.segment_duration.setValue(0)
+        self.segment_duration.valueChanged.connect(self.state_changed)
+
+        self.num_encoders = LabeledSpinBox()
+        self.num_encoders.setText('Parallel encoders:')
+        self.num_encoders.setRange(1, 16)
+        self.num_encoders.setValue(2)
+        self.num_encoders.valueChanged.connect(self.state_changed)
+
+        ## event-triggered clips ------------------------------------
+        self.clip_group = QGroupBox('Record clips around stimulus events')
+        self.clip_group.setCheckable(True)
+        self.clip_group.setChecked(False)
+        self.clip_group.toggled.connect(self.state_changed)
+
+        self.clip_pre_trigger = LabeledDoubleSpinBox()
+        self.clip_pre_trigger.setText('Before event (s):')
+        self.clip_pre_trigger.setRange(0, 60)
+        self.clip_pre_trigger.setValue(2)
+        self.clip_pre_trigger.valueChanged.connect(self.state_changed)
+
+        self.clip_post_trigger = LabeledDoubleSpinBox()
+        self.clip_post_trigger.setText('After event (s):')
+        self.clip_post_trigger.setRange(0, 600)
+        self.clip_post_trigger.setValue(5)
+        self.clip_post_trigger.valueChanged.connect(self.state_changed)
+
+        self.clip_max_buffer = LabeledSpinBox()
+        self.clip_max_buffer.setText('Max buffer memory (MB):')
+        self.clip_max_buffer.setRange(10, 64000)
+        self.clip_max_buffer.setValue(2000)
+        self.clip_max_buffer.valueChanged.connect(self.state_changed)
+
+        self.clip_trigger_stims = QLineEdit()
+        self.clip_trigger_stims.setPlaceholderText('trigger stim_select values, comma separated (empty: all)')
+        self.clip_trigger_stims.textChanged.connect(self.state_changed)
+
         # stack
         self.video_stack = QStackedWidget(self)
         self.video_stack.addWidget(self.single_video)
@@ -146,9 +203,14 @@ class VideoOutputWidget(QWidget):
         single_video_layout.addWidget(self.video_file)
         single_video_layout.addWidget(self.use_gpu)
         single_video_layout.addWidget(self.grayscale)
+        single_video_layout.addWidget(self.conversion_worker)
+        single_video_layout.addWidget(self.crash_safe)
+        single_video_layout.addWidget(self.roi_mode)
         single_video_layout.addWidget(self.codec_combobox)
         single_video_layout.addWidget(self.video_preset)
         single_video_layout.addWidget(self.video_quality)
+        single_video_layout.addWidget(self.segment_duration)
+        single_video_layout.addWidget(self.num_encoders)
         single_video_layout.addStretch()
 
         video_layout = QVBoxLayout()
@@ -158,11 +220,21 @@ class VideoOutputWidget(QWidget):
         video_layout.addWidget(self.video_stack)
         self.video_group.setLayout(video_layout)
 
+        clip_layout = QVBoxLayout()
+        clip_layout.addWidget(self.clip_pre_trigger)
+        clip_layout.addWidget(self.clip_post_trigger)
+        clip_layout.addWidget(self.clip_max_buffer)
+        clip_layout.addWidget(self.clip_trigger_stims)
+        self.clip_group.setLayout(clip_layout)
+
         main_layout = QVBoxLayout(self)
         main_layout.addWidget(self.video_group)
+        main_layout.addWidget(self.clip_group)
 
     def codec_changed(self):
         
+        self.video_quality.setEnabled(True)
+
         if self.codec_combobox.currentText() == 'h264':
             self.video_quality.setRange(-12, 51)
             self.video_quality.setValue(18)
@@ -178,6 +250,13 @@ class VideoOutputWidget(QWidget):
             self.video_quality.setValue(2)
             self.video_preset.setEnabled(False)
 
+        elif self.codec_combobox.currentText() == 'ffv1':
+            # lossless
+            self.video_quality.setEnabled(False)
+            self.video_preset.setEnabled(False)
+            self.state_changed.emit()
+            return
+
         elif self.codec_combobox.currentText() == 'h264_nvenc':
             self.video_quality.setRange(0, 51)
             self.video_quality.setValue(18)
@@ -217,6 +296,7 @@ class VideoOutputWidget(QWidget):
             self.codec_combobox.addItem('h264')
             self.codec_combobox.addItem('mjpeg')
             self.codec_combobox.addItem('hevc')
+            self.codec_combobox.addItem('ffv1')
 
             self.video_preset.clear()
             self.video_preset.addItem('ultrafast')
@@ -240,6 +320,7 @@ class VideoOutputWidget(QWidget):
 
             self.codec_combobox.clear()
             self.codec_combobox.addItem('h264')
+            self.codec_combobox.addItem('ffv1')
 
             self.video_preset.clear()
             self.video_preset.addItem('ultrafast')
@@ -259,6 +340,7 @@ class VideoOutputWidget(QWidget):
             self.codec_combobox.addItem('h264')
             self.codec_combobox.addItem('mjpeg')
             self.codec_combobox.addItem('hevc')
+            self.codec_combobox.addItem('ffv1')
 
             self.video_preset.clear()
             self.video_preset.addItem('ultrafast')
@@ -296,9 +378,19 @@ class VideoOutputWidget(QWidget):
         state['video_codec'] = self.codec_combobox.currentText()
         state['video_gpu'] = self.use_gpu.isChecked()
         state['video_grayscale'] = self.grayscale.isChecked()
+        state['video_conversion_worker'] = self.conversion_worker.isChecked()
+        state['video_crash_safe'] = self.crash_safe.isChecked()
+        state['video_roi_mode'] = self.roi_mode.currentText()
         state['video_preset'] = self.video_preset.currentText()
         state['video_quality'] = self.video_quality.value()
         state['display_fps'] = self.display_fps.value()
+        state['video_segment_duration_sec'] = self.segment_duration.value()
+        state['video_num_encoders'] = self.num_encoders.value()
+        state['clip_recording'] = self.clip_group.isChecked()
+        state['clip_pre_trigger_sec'] = self.clip_pre_trigger.value()
+        state['clip_post_trigger_sec'] = self.clip_post_trigger.value()
+        state['clip_max_buffer_mb'] = self.clip_max_buffer.value()
+        state['clip_trigger_stims'] = self.clip_trigger_stims.text()
         return state
     
     def set_state(self, state: Dict) -> None:
@@ -314,9 +406,19 @@ class VideoOutputWidget(QWidget):
             'video_codec': self.codec_combobox.setCurrentText,
             'video_gpu': self.use_gpu.setChecked,
             'video_grayscale': self.grayscale.setChecked,
+            'video_conversion_worker': self.conversion_worker.setChecked,
+            'video_crash_safe': self.crash_safe.setChecked,
+            'video_roi_mode': self.roi_mode.setCurrentText,
             'video_preset': self.video_preset.setCurrentText,
             'video_quality': self.video_quality.setValue,
-            'display_fps': self.display_fps.setValue
+            'display_fps': self.display_fps.setValue,
+            'video_segment_duration_sec': self.segment_duration.setValue,
+            'video_num_encoders': self.num_encoders.setValue,
+            'clip_recording': self.clip_group.setChecked,
+            'clip_pre_trigger_sec': self.clip_pre_trigger.setValue,
+            'clip_post_trigger_sec': self.clip_post_trigger.setValue,
+            'clip_max_buffer_mb': self.clip_max_buffer.setValue,
+            'clip_trigger_stims': self.clip_trigger_stims.setText,
         }
 
         for key, setter in setters.items():
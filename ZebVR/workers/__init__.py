@@ -1,17 +1,43 @@
+import importlib
+
 from .camera import CameraWorker
-from .display import Display
 from .image_saver import ImageSaverWorker,VideoSaverWorker
 from .protocol_worker import Protocol
-from .queue_monitor import QueueMonitor
-from .protocol_gui import StimGUI
-from .tracker_gui import TrackerGui
 from .tracker import TrackerWorker
-from .tracking_display import TrackingDisplay
-from .image_filter import ImageFilterWorker, rgb_to_yuv420p, rgb_to_gray
+from .image_filter import ImageFilterWorker, rgb_to_yuv420p, rgb_to_gray, RGB_TO_YUV420P, RGB_TO_GRAY
 from .tracking_saver import TrackingSaver
-from .crop import CropWorker
+from .crop import CropWorker, crop_message_dtype
 from .temperature_logger import TemperatureLoggerWorker
-from .audio_stim import AudioStimWorker
-from .daq import DAQ_Worker
-from .latency_display import LatencyDisplay
-from .stim_saver import StimSaver
\ No newline at end of file
+from .stim_saver import StimSaver
+from .queue_metrics import InstrumentedQueue, QueueMetrics
+from .segmented_video import load_manifest
+from .disk_monitor import DiskMonitorWorker
+from .roi_video import ROIMosaic
+from .clip_recorder import ClipRecorderWorker
+from .tracking_qc import TrackingQCRecorder, load_tracking_qc
+from .run_control import RunControlWorker
+
+# Imported on first use: GUI workers (Qt, widgets) and optional backends 
+# (sound, DAQ, sensors). Every worker process imports this package when its 
+# worker is unpickled, and should not import what it does not run.
+LAZY_IMPORTS = {
+    'Display': '.display',
+    'QueueMonitor': '.queue_monitor',
+    'StimGUI': '.protocol_gui',
+    'TrackerGui': '.tracker_gui',
+    'TrackingDisplay': '.tracking_display',
+    'LatencyDisplay': '.latency_display',
+    'AudioStimWorker': '.audio_stim',
+    'DAQ_Worker': '.daq',
+    'SensorLoggerWorker': '.sensor_logger',
+    'SensorChannel': '.sensor_logger',
+    'load_sensor_log': '.sensor_logger',
+    'sensor_message_dtype': '.sensor_logger',
+    'DAQAnalogSensor': '.sensor_logger',
+    'SensorDisplay': '.sensor_display',
+}
+
+def __getattr__(name: str):
+    if name in LAZY_IMPORTS:
+        return getattr(importlib.import_module(LAZY_IMPORTS[name], __name__), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -15,7 +15,7 @@ from numpy.typing import NDArray
 import matplotlib.pyplot as plt
 from numba import njit
 import av
-from ZebVR.utils import SharedString, get_time_ns
+from ZebVR.utils import SharedString, get_time_ns, apply_cpu_placement, start_sampling_profiler
 
 # TODO barrier to check everyone up and running
 # TODO log timings 
@@ -24,7 +24,7 @@ from ZebVR.utils import SharedString, get_time_ns
 # Voss-McCartney method: https://www.firstpr.com.au/dsp/pink-noise/voss-mccartney/
 # IIR filter bank: http://www.cooperbaker.com/home/code/pink%20noise/
 
-@njit
+@njit(cache=True) # compiled once, loaded from disk by later worker processes
 def voss_mccartney(n_samples, n_layers=16):
     """Voss-McCartney pink noise generator."""
     out = np.zeros(n_samples)
@@ -518,6 +518,8 @@ class AudioStimWorker(WorkerNode):
         
     def initialize(self) -> None:
 
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
         self.audio_producer = AudioProducer(
             audio_queue = self.audio_queue,
             log_queue = self.log_queue,
@@ -4,7 +4,9 @@ from dagline import WorkerNode
 from typing import Callable, Any
 import numpy as np
 from numpy.typing import DTypeLike
-from ZebVR.utils import get_time_ns
+from ZebVR.utils import get_time_ns, apply_cpu_placement, start_sampling_profiler, mark_startup
+from ZebVR.utils.startup_timeline import FIRST_FRAME
+from ZebVR.utils.latency_trace import TRACE_FIELD, CAMERA_RECEIVED, CAMERA_SENT, stamp
 from image_tools import im2gray
 
 class CameraWorker(WorkerNode):
@@ -48,12 +50,15 @@ class CameraWorker(WorkerNode):
                 ('index', int),
                 ('timestamp', np.int64),
                 ('camera_timestamp', np.float64),
-                ('image', image_dtype, shape)
+                ('image', image_dtype, shape),
+                TRACE_FIELD
             ])
         )
     
     def initialize(self) -> None:
         super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
         self.cam = self.camera_constructor()
         self.cam.set_width(self.width)
         self.cam.set_height(self.height)
@@ -87,10 +92,15 @@ class CameraWorker(WorkerNode):
             self.res['timestamp'] = timestamp
             self.res['camera_timestamp'] = frame['timestamp']
             self.res['image'] = frame['image']
+            self.res['trace'] = 0
+            self.res['trace'][CAMERA_RECEIVED] = timestamp
+            stamp(self.res, CAMERA_SENT)
+            mark_startup(self, FIRST_FRAME)
 
             res = {}
             res['cam_output1'] = self.res
             res['cam_output2'] = self.res
+            res['cam_output3'] = self.res
             return res
         
     def process_metadata(self, metadata) -> Any:
@@ -0,0 +1,274 @@
+from dagline import WorkerNode
+import math
+import numpy as np
+from numpy.typing import NDArray
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Union
+from ZebVR.utils import append_timestamp_to_filename, apply_cpu_placement, start_sampling_profiler, run_control_message
+from ZebVR.utils.run_control import START_RUN
+from .image_saver import check_video_codec, create_video_writer, convert_for_encoding
+from .segmented_video import SegmentEncoder, new_segment, write_manifest
+
+class PreTriggerRing:
+    '''
+    The last num_frames frames and their timing, in buffers allocated once
+    on the first frame. Memory is bounded by num_frames * frame size.
+    '''
+
+    def __init__(self, num_frames: int) -> None:
+        self.num_frames = num_frames
+        self.images = None
+        self.timing = None
+        self.next = 0
+        self.count = 0
+
+    def push(self, data: NDArray) -> None:
+
+        image = data['image']
+        if self.images is None or self.images.shape[1:] != image.shape or self.images.dtype != image.dtype:
+            self.images = np.empty((self.num_frames,) + image.shape, dtype=image.dtype)
+            self.timing = np.empty(
+                (self.num_frames,),
+                dtype=[('index', np.int64), ('timestamp', np.int64), ('camera_timestamp', np.float64)]
+            )
+            self.next = 0
+            self.count = 0
+
+        self.images[self.next] = image
+        self.timing[self.next] = (data['index'], data['timestamp'], data['camera_timestamp'])
+        self.next = (self.next + 1) % self.num_frames
+        self.count = min(self.count + 1, self.num_frames)
+
+    def since(self, timestamp: int) -> List[int]:
+        '''slots of frames received at or after timestamp, oldest first'''
+        oldest = (self.next - self.count) % self.num_frames
+        slots = [(oldest + i) % self.num_frames for i in range(self.count)]
+        return [slot for slot in slots if self.timing[slot]['timestamp'] >= timestamp]
+
+class ClipRecorderWorker(WorkerNode):
+    '''
+    Record full-resolution, full frame rate clips around stimulus events.
+    Frames are kept in a pre-trigger ring of pre_trigger_sec. When the
+    StimSaver logs an entry (received as metadata with its file and line 
+    in the stimulus log), a clip from pre_trigger_sec before to 
+    post_trigger_sec after the entry's timestamp is encoded in a background 
+    thread. Events during a clip extend it. Clips, with the stimulus log 
+    entries that triggered them, are listed in a JSON manifest.
+    trigger_stims restricts triggers to some stim_select values (None: all).
+    On persistent workers, each run has its own clips and manifest, with
+    the run index (see ZebVR.utils.run_control for run boundaries).
+    '''
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            fps: int = 30,
+            pre_trigger_sec: float = 2,
+            post_trigger_sec: float = 5,
+            trigger_stims: Optional[Sequence[int]] = None,
+            max_buffer_mb: float = 2000,
+            video_codec: str = 'h264',
+            video_quality: int = 18,
+            video_profile: str = 'main',
+            video_preset: str = 'p2',
+            gpu: bool = False,
+            grayscale: bool = False,
+            *args,
+            **kwargs
+        ) -> None:
+
+        super().__init__(*args, **kwargs)
+
+        check_video_codec(video_codec, gpu, grayscale)
+
+        self.fps = fps
+        self.pre_trigger_sec = pre_trigger_sec
+        self.post_trigger_sec = post_trigger_sec
+        self.trigger_stims = None if trigger_stims is None else set(trigger_stims)
+        self.max_buffer_mb = max_buffer_mb
+        self.video_codec = video_codec
+        self.video_quality = video_quality
+        self.video_profile = video_profile
+        self.video_preset = video_preset
+        self.gpu = gpu
+        self.grayscale = grayscale
+        self.set_filename(filename)
+
+    def set_filename(self, filename: Union[str, Path]) -> None:
+        filename = Path(filename)
+        if self.video_codec == 'ffv1':
+            filename = filename.with_suffix('.mkv')
+        self.video_filename = append_timestamp_to_filename(filename.with_name(f'{filename.stem}_clip{filename.suffix}'))
+        self.manifest_filename = self.video_filename.with_name(f'{self.video_filename.stem}_clips.json')
+
+    def create_writer(self, filename: Path) -> Any:
+        height, width = self.frame_shape[:2]
+        return create_video_writer(
+            filename = filename,
+            height = 2*(height//2),
+            width = 2*(width//2),
+            fps = self.fps,
+            video_codec = self.video_codec,
+            gpu = self.gpu,
+            grayscale = self.grayscale,
+            video_quality = self.video_quality,
+            video_profile = self.video_profile,
+            video_preset = self.video_preset
+        )
+
+    def convert(self, image: NDArray) -> NDArray:
+        return convert_for_encoding(image, self.grayscale)
+
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+        self.ring = None
+        self.frame_shape = None
+        self.encoder = None
+        self.open_run()
+
+    def open_run(self, run: int = 0, timestamp: int = 0) -> None:
+        '''clips of the run only include frames received after timestamp'''
+        self.clips = []
+        self.clip = None
+        self.pending_events = []
+        self.run = run
+        self.run_start = timestamp
+        self.recording = True
+
+    def close_run(self) -> None:
+        if not self.recording:
+            return
+        if self.clip is not None:
+            self.close_clip()
+        self.write_manifest()
+        print(f'clips: {len(self.clips)}')
+        self.recording = False
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        self.close_run()
+        if self.encoder is not None:
+            self.encoder.stop()
+
+    def allocate(self, image: NDArray) -> None:
+
+        self.frame_shape = image.shape
+        num_frames = max(1, math.ceil(self.pre_trigger_sec * self.fps))
+        max_frames = max(1, int(self.max_buffer_mb * 1024**2 / 2 // image.nbytes))
+        if num_frames > max_frames:
+            print(f'pre-trigger buffer limited to {max_frames} frames ({max_frames/self.fps:.1f} s) by max_buffer_mb')
+            num_frames = max_frames
+        self.ring = PreTriggerRing(num_frames)
+
+        # the other half of the memory budget goes to the encoder queue, 
+        # which must hold at least the whole pre-trigger window
+        self.encoder = SegmentEncoder(self.create_writer, max_frames, self.convert)
+        self.encoder.start()
+
+    def write_manifest(self) -> None:
+        manifest = {
+            'run': self.run,
+            'video_codec': self.video_codec,
+            'fps': self.fps,
+            'pre_trigger_sec': self.pre_trigger_sec,
+            'post_trigger_sec': self.post_trigger_sec,
+            'clips': self.clips
+        }
+        write_manifest(self.manifest_filename, manifest)
+
+    def is_trigger(self, event: Any) -> bool:
+        if not isinstance(event, dict) or not isinstance(event.get('entry'), dict):
+            return False
+        entry = event['entry']
+        if 'timestamp' not in entry or entry.get('coalesced', False):
+            # superseded DAQ writes were never executed
+            return False
+        return self.trigger_stims is None or entry.get('stim_select') in self.trigger_stims
+
+    def open_clip(self, event: Dict) -> None:
+
+        clip_index = len(self.clips)
+        filename = self.video_filename.with_name(
+            f'{self.video_filename.stem}_{clip_index:04}{self.video_filename.suffix}'
+        )
+        self.clip = new_segment(clip_index, filename, 0)
+        self.clip['events'] = [event]
+        self.clip['start_timestamp'] = int(event['entry']['timestamp'] - 1e9*self.pre_trigger_sec)
+        self.clip['end_timestamp'] = int(event['entry']['timestamp'] + 1e9*self.post_trigger_sec)
+        self.clips.append(self.clip)
+        self.encoder.open_segment(self.clip)
+
+        # frames preceding the event, during the run. Slots are copied, they will be overwritten
+        for slot in self.ring.since(max(self.clip['start_timestamp'], self.run_start)):
+            self.write_frame(self.ring.images[slot].copy(), self.ring.timing[slot])
+
+    def close_clip(self) -> None:
+        self.encoder.close_segment(self.clip)
+        self.clip = None
+        self.write_manifest()
+
+    def write_frame(self, image: NDArray, timing: NDArray) -> None:
+
+        clip = self.clip
+        if not self.encoder.write_frame(clip, image):
+            return
+        if clip['first_index'] is None:
+            clip['first_index'] = int(timing['index'])
+            clip['first_timestamp'] = int(timing['timestamp'])
+            clip['first_camera_timestamp'] = float(timing['camera_timestamp'])
+        clip['last_index'] = int(timing['index'])
+        clip['last_timestamp'] = int(timing['timestamp'])
+        clip['last_camera_timestamp'] = float(timing['camera_timestamp'])
+        clip['num_frames'] += 1
+
+    def process_data(self, data: NDArray) -> None:
+
+        if data is None:
+            return
+
+        if self.ring is None:
+            self.allocate(data['image'])
+
+        # events can arrive before the frames they refer to
+        for event in self.pending_events:
+            if self.clip is None:
+                self.open_clip(event)
+            else:
+                self.clip['events'].append(event)
+                self.clip['end_timestamp'] = max(
+                    self.clip['end_timestamp'],
+                    int(event['entry']['timestamp'] + 1e9*self.post_trigger_sec)
+                )
+        self.pending_events = []
+
+        if self.clip is not None:
+            if data['timestamp'] > self.clip['end_timestamp']:
+                self.close_clip()
+            else:
+                self.write_frame(data['image'].copy(), data)
+
+        self.ring.push(data)
+
+    def process_metadata(self, metadata: Any) -> None:
+
+        if metadata is None:
+            return
+        
+        # persistent workers: new clips and manifest for each run
+        control = run_control_message(metadata)
+        if control is not None:
+            self.close_run()
+            if control['run_control'] == START_RUN:
+                self.set_filename(control['settings']['settings']['videorecording']['video_filename'])
+                self.open_run(control['run'], control['timestamp'])
+
+        # nothing recorded between runs
+        if not self.recording:
+            return
+
+        # one event per logged entry
+        for event in metadata.get('stim_log') or []:
+            if self.is_trigger(event):
+                self.pending_events.append(event)
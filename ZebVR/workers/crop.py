@@ -1,6 +1,21 @@
 from dagline import WorkerNode
 from typing import Any, List, Tuple
 import numpy as np
+from numpy.typing import DTypeLike
+from ZebVR.utils import get_time_ns, apply_cpu_placement, start_sampling_profiler
+from ZebVR.utils.latency_trace import TRACE_FIELD, CROP_RECEIVED, CROP_SENT, stamp, copy_trace
+
+def crop_message_dtype(shape: Tuple, image_dtype: DTypeLike) -> np.dtype:
+    '''message sent to trackers, for crops of the given image shape'''
+    return np.dtype([
+        ('index', int),
+        ('timestamp', np.int64),
+        ('image', image_dtype, shape),
+        ('origin', np.int32, (2,)),
+        ('shape', np.int32, (2,)),
+        ('identity', np.int32),
+        TRACE_FIELD
+    ])
 
 class CropWorker(WorkerNode):
 
@@ -14,28 +29,31 @@ class CropWorker(WorkerNode):
         super().__init__(*args, **kwargs)
         self.ROI_identities = ROI_identities
 
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+
     def process_data(self, data):
         
         if data is None:
             return
         
+        received = get_time_ns()
         res = {}
         for n, roi in enumerate(self.ROI_identities):
             x,y,w,h = roi
             crop = data['image'][y:y+h,x:x+w]
             origin = np.array((x,y), dtype = np.int32)
             shape = np.array((h,w), dtype = np.int32) 
-            res[f'cropper_output_{n}'] = np.array(
-                (data['index'], data['timestamp'], crop, origin, shape, n),
-                dtype=([
-                    ('index', int),
-                    ('timestamp', np.int64),
-                    ('image', crop.dtype, crop.shape),
-                    ('origin', np.int32, (2,)),
-                    ('shape', np.int32, (2,)),
-                    ('identity', np.int32)
-                ])
-            )            
+            msg = np.array(
+                (data['index'], data['timestamp'], crop, origin, shape, n, 0),
+                dtype=crop_message_dtype(crop.shape, crop.dtype)
+            )
+            copy_trace(data, msg)
+            stamp(msg, CROP_RECEIVED, received)
+            stamp(msg, CROP_SENT)
+            res[f'cropper_output_{n}'] = msg
         
         return res
 
@@ -58,22 +76,21 @@ class CropWorker2(WorkerNode):
 
         self.buffers = []
         for x, y, w, h in ROI_identities:
-            dtype = np.dtype([
-                ('index', int),
-                ('timestamp', np.int64),
-                ('image', np.uint8, (h, w, n_channels)), 
-                ('origin', np.int32, (2,)),
-                ('shape', np.int32, (2,)),
-                ('identity', np.int32)
-            ])
+            dtype = crop_message_dtype((h, w, n_channels), np.uint8)
             # Pre-allocate memory once
             self.buffers.append(np.zeros((), dtype=dtype))
 
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+
     def process_data(self, data):
         
         if data is None:
             return
         
+        received = get_time_ns()
         res = {}
         for n, (roi, buf) in enumerate(zip(self.ROI_identities, self.buffers)):
             x,y,w,h = roi
@@ -83,6 +100,9 @@ class CropWorker2(WorkerNode):
             buf['origin'] = (x, y)
             buf['shape'] = (h, w)
             buf['identity'] = n
+            copy_trace(data, buf)
+            stamp(buf, CROP_RECEIVED, received)
+            stamp(buf, CROP_SENT)
             res[f'cropper_output_{n}'] = buf          
         
         return res
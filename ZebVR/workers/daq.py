@@ -1,5 +1,9 @@
 from dagline import WorkerNode
-from typing import Dict, Optional, List, Union
+from typing import Dict, Optional, List, Union, Tuple, Any, Hashable
+from dataclasses import dataclass, field
+from collections import OrderedDict
+import threading
+import queue
 from daq_tools import (
     Arduino_SoftTiming, 
     LabJackU3_SoftTiming, 
@@ -9,7 +13,108 @@ from daq_tools import (
     DAQ_CONSTRUCTORS
 )
 from ZebVR.protocol import Stim, DAQ_STIMS
-from ZebVR.utils import get_time_ns
+from ZebVR.utils import get_time_ns, apply_cpu_placement, start_sampling_profiler
+
+# writes that only matter for their last value: a pending write is superseded
+# by a newer write of the same operation to the same channels 
+COALESCABLE_OPERATIONS = {'analog_write', 'digital_write', 'pwm_write'}
+
+@dataclass
+class DAQCommand:
+    calls: List[Tuple[str, Tuple, Dict]] # (operation, args, kwargs), first arg is the channel
+    log: Dict
+    timestamp_queued: int = field(default_factory=get_time_ns)
+
+    def key(self) -> Hashable:
+        operations = {operation for operation, _, _ in self.calls}
+        if len(operations) == 1 and operations <= COALESCABLE_OPERATIONS:
+            channels = tuple(args[0] for _, args, _ in self.calls if args)
+            return (operations.pop(), channels)
+        # never coalesced
+        return id(self)
+
+class DAQCommandQueue:
+    '''
+    Executes commands for a single board in a background thread so that
+    slow boards (e.g. serial Arduino) never block the metadata receive path.
+    Pending writes superseded by a newer write to the same channels are not
+    executed, their log is kept with 'coalesced' set to True.
+    '''
+
+    def __init__(self, board: Any, log_queue: queue.Queue, logger: Any) -> None:
+
+        self.board = board
+        self.log_queue = log_queue
+        self.logger = logger
+        self.pending: OrderedDict = OrderedDict()
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.num_coalesced = 0
+        self.thread = None
+
+    def start(self) -> None:
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        '''stop after executing remaining pending commands'''
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def put(self, command: DAQCommand) -> None:
+        key = command.key()
+        with self.condition:
+            if key in self.pending:
+                superseded = self.pending.pop(key)
+                superseded.log.update({
+                    'timestamp_queued': superseded.timestamp_queued,
+                    'timestamp_superseded': get_time_ns(),
+                    'coalesced': True
+                })
+                self.log_queue.put(superseded.log)
+                self.num_coalesced += 1
+            self.pending[key] = command
+            self.condition.notify()
+
+    def run(self) -> None:
+
+        while True:
+
+            with self.condition:
+                while not self.pending and not self.stopped:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                _, command = self.pending.popitem(last=False)
+                num_coalesced = self.num_coalesced
+
+            timestamp_start = get_time_ns()
+            results = []
+            for operation, args, kwargs in command.calls:
+                try:
+                    results.append(getattr(self.board, operation)(*args, **kwargs))
+                except Exception as e:
+                    self.logger.error(f'DAQ command {operation}{args} failed: {e}')
+                    results.append(None)
+            timestamp_done = get_time_ns()
+
+            command.log.update({
+                'timestamp_queued': command.timestamp_queued,
+                'timestamp_start': timestamp_start,
+                'timestamp_done': timestamp_done,
+                'queue_latency_ms': 1e-6*(timestamp_start - command.timestamp_queued),
+                'execution_latency_ms': 1e-6*(timestamp_done - timestamp_start),
+                'num_coalesced': num_coalesced,
+                'coalesced': False
+            })
+            if 'operation' in command.log:
+                command.log['result'] = results[0]
+            self.log_queue.put(command.log)
 
 class DAQ_Worker(WorkerNode):
 
@@ -25,16 +130,29 @@ class DAQ_Worker(WorkerNode):
 
     def initialize(self) -> None:
 
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+        self.log_queue = queue.Queue()
         self.daqs = {}
+        self.command_queues = {}
         for board_type, board_list in self.daq_boards.items():
             self.daqs[board_type] = {}
+            self.command_queues[board_type] = {}
             for board in board_list:
-                self.daqs[board_type][board.id] = DAQ_CONSTRUCTORS[board_type](board_id = board.id)
+                daq = DAQ_CONSTRUCTORS[board_type](board_id = board.id)
+                command_queue = DAQCommandQueue(daq, self.log_queue, self.local_logger)
+                command_queue.start()
+                self.daqs[board_type][board.id] = daq
+                self.command_queues[board_type][board.id] = command_queue
 
         super().initialize()
 
     def cleanup(self) -> None:
         
+        for command_queue_dict in self.command_queues.values():
+            for command_queue in command_queue_dict.values():
+                command_queue.stop()
+
         for board_dict in self.daqs.values():
             for board in board_dict.values():
                 board.close()
@@ -43,24 +161,41 @@ class DAQ_Worker(WorkerNode):
 
     def process_data(self, data: Dict) -> None:
         pass
+
+    def submit(self, board_type: BoardType, board_id: Any, command: DAQCommand) -> bool:
+        try:
+            self.command_queues[board_type][board_id].put(command)
+        except KeyError:
+            print(f'DAQ board {board_type} {board_id} not found')
+            return False
+        return True
         
-    def process_metadata(self, metadata: Dict) -> Optional[Union[List, Dict]]:
-        # TODO accept either stim select or tuple style commands
+    def executed_commands(self) -> Optional[List[Dict]]:
+        '''logs of all the commands executed since the last call, None if there are none'''
+        logs = []
+        while True:
+            try:
+                logs.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                return logs or None
+
+    def process_metadata(self, metadata: Dict) -> Optional[List[Dict]]:
+        # commands are executed asynchronously, the logs of commands executed
+        # since the last call are returned together
         
-        result = None
+        log_message = self.executed_commands()
 
         if isinstance(metadata, list):
 
-            result = []
-
             for board_type, board_id, operation, args, kwargs in metadata:
-                try:
-                    method = getattr(self.daqs[board_type][board_id], operation, None)
-                    if method:
-                        result.append((board_type, board_id, operation, args, kwargs, method(*args, **kwargs)))
-                except KeyError:
-                    # TODO log something?
-                    return
+                log = {
+                    'board_type': board_type,
+                    'board_id': board_id,
+                    'operation': operation,
+                    'args': args,
+                    'kwargs': kwargs,
+                }
+                self.submit(board_type, board_id, DAQCommand([(operation, args, kwargs)], log))
                 
         else:
 
@@ -69,15 +204,15 @@ class DAQ_Worker(WorkerNode):
 
                 stim = control.get('stim_select')
                 if stim not in DAQ_STIMS:
-                    return
+                    return log_message
                 
                 board_type = control.get('board_type')
                 if board_type is None:
-                    return
+                    return log_message
                 
                 board_id = control.get('board_id')
                 if board_id is None:
-                    return
+                    return log_message
                 
                 channels = control.get('channels', [])
 
@@ -86,7 +221,7 @@ class DAQ_Worker(WorkerNode):
                 pulse_duration = control.get('pulse_duration_msec')
                 duty_cycle = control.get('duty_cycle')
 
-                result = {
+                log = {
                     'stim_select': stim,
                     'timestamp': get_time_ns(),
                     'board_type': board_type,
@@ -95,64 +230,53 @@ class DAQ_Worker(WorkerNode):
                 }
 
                 if stim == Stim.ANALOG_WRITE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].analog_write(c, analog_value)
-                    result.update({'analog_value': analog_value})
+                    calls = [('analog_write', (c, analog_value), {}) for c in channels]
+                    log.update({'analog_value': analog_value})
 
                 elif stim == Stim.DIGITAL_WRITE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].digital_write(c, digital_level)
-                    result.update({'digital_level': digital_level})
+                    calls = [('digital_write', (c, digital_level), {}) for c in channels]
+                    log.update({'digital_level': digital_level})
 
                 elif stim == Stim.PWM_WRITE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].pwm_write(c, duty_cycle)
-                    result.update({'duty_cycle': duty_cycle})
+                    calls = [('pwm_write', (c, duty_cycle), {}) for c in channels]
+                    log.update({'duty_cycle': duty_cycle})
 
                 elif stim == Stim.ANALOG_PULSE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].analog_pulse(
-                            c, 
-                            pulse_duration, 
-                            analog_value, 
-                            blocking = False
-                        )
-                    result.update({
+                    calls = [
+                        ('analog_pulse', (c, pulse_duration, analog_value), {'blocking': False}) 
+                        for c in channels
+                    ]
+                    log.update({
                         'analog_value': analog_value,
                         'pulse_duration': pulse_duration
                     })
 
                 elif stim == Stim.DIGITAL_PULSE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].digital_pulse(
-                            c, 
-                            pulse_duration, 
-                            digital_level, 
-                            blocking = False
-                        )
-                    result.update({
+                    calls = [
+                        ('digital_pulse', (c, pulse_duration, digital_level), {'blocking': False}) 
+                        for c in channels
+                    ]
+                    log.update({
                         'digital_level': digital_level,
                         'pulse_duration': pulse_duration
                     })
 
-
                 elif stim == Stim.PWM_PULSE:
-                    for c in channels:
-                        self.daqs[board_type][board_id].pwm_pulse(
-                            c, 
-                            pulse_duration, 
-                            duty_cycle, 
-                            blocking = False
-                        )
-                    result.update({
+                    calls = [
+                        ('pwm_pulse', (c, pulse_duration, duty_cycle), {'blocking': False}) 
+                        for c in channels
+                    ]
+                    log.update({
                         'duty_cycle': duty_cycle,
                         'pulse_duration': pulse_duration
                     })
 
                 else:
-                    pass
+                    return log_message
+                
+                self.submit(board_type, board_id, DAQCommand(calls, log))
 
-        return result
+        return log_message
 
 
 if __name__ == '__main__':
@@ -234,9 +358,16 @@ if __name__ == '__main__':
         (BoardType.LABJACK, 320043003, 'pwm_write', (5, 0.15), {}),
         (BoardType.NATIONAL_INSTRUMENTS, 0, 'digital_write', (0, True), {})
     ])
+
+    # burst of writes to the same channel: only the last one should reach the board
+    input_queue.put([
+        (BoardType.ARDUINO, '/dev/ttyACM0', 'analog_write', (5, v/100), {}) for v in range(100)
+    ])
        
-    print(output_queue.get()) 
     time.sleep(1)
+    while output_queue.qsize() > 0:
+        for msg in output_queue.get():
+            print(f"{msg['operation']}{msg['args']}: queued {msg['queue_latency_ms']:.3f} ms, executed {msg['execution_latency_ms']:.3f} ms, coalesced {msg['num_coalesced']}")
     print(output_queue.qsize())
     print(input_queue.qsize())
 
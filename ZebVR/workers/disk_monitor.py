@@ -0,0 +1,70 @@
+from dagline import WorkerNode
+import time
+from pathlib import Path
+from typing import Any, Dict
+from ZebVR.utils.disk_guard import DiskUsageMonitor
+from ZebVR.utils import start_sampling_profiler
+
+class DiskMonitorWorker(WorkerNode):
+    '''Periodically check free space and write latency of the recording folders'''
+
+    POLL_INTERVAL_SEC = 0.1
+
+    def __init__(
+            self,
+            data_rates: Dict[Path, Dict[str, float]],
+            check_interval_sec: float = 10,
+            min_free_sec: float = 600,
+            max_latency_ms: float = 100,
+            *args,
+            **kwargs
+        ) -> None:
+
+        super().__init__(*args, **kwargs)
+        self.data_rates = data_rates
+        self.check_interval_sec = check_interval_sec
+        self.min_free_sec = min_free_sec
+        self.max_latency_ms = max_latency_ms
+        self.monitors = []
+        self.last_check = 0
+
+    def initialize(self) -> None:
+        super().initialize()
+        start_sampling_profiler(self)
+        self.monitors = [
+            DiskUsageMonitor(
+                folder, 
+                sum(streams.values()), 
+                self.min_free_sec, 
+                self.max_latency_ms
+            )
+            for folder, streams in self.data_rates.items()
+        ]
+        self.last_check = 0
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        for monitor in self.monitors:
+            monitor.close()
+
+    def process_data(self, data) -> None:
+        # isolated stage: usage and warnings go to the worker log
+
+        if time.monotonic() - self.last_check < self.check_interval_sec:
+            # nothing to do, don't spin
+            time.sleep(self.POLL_INTERVAL_SEC)
+            return None
+
+        self.last_check = time.monotonic()
+        for monitor in self.monitors:
+            try:
+                usage = monitor.check()
+            except OSError as e:
+                self.local_logger.error(f'disk monitor {monitor.folder}: {e}')
+                continue
+            self.local_logger.info(f'disk monitor {monitor.folder}: {usage}')
+            for warning in monitor.warnings(usage):
+                self.local_logger.warning(warning)
+
+    def process_metadata(self, metadata) -> Any:
+        pass
@@ -4,6 +4,7 @@ from typing import Dict, Optional
 import time
 from PyQt5.QtWidgets import QApplication
 from ..widgets import DisplayWidget
+from ..utils import start_sampling_profiler
 
 class Display(WorkerNode):
 
@@ -22,6 +23,7 @@ class Display(WorkerNode):
     def initialize(self) -> None:
 
         super().initialize()
+        start_sampling_profiler(self)
         
         self.app = QApplication([])
         self.window = DisplayWidget()
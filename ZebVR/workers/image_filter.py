@@ -1,33 +1,112 @@
 from dagline import WorkerNode
 from numpy.typing import NDArray
-from typing import Any, Callable
+from typing import Any, Callable, Optional, Sequence, Tuple, Union
 import numpy as np
 import cv2
 from image_tools import im2gray, im2single
+from ZebVR.utils import apply_cpu_placement, start_sampling_profiler
+from ZebVR.utils.latency_trace import TRACE_FIELD, copy_trace
 
 def to_single_grayscale(image: NDArray) -> NDArray:
     return im2single(im2gray(image))
 
-def rgb_to_yuv420p(image_rgb: NDArray) -> NDArray:
-    return cv2.cvtColor(image_rgb, cv2.COLOR_RGB2YUV_I420)
+# Filters take an optional preallocated output. Output shapes are 
+# declared by the matching *_shape functions so that buffers can be 
+# allocated once. 
 
-def gray_to_yuv420p(image_gray: NDArray) -> NDArray:
-    image_rgb = np.dstack((image_gray, image_gray, image_gray))
-    return rgb_to_yuv420p(image_rgb)
+def rgb_to_yuv420p(image_rgb: NDArray, out: Optional[NDArray] = None) -> NDArray:
+    return cv2.cvtColor(image_rgb, cv2.COLOR_RGB2YUV_I420, dst=out)
 
-def rgb_to_gray(image_rgb: NDArray) -> NDArray:
-    return im2gray(image_rgb)
+def yuv420p_shape(shape: Tuple, dtype: np.dtype) -> Tuple[Tuple, np.dtype]:
+    return (shape[0]*3//2, shape[1]), dtype
 
-def decimate(image: NDArray, k:int) -> NDArray:
-    return image[::k,::k]
+def gray_to_yuv420p(image_gray: NDArray, out: Optional[NDArray] = None) -> NDArray:
+    # gray pixels have Y = value and neutral chroma
+    height = image_gray.shape[0]
+    if out is None:
+        out = np.empty((height*3//2, image_gray.shape[1]), dtype=image_gray.dtype)
+    out[:height] = image_gray
+    out[height:] = 128
+    return out
 
-def bin(image: NDArray, k:int) -> NDArray:
+def rgb_to_gray(image_rgb: NDArray, out: Optional[NDArray] = None) -> NDArray:
+    if image_rgb.ndim == 2:
+        if out is None:
+            return image_rgb
+        np.copyto(out, image_rgb)
+        return out
+    return cv2.cvtColor(image_rgb, cv2.COLOR_RGB2GRAY, dst=out)
+
+def gray_shape(shape: Tuple, dtype: np.dtype) -> Tuple[Tuple, np.dtype]:
+    return shape[:2], dtype
+
+def decimate(image: NDArray, k:int, out: Optional[NDArray] = None) -> NDArray:
+    if out is None:
+        return image[::k,::k]
+    np.copyto(out, image[::k,::k])
+    return out
+
+def decimate_shape(shape: Tuple, dtype: np.dtype, k: int) -> Tuple[Tuple, np.dtype]:
+    return (-(-shape[0]//k), -(-shape[1]//k)) + tuple(shape[2:]), dtype
+
+def bin(image: NDArray, k:int, out: Optional[NDArray] = None) -> NDArray:
     h, w = image.shape[:2]
     new_h, new_w = h // k, w // k  
-    binned = image[:new_h * k, :new_w * k].reshape(new_h, k, new_w, k, -1).mean(axis=(1, 3))
-    if binned.shape[-1] == 1:
-        binned = binned.squeeze(-1)
-    return binned
+    blocks = image[:new_h * k, :new_w * k].reshape(new_h, k, new_w, k, -1)
+    if out is None:
+        binned = blocks.mean(axis=(1, 3))
+        if binned.shape[-1] == 1:
+            binned = binned.squeeze(-1)
+        return binned
+    blocks.mean(axis=(1, 3), out=out.reshape(new_h, new_w, -1))
+    return out
+
+def bin_shape(shape: Tuple, dtype: np.dtype, k: int) -> Tuple[Tuple, np.dtype]:
+    binned_shape = (shape[0]//k, shape[1]//k)
+    if len(shape) == 3 and shape[2] > 1:
+        binned_shape += (shape[2],)
+    return binned_shape, np.dtype(np.float64)
+
+class ImageFilter:
+    '''
+    Image function writing into a preallocated output, with its output shape
+    declared by shape_function (shape, dtype) -> (shape, dtype). 
+    Without shape_function, the output shape is found by running the function
+    once, and the result is copied into the output.
+    '''
+
+    def __init__(
+            self, 
+            function: Callable[..., NDArray], 
+            shape_function: Optional[Callable[..., Tuple[Tuple, np.dtype]]] = None,
+            **kwargs
+        ) -> None:
+        
+        self.function = function
+        self.shape_function = shape_function
+        self.kwargs = kwargs
+
+    def output_shape(self, shape: Tuple, dtype: np.dtype) -> Tuple[Tuple, np.dtype]:
+        if self.shape_function is not None:
+            return self.shape_function(shape, np.dtype(dtype), **self.kwargs)
+        result = self.function(np.zeros(shape, dtype), **self.kwargs)
+        return result.shape, result.dtype
+
+    def __call__(self, image: NDArray, out: NDArray) -> NDArray:
+        if self.shape_function is not None:
+            return self.function(image, out=out, **self.kwargs)
+        np.copyto(out, self.function(image, **self.kwargs))
+        return out
+
+RGB_TO_YUV420P = ImageFilter(rgb_to_yuv420p, yuv420p_shape)
+GRAY_TO_YUV420P = ImageFilter(gray_to_yuv420p, yuv420p_shape)
+RGB_TO_GRAY = ImageFilter(rgb_to_gray, gray_shape)
+
+def Decimate(k: int) -> ImageFilter:
+    return ImageFilter(decimate, decimate_shape, k=k)
+
+def Bin(k: int) -> ImageFilter:
+    return ImageFilter(bin, bin_shape, k=k)
 
 def resize_to_closest_multiple_of_two(image: NDArray, height: int, width: int) -> NDArray:
     # some video_codecs require images with even size
@@ -41,33 +120,139 @@ def resize_to_closest_multiple_of_two(image: NDArray, height: int, width: int) -
     return image_resized
 
 class ImageFilterWorker(WorkerNode):
+    '''
+    Apply one filter, or a chain of filters, to incoming images. Intermediate
+    images and the output message are allocated once and reused as long as
+    the input shape does not change.
+    '''
 
     def __init__(
         self, 
-        image_function: Callable[[NDArray], NDArray],
+        image_function: Union[Callable[[NDArray], NDArray], ImageFilter, Sequence[ImageFilter]],
         *args, 
         **kwargs
         ):
     
         super().__init__(*args, **kwargs)
-        self.image_function = image_function
+
+        if callable(image_function):
+            image_function = [image_function]
+        self.filters = [f if isinstance(f, ImageFilter) else ImageFilter(f) for f in image_function]
+        self.input_key = None
+        self.buffers = []
+        self.output = None
+
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+
+    def output_dtype(self, shape: Tuple, dtype: np.dtype) -> np.dtype:
+        '''dtype of the messages sent for input images of the given shape and dtype'''
+
+        for image_filter in self.filters:
+            shape, dtype = image_filter.output_shape(shape, dtype)
+        return np.dtype([
+            ('index', int),
+            ('timestamp', np.int64),
+            ('camera_timestamp', np.float64),
+            ('image', dtype, shape),
+            TRACE_FIELD
+        ])
+
+    def allocate(self, shape: Tuple, dtype: np.dtype) -> None:
+
+        output_dtype = self.output_dtype(shape, dtype)
+        self.buffers = []
+        for image_filter in self.filters:
+            shape, dtype = image_filter.output_shape(shape, dtype)
+            self.buffers.append(np.empty(shape, dtype))
+
+        # the last filter writes directly in the output message
+        self.output = np.zeros((), dtype=output_dtype)
+        self.buffers[-1] = self.output['image']
 
     def process_data(self, data: NDArray) -> None:
 
         if data is None:
             return 
         
-        image_processed = self.image_function(data['image']) 
-        output = np.array(
-            (data['index'], data['timestamp'], data['camera_timestamp'], image_processed),
+        image = data['image']
+        input_key = (image.shape, image.dtype)
+        if input_key != self.input_key:
+            self.allocate(*input_key)
+            self.input_key = input_key
+
+        for image_filter, buffer in zip(self.filters, self.buffers):
+            image = image_filter(image, out=buffer)
+
+        self.output['index'] = data['index']
+        self.output['timestamp'] = data['timestamp']
+        self.output['camera_timestamp'] = data['camera_timestamp']
+        copy_trace(data, self.output)
+        return self.output
+
+    def process_metadata(self, metadata) -> Any:
+        pass
+
+if __name__ == '__main__':
+
+    import time
+
+    NUM_FRAMES = 50
+    SIZES = {'1MP': (1024, 1024), '4MP': (2048, 2048), '12MP': (3000, 4000)}
+
+    def benchmark(function: Callable[[], Any]) -> Tuple[float, float]:
+        latency_ms = []
+        cpu_start = time.process_time()
+        for _ in range(NUM_FRAMES):
+            start = time.perf_counter()
+            function()
+            latency_ms.append(1000*(time.perf_counter() - start))
+        cpu_ms = 1000*(time.process_time() - cpu_start)/NUM_FRAMES
+        return np.median(latency_ms), cpu_ms
+
+    # allocating functions vs filters writing into preallocated outputs
+    for size, (height, width) in SIZES.items():
+
+        rgb = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        gray = rgb[:,:,0].copy()
+        cases = [
+            ('rgb_to_yuv420p', rgb, rgb_to_yuv420p, RGB_TO_YUV420P),
+            ('gray_to_yuv420p', gray, gray_to_yuv420p, GRAY_TO_YUV420P),
+            ('rgb_to_gray', rgb, rgb_to_gray, RGB_TO_GRAY),
+            ('decimate 2', gray, lambda x: np.ascontiguousarray(decimate(x, 2)), Decimate(2)),
+            ('bin 2', gray, lambda x: bin(x, 2), Bin(2)),
+        ]
+        for name, image, function, image_filter in cases:
+            out = np.empty(*image_filter.output_shape(image.shape, image.dtype))
+            allocating_ms, _ = benchmark(lambda: function(image))
+            inplace_ms, _ = benchmark(lambda: image_filter(image, out=out))
+            print(f'{size} {name}: allocating {allocating_ms:.2f} ms, preallocated {inplace_ms:.2f} ms')
+
+    # cost per frame of a separate conversion stage (conversion, output 
+    # message, extra ring buffer copy) vs conversion fused in the saver
+    for size, (height, width) in SIZES.items():
+
+        image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+        message = np.array(
+            (0, 0, 0.0, image),
             dtype=np.dtype([
                 ('index', int),
                 ('timestamp', np.int64),
                 ('camera_timestamp', np.float64),
-                ('image', image_processed.dtype, image_processed.shape)
+                ('image', image.dtype, image.shape)
             ])
         )
-        return output
+        worker = ImageFilterWorker(RGB_TO_YUV420P, name='benchmark')
+        ring_buffer_slot = np.empty_like(worker.process_data(message))
 
-    def process_metadata(self, metadata) -> Any:
-        pass
\ No newline at end of file
+        def separate_stage():
+            np.copyto(ring_buffer_slot, worker.process_data(message)) # extra queue hop
+
+        def fused():
+            rgb_to_yuv420p(message['image'])
+
+        for label, function in [('separate stage', separate_stage), ('fused in saver', fused)]:
+            latency_ms, cpu_ms = benchmark(function)
+            print(f'{size} {label}: latency median {latency_ms:.2f} ms, cpu {cpu_ms:.2f} ms/frame')
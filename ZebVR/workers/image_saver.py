@@ -1,7 +1,7 @@
 from dagline import WorkerNode
 import numpy as np
 from numpy.typing import NDArray
-from typing import Any, Union
+from typing import Any, Optional, Sequence, Tuple, Union
 import cv2
 import os
 from pathlib import Path
@@ -11,19 +11,49 @@ from video_tools import (
     FFMPEG_VideoWriter_CPU_Grayscale
 )
 import time
-from ZebVR.utils import append_timestamp_to_filename
-
-# TODO: check zarr, maybe try cv2.imwrite
+from ZebVR.utils import (
+    append_timestamp_to_filename, 
+    get_time_ns,
+    ChunkedImageStoreWriter, 
+    FRAME_TIMING_DTYPE,
+    FrameContinuityMonitor,
+    FrameTimingSidecar,
+    register_frame_timing_counters,
+    Checkpointer,
+    checkpoint_filename,
+    apply_cpu_placement,
+    start_sampling_profiler,
+    run_control_message,
+    mark_startup
+)
+from ZebVR.utils.latency_trace import TraceRecorder
+from ZebVR.utils.run_control import START_RUN
+from ZebVR.utils.startup_timeline import RECORDING
+from .image_filter import rgb_to_yuv420p, rgb_to_gray
+from .segmented_video import (
+    FFMPEG_VideoWriter_CPU_FFV1,
+    SegmentEncoder,
+    new_segment,
+    write_manifest
+)
+from .roi_video import even_ROIs, roi_filename, roi_manifest_filename, roi_manifest, ROIMosaic
 
 class ImageSaverWorker(WorkerNode):
+    '''
+    Save resized frames as an image sequence in a chunked store 
+    (see ZebVR.utils.chunked_image_store), one store per run.
+    Per-frame timing is stored as FRAME_TIMING_DTYPE records in the store.
+    '''
 
     def __init__(
             self, 
             folder: Union[str, Path], 
             decimation: int = 1,
-            zero_padding: int = 8, 
             resize: float = 0.25,
             compress: bool = False, 
+            chunk_frames: int = 100,
+            num_threads: int = 4,
+            checkpoint_interval_sec: float = 10,
             *args, 
             **kwargs
         ):
@@ -31,15 +61,35 @@ class ImageSaverWorker(WorkerNode):
         super().__init__(*args, **kwargs)
         
         self.folder = Path(folder)
+        self.checkpoint_interval_sec = checkpoint_interval_sec
         self.decimation = decimation
         self.resize = resize
-        self.zero_padding = zero_padding
         self.compress = compress
+        self.chunk_frames = chunk_frames
+        self.num_threads = num_threads
+        self.store_folder = None
+        self.writer = None
+        self.timing_counters = register_frame_timing_counters('image sequence')
 
     def initialize(self) -> None:
         super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
         if not self.folder.exists():
-            os.mkdir(self.folder)
+            os.makedirs(self.folder)
+        self.store_folder = append_timestamp_to_filename(self.folder / 'images')
+        # frame shape is only known once the first frame arrives
+        self.writer = None
+        self.monitor = FrameContinuityMonitor(self.timing_counters, self.decimation)
+        # chunks are written then renamed, only the records file needs syncing
+        self.checkpointer = Checkpointer(self.checkpoint_interval_sec)
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        if self.writer is not None:
+            self.checkpointer.checkpoint()
+            self.writer.close()
+            self.writer = None
 
     def process_data(self, data: NDArray) -> None:
 
@@ -48,25 +98,117 @@ class ImageSaverWorker(WorkerNode):
 
         if data['index'] % self.decimation == 0:
             
+            self.monitor.update(data['index'], data['timestamp'])
             image_resized = cv2.resize(data['image'],None,None,self.resize,self.resize,cv2.INTER_NEAREST)
-            metadata = data[['index','timestamp']]
-            filename = self.folder / f"{data['index']:0{self.zero_padding}}"
-            
-            if self.compress:
-                np.savez_compressed(filename, image=image_resized, metadata=metadata)
-            else:
-                np.savez(filename, image=image_resized, metadata=metadata)
+            record = np.array(
+                (data['index'], data['camera_timestamp'], data['timestamp'], get_time_ns()), 
+                dtype=FRAME_TIMING_DTYPE
+            )
+
+            if self.writer is None:
+                self.writer = ChunkedImageStoreWriter(
+                    folder = self.store_folder,
+                    frame_shape = image_resized.shape,
+                    dtype = image_resized.dtype,
+                    record_dtype = FRAME_TIMING_DTYPE,
+                    chunk_frames = self.chunk_frames,
+                    compress = self.compress,
+                    num_threads = self.num_threads
+                )
+                self.checkpointer.add_file(self.writer.records)
+
+            self.writer.append(image_resized, record)
+            self.checkpointer.maybe_checkpoint()
             
             return data
 
     def process_metadata(self, metadata) -> Any:
         pass
 
+SUPPORTED_VIDEO_CODECS_GRAYSCALE = ['h264', 'ffv1']
+SUPPORTED_VIDEO_CODECS_CPU = ['h264', 'hevc', 'mjpeg', 'ffv1']
+SUPPORTED_VIDEO_CODECS_GPU = ['h264_nvenc', 'hevc_nvenc']
+
+def check_video_codec(video_codec: str, gpu: bool = False, grayscale: bool = False) -> None:
+
+    if grayscale and (not video_codec in SUPPORTED_VIDEO_CODECS_GRAYSCALE):
+        raise ValueError(f'wrong video_codec type for grayscale CPU encoding, supported video_codecs are: {SUPPORTED_VIDEO_CODECS_GRAYSCALE}') 
+    
+    if gpu and (not video_codec in SUPPORTED_VIDEO_CODECS_GPU):
+        raise ValueError(f'wrong video_codec type for GPU encoding, supported video_codecs are: {SUPPORTED_VIDEO_CODECS_GPU}') 
+
+    if (not gpu) and (not video_codec in SUPPORTED_VIDEO_CODECS_CPU):
+        raise ValueError(f'wrong video_codec type for CPU encoding, supported video_codecs are: {SUPPORTED_VIDEO_CODECS_CPU}')
+
+def create_video_writer(
+        filename: Path,
+        height: int,
+        width: int,
+        fps: int,
+        video_codec: str = 'h264',
+        gpu: bool = False,
+        grayscale: bool = False,
+        video_quality: int = 18,
+        video_profile: str = 'main',
+        video_preset: str = 'p2'
+    ) -> Any:
+
+    if video_codec == 'ffv1':
+        return FFMPEG_VideoWriter_CPU_FFV1(
+            height = height, 
+            width = width, 
+            fps = fps, 
+            filename = filename,
+            grayscale = grayscale
+        )
+    
+    if gpu:
+        writer_class = FFMPEG_VideoWriter_GPU_YUV420P
+    elif grayscale:
+        writer_class = FFMPEG_VideoWriter_CPU_Grayscale
+    else:
+        writer_class = FFMPEG_VideoWriter_CPU_YUV420P
+
+    return writer_class(
+        height = height, 
+        width = width, 
+        fps = fps, 
+        q = video_quality,
+        filename = filename,
+        codec = video_codec,
+        profile = video_profile,
+        preset = video_preset
+    )
+
+def convert_for_encoding(image: NDArray, grayscale: bool = False) -> NDArray:
+    
+    if image.ndim == 3 and image.shape[2] == 3:
+        if grayscale:
+            return rgb_to_gray(image)
+        return rgb_to_yuv420p(image)
+    
+    # already converted upstream
+    return image
+
 class VideoSaverWorker(WorkerNode):
+    '''
+    Encode frames to a single video file, or with segment_duration_sec > 0 
+    to fixed-duration segments distributed round-robin over num_encoders
+    encoders. Segments are described in a JSON manifest (frame ranges, 
+    timestamps, dropped frames).
+    With crash_safe_container, videos are written as Matroska (.mkv), which
+    stays readable up to the last written cluster if the recording is
+    interrupted, unlike MP4 which needs its index written at the end.
+    Every checkpoint_interval_sec, timings and video are synced to disk.
+    With roi_mode 'per ROI', only the ROIs (x, y, w, h) are recorded, one 
+    video per ROI. With 'mosaic', ROIs are packed in a single video. ROI
+    geometry is described in a JSON file next to the video, and all ROIs
+    share the same timings.
+    RGB frames are converted to yuv420p (or grayscale) before encoding, in the
+    same thread as the write, so no separate ImageFilterWorker stage is needed.
+    '''
     
-    SUPPORTED_VIDEO_CODECS_GRAYSCALE = ['h264']
-    SUPPORTED_VIDEO_CODECS_CPU = ['h264', 'hevc', 'mjpeg']
-    SUPPORTED_VIDEO_CODECS_GPU = ['h264_nvenc', 'hevc_nvenc']
+    ROI_MODES = ['full frame', 'per ROI', 'mosaic']
 
     def __init__(
             self, 
@@ -81,15 +223,21 @@ class VideoSaverWorker(WorkerNode):
             video_preset: str = 'p2',
             gpu: bool = False,
             grayscale: bool = False,
+            segment_duration_sec: float = 0,
+            num_encoders: int = 2,
+            encoder_queue_size: int = 64,
+            crash_safe_container: bool = False,
+            checkpoint_interval_sec: float = 10,
+            roi_mode: str = 'full frame',
+            ROIs: Optional[Sequence[Tuple[int,int,int,int]]] = None,
+            trace_file: Optional[str] = None,
             *args, 
             **kwargs
         ):
 
         super().__init__(*args, **kwargs)
         
-        video_filename = append_timestamp_to_filename(filename)
-        self.video_filename = video_filename
-        self.timings_filename = video_filename.with_suffix('.csv')         
+        self.timing_counters = register_frame_timing_counters('video')
         self.fps = fps
         self.height = 2*(height//2) # some video_codecs require images with even size
         self.width = 2*(width//2)
@@ -98,81 +246,299 @@ class VideoSaverWorker(WorkerNode):
         self.video_preset = video_preset
         self.video_quality = video_quality
         self.grayscale = grayscale
+        self.segment_duration_sec = segment_duration_sec
+        self.num_encoders = num_encoders
+        self.encoder_queue_size = encoder_queue_size
+        self.checkpoint_interval_sec = checkpoint_interval_sec
+        self.crash_safe_container = crash_safe_container
 
-        if grayscale and (not video_codec in self.SUPPORTED_VIDEO_CODECS_GRAYSCALE):
-            raise ValueError(f'wrong video_codec type for grayscale CPU encoding, supported video_codecs are: {self.SUPPORTED_VIDEO_CODECS_GRAYSCALE}') 
+        if roi_mode not in self.ROI_MODES:
+            raise ValueError(f'wrong roi_mode, supported modes are: {self.ROI_MODES}')
+        
+        if roi_mode != 'full frame' and not ROIs:
+            raise ValueError(f'roi_mode {roi_mode} requires ROIs')
         
-        if gpu and (not video_codec in self.SUPPORTED_VIDEO_CODECS_GPU):
-            raise ValueError(f'wrong video_codec type for GPU encoding, supported video_codecs are: {self.SUPPORTED_VIDEO_CODECS_GPU}') 
+        self.roi_mode = roi_mode
+        self.ROIs = even_ROIs(ROIs) if roi_mode != 'full frame' else []
+        self.mosaic = None
+        if roi_mode == 'mosaic':
+            self.mosaic = ROIMosaic(self.ROIs)
+            self.height = self.mosaic.height
+            self.width = self.mosaic.width
 
-        if (not gpu) and (not video_codec in self.SUPPORTED_VIDEO_CODECS_CPU):
-            raise ValueError(f'wrong video_codec type for CPU encoding, supported video_codecs are: {self.SUPPORTED_VIDEO_CODECS_CPU}')
-    
+        check_video_codec(video_codec, gpu, grayscale)
         self.video_codec = video_codec
         self.gpu = gpu
         self.writer = None
+        self.fd = None
+        self.trace_file = trace_file
+        self.trace_recorder = None
+        self.set_filename(filename)
+
+    def set_filename(self, filename: Union[str, Path]) -> None:
+        '''timestamped video, timings and manifest filenames'''
+        if self.video_codec == 'ffv1' or self.crash_safe_container:
+            filename = Path(filename).with_suffix('.mkv')
+        video_filename = append_timestamp_to_filename(filename)
+        self.video_filename = video_filename
+        self.timings_filename = video_filename.with_suffix('.csv')         
+        self.sidecar_filename = video_filename.with_suffix('.timing')
+        self.manifest_filename = video_filename.with_name(f'{video_filename.stem}_manifest.json')
+
+    def create_writer(self, filename: Path, height: Optional[int] = None, width: Optional[int] = None) -> Any:
+        return create_video_writer(
+            filename = filename,
+            height = height or self.height, 
+            width = width or self.width, 
+            fps = self.fps, 
+            video_codec = self.video_codec,
+            gpu = self.gpu,
+            grayscale = self.grayscale,
+            video_quality = self.video_quality,
+            video_profile = self.video_profile,
+            video_preset = self.video_preset
+        )
+
+    def convert(self, image: NDArray) -> NDArray:
+        return convert_for_encoding(image, self.grayscale)
 
     def initialize(self) -> None:
 
         super().initialize()
-        
-        if self.gpu:
-            self.writer = FFMPEG_VideoWriter_GPU_YUV420P(
-                height = self.height, 
-                width = self.width, 
-                fps = self.fps, 
-                q = self.video_quality,
-                filename = self.video_filename,
-                codec = self.video_codec,
-                profile = self.video_profile,
-                preset = self.video_preset
-            )
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+        self.open_run()
 
-        elif self.grayscale:
-            self.writer = FFMPEG_VideoWriter_CPU_Grayscale(
-                height = self.height, 
-                width = self.width, 
-                fps = self.fps, 
-                q = self.video_quality,
-                filename = self.video_filename,
-                codec = self.video_codec,
-                profile = self.video_profile,
-                preset = self.video_preset
-            )
+        if self.trace_file is not None:
+            self.trace_recorder = TraceRecorder(self.trace_file, 'video_saver')
+
+    def open_run(self) -> None:
 
+        self.encoders = []
+        self.segments = []
+        self.segment = None
+        self.num_dropped = 0
+        self.roi_writers = []
+
+        if self.roi_mode == 'per ROI':
+            if self.segment_duration_sec > 0:
+                print('per ROI recording: segmentation is not supported, recording one file per ROI')
+            for identity, (x, y, w, h) in enumerate(self.ROIs):
+                self.roi_writers.append(self.create_writer(roi_filename(self.video_filename, identity), h, w))
+        elif self.segment_duration_sec > 0:
+            self.frames_per_segment = max(1, round(self.segment_duration_sec * self.fps))
+            for _ in range(self.num_encoders):
+                encoder = SegmentEncoder(self.create_writer, self.encoder_queue_size, self.convert)
+                encoder.start()
+                self.encoders.append(encoder)
         else:
-            self.writer = FFMPEG_VideoWriter_CPU_YUV420P(
-                height = self.height, 
-                width = self.width, 
-                fps = self.fps, 
-                q = self.video_quality,
-                filename = self.video_filename,
-                codec = self.video_codec,
-                profile = self.video_profile,
-                preset = self.video_preset
-            )
+            self.writer = self.create_writer(self.video_filename)
 
         self.fd = open(self.timings_filename, 'w')
         headers = ('index', 'timestamp', 'camera_timestamp')
         self.fd.write(','.join(headers) + '\n')
 
+        self.sidecar = FrameTimingSidecar(
+            self.sidecar_filename, 
+            self.timing_counters, 
+            self.decimation,
+            header = {'video': str(self.video_filename)}
+        )
+
+        self.checkpointer = Checkpointer(self.checkpoint_interval_sec, checkpoint_filename(self.video_filename))
+        self.checkpointer.add_file(self.fd)
+        self.checkpointer.add_file(self.sidecar.writer)
+        if self.roi_writers:
+            for identity in range(len(self.ROIs)):
+                self.checkpointer.add_path(roi_filename(self.video_filename, identity))
+        elif not self.encoders:
+            self.checkpointer.add_path(self.video_filename)
+        self.checkpoint_state = {}
+
+        if self.roi_mode != 'full frame':
+            write_manifest(
+                roi_manifest_filename(self.video_filename),
+                roi_manifest(self.roi_mode, self.ROIs, self.video_filename, self.timings_filename, self.mosaic)
+            )
+
+        mark_startup(self, RECORDING)
+
+    def checkpoint(self) -> None:
+        if self.encoders:
+            self.write_manifest()
+        self.checkpointer.checkpoint(self.checkpoint_state)
+
+    def close_run(self) -> None:
+
+        if self.fd is None:
+            return
+        
+        self.checkpointer.checkpoint(self.checkpoint_state)
+        self.sidecar.close()
+
+        if self.encoders:
+            if self.segment is not None:
+                self.encoders[self.segment['encoder']].close_segment(self.segment)
+            for encoder in self.encoders:
+                encoder.stop()
+            self.write_manifest()
+            print(f'video segments: {len(self.segments)}, dropped frames: {self.num_dropped}')
+        elif self.roi_writers:
+            for writer in self.roi_writers:
+                writer.close()
+        else:
+            self.writer.close()
+            self.writer = None
+
+        self.fd.close()
+        self.fd = None
+
     def cleanup(self) -> None:
 
         super().cleanup()
-        self.writer.close()
-        self.fd.close()
+        self.close_run()
+
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+            self.trace_recorder = None
+
+    def write_manifest(self) -> None:
+        manifest = {
+            'video_codec': self.video_codec,
+            'fps': self.fps,
+            'segment_duration_sec': self.segment_duration_sec,
+            'num_encoders': self.num_encoders,
+            'timings': str(self.timings_filename),
+            'num_frames': sum(segment['num_frames'] for segment in self.segments),
+            'num_dropped': self.num_dropped,
+            'segments': self.segments
+        }
+        write_manifest(self.manifest_filename, manifest)
+
+    def next_segment(self) -> None:
+
+        if self.segment is not None:
+            self.encoders[self.segment['encoder']].close_segment(self.segment)
+            self.write_manifest()
+
+        segment_index = len(self.segments)
+        filename = self.video_filename.with_name(
+            f'{self.video_filename.stem}_{segment_index:04}{self.video_filename.suffix}'
+        )
+        self.segment = new_segment(segment_index, filename, segment_index % self.num_encoders)
+        self.segments.append(self.segment)
+        # sync the segment being written and the previous one, which may still be encoding
+        self.checkpointer.paths = self.checkpointer.paths[-1:] + [filename]
+        self.encoders[self.segment['encoder']].open_segment(self.segment)
+
+    def write_segmented(self, data: NDArray, image: NDArray) -> bool:
+
+        if self.segment is None or self.segment['num_frames'] + self.segment['num_dropped'] >= self.frames_per_segment:
+            self.next_segment()
+
+        segment = self.segment
+        if not self.encoders[segment['encoder']].write_frame(segment, image):
+            # encoder fell behind
+            self.num_dropped += 1
+            return False
+
+        if segment['first_index'] is None:
+            segment['first_index'] = int(data['index'])
+            segment['first_timestamp'] = int(data['timestamp'])
+            segment['first_camera_timestamp'] = float(data['camera_timestamp'])
+        segment['last_index'] = int(data['index'])
+        segment['last_timestamp'] = int(data['timestamp'])
+        segment['last_camera_timestamp'] = float(data['camera_timestamp'])
+        segment['num_frames'] += 1
+        return True
 
     def process_data(self, data: NDArray) -> None:
 
-        if data is None:
+        # between runs on persistent workers
+        if data is None or self.fd is None:
             return
 
         if data['index'] % self.decimation == 0:
             
-            self.writer.write_frame(data['image'])
+            received = get_time_ns()
+            self.sidecar.frame_received(data['index'], data['timestamp'])
+
+            image = data['image']
+            if self.mosaic is not None:
+                image = self.mosaic(image)
+
+            if self.roi_writers:
+                for writer, (x, y, w, h) in zip(self.roi_writers, self.ROIs):
+                    writer.write_frame(self.convert(image[y:y+h, x:x+w]))
+            elif self.encoders:
+                # the received frame and the mosaic buffer are reused, 
+                # encoder threads need their own copy
+                if not self.write_segmented(data, image.copy()):
+                    return
+            else:
+                self.writer.write_frame(self.convert(image))
+
+            self.sidecar.frame_written(data['index'], data['camera_timestamp'], data['timestamp'])
             self.fd.write(f"{data['index']}, {data['timestamp']}, {data['camera_timestamp']}\n")
 
+            self.checkpoint_state = {'index': int(data['index']), 'timestamp': int(data['timestamp'])}
+            if self.checkpointer.due():
+                self.checkpoint()
+
+            if self.trace_recorder is not None:
+                self.trace_recorder.write(data, received)
+
             return data
 
     def process_metadata(self, metadata) -> Any:
-        pass
\ No newline at end of file
+
+        # persistent workers: new video files for each run
+        control = run_control_message(metadata)
+        if control is None:
+            return
+        
+        self.close_run()
+        if control['run_control'] == START_RUN:
+            self.set_filename(control['settings']['settings']['videorecording']['video_filename'])
+            self.open_run()
+
+if __name__ == '__main__':
+
+    # sustained write throughput: one .npz per frame vs chunked store
+    import tempfile
+    from ZebVR.utils import ChunkedImageStore
+
+    NUM_FRAMES = 1000
+    frame_shape = (512, 512)
+    images = np.random.randint(0, 50, (10,) + frame_shape, dtype=np.uint8) # compressible, like fish on a dark background
+    record = np.zeros((), dtype=FRAME_TIMING_DTYPE)
+
+    for compress in [False, True]:
+
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            for i in range(NUM_FRAMES):
+                filename = Path(folder) / f"{i:08}"
+                if compress:
+                    np.savez_compressed(filename, image=images[i % 10], metadata=record)
+                else:
+                    np.savez(filename, image=images[i % 10], metadata=record)
+            npz_fps = NUM_FRAMES / (time.perf_counter() - start)
+
+        with tempfile.TemporaryDirectory() as folder:
+            start = time.perf_counter()
+            writer = ChunkedImageStoreWriter(
+                Path(folder) / 'images', 
+                frame_shape, 
+                np.uint8, 
+                FRAME_TIMING_DTYPE, 
+                compress = compress
+            )
+            for i in range(NUM_FRAMES):
+                record['index'] = i
+                writer.append(images[i % 10], record)
+            writer.close()
+            chunked_fps = NUM_FRAMES / (time.perf_counter() - start)
+            assert len(ChunkedImageStore(Path(folder) / 'images')) == NUM_FRAMES
+
+        print(f'compress={compress}: npz {npz_fps:.0f} frames/s, chunked store {chunked_fps:.0f} frames/s')
@@ -9,6 +9,7 @@ import pyqtgraph as pg
 from dagline import WorkerNode
 from typing import Dict, Optional
 from collections import deque
+from ..utils import start_sampling_profiler
 
 LATENCY_THRESHOLD_MS = 20.0
 MAX_HISTORY = 30
@@ -119,6 +120,7 @@ class LatencyDisplay(WorkerNode):
     def initialize(self) -> None:
 
         super().initialize()
+        start_sampling_profiler(self)
 
         self.app = QApplication([])
         self.window = LatencyWidget(self.refresh_frequency)
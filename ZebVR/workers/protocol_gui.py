@@ -4,6 +4,7 @@ from typing import Dict, Optional, List
 import time
 from ..widgets import StimWidget
 from ..protocol import Debouncer
+from ..utils import start_sampling_profiler
 from PyQt5.QtWidgets import QApplication
 from daq_tools import (
     BoardInfo,
@@ -28,6 +29,7 @@ class StimGUI(WorkerNode):
 
     def initialize(self) -> None:
         super().initialize()
+        start_sampling_profiler(self)
         self.app = QApplication([])
         self.window = StimWidget(
             daq_boards = self.daq_boards,
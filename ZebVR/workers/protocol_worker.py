@@ -1,27 +1,37 @@
 from dagline import WorkerNode
 import time
+from collections import deque
 from numpy.typing import NDArray
 from typing import Dict, Optional, Any, Deque, List
-from ..protocol import ProtocolItem
+from ..utils import start_sampling_profiler, run_control_message
+from ..utils.run_control import START_RUN
+
+# ProtocolItem (ZebVR.protocol, with its Qt widgets) is not imported here: 
+# protocol items are only imported by the protocol process, when unpickled
 
 class Protocol(WorkerNode):
 
     def __init__(
             self, 
-            protocol: Optional[Deque[ProtocolItem]] = None,
+            protocol: Optional[Deque['ProtocolItem']] = None,
+            keep_alive: bool = False,
             *args, 
             **kwargs
         ):
+        '''keep_alive: wait for the next run when the protocol is finished (persistent workers)'''
 
         super().__init__(*args, **kwargs)
         self.protocol = protocol
+        self.keep_alive = keep_alive
         self.current_item = None
+        self.running = True
 
-    def set_protocol(self, protocol: Deque[ProtocolItem]) -> None:
+    def set_protocol(self, protocol: Deque['ProtocolItem']) -> None:
         self.protocol = protocol
 
     def initialize(self) -> None:
         super().initialize()
+        start_sampling_profiler(self)
         for protocol_item in self.protocol:
             protocol_item.initialize()
 
@@ -30,6 +40,20 @@ class Protocol(WorkerNode):
         for protocol_item in self.protocol:
             protocol_item.cleanup()
 
+    def start_run(self, protocol: Deque['ProtocolItem']) -> None:
+        self.stop_run()
+        self.protocol = protocol
+        for protocol_item in self.protocol:
+            protocol_item.initialize()
+        self.running = True
+
+    def stop_run(self) -> None:
+        for protocol_item in self.protocol or ():
+            protocol_item.cleanup()
+        self.protocol = deque()
+        self.current_item = None
+        self.running = False
+
     def process_data(self, data: Any) -> NDArray:
         pass
 
@@ -41,6 +65,11 @@ class Protocol(WorkerNode):
             command = self.current_item.start()
 
         except IndexError:
+            if self.keep_alive:
+                print('Protocol finished, waiting for the next run')
+                self.stop_run()
+                return None
+            
             # sleep a bit to let enough time for the message 
             # to be delivered before closing the queue
             time.sleep(1)
@@ -53,6 +82,17 @@ class Protocol(WorkerNode):
 
     def process_metadata(self, metadata: Dict) -> Optional[Dict]:    
 
+        # persistent workers: the protocol of each run is sent with the run
+        control = run_control_message(metadata)
+        if control is not None:
+            if control['run_control'] == START_RUN:
+                self.start_run(control['settings']['sequencer']['protocol'])
+            else:
+                self.stop_run()
+
+        if not self.running:
+            return
+
         if self.current_item is not None:
             if not self.current_item.done(metadata):
                 return
@@ -73,7 +113,7 @@ class Protocol2(WorkerNode):
 
     def __init__(
             self, 
-            protocol: Optional[List[Deque[ProtocolItem]]] = None,
+            protocol: Optional[List[Deque['ProtocolItem']]] = None,
             *args, 
             **kwargs
         ):
@@ -82,11 +122,12 @@ class Protocol2(WorkerNode):
         self.protocol = protocol
         self.current_items = []
 
-    def set_protocol(self, protocol: List[Deque[ProtocolItem]]) -> None:
+    def set_protocol(self, protocol: List[Deque['ProtocolItem']]) -> None:
         self.protocol = protocol
 
     def initialize(self) -> None:
         super().initialize()
+        start_sampling_profiler(self)
         for fish_protocol in self.protocol:
             for protocol_item in fish_protocol:
                 protocol_item.initialize()
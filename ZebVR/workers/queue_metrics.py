@@ -0,0 +1,391 @@
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Lock, RawArray
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+from ..utils import get_time_ns
+
+QUEUE_METRICS_DTYPE = np.dtype([
+    ('timestamp', np.int64), # get_time_ns
+    ('queue', np.uint16),
+    ('depth_mean', np.float32),
+    ('depth_max', np.uint32),
+    ('capacity', np.uint32),
+    ('put_rate_hz', np.float32),
+    ('get_rate_hz', np.float32),
+    ('put_blocking_us', np.float32), # mean time spent in put, per message
+    ('get_blocking_us', np.float32), # mean time spent in get, per message
+    ('bytes_per_message', np.float32),
+    ('num_dropped', np.uint32), # during the summary interval
+    ('health', np.uint8), # InstrumentedQueue.HEALTHY, BEHIND or SATURATED
+])
+
+FILL_RATIO_BINS = np.linspace(0, 1, 21)
+BLOCKING_US_BINS = np.concatenate(([0], np.logspace(0, 6, 25)))
+
+class InstrumentedQueue:
+    '''
+    Wrapper counting puts, gets, bytes and time spent blocking, and applying
+    a drop policy to the edge. Counters live in shared memory so that the 
+    queue monitor can read them from another process.
+
+    Policies:
+        LOSSLESS: every message is delivered, the producer blocks when the
+            queue is full (critical path). The default, transparent.
+        DROP_WHEN_FULL: every message is delivered while there is room, 
+            new messages are dropped when the queue is full (savers and
+            recorders, which must not stall the critical path).
+        LATEST_ONLY: the consumer only gets the most recent message, older
+            ones are dropped (displays, stimulus).
+        DECIMATE: above pressure_ratio fill, only one message in 2, 4, ... up
+            to max_decimation is put, more as the queue fills (previews).
+    Apart from LOSSLESS, the producer never blocks: messages are dropped
+    when the queue is full. Health is BEHIND above alert_ratio fill
+    (pressure_ratio for DECIMATE) and SATURATED when full.
+    '''
+
+    NUM_PUT = 0
+    NUM_GET = 1
+    BYTES_PUT = 2
+    PUT_NS = 3
+    GET_NS = 4
+    NUM_DROPPED = 5
+    HEALTH = 6 # not a counter, last health seen by the producer
+    NUM_COUNTERS = 7
+
+    LOSSLESS = 'lossless'
+    DROP_WHEN_FULL = 'drop_when_full'
+    LATEST_ONLY = 'latest_only'
+    DECIMATE = 'decimate'
+    POLICIES = (LOSSLESS, DROP_WHEN_FULL, LATEST_ONLY, DECIMATE)
+
+    HEALTHY = 0
+    BEHIND = 1
+    SATURATED = 2
+    HEALTH_NAMES = ('healthy', 'behind', 'saturated')
+
+    def __init__(
+            self, 
+            queue: Any,
+            policy: str = LOSSLESS,
+            alert_ratio: float = 0.8,
+            pressure_ratio: float = 0.5,
+            max_decimation: int = 8
+        ) -> None:
+
+        if policy not in self.POLICIES:
+            raise ValueError(f'policy must be one of {self.POLICIES}')
+
+        self.queue = queue
+        self.policy = policy
+        self.alert_ratio = alert_ratio
+        self.pressure_ratio = pressure_ratio
+        self.max_decimation = max_decimation
+        self.num_decimated = 0
+        self.counters = RawArray('Q', self.NUM_COUNTERS)
+        self.counters_lock = Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # during unpickling self.queue does not exist yet
+        if name == 'queue':
+            raise AttributeError(name)
+        return getattr(self.queue, name)
+
+    def decimation(self, fill_ratio: float) -> int:
+        '''1 below pressure_ratio, then doubling up to max_decimation as the queue fills'''
+        if fill_ratio < self.pressure_ratio:
+            return 1
+        levels = int(np.log2(self.max_decimation))
+        level = 1 + int(levels * (fill_ratio - self.pressure_ratio) / (1 - self.pressure_ratio))
+        return min(2**level, self.max_decimation)
+
+    def admit(self) -> Tuple[bool, int]:
+        '''whether the next message is put, and health of the edge'''
+
+        depth = self.queue.qsize() or 0
+        capacity = self.queue.get_num_items() or 0
+        if capacity == 0:
+            # item size (and thus capacity) unknown before the first put
+            return True, self.HEALTHY
+
+        fill_ratio = depth / capacity
+        if depth >= capacity:
+            return self.policy == self.LOSSLESS, self.SATURATED
+
+        threshold = self.pressure_ratio if self.policy == self.DECIMATE else self.alert_ratio
+        health = self.BEHIND if fill_ratio >= threshold else self.HEALTHY
+
+        if self.policy == self.DECIMATE:
+            decimation = self.decimation(fill_ratio)
+            if decimation == 1:
+                self.num_decimated = 0
+                return True, health
+            self.num_decimated += 1
+            return self.num_decimated % decimation == 0, health
+
+        return True, health
+
+    def put(self, element: Any, *args, **kwargs) -> Any:
+        start = time.perf_counter_ns()
+        keep, health = self.admit()
+        res = self.queue.put(element, *args, **kwargs) if keep else None
+        elapsed = time.perf_counter_ns() - start
+
+        with self.counters_lock:
+            if keep:
+                self.counters[self.NUM_PUT] += 1
+                self.counters[self.BYTES_PUT] += getattr(element, 'nbytes', 0)
+            else:
+                self.counters[self.NUM_DROPPED] += 1
+            self.counters[self.PUT_NS] += elapsed
+            self.counters[self.HEALTH] = health
+        return res
+
+    def get(self, *args, **kwargs) -> Any:
+        start = time.perf_counter_ns()
+        num_skipped = 0
+        try:
+            res = self.queue.get(*args, **kwargs)
+            if res is not None and self.policy == self.LATEST_ONLY:
+                # single consumer: items are there, get doesn't block
+                while (self.queue.qsize() or 0) > 0:
+                    latest = self.queue.get()
+                    if latest is None:
+                        break
+                    res = latest
+                    num_skipped += 1
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            with self.counters_lock:
+                self.counters[self.GET_NS] += elapsed
+                self.counters[self.NUM_DROPPED] += num_skipped
+
+        if res is not None:
+            with self.counters_lock:
+                self.counters[self.NUM_GET] += 1
+        return res
+
+    def read_counters(self) -> NDArray:
+        with self.counters_lock:
+            return np.array(self.counters[:], dtype=np.uint64)
+
+class RollingHistogram:
+    '''Histogram over the last window_size samples, plus cumulative counts for the whole run'''
+
+    def __init__(self, bin_edges: NDArray, window_size: int = 1000) -> None:
+        self.bin_edges = np.asarray(bin_edges)
+        self.num_bins = len(self.bin_edges) - 1
+        self.window = deque(maxlen=window_size)
+        self.counts = np.zeros(self.num_bins, dtype=np.int64)
+        self.cumulative_counts = np.zeros(self.num_bins, dtype=np.int64)
+        self.cumulative_sum = 0.0
+
+    def add(self, value: float) -> None:
+        # values outside the range go in the edge bins
+        bin = int(np.clip(np.searchsorted(self.bin_edges, value, side='right') - 1, 0, self.num_bins - 1))
+        if len(self.window) == self.window.maxlen:
+            self.counts[self.window[0]] -= 1
+        self.window.append(bin)
+        self.counts[bin] += 1
+        self.cumulative_counts[bin] += 1
+        self.cumulative_sum += value
+
+class QueueMetrics:
+    '''
+    Sample depth and counters of instrumented queues, keep histograms and
+    summarize every summary_interval_sec.
+    '''
+
+    def __init__(
+            self,
+            queues: Dict[Any, str],
+            summary_interval_sec: float = 1.0,
+            window_size: int = 1000
+        ) -> None:
+
+        self.queues = list(queues.keys())
+        self.names = list(queues.values())
+        self.summary_interval_sec = summary_interval_sec
+        self.window_size = window_size
+
+        num_queues = len(self.queues)
+        self.fill_ratio = [RollingHistogram(FILL_RATIO_BINS, window_size) for _ in range(num_queues)]
+        self.put_blocking = [RollingHistogram(BLOCKING_US_BINS, window_size) for _ in range(num_queues)]
+        self.get_blocking = [RollingHistogram(BLOCKING_US_BINS, window_size) for _ in range(num_queues)]
+
+        self.depth = np.zeros(num_queues, dtype=np.int64)
+        self.capacity = np.zeros(num_queues, dtype=np.int64)
+        self.depth_sum = np.zeros(num_queues, dtype=np.float64)
+        self.depth_max = np.zeros(num_queues, dtype=np.int64)
+        self.num_samples = 0
+        self.last_counters = [self._read_counters(q) for q in self.queues]
+        self.totals = [c.copy() for c in self.last_counters]
+        self.last_summary = time.perf_counter()
+
+    @staticmethod
+    def _read_counters(queue: Any) -> NDArray:
+        if isinstance(queue, InstrumentedQueue):
+            return queue.read_counters()
+        # not instrumented: only depth is available
+        return np.zeros(InstrumentedQueue.NUM_COUNTERS, dtype=np.uint64)
+
+    def sample(self) -> None:
+
+        for i, queue in enumerate(self.queues):
+            depth = queue.qsize() or 0
+            capacity = queue.get_num_items() or 0
+            self.depth[i] = depth
+            self.capacity[i] = capacity
+            self.depth_sum[i] += depth
+            self.depth_max[i] = max(self.depth_max[i], depth)
+            if capacity > 0:
+                self.fill_ratio[i].add(depth/capacity)
+
+        self.num_samples += 1
+
+    def summary_due(self) -> bool:
+        return time.perf_counter() - self.last_summary >= self.summary_interval_sec
+
+    def summarize(self) -> NDArray:
+
+        now = time.perf_counter()
+        elapsed = now - self.last_summary
+        self.last_summary = now
+        timestamp = get_time_ns()
+
+        records = np.zeros(len(self.queues), dtype=QUEUE_METRICS_DTYPE)
+        for i, queue in enumerate(self.queues):
+            counters = self._read_counters(queue)
+            delta = (counters - self.last_counters[i]).astype(np.float64)
+            self.last_counters[i] = counters
+            self.totals[i] = counters
+
+            num_put = delta[InstrumentedQueue.NUM_PUT]
+            num_get = delta[InstrumentedQueue.NUM_GET]
+            put_blocking_us = 1e-3*delta[InstrumentedQueue.PUT_NS]/num_put if num_put else 0
+            get_blocking_us = 1e-3*delta[InstrumentedQueue.GET_NS]/num_get if num_get else 0
+            if num_put:
+                self.put_blocking[i].add(put_blocking_us)
+            if num_get:
+                self.get_blocking[i].add(get_blocking_us)
+
+            records[i] = (
+                timestamp,
+                i,
+                self.depth_sum[i]/max(self.num_samples, 1),
+                self.depth_max[i],
+                self.capacity[i],
+                num_put/elapsed,
+                num_get/elapsed,
+                put_blocking_us,
+                get_blocking_us,
+                delta[InstrumentedQueue.BYTES_PUT]/num_put if num_put else 0,
+                delta[InstrumentedQueue.NUM_DROPPED],
+                counters[InstrumentedQueue.HEALTH]
+            )
+
+        self.depth_sum[:] = 0
+        self.depth_max[:] = 0
+        self.num_samples = 0
+        return records
+
+    def edge_status(self) -> Tuple[NDArray, NDArray]:
+        '''total messages dropped and current health of each queue'''
+        counters = np.array([self._read_counters(q) for q in self.queues])
+        return counters[:, InstrumentedQueue.NUM_DROPPED], counters[:, InstrumentedQueue.HEALTH]
+
+    def policies(self) -> List[str]:
+        return [getattr(q, 'policy', InstrumentedQueue.LOSSLESS) for q in self.queues]
+
+    def histograms(self) -> Dict[str, NDArray]:
+        '''cumulative histograms for the whole run'''
+        return {
+            'queue_names': np.array(self.names),
+            'fill_ratio_bin_edges': FILL_RATIO_BINS,
+            'fill_ratio_counts': np.array([h.cumulative_counts for h in self.fill_ratio]),
+            'blocking_us_bin_edges': BLOCKING_US_BINS,
+            'put_blocking_counts': np.array([h.cumulative_counts for h in self.put_blocking]),
+            'get_blocking_counts': np.array([h.cumulative_counts for h in self.get_blocking]),
+        }
+
+    def prometheus_text(self, last_summary: Optional[NDArray] = None) -> str:
+        '''Prometheus text exposition format'''
+
+        lines = []
+
+        def gauge(metric: str, help: str, values: List) -> None:
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} gauge')
+            for name, value in zip(self.names, values):
+                lines.append(f'{metric}{{queue="{name}"}} {value}')
+
+        def counter(metric: str, help: str, index: int) -> None:
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} counter')
+            for name, totals in zip(self.names, self.totals):
+                lines.append(f'{metric}{{queue="{name}"}} {int(totals[index])}')
+
+        def histogram(metric: str, help: str, histograms: List[RollingHistogram]) -> None:
+            lines.append(f'# HELP {metric} {help}')
+            lines.append(f'# TYPE {metric} histogram')
+            for name, h in zip(self.names, histograms):
+                cumsum = np.cumsum(h.cumulative_counts)
+                for edge, count in zip(h.bin_edges[1:], cumsum):
+                    lines.append(f'{metric}_bucket{{queue="{name}",le="{edge:g}"}} {count}')
+                lines.append(f'{metric}_bucket{{queue="{name}",le="+Inf"}} {cumsum[-1]}')
+                lines.append(f'{metric}_sum{{queue="{name}"}} {h.cumulative_sum}')
+                lines.append(f'{metric}_count{{queue="{name}"}} {cumsum[-1]}')
+
+        gauge('zebvr_queue_depth', 'number of items in queue', self.depth)
+        gauge('zebvr_queue_capacity', 'max number of items in queue', self.capacity)
+        if last_summary is not None:
+            gauge('zebvr_queue_put_rate_hz', 'put rate over last summary interval', last_summary['put_rate_hz'])
+            gauge('zebvr_queue_get_rate_hz', 'get rate over last summary interval', last_summary['get_rate_hz'])
+        counter('zebvr_queue_put_total', 'number of items put', InstrumentedQueue.NUM_PUT)
+        counter('zebvr_queue_get_total', 'number of items retrieved', InstrumentedQueue.NUM_GET)
+        counter('zebvr_queue_put_bytes_total', 'number of bytes put', InstrumentedQueue.BYTES_PUT)
+        counter('zebvr_queue_dropped_total', 'number of items dropped by the edge policy', InstrumentedQueue.NUM_DROPPED)
+        gauge('zebvr_queue_health', '0: healthy, 1: consumer behind, 2: saturated', [int(t[InstrumentedQueue.HEALTH]) for t in self.totals])
+        histogram('zebvr_queue_fill_ratio', 'sampled queue depth / capacity', self.fill_ratio)
+        histogram('zebvr_queue_put_blocking_us', 'mean time in put per message', self.put_blocking)
+        histogram('zebvr_queue_get_blocking_us', 'mean time in get per message', self.get_blocking)
+
+        return '\n'.join(lines) + '\n'
+
+class PrometheusEndpoint:
+    '''Serve the latest metrics text on localhost from a daemon thread'''
+
+    def __init__(self, port: int, host: str = '127.0.0.1') -> None:
+
+        self.text = ''
+        self.lock = threading.Lock()
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with endpoint.lock:
+                    body = endpoint.text.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def update(self, text: str) -> None:
+        with self.lock:
+            self.text = text
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
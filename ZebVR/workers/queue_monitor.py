@@ -1,29 +1,56 @@
 from dagline import WorkerNode
 from ipc_tools import QueueLike
 from typing import Dict, Optional
+from pathlib import Path
 from PyQt5.QtWidgets import QApplication
+import numpy as np
 from ..widgets import QueueWidget, QueueMonitorWidget
+from ..utils import append_timestamp_to_filename, BinaryRecordWriter, start_sampling_profiler
+from .queue_metrics import InstrumentedQueue, QueueMetrics, PrometheusEndpoint, QUEUE_METRICS_DTYPE
 import time
 
 class QueueMonitor(WorkerNode):
+    '''
+    Sample queues at sampling_rate_hz, update the GUI at gui_refresh_rate_hz
+    and write per-queue summaries every summary_interval_sec. Cumulative
+    histograms are saved next to the metrics file at the end of the run.
+    Set prometheus_port to expose metrics on localhost, 0 disables.
+    A message is printed when the consumer of a queue falls behind 
+    (see InstrumentedQueue health), or when a DROP_WHEN_FULL edge (savers)
+    drops messages, at most every alert_interval_sec.
+    '''
 
     def __init__(
-            self, 
+            self,
             queues : Dict[QueueLike, str],
-            refresh_interval_seconds: int = 0.1,
-            *args, 
+            sampling_rate_hz: float = 200,
+            gui_refresh_rate_hz: float = 10,
+            summary_interval_sec: float = 1.0,
+            metrics_file: Optional[str] = 'queue_metrics.bin',
+            prometheus_port: int = 0,
+            alert_interval_sec: float = 5.0,
+            *args,
             **kwargs
         ):
 
         super().__init__(*args, **kwargs)
         self.queues = queues
         self.widgets = []
-        self.refresh_interval_seconds = refresh_interval_seconds
+        self.sampling_rate_hz = sampling_rate_hz
+        self.gui_refresh_rate_hz = gui_refresh_rate_hz
+        self.summary_interval_sec = summary_interval_sec
+        self.metrics_file = metrics_file
+        self.prometheus_port = prometheus_port
+        self.alert_interval_sec = alert_interval_sec
+        self.metrics = None
+        self.writer = None
+        self.endpoint = None
 
     def initialize(self) -> None:
 
         super().initialize()
-        
+        start_sampling_profiler(self)
+
         self.app = QApplication([])
         self.window = QueueMonitorWidget()
 
@@ -34,16 +61,106 @@ class QueueMonitor(WorkerNode):
 
         self.window.show()
 
+        self.metrics = QueueMetrics(self.queues, self.summary_interval_sec)
+        self.gui_depth_max = np.zeros(len(self.queues), dtype=np.int64)
+        self.last_summary = None
+        self.last_alert = np.full(len(self.queues), -np.inf)
+        self.alerted_dropped = np.zeros(len(self.queues), dtype=np.int64)
+
+        if self.metrics_file:
+            self.metrics_filename = append_timestamp_to_filename(self.metrics_file)
+            self.writer = BinaryRecordWriter(
+                self.metrics_filename,
+                QUEUE_METRICS_DTYPE,
+                header = {
+                    'timebase': 'get_time_ns',
+                    'queues': list(self.queues.values()),
+                    'policies': self.metrics.policies(),
+                    'sampling_rate_hz': self.sampling_rate_hz,
+                    'summary_interval_sec': self.summary_interval_sec
+                }
+            )
+
+        if self.prometheus_port:
+            try:
+                self.endpoint = PrometheusEndpoint(self.prometheus_port)
+            except OSError as e:
+                print(f'Queue metrics endpoint disabled: {e}')
+                self.endpoint = None
+
+        self.next_sample = time.perf_counter()
+        self.next_gui_refresh = self.next_sample
+
+    def cleanup(self) -> None:
+
+        super().cleanup()
+
+        if self.writer is not None:
+            self.writer.write(self.metrics.summarize())
+            self.writer.close()
+            self.writer = None
+            histogram_file = Path(self.metrics_filename).with_suffix('')
+            np.savez(f'{histogram_file}_histograms.npz', **self.metrics.histograms())
+
+        if self.endpoint is not None:
+            self.endpoint.close()
+            self.endpoint = None
+
+    def alert(self, health: np.ndarray, num_dropped: np.ndarray, now: float) -> None:
+        for i, (name, policy) in enumerate(zip(self.queues.values(), self.metrics.policies())):
+            # drops are expected on displays and previews, not on savers
+            data_lost = policy == InstrumentedQueue.DROP_WHEN_FULL and num_dropped[i] > self.alerted_dropped[i]
+            if health[i] == InstrumentedQueue.HEALTHY and not data_lost:
+                continue
+            if now - self.last_alert[i] < self.alert_interval_sec:
+                continue
+            self.last_alert[i] = now
+            if data_lost:
+                print(f'queue {name}: {num_dropped[i] - self.alerted_dropped[i]} messages not saved, {num_dropped[i]} in total')
+                self.alerted_dropped[i] = num_dropped[i]
+            else:
+                fill = self.metrics.depth[i] / self.metrics.capacity[i] if self.metrics.capacity[i] else 0
+                print(
+                    f'queue {name}: consumer falling behind ({InstrumentedQueue.HEALTH_NAMES[health[i]]}, '
+                    f'{fill:.0%} full, {num_dropped[i]} dropped)'
+                )
+
     def process_data(self, data) -> None:
 
-        self.app.processEvents()
-        self.app.sendPostedEvents()
+        self.metrics.sample()
+        np.maximum(self.gui_depth_max, self.metrics.depth, out=self.gui_depth_max)
 
-        for queue, widget in zip(self.queues.keys(), self.widgets):
-            widget.set_state(queue.qsize(), queue.get_num_items())
+        now = time.perf_counter()
+        if now >= self.next_gui_refresh:
+            self.app.processEvents()
+            self.app.sendPostedEvents()
 
-        time.sleep(self.refresh_interval_seconds)
+            # show the peak since last refresh, so that short bursts are visible
+            num_dropped, health = self.metrics.edge_status()
+            for widget, depth, capacity, dropped, status in zip(
+                    self.widgets, self.gui_depth_max, self.metrics.capacity, num_dropped, health
+                ):
+                widget.set_state(int(depth), int(capacity), int(dropped), int(status))
+            self.alert(health, num_dropped, now)
+            self.gui_depth_max[:] = 0
+            self.next_gui_refresh = now + 1/self.gui_refresh_rate_hz
+
+        if self.metrics.summary_due():
+            self.last_summary = self.metrics.summarize()
+            if self.writer is not None:
+                self.writer.write(self.last_summary)
+                self.writer.flush()
+            if self.endpoint is not None:
+                self.endpoint.update(self.metrics.prometheus_text(self.last_summary))
+
+        # fixed rate sampling, don't accumulate drift
+        self.next_sample += 1/self.sampling_rate_hz
+        delay = self.next_sample - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_sample = time.perf_counter()
 
     def process_metadata(self, metadata: Dict) -> Optional[Dict]:
         pass
-        
\ No newline at end of file
+
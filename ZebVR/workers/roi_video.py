@@ -0,0 +1,77 @@
+import math
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from numpy.typing import NDArray
+
+ROI = Tuple[int, int, int, int] # x, y, w, h as in settings['identity']['ROIs']
+
+def even_ROIs(ROIs: Sequence[ROI]) -> List[ROI]:
+    # video codecs require images with even size
+    return [(int(x), int(y), 2*(int(w)//2), 2*(int(h)//2)) for x, y, w, h in ROIs]
+
+def roi_filename(video_filename: Path, identity: int) -> Path:
+    return video_filename.with_name(f'{video_filename.stem}_roi_{identity:03}{video_filename.suffix}')
+
+def roi_manifest_filename(video_filename: Path) -> Path:
+    return video_filename.with_name(f'{video_filename.stem}_rois.json')
+
+class ROIMosaic:
+    '''
+    Pack ROIs in a grid, each in the top-left corner of a cell of the size of
+    the largest ROI. The mosaic is allocated once, the space around ROIs stays black.
+    '''
+
+    def __init__(self, ROIs: Sequence[ROI], num_cols: Optional[int] = None) -> None:
+
+        self.ROIs = list(ROIs)
+        self.num_cols = num_cols or math.ceil(math.sqrt(len(self.ROIs)))
+        self.num_rows = math.ceil(len(self.ROIs) / self.num_cols)
+        self.cell_width = max(w for _, _, w, _ in self.ROIs)
+        self.cell_height = max(h for _, _, _, h in self.ROIs)
+        self.height = self.num_rows * self.cell_height
+        self.width = self.num_cols * self.cell_width
+        self.positions = [
+            ((n % self.num_cols) * self.cell_width, (n // self.num_cols) * self.cell_height)
+            for n in range(len(self.ROIs))
+        ]
+        self.mosaic = None
+
+    def __call__(self, image: NDArray) -> NDArray:
+
+        shape = (self.height, self.width) + image.shape[2:]
+        if self.mosaic is None or self.mosaic.shape != shape or self.mosaic.dtype != image.dtype:
+            self.mosaic = np.zeros(shape, dtype=image.dtype)
+
+        for (x, y, w, h), (mx, my) in zip(self.ROIs, self.positions):
+            self.mosaic[my:my+h, mx:mx+w] = image[y:y+h, x:x+w]
+
+        return self.mosaic
+
+def roi_manifest(
+        roi_mode: str,
+        ROIs: Sequence[ROI],
+        video_filename: Path,
+        timings_filename: Path,
+        mosaic: Optional[ROIMosaic] = None
+    ) -> Dict:
+    '''
+    Where each ROI is in the recording. All ROIs share the same timings file:
+    frame i of every ROI video (or of the mosaic) is row i of the timings.
+    '''
+
+    rois = []
+    for identity, (x, y, w, h) in enumerate(ROIs):
+        roi = {'identity': identity, 'origin': [x, y], 'shape': [h, w]}
+        if roi_mode == 'per ROI':
+            roi['filename'] = str(roi_filename(video_filename, identity))
+        else:
+            roi['filename'] = str(video_filename)
+            roi['mosaic_origin'] = list(mosaic.positions[identity])
+        rois.append(roi)
+
+    return {
+        'roi_mode': roi_mode,
+        'timings': str(timings_filename),
+        'rois': rois
+    }
@@ -0,0 +1,45 @@
+from dagline import WorkerNode
+import queue
+from typing import Dict, List, Optional
+from ZebVR.utils import start_sampling_profiler
+from ZebVR.utils.run_control import RunControl, run_control_input
+
+class RunControlWorker(WorkerNode):
+    '''Forward run control messages from the main process to the workers (see ZebVR.utils.run_control)'''
+
+    POLL_TIMEOUT_SEC = 0.1
+
+    def __init__(
+            self, 
+            run_control: RunControl,
+            *args, 
+            **kwargs
+        ) -> None:
+
+        super().__init__(*args, **kwargs)
+        self.commands = run_control.commands
+        self.receivers: List[str] = []
+
+    def set_receivers(self, stages: List[str]) -> None:
+        self.receivers = list(stages)
+
+    def initialize(self) -> None:
+        super().initialize()
+        start_sampling_profiler(self)
+
+    def process_data(self, data: None) -> None:
+        pass
+
+    def process_metadata(self, metadata) -> Optional[Dict]:
+
+        # short wait so that the worker loop doesn't spin
+        try:
+            message = self.commands.get(timeout=self.POLL_TIMEOUT_SEC)
+        except queue.Empty:
+            return None
+
+        print(f"run {message['run']}: {message['run_control']}")
+        res = {}
+        for stage in self.receivers:
+            res[run_control_input(stage)] = message
+        return res
@@ -0,0 +1,169 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Union
+import numpy as np
+from numpy.typing import NDArray
+
+class FFMPEG_VideoWriter_CPU_FFV1:
+    '''
+    Lossless ffv1 encoding in a .mkv container, CPU only. Takes the same
+    frames as the other writers: yuv420p (I420, 1.5*height rows) or grayscale.
+    q, profile and preset are accepted for compatibility and ignored.
+    '''
+
+    def __init__(
+            self,
+            height: int,
+            width: int,
+            fps: int,
+            filename: Union[str, Path],
+            grayscale: bool = False,
+            *args,
+            **kwargs
+        ) -> None:
+
+        self.height = height
+        self.width = width
+        self.fps = fps
+        self.filename = Path(filename).with_suffix('.mkv')
+        self.grayscale = grayscale
+        self.process = None
+
+    def start(self, input_height: int, input_width: int) -> None:
+
+        pix_fmt = 'gray' if self.grayscale else 'yuv420p'
+        cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo',
+            '-pix_fmt', pix_fmt,
+            '-s', f'{input_width}x{input_height}',
+            '-r', str(self.fps),
+            '-i', '-',
+            '-vf', f'scale={self.width}:{self.height}:flags=neighbor',
+            '-c:v', 'ffv1',
+            '-level', '3',
+            '-pix_fmt', pix_fmt,
+            str(self.filename)
+        ]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def write_frame(self, image: NDArray) -> None:
+
+        if self.process is None:
+            input_height = image.shape[0] if self.grayscale else 2*image.shape[0]//3
+            self.start(input_height, image.shape[1])
+
+        self.process.stdin.write(np.ascontiguousarray(image).tobytes())
+
+    def close(self) -> None:
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process = None
+
+class SegmentEncoder:
+    '''
+    Feed video segments to encoders from a dedicated thread.
+    Encoding happens in the ffmpeg process of each writer, the thread
+    only pushes frames into its pipe, after an optional per-frame
+    preprocessing (e.g. color conversion). Frames are dropped (and counted)
+    instead of blocking the caller when the encoder falls behind.
+    '''
+
+    def __init__(
+            self,
+            writer_constructor: Callable[[Path], Any],
+            max_queued_frames: int = 64,
+            preprocess: Optional[Callable[[NDArray], NDArray]] = None
+        ) -> None:
+
+        self.writer_constructor = writer_constructor
+        self.preprocess = preprocess
+        self.frames = queue.Queue(maxsize=max_queued_frames)
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.frames.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def open_segment(self, segment: Dict) -> None:
+        # markers are never dropped
+        self.frames.put(('open', segment))
+
+    def close_segment(self, segment: Dict) -> None:
+        self.frames.put(('close', segment))
+
+    def write_frame(self, segment: Dict, image: NDArray) -> bool:
+        try:
+            self.frames.put_nowait(('frame', image))
+        except queue.Full:
+            segment['num_dropped'] += 1
+            return False
+        return True
+
+    def run(self) -> None:
+
+        writer = None
+        while True:
+            item = self.frames.get()
+            if item is None:
+                break
+
+            kind, payload = item
+            try:
+                if kind == 'open':
+                    segment = payload
+                    writer = self.writer_constructor(Path(segment['filename']))
+                elif kind == 'frame':
+                    if self.preprocess is not None:
+                        payload = self.preprocess(payload)
+                    writer.write_frame(payload)
+                    segment['num_written'] += 1
+                elif kind == 'close':
+                    writer.close()
+                    writer = None
+                    payload['complete'] = True
+            except Exception as e:
+                print(f"segment {segment['segment']}: {e}")
+                segment['num_errors'] += 1
+
+        if writer is not None:
+            writer.close()
+
+def new_segment(segment_index: int, filename: Path, encoder_index: int) -> Dict:
+    return {
+        'segment': segment_index,
+        'filename': str(filename),
+        'encoder': encoder_index,
+        'first_index': None,
+        'last_index': None,
+        'first_timestamp': None,
+        'last_timestamp': None,
+        'first_camera_timestamp': None,
+        'last_camera_timestamp': None,
+        'num_frames': 0,
+        'num_written': 0,
+        'num_dropped': 0,
+        'num_errors': 0,
+        'complete': False
+    }
+
+def write_manifest(filename: Path, manifest: Dict) -> None:
+    # write then rename, the manifest on disk is always valid JSON
+    tmp_filename = filename.with_suffix('.tmp')
+    with open(tmp_filename, 'w') as fd:
+        json.dump(manifest, fd, indent=2)
+    os.replace(tmp_filename, filename)
+
+def load_manifest(filename: Union[str, Path]) -> Dict:
+    with open(filename, 'r') as fd:
+        return json.load(fd)
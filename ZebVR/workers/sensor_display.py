@@ -0,0 +1,112 @@
+from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QLabel
+from PyQt5.QtCore import QTimer
+import pyqtgraph as pg
+from dagline import WorkerNode
+from typing import Dict, List, Optional
+from collections import deque
+from ..utils import start_sampling_profiler
+
+class SensorPlot(QWidget):
+
+    HEIGHT = 200
+    LINE_COL = (50,50,50,255)
+    LINE_WIDTH = 2
+
+    def __init__(self, label: str, num_points: int):
+
+        super().__init__()
+
+        self.label = label
+        self.timestamps = deque(maxlen = num_points)
+        self.values = deque(maxlen = num_points)
+
+        self.value_label = QLabel(f'{label}: -')
+        self.plot_widget = pg.PlotWidget()
+        self.plot_widget.setFixedHeight(self.HEIGHT)
+        self.plot_widget.setLabel('left', label)
+        self.plot_widget.setLabel('bottom', 'time (s)')
+        self.curve = self.plot_widget.plot(pen=pg.mkPen(self.LINE_COL, width=self.LINE_WIDTH))
+
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.value_label)
+        layout.addWidget(self.plot_widget)
+
+    def add_reading(self, timestamp: int, value: float) -> None:
+        self.timestamps.append(timestamp)
+        self.values.append(value)
+
+    def update_display(self) -> None:
+        if not self.values:
+            return
+        self.value_label.setText(f'{self.label}: {self.values[-1]:.2f}')
+        # seconds before the latest reading
+        latest = self.timestamps[-1]
+        self.curve.setData([1e-9*(t - latest) for t in self.timestamps], list(self.values))
+
+class SensorWindow(QWidget):
+
+    def __init__(self, channels: List[str], num_points: int, refresh_rate_hz: float):
+
+        super().__init__()
+        self.setWindowTitle('Sensors')
+
+        self.plots = [SensorPlot(label, num_points) for label in channels]
+        layout = QVBoxLayout(self)
+        for plot in self.plots:
+            layout.addWidget(plot)
+
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.update_display)
+        self.timer.start(int(1000/refresh_rate_hz))
+
+    def update_display(self) -> None:
+        for plot in self.plots:
+            plot.update_display()
+
+class SensorDisplay(WorkerNode):
+    '''
+    Latest readings of sensor loggers, one plot per channel. Senders use
+    sensor_message_dtype, channel indices refer to channels.
+    '''
+
+    def __init__(
+            self,
+            channels: List[str],
+            num_points: int = 600,
+            refresh_rate_hz: float = 1,
+            *args,
+            **kwargs
+        ):
+
+        super().__init__(*args, **kwargs)
+        self.channels = channels
+        self.num_points = num_points
+        self.refresh_rate_hz = refresh_rate_hz
+
+    def initialize(self) -> None:
+
+        super().initialize()
+        start_sampling_profiler(self)
+
+        self.app = QApplication([])
+        self.window = SensorWindow(self.channels, self.num_points, self.refresh_rate_hz)
+        self.window.show()
+
+    def process_data(self, data) -> None:
+
+        self.app.processEvents()
+        self.app.sendPostedEvents()
+
+        if data is None:
+            return
+
+        for reading in data['readings']:
+            # timestamp 0: no reading yet
+            if reading['timestamp'] > 0:
+                self.window.plots[int(reading['channel'])].add_reading(
+                    int(reading['timestamp']),
+                    float(reading['value'])
+                )
+
+    def process_metadata(self, metadata: Dict) -> Optional[Dict]:
+        pass
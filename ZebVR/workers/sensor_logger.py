@@ -0,0 +1,344 @@
+from dagline import WorkerNode
+import time
+import threading
+import queue
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+from numpy.typing import NDArray
+from ZebVR.utils import (
+    get_time_ns, 
+    append_timestamp_to_filename, 
+    BinaryRecordWriter, 
+    load_binary_records, 
+    start_sampling_profiler,
+    run_control_message
+)
+from ZebVR.utils.run_control import START_RUN
+
+SENSOR_RECORD_DTYPE = np.dtype([
+    ('timestamp', np.int64), # get_time_ns, same timebase as camera and tracking
+    ('channel', np.uint16),
+    ('value', np.float64)
+])
+
+def sensor_message_dtype(num_channels: int) -> np.dtype:
+    '''latest reading of each channel, published to displays'''
+    return np.dtype([('readings', SENSOR_RECORD_DTYPE, (num_channels,))])
+
+class DS18B20Sensor:
+
+    def __init__(self, serial_port: str = '/dev/ttyUSB0') -> None:
+        # sensors are constructed in the worker process, hardware backends
+        # are only imported there
+        from ds18b20 import read_temperature_celsius
+        self.read_temperature_celsius = read_temperature_celsius
+        self.serial_port = serial_port
+
+    def read(self) -> float:
+        # this blocks and takes ~ 1s
+        return self.read_temperature_celsius(port=self.serial_port)
+
+    def close(self) -> None:
+        pass
+
+class DAQAnalogSensor:
+
+    def __init__(self, board_type: Any, board_id: Union[int, str], channel: int) -> None:
+        from daq_tools import DAQ_CONSTRUCTORS
+        self.channel = channel
+        self.board = DAQ_CONSTRUCTORS[board_type](board_id = board_id)
+
+    def read(self) -> float:
+        return self.board.analog_read(self.channel)
+
+    def close(self) -> None:
+        self.board.close()
+
+class PowermeterSensor:
+
+    def __init__(self, powermeter_constructor: Callable[[], Any], wavelength_nm: float) -> None:
+        self.powermeter = powermeter_constructor()
+        self.powermeter.set_wavelength_nm(wavelength_nm)
+
+    def read(self) -> float:
+        return self.powermeter.get_power_density_microW_cm2()
+
+    def close(self) -> None:
+        self.powermeter.close()
+
+class MockSensor:
+    '''Noisy constant value, with configurable read duration'''
+
+    def __init__(
+            self,
+            value: float = 0.0,
+            noise: float = 0.1,
+            read_duration_sec: float = 0.1,
+        ) -> None:
+
+        self.value = value
+        self.noise = noise
+        self.read_duration_sec = read_duration_sec
+
+    def read(self) -> float:
+        time.sleep(self.read_duration_sec)
+        return self.value + self.noise * np.random.randn()
+
+    def close(self) -> None:
+        pass
+
+class SensorAcquisition:
+    '''
+    Read a sensor at a fixed period in a dedicated thread.
+    Readings are kept in a ring and published through a queue.
+    '''
+
+    def __init__(
+            self,
+            sensor: Any,
+            sample_period_sec: float = 1.0,
+            ring_size: int = 600
+        ) -> None:
+
+        self.sensor = sensor
+        self.sample_period_sec = sample_period_sec
+        self.ring = deque(maxlen=ring_size)  # (timestamp, value)
+        self.readings = queue.Queue()
+        self.num_overruns = 0
+        self.num_errors = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+
+        period_ns = int(1e9*self.sample_period_sec)
+        deadline = get_time_ns()
+
+        while not self.stop_event.is_set():
+
+            timestamp = get_time_ns()
+            try:
+                value = self.sensor.read()
+                reading = (timestamp, value)
+                self.ring.append(reading)
+                self.readings.put(reading)
+            except Exception as e:
+                print(e)
+                self.num_errors += 1
+
+            deadline += period_ns
+            delay = deadline - get_time_ns()
+            if delay < 0:
+                # read took longer than the sample period
+                self.num_overruns += 1
+                deadline = get_time_ns()
+            else:
+                self.stop_event.wait(1e-9*delay)
+
+    def latest(self) -> Optional[Tuple[int, float]]:
+        try:
+            return self.ring[-1]
+        except IndexError:
+            return None
+
+@dataclass
+class SensorChannel:
+    name: str
+    sensor_constructor: Optional[Callable[[], Any]] # called in the worker process, None: received from another worker
+    sample_period_sec: float = 1.0
+    unit: str = ''
+
+class SensorLogWriter(BinaryRecordWriter):
+    '''Gzip-compressed stream of SENSOR_RECORD_DTYPE records, channels described in the header'''
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            channels: List[SensorChannel],
+            compresslevel: int = 1
+        ) -> None:
+
+        header = {
+            'timebase': 'get_time_ns',
+            'channels': [
+                {'name': c.name, 'unit': c.unit, 'sample_period_sec': c.sample_period_sec}
+                for c in channels
+            ]
+        }
+        super().__init__(filename, SENSOR_RECORD_DTYPE, header, compress=True, compresslevel=compresslevel)
+
+def load_sensor_log(filename: Union[str, Path]) -> Tuple[Dict, NDArray]:
+    return load_binary_records(filename)
+
+class SensorLoggerWorker(WorkerNode):
+    '''
+    Channels with a sensor constructor are read here, each in its own thread.
+    The others are received on data inputs (sensor_message_dtype, e.g. from 
+    the temperature logger), with their index in channels. The latest
+    readings of the channels read here are published on sensor_readings.
+    '''
+
+    POLL_INTERVAL_SEC = 0.05
+    FLUSH_INTERVAL_SEC = 10
+
+    def __init__(
+            self,
+            channels: List[SensorChannel],
+            filename: str = 'sensors.gz',
+            ring_size: int = 600,
+            *args,
+            **kwargs
+        ) -> None:
+
+        super().__init__(*args, **kwargs)
+
+        self.channels = channels
+        self.filename = filename
+        self.ring_size = ring_size
+        self.writer = None
+        self.acquisitions: Dict[int, SensorAcquisition] = {} # by channel index
+        self.last_flush = 0
+        self.message = np.zeros((), dtype=sensor_message_dtype(len(channels)))
+
+    def set_filename(self, filename:str):
+        self.filename = filename
+
+    def initialize(self) -> None:
+
+        super().initialize()
+        start_sampling_profiler(self)
+        self.open_run()
+
+        self.acquisitions = {}
+        for channel_id, channel in enumerate(self.channels):
+            if channel.sensor_constructor is None:
+                continue
+            acquisition = SensorAcquisition(
+                sensor = channel.sensor_constructor(),
+                sample_period_sec = channel.sample_period_sec,
+                ring_size = self.ring_size
+            )
+            acquisition.start()
+            self.acquisitions[channel_id] = acquisition
+
+    def open_run(self) -> None:
+        filename = append_timestamp_to_filename(self.filename)
+        self.writer = SensorLogWriter(filename, self.channels)
+        self.last_flush = time.monotonic()
+
+    def close_run(self) -> None:
+        if self.writer is not None:
+            self.write_pending()
+            self.writer.close()
+            self.writer = None
+
+    def cleanup(self) -> None:
+
+        super().cleanup()
+
+        for acquisition in self.acquisitions.values():
+            acquisition.stop()
+            acquisition.sensor.close()
+
+        self.close_run()
+
+        for channel_id, acquisition in self.acquisitions.items():
+            print(f'sensor {self.channels[channel_id].name}: {acquisition.num_overruns} overruns, {acquisition.num_errors} errors')
+
+    def write_pending(self, received: Optional[NDArray] = None) -> int:
+
+        readings = []
+        for channel_id, acquisition in self.acquisitions.items():
+            while True:
+                try:
+                    timestamp, value = acquisition.readings.get_nowait()
+                except queue.Empty:
+                    break
+                readings.append((timestamp, channel_id, value))
+
+        if received is not None:
+            # timestamp 0: no reading yet
+            readings.extend(r for r in received['readings'].tolist() if r[0] > 0)
+
+        # readings between runs are not saved
+        if readings and self.writer is not None:
+            self.writer.write(np.array(readings, dtype=SENSOR_RECORD_DTYPE))
+
+        return len(readings)
+
+    def process_data(self, data) -> Optional[Dict]:
+
+        num_readings = self.write_pending(data)
+
+        if self.writer is not None and time.monotonic() - self.last_flush > self.FLUSH_INTERVAL_SEC:
+            self.writer.flush()
+            self.last_flush = time.monotonic()
+
+        if num_readings == 0:
+            # channels are slow, don't spin
+            time.sleep(self.POLL_INTERVAL_SEC)
+            return None
+
+        for channel_id, acquisition in self.acquisitions.items():
+            latest = acquisition.latest()
+            if latest is not None:
+                self.message['readings'][channel_id] = (latest[0], channel_id, latest[1])
+
+        res = {}
+        res['sensor_readings'] = self.message
+        return res
+
+    def process_metadata(self, metadata) -> Any:
+
+        # persistent workers: one file per run
+        control = run_control_message(metadata)
+        if control is None:
+            return
+        
+        self.close_run()
+        if control['run_control'] == START_RUN:
+            self.set_filename(control['settings']['sensors']['filename'])
+            self.open_run()
+
+if __name__ == '__main__':
+
+    from functools import partial
+
+    channels = [
+        SensorChannel('temperature', partial(MockSensor, value = 28.0, read_duration_sec = 0.8), 1.0, 'celsius'),
+        SensorChannel('oxygen', partial(MockSensor, value = 8.0, read_duration_sec = 0.01), 0.1, 'mg/L'),
+        SensorChannel('light_power', partial(MockSensor, value = 50.0, read_duration_sec = 0.001), 0.01, 'microW/cm2'),
+    ]
+
+    writer = SensorLogWriter('sensors_test.gz', channels)
+    acquisitions = [SensorAcquisition(c.sensor_constructor(), c.sample_period_sec) for c in channels]
+    for acquisition in acquisitions:
+        acquisition.start()
+    time.sleep(5)
+    for acquisition in acquisitions:
+        acquisition.stop()
+
+    records = []
+    for channel_id, acquisition in enumerate(acquisitions):
+        records.extend((t, channel_id, v) for t, v in acquisition.ring)
+    writer.write(np.array(records, dtype=SENSOR_RECORD_DTYPE))
+    writer.close()
+
+    header, records = load_sensor_log('sensors_test.gz')
+    for channel_id, channel in enumerate(header['channels']):
+        samples = records[records['channel'] == channel_id]
+        print(f"{channel['name']}: {len(samples)} samples, mean {samples['value'].mean():.2f} {channel['unit']}")
@@ -1,12 +1,22 @@
 import json
+from typing import Dict, Optional
 from dagline import WorkerNode
-from ZebVR.utils import append_timestamp_to_filename
+from ZebVR.utils import (
+    append_timestamp_to_filename, 
+    get_time_ns, 
+    Checkpointer, 
+    checkpoint_filename, 
+    start_sampling_profiler,
+    run_control_message
+)
+from ZebVR.utils.run_control import START_RUN
 
 class StimSaver(WorkerNode):
 
     def __init__(
             self, 
             filename: str = 'stimulus.json',
+            checkpoint_interval_sec: float = 10,
             *args, 
             **kwargs
         ) -> None:
@@ -14,6 +24,7 @@ class StimSaver(WorkerNode):
         super().__init__(*args, **kwargs)
 
         self.filename = filename
+        self.checkpoint_interval_sec = checkpoint_interval_sec
         self.fd = None
 
     def set_filename(self, filename:str):
@@ -22,19 +33,47 @@ class StimSaver(WorkerNode):
     def initialize(self):
 
         super().initialize()
-        
+        start_sampling_profiler(self)
+        self.open_run()
+
+    def open_run(self) -> None:
         file = append_timestamp_to_filename(self.filename)
+        self.file = file
         self.fd = open(file, 'w')
+        self.checkpointer = Checkpointer(self.checkpoint_interval_sec, checkpoint_filename(file))
+        self.checkpointer.add_file(self.fd)
+        self.num_lines = 0
 
-    def cleanup(self):
-        super().cleanup()
+    def close_run(self) -> None:
         if self.fd is not None:
+            self.checkpointer.checkpoint(self.checkpoint_state())
             self.fd.close()
+            self.fd = None
+
+    def cleanup(self):
+        super().cleanup()
+        self.close_run()
+
+    def checkpoint_state(self):
+        return {'num_lines': self.num_lines, 'timestamp': get_time_ns()}
 
     def process_data(self, data) -> None:
         pass
         
-    def process_metadata(self, metadata) -> None:
+    def process_metadata(self, metadata) -> Optional[Dict]:
+
+        # persistent workers: one file per run, starting with a run marker
+        control = run_control_message(metadata)
+        if control is not None:
+            self.close_run()
+            if control['run_control'] == START_RUN:
+                self.set_filename(control['settings']['settings']['stim_output']['filename'])
+                self.open_run()
+                marker = {key: control[key] for key in ('run_control', 'run', 'timestamp')}
+                json.dump(marker, self.fd)
+                self.fd.write('\n')
+                self.num_lines += 1
+            return
 
         if self.fd is None:
             return
@@ -42,7 +81,25 @@ class StimSaver(WorkerNode):
         if metadata is None:
             return
         
-        print(metadata)
+        # the DAQ sends the logs of several commands together
+        entries = metadata if isinstance(metadata, list) else [metadata]
+
+        # logged entries, with their position in the log, can trigger clip recording
+        stim_log = []
+        for entry in entries:
+            print(entry)
+            json.dump(entry, self.fd)
+            self.fd.write('\n')
+            self.num_lines += 1
+            stim_log.append({
+                'stim_log_file': str(self.file),
+                'stim_log_line': self.num_lines - 1,
+                'entry': entry
+            })
+
+        if self.checkpointer.due():
+            self.checkpointer.checkpoint(self.checkpoint_state())
 
-        json.dump(metadata, self.fd)
-        self.fd.write('\n')
\ No newline at end of file
+        res = {}
+        res['stim_log'] = stim_log
+        return res
@@ -1,16 +1,39 @@
-from ds18b20 import read_temperature_celsius, CommunicationError
 from dagline import WorkerNode
 import time
-from typing import Any
-from ZebVR.utils import get_time_ns, append_timestamp_to_filename
+import queue
+from typing import Any, Optional, Callable, Dict
+import numpy as np
+from ZebVR.utils import append_timestamp_to_filename, start_sampling_profiler, run_control_message
+from ZebVR.utils.run_control import START_RUN
+from .sensor_logger import DS18B20Sensor, MockSensor, SensorAcquisition, sensor_message_dtype
+
+class MockTemperatureSensor(MockSensor):
+
+    def __init__(
+            self,
+            temperature_celsius: float = 28.0,
+            noise_celsius: float = 0.1,
+            read_duration_sec: float = 0.1,
+        ) -> None:
+
+        super().__init__(temperature_celsius, noise_celsius, read_duration_sec)
 
 class TemperatureLoggerWorker(WorkerNode):
+    '''
+    Temperature saved to a CSV file. The latest reading is published on 
+    temperature_display and temperature_log (sensor_message_dtype, one channel).
+    '''
+
+    PUBLISH_TIMEOUT_SEC = 0.05
 
     def __init__(
-            self, 
+            self,
             filename: str = 'temperature.csv',
             serial_port: str = '/dev/ttyUSB0',
-            *args, 
+            sample_period_sec: float = 1.0,
+            ring_size: int = 600,
+            sensor_constructor: Optional[Callable[[], Any]] = None,
+            *args,
             **kwargs
         ) -> None:
 
@@ -18,34 +41,105 @@ class TemperatureLoggerWorker(WorkerNode):
 
         self.filename = filename
         self.serial_port = serial_port
+        self.sample_period_sec = sample_period_sec
+        self.ring_size = ring_size
+        self.sensor_constructor = sensor_constructor
         self.fd = None
+        self.acquisition = None
+        self.message = np.zeros((), dtype=sensor_message_dtype(1))
 
     def set_filename(self, filename:str):
         self.filename = filename
 
     def initialize(self) -> None:
         super().initialize()
+        start_sampling_profiler(self)
+        self.open_run()
+
+        if self.sensor_constructor is not None:
+            sensor = self.sensor_constructor()
+        else:
+            sensor = DS18B20Sensor(self.serial_port)
+
+        self.acquisition = SensorAcquisition(
+            sensor = sensor,
+            sample_period_sec = self.sample_period_sec,
+            ring_size = self.ring_size
+        )
+        self.acquisition.start()
+
+    def open_run(self) -> None:
         filename = append_timestamp_to_filename(self.filename)
         self.fd = open(filename, 'w')
         headers = ('timestamp', 'temperature_celsius')
         self.fd.write(','.join(headers) + '\n')
 
+    def close_run(self) -> None:
+        if self.fd is not None:
+            self.write_pending()
+            self.fd.close()
+            self.fd = None
+
     def cleanup(self):
         super().cleanup()
-        self.fd.close()
+        self.acquisition.stop()
+        self.close_run()
+        print(f'temperature logger: {self.acquisition.num_overruns} overruns, {self.acquisition.num_errors} errors')
+
+    def write_pending(self) -> None:
+        while True:
+            try:
+                timestamp, temperature = self.acquisition.readings.get_nowait()
+            except queue.Empty:
+                return
+            # readings between runs are not saved
+            if self.fd is not None:
+                self.fd.write(f"{timestamp}, {temperature}\n")
 
-    def process_data(self, data) -> None:
+    def process_data(self, data) -> Optional[Dict]:
 
+        # short wait so that the worker loop doesn't spin
         try:
-            # this blocks and takes ~ 1s
-            temperature = read_temperature_celsius(port=self.serial_port)
-        except CommunicationError as e:
-            print(e)
-            time.sleep(1)
-            return
+            timestamp, temperature = self.acquisition.readings.get(timeout=self.PUBLISH_TIMEOUT_SEC)
+        except queue.Empty:
+            return None
+
+        if self.fd is not None:
+            self.fd.write(f"{timestamp}, {temperature}\n")
+        self.write_pending()
 
-        timestamp = get_time_ns()
-        self.fd.write(f"{timestamp}, {temperature}\n")
+        timestamp, temperature = self.acquisition.latest()
+        self.message['readings'][0] = (timestamp, 0, temperature)
+        res = {}
+        res['temperature_display'] = self.message
+        res['temperature_log'] = self.message
+        return res
 
     def process_metadata(self, metadata) -> Any:
-        pass
\ No newline at end of file
+
+        # persistent workers: one file per run
+        control = run_control_message(metadata)
+        if control is None:
+            return
+        
+        self.close_run()
+        if control['run_control'] == START_RUN:
+            self.set_filename(control['settings']['temperature']['csv_filename'])
+            self.open_run()
+
+if __name__ == '__main__':
+
+    for read_duration_sec in [0.5, 1.2]:
+        acquisition = SensorAcquisition(
+            sensor = MockTemperatureSensor(read_duration_sec = read_duration_sec),
+            sample_period_sec = 1.0
+        )
+        acquisition.start()
+        time.sleep(5)
+        acquisition.stop()
+        timestamps = np.array([t for t, _ in acquisition.ring])
+        print(
+            f'read duration {read_duration_sec} s: {len(timestamps)} readings, '
+            f'sample spacing {1e-9*np.mean(np.diff(timestamps)):.3f} +/- {1e-9*np.std(np.diff(timestamps)):.3f} s, '
+            f'{acquisition.num_overruns} overruns'
+        )
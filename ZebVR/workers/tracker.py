@@ -1,4 +1,5 @@
-from typing import Any, Dict, Union
+import copy
+from typing import Any, Dict, Optional, Tuple, Union
 import numpy as np
 from numpy.typing import NDArray
 from pathlib import Path
@@ -25,6 +26,20 @@ from tracker import (
 )
 from dagline import WorkerNode
 from geometry import SimilarityTransform2D
+from ZebVR.utils import get_time_ns, apply_cpu_placement, start_sampling_profiler, mark_startup
+from ZebVR.utils.startup_timeline import FIRST_TRACKING
+from ZebVR.utils.latency_trace import TRACE_FIELD, TRACKER_RECEIVED, TRACKER_SENT, stamp, copy_trace
+
+def tracking_message_dtype(tracking_dtype: np.dtype) -> np.dtype:
+    return np.dtype([
+        ('index', int),
+        ('timestamp', np.int64),
+        ('tracking', tracking_dtype),
+        ('origin', np.int32, (2,)),
+        ('shape', np.int32, (2,)),
+        ('identity', np.int32),
+        TRACE_FIELD
+    ])
 
 class TrackerWorker(WorkerNode):
     
@@ -36,6 +51,8 @@ class TrackerWorker(WorkerNode):
             cam_width: int,
             cam_height: int,
             n_tracker_workers: int,
+            qc_decimation: int = 0,
+            warmup_ROI: Optional[Tuple[int, int, int, int]] = None,
             *args, 
             **kwargs
         ):
@@ -48,13 +65,27 @@ class TrackerWorker(WorkerNode):
         self.cam_height = cam_height
         self.cam_fps = cam_fps
         self.n_tracker_workers = n_tracker_workers
+        self.qc_decimation = qc_decimation # 0: no QC images
+        self.warmup_ROI = warmup_ROI # tracked once on start, so the first frame doesn't pay for JIT compilation
         self.current_tracking = None
+        self.output_dtypes: Dict[Tuple[int, int, int, int], Optional[np.dtype]] = {}
+
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+        if self.warmup_ROI is not None:
+            try:
+                self.track_background(self.warmup_ROI)
+            except Exception as e:
+                print(f'tracker: warm-up failed ({e})')
 
     def process_data(self, data: NDArray) -> Dict:
 
         if data is None:
             return None
 
+        received = get_time_ns()
         T = SimilarityTransform2D.translation(data['origin'][0], data['origin'][1])
 
         background = self.background_image[
@@ -65,25 +96,53 @@ class TrackerWorker(WorkerNode):
         tracking = self.tracker.track(data['image'], background, None, T)
         
         msg = np.array(
-            (data['index'], data['timestamp'], tracking, data['origin'], data['shape'], data['identity']),
-            dtype=np.dtype([
-                ('index', int),
-                ('timestamp', np.int64),
-                ('tracking', tracking.dtype),
-                ('origin', np.int32, (2,)),
-                ('shape', np.int32, (2,)),
-                ('identity', np.int32),
-            ])
+            (data['index'], data['timestamp'], tracking, data['origin'], data['shape'], data['identity'], 0),
+            dtype=tracking_message_dtype(tracking.dtype)
         )
+        copy_trace(data, msg)
+        stamp(msg, TRACKER_RECEIVED, received)
+        stamp(msg, TRACKER_SENT)
+        mark_startup(self, FIRST_TRACKING)
 
         res = {}    
         res['tracker_output_stim'] = msg # visual stimulus, TODO no need to send image, send only relevant info 
         res['tracker_output_overlay'] = msg
         res['tracker_output_saver'] = msg 
+        if self.qc_decimation > 0 and data['index'] % self.qc_decimation == 0:
+            res['tracker_output_qc'] = msg
         self.current_tracking = msg
 
         return res
         
+    def track_background(self, ROI: Tuple[int, int, int, int]) -> Optional[NDArray]:
+        '''
+        track the background of an ROI with a copy of the tracker, which may 
+        have state (e.g. Kalman filters)
+        '''
+        x, y, w, h = ROI
+        background = self.background_image[y:y+h, x:x+w]
+        return copy.deepcopy(self.tracker).track(background, background, None, SimilarityTransform2D.translation(x, y))
+
+    def output_dtype(self, ROI: Tuple[int, int, int, int]) -> Optional[np.dtype]:
+        '''
+        dtype of the messages sent for an ROI, to size queues. The tracking dtype 
+        depends on the tracker settings, it is found by tracking the background 
+        once per ROI. None if that fails.
+        '''
+        ROI = tuple(ROI)
+        if ROI in self.output_dtypes:
+            return self.output_dtypes[ROI]
+
+        dtype = None
+        try:
+            tracking = self.track_background(ROI)
+            if tracking is not None:
+                dtype = tracking_message_dtype(tracking.dtype)
+        except Exception as e:
+            print(f'tracker: tracking dtype unknown, fixed queue size used ({e})')
+        self.output_dtypes[ROI] = dtype
+        return dtype
+
     def process_metadata(self, metadata) -> Any:
 
         # handle control input
@@ -159,6 +218,7 @@ class TrackerWorker(WorkerNode):
                         tracking_param=TailTrackerParamTracking(**control['tail_tracking']),
                     )
             
+            self.output_dtypes = {}
             self.tracker = SingleFishTracker_CPU(
                 SingleFishTrackerParamTracking(
                     animal = animal,
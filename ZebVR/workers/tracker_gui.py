@@ -4,6 +4,7 @@ from numpy.typing import NDArray
 from typing import Dict, Optional
 from PyQt5.QtWidgets import QApplication
 from ..widgets import TrackerWidget
+from ..utils import start_sampling_profiler
 from pathlib import Path
 from typing import Union, Tuple
 
@@ -27,6 +28,7 @@ class TrackerGui(WorkerNode):
 
     def initialize(self) -> None:
         super().initialize()
+        start_sampling_profiler(self)
         
         self.app = QApplication([])
         self.window = TrackerWidget(
@@ -8,6 +8,7 @@ from tracker import SingleFishOverlay
 from image_tools import im2uint8
 from geometry import SimilarityTransform2D
 from ..widgets import TrackingDisplayWidget, TrackerType, DisplayType
+from ..utils import start_sampling_profiler
 
 class TrackingDisplay(WorkerNode):
 
@@ -30,6 +31,7 @@ class TrackingDisplay(WorkerNode):
     def initialize(self) -> None:
 
         super().initialize()
+        start_sampling_profiler(self)
         
         self.app = QApplication([])
         self.window = TrackingDisplayWidget(n_animals=self.n_animals)
@@ -0,0 +1,145 @@
+from dagline import WorkerNode
+import json
+import numpy as np
+from numpy.typing import NDArray
+from pathlib import Path
+from typing import Any, Dict, Tuple, Union
+from image_tools import im2uint8
+from ZebVR.utils import (
+    append_timestamp_to_filename, 
+    ChunkedImageStoreWriter, 
+    ChunkedImageStore, 
+    apply_cpu_placement, 
+    start_sampling_profiler,
+    run_control_message
+)
+from ZebVR.utils.run_control import START_RUN
+
+QC_RECORD_DTYPE = np.dtype([
+    ('index', np.int64),
+    ('timestamp', np.int64),
+    ('identity', np.int32),
+])
+QC_TRACKERS = ('animals', 'body', 'eyes', 'tail')
+QC_IMAGES = ('image_processed', 'mask')
+
+class TrackingQCRecorder(WorkerNode):
+    '''
+    Store the tracker's processed images and masks for quality control, in
+    compressed chunked stores (see ZebVR.utils.chunked_image_store), one
+    per identity, tracker and image: <folder>/qc_<time>/<identity>/<tracker>_<image>.
+    Trackers only send every decimation-th frame (TrackerWorker.qc_decimation).
+    Images are stored as uint8 and frames are dropped rather than waiting
+    when compression falls behind. On persistent workers, each run is
+    stored in its own qc_<time> folder, with the run index in run.json.
+    '''
+
+    def __init__(
+            self,
+            folder: Union[str, Path],
+            chunk_frames: int = 50,
+            num_threads: int = 2,
+            *args,
+            **kwargs
+        ) -> None:
+
+        super().__init__(*args, **kwargs)
+        self.folder = Path(folder)
+        self.chunk_frames = chunk_frames
+        self.num_threads = num_threads
+
+    def initialize(self) -> None:
+        super().initialize()
+        apply_cpu_placement(self)
+        start_sampling_profiler(self)
+        self.record = np.zeros((), dtype=QC_RECORD_DTYPE)
+        self.writers = None
+        self.open_run()
+
+    def set_folder(self, folder: Union[str, Path]) -> None:
+        self.folder = Path(folder)
+
+    def open_run(self, run: int = 0) -> None:
+        self.store_folder = append_timestamp_to_filename(self.folder / 'qc')
+        self.writers: Dict[Tuple[int, str, str], ChunkedImageStoreWriter] = {}
+        self.run = run
+
+    def close_run(self) -> None:
+        if self.writers is None:
+            return
+        num_frames = sum(writer.num_frames for writer in self.writers.values())
+        num_dropped = sum(writer.num_dropped for writer in self.writers.values())
+        for writer in self.writers.values():
+            writer.close()
+        if self.writers:
+            with open(self.store_folder / 'run.json', 'w') as fd:
+                json.dump({'run': self.run}, fd)
+            print(f'QC images: {num_frames} stored, {num_dropped} dropped')
+        self.writers = None
+
+    def cleanup(self) -> None:
+        super().cleanup()
+        self.close_run()
+
+    def append(self, identity: int, tracker: str, name: str, image: NDArray) -> None:
+
+        image = im2uint8(image)
+        key = (identity, tracker, name)
+        if key not in self.writers:
+            self.writers[key] = ChunkedImageStoreWriter(
+                folder = self.store_folder / f'{identity:03}' / f'{tracker}_{name}',
+                frame_shape = image.shape,
+                dtype = np.uint8,
+                record_dtype = QC_RECORD_DTYPE,
+                chunk_frames = self.chunk_frames,
+                compress = True,
+                num_threads = self.num_threads
+            )
+
+        writer = self.writers[key]
+        if image.shape != writer.frame_shape:
+            return
+        writer.append(image, self.record, block=False)
+
+    def process_data(self, data: NDArray) -> None:
+
+        # between runs on persistent workers
+        if data is None or self.writers is None:
+            return
+
+        identity = int(data['identity'])
+        self.record['index'] = data['index']
+        self.record['timestamp'] = data['timestamp']
+        self.record['identity'] = identity
+
+        tracking = data['tracking']
+        for tracker in QC_TRACKERS:
+            if tracker not in tracking.dtype.names:
+                continue
+            for name in QC_IMAGES:
+                try:
+                    image = tracking[tracker][name]
+                except (KeyError, ValueError, TypeError):
+                    continue
+                if image is None or np.ndim(image) < 2:
+                    continue
+                self.append(identity, tracker, name, image)
+
+    def process_metadata(self, metadata) -> Any:
+
+        # persistent workers: new stores for each run
+        control = run_control_message(metadata)
+        if control is None:
+            return
+
+        self.close_run()
+        if control['run_control'] == START_RUN:
+            self.set_folder(Path(control['settings']['settings']['tracking']['csv_filename']).parent)
+            self.open_run(control['run'])
+
+def load_tracking_qc(folder: Union[str, Path]) -> Dict[Tuple[int, str], ChunkedImageStore]:
+    '''stores of a QC recording by (identity, '<tracker>_<image>'), frames are looked up with store.index'''
+    stores = {}
+    for store_folder in sorted(Path(folder).glob('*/*')):
+        stores[(int(store_folder.parent.name), store_folder.name)] = ChunkedImageStore(store_folder)
+    return stores
@@ -1,6 +1,20 @@
 import numpy as np 
+from typing import Optional
 from dagline import WorkerNode
-from ZebVR.utils import get_time_ns, append_timestamp_to_filename
+from ZebVR.utils import (
+    get_time_ns, 
+    append_timestamp_to_filename, 
+    FrameContinuityMonitor, 
+    register_frame_timing_counters,
+    Checkpointer,
+    checkpoint_filename,
+    start_sampling_profiler,
+    run_control_message,
+    mark_startup
+)
+from ZebVR.utils.latency_trace import TraceRecorder
+from ZebVR.utils.run_control import START_RUN
+from ZebVR.utils.startup_timeline import RECORDING
 
 class TrackingSaver(WorkerNode):
 
@@ -8,6 +22,8 @@ class TrackingSaver(WorkerNode):
             self, 
             filename: str = 'tracking.csv',
             num_tail_points_interp: int = 40,
+            checkpoint_interval_sec: float = 10,
+            trace_file: Optional[str] = None,
             *args, 
             **kwargs
         ) -> None:
@@ -16,14 +32,29 @@ class TrackingSaver(WorkerNode):
 
         self.filename = filename
         self.num_tail_points_interp = num_tail_points_interp
+        self.checkpoint_interval_sec = checkpoint_interval_sec
+        self.trace_file = trace_file
+        self.trace_recorder = None
         self.fd = None
+        self.timing_counters = register_frame_timing_counters('tracking')
+        self.monitors = {}
 
     def set_filename(self, filename:str):
         self.filename = filename
 
     def initialize(self):
         super().initialize()
+        start_sampling_profiler(self)
+        self.open_run()
+
+        if self.trace_file is not None:
+            self.trace_recorder = TraceRecorder(self.trace_file, 'tracking_saver')
+
+    def open_run(self) -> None:
         
+        # one continuity monitor per identity, sharing counters
+        self.monitors = {}
+
         # init file name
         file = append_timestamp_to_filename(self.filename)
 
@@ -51,10 +82,24 @@ class TrackingSaver(WorkerNode):
         + tuple(f"tail_point_{n:03d}_y" for n in range(self.num_tail_points_interp))
         self.fd.write(','.join(headers) + '\n')
 
-    def cleanup(self):
-        super().cleanup()
+        # rows are pushed to disk every checkpoint_interval_sec 
+        self.checkpointer = Checkpointer(self.checkpoint_interval_sec, checkpoint_filename(file))
+        self.checkpointer.add_file(self.fd)
+        self.checkpoint_state = {}
+        mark_startup(self, RECORDING)
+
+    def close_run(self) -> None:
         if self.fd is not None:
+            self.checkpointer.checkpoint(self.checkpoint_state)
             self.fd.close()
+            self.fd = None
+
+    def cleanup(self):
+        super().cleanup()
+        self.close_run()
+        if self.trace_recorder is not None:
+            self.trace_recorder.close()
+            self.trace_recorder = None
 
     def process_data(self, data):
         
@@ -64,6 +109,12 @@ class TrackingSaver(WorkerNode):
         if data is None:
             return
 
+        received = get_time_ns()
+        identity = int(data['identity'])
+        if identity not in self.monitors:
+            self.monitors[identity] = FrameContinuityMonitor(self.timing_counters)
+        self.monitors[identity].update(data['index'], data['timestamp'])
+
         fish_centroid = np.zeros((2,), dtype=float)
         fish_caudorostral_axis = np.zeros((2,), dtype=float)
         fish_mediolateral_axis = np.zeros((2,), dtype=float)
@@ -136,6 +187,12 @@ class TrackingSaver(WorkerNode):
 
         self.fd.write(','.join(row) + '\n')
 
+        self.checkpoint_state = {'index': int(data['index']), 'timestamp': int(data['timestamp'])}
+        self.checkpointer.maybe_checkpoint(self.checkpoint_state)
+
+        if self.trace_recorder is not None:
+            self.trace_recorder.write(data, received, identity)
+
         res = {
             'frame': data['index'],
             'fish_id': data['identity'],
@@ -144,4 +201,13 @@ class TrackingSaver(WorkerNode):
         return res
         
     def process_metadata(self, metadata) -> None:
-        pass
\ No newline at end of file
+        
+        # persistent workers: one file per run, nothing saved between runs
+        control = run_control_message(metadata)
+        if control is None:
+            return
+        
+        self.close_run()
+        if control['run_control'] == START_RUN:
+            self.set_filename(control['settings']['settings']['tracking']['csv_filename'])
+            self.open_run()
\ No newline at end of file